@@ -0,0 +1,383 @@
+import contextvars
+import threading
+import time
+from typing import Optional
+
+from utils.config import AdmissionConfig
+from utils.metrics import ADMISSION_QUEUED, ADMISSION_REJECTED
+
+# Request header naming the tenant a request is counted against, the table if absent.
+TENANT_HEADER = "X-Nanovector-Tenant"
+# Request headers giving the deadline of a request, as a Unix time in seconds or as milliseconds from now.
+DEADLINE_HEADER = "X-Nanovector-Deadline"
+TIMEOUT_HEADER = "X-Nanovector-Timeout-Ms"
+
+# Route class of each endpoint under admission control. Other endpoints, such as /metrics
+# and /details, are always admitted so the server stays observable under overload.
+ENDPOINT_CLASSES = {
+    "query_table": "query",
+    "query_table_batch": "query",
+    "query_tables": "query",
+    "add_to_table": "ingest",
+    "knn_graph": "ingest",
+    "create_table": "create",
+    "rebuild_table": "create",
+    "tune_table": "create",
+}
+
+_deadline = contextvars.ContextVar("nanovector_deadline", default=None)
+
+
+class Rejected(Exception):
+    """
+    A request shed by admission control.
+
+    Attributes:
+        status (int): The response status code, 429 for a tenant over its quota or 503 for a full server.
+        message (str): The reason, for the response body.
+        retry_after (float): Seconds after which the request may be retried, None if unknown.
+    """
+
+    def __init__(self, status: int, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    def payload(self) -> dict:
+        """
+        Get the response body of the rejection.
+        """
+        payload = {"message": self.message}
+        if self.retry_after is not None:
+            payload["retry_after"] = self.retry_after
+        return payload
+
+    def headers(self) -> dict:
+        """
+        Get the response headers of the rejection.
+        """
+        if self.retry_after is None:
+            return {}
+        # Retry-After takes whole seconds
+        return {"Retry-After": str(max(int(self.retry_after + 0.999), 1))}
+
+
+class DeadlineExceeded(Rejected):
+    """
+    A request whose deadline passed before it could be answered.
+    """
+
+    def __init__(self, message: str = "Request deadline exceeded"):
+        super().__init__(504, message)
+
+
+def parse_deadline(headers) -> Optional[float]:
+    """
+    Get the deadline of a request from its headers, as a Unix time in seconds.
+
+    X-Nanovector-Deadline is passed on unchanged by services calling each other, so that a
+    request keeps the deadline of the request it serves. X-Nanovector-Timeout-Ms does not
+    depend on the clocks of client and server agreeing.
+
+    Args:
+        headers (Mapping): The request headers, with case-insensitive get or lower-case keys.
+
+    Returns:
+        float: The deadline, None if the request has none.
+
+    Raises:
+        ValueError: If a header is not a number.
+    """
+    deadline = headers.get(DEADLINE_HEADER) or headers.get(DEADLINE_HEADER.lower())
+    if deadline:
+        return float(deadline)
+    timeout = headers.get(TIMEOUT_HEADER) or headers.get(TIMEOUT_HEADER.lower())
+    if timeout:
+        return time.time() + float(timeout) / 1000
+    return None
+
+
+def set_deadline(deadline: Optional[float]) -> contextvars.Token:
+    """
+    Set the deadline of the current request, to be checked by check_deadline.
+
+    Returns:
+        contextvars.Token: The token to reset the deadline with.
+    """
+    return _deadline.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token):
+    """
+    Reset the deadline set by set_deadline.
+    """
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Get the seconds left before the deadline of the current request, None if it has none.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.time()
+
+
+def check_deadline(stage: str = None):
+    """
+    Give up on the current request if its deadline has passed, as no client is waiting for it anymore.
+
+    Called between the expensive steps of a request, such as after embedding and before searching.
+
+    Args:
+        stage (str, optional): The step about to start, for the error message (default is None).
+
+    Raises:
+        DeadlineExceeded: If the deadline has passed.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        message = "Request deadline exceeded" + (f" before {stage}" if stage else "")
+        raise DeadlineExceeded(message)
+
+
+class TokenBucket:
+    """
+    A token bucket holding up to burst tokens, refilled at rate tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token if there is one.
+
+        Returns:
+            float: 0 if a token was taken, else the seconds until one is available.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def refund(self):
+        """
+        Give back a token taken for a request that was rejected after all.
+        """
+        self._tokens = min(self.burst, self._tokens + 1)
+
+
+class Ticket:
+    """
+    The admission of a request, to be released when the request is answered.
+    """
+
+    def __init__(self, route_class: str, tenant: Optional[str]):
+        self.route_class = route_class
+        self.tenant = tenant
+        self.released = False
+
+
+class AdmissionController:
+    """
+    A class deciding which requests run, wait or are rejected, so that under overload the server sheds load instead of slowing every request down.
+
+    Requests are grouped into route classes (query, ingest and create), each running at most
+    its concurrency at once with a bounded queue of waiting requests. A request finding the
+    queue full is rejected at once with 503, and one waiting longer than queue_timeout or past
+    its deadline is rejected then, so admitted requests keep their latency. Tenants over their
+    rate or concurrency quota are rejected with 429. Requests whose deadline has already passed
+    are dropped with 504 before any work is done.
+
+    Attributes:
+        config (AdmissionConfig): The limits.
+
+    Methods:
+        admit(endpoint, tenant, deadline, block): Admit a request, waiting in its class queue if needed.
+        release(ticket): Release the admission of an answered request.
+        stats(): Get the running and queued requests of each route class.
+
+    Example:
+        controller = AdmissionController(AdmissionConfig(concurrency={"query": 8}))
+        ticket = controller.admit("query_table", tenant="docs")
+        try:
+            ...
+        finally:
+            controller.release(ticket)
+    """
+
+    def __init__(self, config: AdmissionConfig):
+        """
+        Initialize an AdmissionController instance.
+
+        Args:
+            config (AdmissionConfig): The limits.
+        """
+        self.config = config
+        self._condition = threading.Condition()
+        self._running = {name: 0 for name in config.concurrency}
+        self._queued = {name: 0 for name in config.concurrency}
+        self._tenant_running = {}
+        self._buckets = {}
+
+    def _reject(self, route_class: str, reason: str, error: Rejected):
+        ADMISSION_REJECTED.inc(route_class=route_class, reason=reason)
+        raise error
+
+    def admit(
+        self,
+        endpoint: str,
+        tenant: str = None,
+        deadline: float = None,
+        block: bool = True,
+    ) -> Optional[Ticket]:
+        """
+        Admit a request, waiting in the queue of its route class if the class is at its concurrency.
+
+        Args:
+            endpoint (str): The endpoint name of the request.
+            tenant (str, optional): The tenant the request is counted against, None for no tenant quotas (default is None).
+            deadline (float, optional): The Unix time after which the request is not worth answering (default is None).
+            block (bool, optional): Whether to wait for a slot. Without blocking, as in the async server whose
+                executors queue requests themselves, queued requests are admitted up to the queue length (default is True).
+
+        Returns:
+            Ticket: The admission to release once the request is answered, None for endpoints not under admission control.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before the request is admitted.
+            Rejected: If the tenant is over its quota (429) or the queue of the class is full or timed out (503).
+        """
+        route_class = ENDPOINT_CLASSES.get(endpoint)
+        if route_class is None:
+            return None
+        if deadline is not None and deadline <= time.time():
+            self._reject(
+                route_class,
+                "deadline",
+                DeadlineExceeded("Request deadline passed before admission"),
+            )
+
+        config = self.config
+        limit = config.concurrency[route_class]
+        with self._condition:
+            bucket = None
+            if tenant is not None and config.tenant_rate is not None:
+                bucket = self._buckets.setdefault(
+                    tenant, TokenBucket(config.tenant_rate, config.tenant_burst)
+                )
+                wait = bucket.take()
+                if wait > 0:
+                    self._reject(
+                        route_class,
+                        "tenant_rate",
+                        Rejected(429, f"Tenant {tenant} is over its rate quota", wait),
+                    )
+            try:
+                if (
+                    tenant is not None
+                    and config.tenant_concurrency is not None
+                    and self._tenant_running.get(tenant, 0) >= config.tenant_concurrency
+                ):
+                    self._reject(
+                        route_class,
+                        "tenant_concurrency",
+                        Rejected(
+                            429, f"Tenant {tenant} is over its concurrency quota", 1.0
+                        ),
+                    )
+
+                if limit is not None:
+                    if not block:
+                        # The caller queues admitted requests, the queue counts as running
+                        limit += config.queue[route_class]
+                    if self._running[route_class] >= limit or self._queued[route_class]:
+                        self._wait(route_class, limit, deadline, block)
+            except Rejected:
+                # Requests the server turns away do not use up the rate quota of their tenant
+                if bucket is not None:
+                    bucket.refund()
+                raise
+
+            self._running[route_class] += 1
+            if tenant is not None:
+                self._tenant_running[tenant] = self._tenant_running.get(tenant, 0) + 1
+        return Ticket(route_class, tenant)
+
+    def _wait(self, route_class: str, limit: int, deadline: float, block: bool):
+        """
+        Wait in the queue of a route class until it is below its limit. The condition must be held.
+        """
+        if not block or self._queued[route_class] >= self.config.queue[route_class]:
+            self._reject(
+                route_class,
+                "queue_full",
+                Rejected(503, f"Too many {route_class} requests, try again later", 1.0),
+            )
+
+        timeout = self.config.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        end = time.monotonic() + timeout
+        self._queued[route_class] += 1
+        ADMISSION_QUEUED.set(self._queued[route_class], route_class=route_class)
+        try:
+            while self._running[route_class] >= limit:
+                left = end - time.monotonic()
+                if left <= 0:
+                    if deadline is not None and deadline <= time.time():
+                        self._reject(
+                            route_class,
+                            "deadline",
+                            DeadlineExceeded("Request deadline passed while queued"),
+                        )
+                    self._reject(
+                        route_class,
+                        "queue_timeout",
+                        Rejected(
+                            503,
+                            f"Timed out waiting to run a {route_class} request",
+                            1.0,
+                        ),
+                    )
+                self._condition.wait(left)
+        finally:
+            self._queued[route_class] -= 1
+            ADMISSION_QUEUED.set(self._queued[route_class], route_class=route_class)
+
+    def release(self, ticket: Optional[Ticket]):
+        """
+        Release the admission of an answered request, letting a queued one run.
+
+        Args:
+            ticket (Ticket): The ticket returned by admit, None does nothing.
+        """
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        with self._condition:
+            self._running[ticket.route_class] -= 1
+            if ticket.tenant is not None:
+                running = self._tenant_running[ticket.tenant] - 1
+                if running:
+                    self._tenant_running[ticket.tenant] = running
+                else:
+                    del self._tenant_running[ticket.tenant]
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Get the running and queued requests of each route class.
+
+        Returns:
+            dict: The "running" and "queued" requests per route class.
+        """
+        with self._condition:
+            return {"running": dict(self._running), "queued": dict(self._queued)}
@@ -1,20 +1,189 @@
+import hmac
+import os
+import time
 import urllib.parse
 
 import numpy as np
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 
+from app.admission import (
+    TENANT_HEADER,
+    AdmissionController,
+    Rejected,
+    check_deadline,
+    parse_deadline,
+    reset_deadline,
+    set_deadline,
+)
 from embedder.embedder import Embedder
+from index.multi_vector_index import check_offsets
 from tables.db import VectorDB
+from tables.replication import (
+    SECRET_HEADER,
+    SIGNATURE_HEADER,
+    Replica,
+    ReplicatedVectorDB,
+    encode_log_batch,
+    sign,
+)
+from tables.sharding import ShardedTable
+from tables.shared import SharedVectorDB
 from tables.table import VectorTable
-from utils.config import IndexConfig
+from tables.tiered import TieredVectorDB
+from utils import compute, tuning
+from utils.config import AdmissionConfig, IndexConfig, ServerConfig
+from utils.encoding import BASE64, decode_array, encode_array
+from utils.jobs import JobManager
+from utils.loading import open_embeddings
+from utils.metrics import (
+    CONTENT_TYPE,
+    MODEL_CACHE,
+    REGISTRY,
+    observe_request,
+    update_table_gauges,
+)
+from utils.singleflight import SingleFlight
+from utils.timing import (
+    TIMING_HEADER,
+    SlowRequestProfiler,
+    stage,
+    start_timer,
+    stop_timer,
+    timing_requested,
+)
+from utils.traffic import TrafficRecorder
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """
+    The default JSON provider, timing request parsing and response serialisation as request stages.
+    """
+
+    def loads(self, s, **kwargs):
+        with stage("parse"):
+            return super().loads(s, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        with stage("serialise"):
+            return super().dumps(obj, **kwargs)
+
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)
 
-tables = VectorDB()
+server_config = ServerConfig.from_env()
+
+# A sample of requests is profiled and the slow ones are written out
+profiler = None
+if server_config.profile_dir is not None:
+    profiler = SlowRequestProfiler(
+        server_config.profile_dir,
+        server_config.profile_slow_seconds,
+        server_config.profile_sample_rate,
+    )
+
+# A sample of adds and queries is recorded, to be replayed by benchmarks.replay
+recorder = None
+if server_config.record_path is not None:
+    recorder = TrafficRecorder(
+        server_config.record_path, server_config.record_sample_rate
+    )
+
+# BLAS threads are split between the searches running, so request threads do not oversubscribe the cores
+compute.configure(
+    server_config.blas_policy,
+    server_config.blas_threads,
+    server_config.blas_parallel_work,
+)
+
+# Requests beyond the configured concurrency, queue and tenant quotas are shed
+admission = AdmissionController(AdmissionConfig.from_env())
+
+# With a shared directory, every worker process serves the same tables
+if server_config.shared_dir is not None:
+    tables = SharedVectorDB(server_config.shared_dir)
+elif server_config.role == "primary":
+    tables = ReplicatedVectorDB(server_config.replication_log_entries)
+elif server_config.memory_budget is not None:
+    # Cold tables are spilled to disk and memory-mapped back on access
+    tables = TieredVectorDB(server_config.spill_dir, server_config.memory_budget)
+else:
+    tables = VectorDB()
 models = {}
 
+# Replicas replay the primary's mutation log and serve reads only
+replica = None
+if server_config.role == "replica":
+    replica = Replica(
+        server_config.primary_url,
+        tables,
+        server_config.replication_secret,
+        server_config.replica_poll_interval,
+    )
+    replica.start()
+
+WRITE_ENDPOINTS = {
+    "create_table",
+    "delete_table",
+    "add_to_table",
+    "rebuild_table",
+    "tune_table",
+}
+
+# IndexConfig fields a rebuild can change
+REBUILD_FIELDS = (
+    "dim_final",
+    "pca",
+    "normalise",
+    "index_type",
+    "nlist",
+    "nprobe",
+    "dtype",
+)
+
+# Long creates and adds requested with 'background' run here, off the request path
+jobs = JobManager(server_config.job_workers)
+
+# Texts embedded per step by background jobs, so they can report progress.
+EMBED_BATCH = 256
+
+# The same query texts sent at once, such as a trending query, are embedded once
+query_embeddings = SingleFlight("embedding")
+
+
+def get_model(model_name: str) -> Embedder:
+    """
+    Get the embedder for a model, loading it on first use in this process.
+    """
+    if model_name not in models:
+        MODEL_CACHE.inc(result="miss")
+        models[model_name] = Embedder(model_name)
+    else:
+        MODEL_CACHE.inc(result="hit")
+    return models[model_name]
+
+
+def query_embedding_key(model_name: str, texts) -> tuple:
+    """
+    Get the key identifying the embeddings of query texts.
+    """
+    return model_name, texts if isinstance(texts, str) else tuple(texts)
+
+
+def embed_query(model_name: str, texts, table: str = ""):
+    """
+    Embed query texts, sharing the embedding with identical queries being embedded at the same time.
+
+    A shared embedding is timed under the table of the query that ran it.
+    """
+    return query_embeddings.do(
+        query_embedding_key(model_name, texts),
+        lambda: get_model(model_name).generate_embeddings(texts, table),
+    )
+
 
 def check_table_exists(route_function):
     def wrapper(table, *args, **kwargs):
@@ -29,27 +198,91 @@ def check_table_exists(route_function):
 def load_data_from_json(data, variable):
     """
     Load data from the 'data' dictionary based on the 'variable' name and its corresponding '_path' key.
-    If '{variable}_path' is provided and exists in 'data', load data from the path.
+    If '{variable}_path' is provided and exists in 'data', load data from the path (memory-mapped).
     If 'variable' is provided and exists in 'data', load data from '{variable}'.
     """
-    if f"{variable}_path" is not None and f"{variable}_path" in data:
-        return np.load(f"{variable}_path")
+    if data.get(f"{variable}_path", None) is not None:
+        with stage("decode"):
+            shards = open_embeddings(
+                data[f"{variable}_path"], data.get("dim_input", None)
+            )
+            return shards[0] if len(shards) == 1 else np.concatenate(shards)
     elif variable is not None and variable in data:
-        return np.array(data[variable])
+        with stage("decode"):
+            # Either nested lists or base64-encoded, see utils.encoding
+            return decode_array(data[variable])
     else:
         raise ValueError("Either path or  embeddings should be provided.")
         return None
 
 
-@app.route("/", methods=["GET"])
-def trying():
-    return "hello"
+def load_query_vector(data, table: VectorTable):
+    """
+    Load the query vector for a table from the request 'data', embedding 'texts' if the table uses an embedder.
+    """
+    if table.use_embedder:
+        texts = data.get("texts", None)
+        if texts == None:
+            raise ValueError(
+                "Table is configured to work with texts, 'texts' field empty in request."
+            )
 
+        return embed_query(table.model_name, texts, table.table_name)
 
-@app.route("/create", methods=["POST"])
-def create_table():
-    data = request.get_json()
+    query_vector = data.get("query_vector", None)
+    query_vector_path = data.get("query_vector_path", None)
+
+    if query_vector_path is not None and query_vector is not None:
+        app.logger.warning(
+            "Both 'query_vector_path' and 'query_vector' provided; 'query_vector_path' will be used."
+        )
 
+    return load_data_from_json(data, "query_vector")
+
+
+def parse_k(data):
+    """
+    Parse 'k' and 'min_score' from the request 'data'. In threshold mode k is an optional cap.
+    """
+    min_score = data.get("min_score", None)
+    if min_score is not None:
+        # Threshold mode: k is an optional cap on the number of matches
+        min_score = float(min_score)
+        k = data.get("k", None)
+        k = int(k) if k is not None else None
+    else:
+        k = data.get("k", 1)
+        k = int(k)
+    return k, min_score
+
+
+def texts_to_embed(data, table_name=None):
+    """
+    Get the model name and texts a request needs embedded, or None if it carries vectors.
+
+    Lets a server run the embedding apart from the rest of the request. Without a table_name,
+    'data' is a /create request.
+    """
+    if table_name is None:
+        use_embedder = data.get("use_embedder", False)
+        model_name = data.get("model_name", None)
+    else:
+        table = tables.get_table(table_name)
+        use_embedder, model_name = table.use_embedder, table.model_name
+
+    texts = data.get("texts", None)
+    if not use_embedder or texts is None or model_name is None:
+        return None
+    return model_name, texts
+
+
+def handle_create(data, embeddings=None):
+    """
+    Create a table from a /create request. Texts are embedded unless 'embeddings' are given.
+
+    Returns:
+        tuple: The response payload and status code.
+    """
     table_name = data.get("table_name")
     table_name = table_name.replace("/", "_")
 
@@ -61,18 +294,16 @@ def create_table():
     description = data.get("description", None)
     use_embedder = data.get("use_embedder", False)
     model_name = data.get("model_name", None)
+    texts = None
 
     if use_embedder:
         texts = data.get("texts", None)
-        print(texts)
         if texts == None or model_name == None:
             raise AssertionError(
                 "use_embedder not possible, either texts are missing or model_name is missing."
             )
-        if model_name not in models:
-            models[model_name] = Embedder(model_name)
-
-        embeddings = models[model_name].generate_embeddings(texts)
+        if embeddings is None:
+            embeddings = get_model(model_name).generate_embeddings(texts, table_name)
     else:
         embeddings_path = data.get("embeddings_path", None)
         embeddings = data.get("embeddings", None)
@@ -80,55 +311,96 @@ def create_table():
             app.logger.warning(
                 "Both 'embeddings_path' and 'embeddings' provided; 'embeddings_path' will be used."
             )
-        embeddings = load_data_from_json(data, "embeddings")
+        if embeddings_path is not None:
+            # Memory-map the file(s), the index is then built from them chunk by chunk
+            embeddings = open_embeddings(embeddings_path, data.get("dim_input", None))
+        else:
+            embeddings = load_data_from_json(data, "embeddings")
 
     # Check if embeddings has exactly 2 dimensions
-    if len(embeddings.shape) != 2:
-        return jsonify(message="Embeddings must have exactly 2 dimensions"), 400
+    if not isinstance(embeddings, list) and len(embeddings.shape) != 2:
+        return {"message": "Embeddings must have exactly 2 dimensions"}, 400
 
     # Extract other configuration parameters
     pca = data.get("pca", False)
     normalise = data.get("normalise", True)
-    dim_input = embeddings.shape[1]
+    dim_input = (
+        embeddings[0].shape[1] if isinstance(embeddings, list) else embeddings.shape[1]
+    )
     dim_final = data.get("dim_final", dim_input)
 
     # Create an IndexConfig object with specified configuration
-    config = IndexConfig(dim_input, dim_final, pca, normalise)
-
-    # Create a VectorTable and add it to the database
-    table = VectorTable(
-        table_name,
-        config,
-        embeddings,
-        description,
-        use_embedder,
-        model_name,
-        texts=texts,
+    config = IndexConfig(
+        dim_input,
+        dim_final,
+        pca,
+        normalise,
+        index_type=data.get("index_type", "flat"),
+        nlist=data.get("nlist", None),
+        nprobe=int(data.get("nprobe", 8)),
+        dtype=data.get("dtype", None),
     )
-    tables.add_table(table)
 
-    return jsonify(message=f"Table '{table_name}' created successfully"), 201
+    bm25 = data.get("bm25", False)
 
+    num_shards = int(data.get("num_shards", 1))
 
-@app.route("/<table>/details", methods=["GET"])
-@check_table_exists
-def table_details(table):
-    table = tables.get_table(table)
-    return jsonify(str(table)), 200
+    # Multi-vector documents: the start of each document in the embeddings, then their number
+    offsets = data.get("offsets", None)
+    if config.index_type == "multi_vector" and use_embedder:
+        return {"message": "Multi-vector tables do not support use_embedder"}, 400
+    if config.index_type == "multi_vector" and isinstance(tables, SharedVectorDB):
+        return {"message": "Multi-vector tables cannot be shared across workers"}, 400
 
+    # Create a VectorTable (or one partitioned across worker processes) and add it to the database
+    if num_shards > 1:
+        if isinstance(tables, SharedVectorDB):
+            return {"message": "Sharded tables cannot be shared across workers"}, 400
+        if isinstance(tables, ReplicatedVectorDB):
+            return {"message": "Sharded tables cannot be replicated"}, 400
+        if isinstance(embeddings, list):
+            embeddings = np.concatenate(embeddings)
+        table = ShardedTable(
+            table_name,
+            config,
+            embeddings,
+            description,
+            use_embedder,
+            model_name,
+            texts=texts,
+            num_shards=num_shards,
+            partition=data.get("partition", "hash"),
+        )
+    else:
+        num_rows = (
+            sum(map(len, embeddings))
+            if isinstance(embeddings, list)
+            else len(embeddings)
+        )
+        with compute.section(num_rows * dim_input):
+            table = VectorTable(
+                table_name,
+                config,
+                embeddings,
+                description,
+                use_embedder,
+                model_name,
+                texts=texts,
+                bm25=bm25,
+                offsets=offsets,
+            )
+    tables.add_table(table)
 
-@app.route("/<table>/delete", methods=["DELETE"])
-@check_table_exists
-def delete_table(table):
-    tables.delete_table(table)
-    return jsonify(message=f"Table {table} deleted successfully"), 200
+    return {"message": f"Table '{table_name}' created successfully"}, 201
 
 
-@app.route("/<table>/add", methods=["POST"])
-@check_table_exists
-def add_to_table(table):
-    data = request.get_json()
+def handle_add(table, data, vector=None):
+    """
+    Add rows to a table from an /add request. Texts are embedded unless 'vector' is given.
 
+    Returns:
+        tuple: The response payload and status code.
+    """
     texts = data.get("texts", None)
 
     if tables.get_table(table).use_embedder:
@@ -137,7 +409,10 @@ def add_to_table(table):
                 "Table is configured to work with texts, 'texts' field empty in request."
             )
 
-        vector = models[tables.get_table(table).model_name].generate_embeddings(texts)
+        if vector is None:
+            vector = get_model(tables.get_table(table).model_name).generate_embeddings(
+                texts, table
+            )
     else:
         vector = data.get("vector", None)
         vector_path = data.get("vector_path", None)
@@ -149,51 +424,654 @@ def add_to_table(table):
 
         vector = load_data_from_json(data, "vector")
 
+    if tables.get_table(table).config.index_type == "multi_vector":
+        vector = split_documents(vector, data.get("offsets", None))
+
+    # A client that gave up may retry, the add must not happen twice
+    check_deadline("add")
     tables.add_vector(table, vector, texts)
 
-    return jsonify(message="Row added successfully"), 201
+    return {"message": "Row added successfully"}, 201
 
 
-@app.route("/<table>/query", methods=["POST"])
-@check_table_exists
-def query_table(table):
-    data = request.get_json()
+def split_documents(vectors, offsets) -> list:
+    """
+    Split the vectors of an /add request to a multi-vector table into documents at 'offsets', one vector per document if None.
+    """
+    vectors = np.asarray(vectors)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    offsets = check_offsets(
+        np.arange(len(vectors) + 1) if offsets is None else offsets, len(vectors)
+    )
+    return np.split(vectors, offsets[1:-1])
 
-    k = data.get("k", 1)
-    k = int(k)
 
-    if tables.get_table(table).use_embedder:
-        texts = data.get("texts", None)
-        if texts == None:
+def encode_payload_array(array: np.array, data):
+    """
+    Get an array for a response payload: base64-encoded if the request asked for 'encoding': 'base64', else as nested lists.
+    """
+    if data.get("encoding", None) == BASE64:
+        return encode_array(array)
+    return array.tolist()
+
+
+def handle_query(table, data, query_vector=None):
+    """
+    Query a table from a /<table>/query request. Texts are embedded unless 'query_vector' is given.
+
+    With 'explain', the response includes the query plan: the chosen strategy and the estimated
+    cost of each alternative. Multi-vector tables take several query vectors, and 'prefilter'.
+
+    Returns:
+        tuple: The response payload and status code.
+    """
+    k, min_score = parse_k(data)
+    filter_ids = data.get("filter_ids", None)
+    explain = data.get("explain", False)
+    prefilter = data.get("prefilter", None)
+    prefilter = int(prefilter) if prefilter is not None else None
+
+    if query_vector is None:
+        query_vector = load_query_vector(data, tables.get_table(table))
+    check_deadline("search")
+
+    if data.get("hybrid", False):
+        query_text = data.get("query_text", data.get("texts", None))
+        if isinstance(query_text, list):
+            query_text = " ".join(query_text)
+        if query_text is None:
+            raise ValueError("Hybrid query requires 'query_text' or 'texts'.")
+        # Fused scores are rank-based, on no scale a similarity threshold applies to
+        if (
+            filter_ids is not None
+            or explain
+            or prefilter is not None
+            or min_score is not None
+        ):
             raise ValueError(
-                "Table is configured to work with texts, 'texts' field empty in request."
+                "Hybrid query does not support 'filter_ids', 'explain', 'prefilter' or 'min_score'."
             )
 
-        query_vector = models[tables.get_table(table).model_name].generate_embeddings(
-            texts
+        top_k_indices_sorted, top_k_embeddings, texts, scores = tables.hybrid_query(
+            table, query_vector, query_text, k
         )
+        plan = None
     else:
-        query_vector = data.get("query_vector", None)
-        query_vector_path = data.get("query_vector_path", None)
-
-        if query_vector_path is not None and query_vector is not None:
-            app.logger.warning(
-                "Both 'query_vector_path' and 'query_vector' provided; 'query_vector_path' will be used."
-            )
-
-        query_vector = load_data_from_json(data, "query_vector")
-
-    top_k_indices_sorted, top_k_embeddings, texts = tables.query(table, query_vector, k)
+        plan = (
+            tables.plan(table, k, min_score, filter_ids, prefilter) if explain else None
+        )
+        top_k_indices_sorted, top_k_embeddings, texts = tables.query(
+            table, query_vector, k, min_score, filter_ids, plan, prefilter
+        )
+        scores = None
 
     results = {
         "top_k_indices_sorted": top_k_indices_sorted.tolist(),
-        "top_k_embeddings": top_k_embeddings.tolist(),
+        "top_k_embeddings": encode_payload_array(top_k_embeddings, data),
         "texts": texts,
     }
+    if scores is not None:
+        results["scores"] = encode_payload_array(scores, data)
+    if plan is not None:
+        results["plan"] = plan.to_dict()
+
+    tables.update_time(table)
+
+    return results, 200
+
+
+def handle_query_batch(table, data, query_vectors=None):
+    """
+    Query a table with several vectors from a /<table>/query_batch request, in one round trip.
+
+    The vectors are given as 'query_vectors' (2D) or embedded together from a list of 'texts'.
+    'k', 'min_score' and 'filter_ids' apply to every query.
+
+    Returns:
+        tuple: The response payload, with one result per query vector in 'results', and status code.
+    """
+    k, min_score = parse_k(data)
+    filter_ids = data.get("filter_ids", None)
+
+    if query_vectors is None:
+        if tables.get_table(table).use_embedder:
+            query_vectors = load_query_vector(data, tables.get_table(table))
+        else:
+            query_vectors = load_data_from_json(data, "query_vectors")
+    check_deadline("search")
+    query_vectors = np.asarray(query_vectors)
+    if query_vectors.ndim != 2:
+        raise ValueError(
+            f"Expected 'query_vectors' of shape (n, d) but got {query_vectors.shape}"
+        )
+
+    results = []
+    for query_vector in query_vectors:
+        top_k_indices_sorted, top_k_embeddings, texts = tables.query(
+            table, query_vector, k, min_score, filter_ids
+        )
+        results.append(
+            {
+                "top_k_indices_sorted": top_k_indices_sorted.tolist(),
+                "top_k_embeddings": encode_payload_array(top_k_embeddings, data),
+                "texts": texts,
+            }
+        )
 
     tables.update_time(table)
 
-    return jsonify(results), 200
+    return {"results": results}, 200
+
+
+def handle_query_tables(data, query_vector=None):
+    """
+    Query several tables from a /query request. Texts are embedded unless 'query_vector' is given.
+
+    Returns:
+        tuple: The response payload and status code.
+    """
+    table_names = data.get("tables", None)
+    if not table_names:
+        return {"message": "'tables' must list at least one table"}, 400
+    for table in table_names:
+        if table not in tables.tables:
+            return {"message": f"Table {table} not found"}, 404
+
+    k, min_score = parse_k(data)
+
+    # Embed the query once, all tables must share the same model
+    model_names = {tables.get_table(table).model_name for table in table_names}
+    if len(model_names) > 1:
+        return {"message": "Tables must share the same embedding model"}, 400
+
+    if query_vector is None:
+        query_vector = load_query_vector(data, tables.get_table(table_names[0]))
+    check_deadline("search")
+
+    results = tables.query_tables(table_names, query_vector, k, min_score)
+
+    for result in results:
+        result["embedding"] = result["embedding"].tolist()
+    for table in set(table_names):
+        tables.update_time(table)
+
+    return {"results": results}, 200
+
+
+def handle_knn_graph(table, data):
+    """
+    Compute a kNN graph from a /<table>/knn_graph request, written to 'output_dir' under the configured graph_dir.
+
+    Returns:
+        tuple: The response payload and status code.
+    """
+    k = int(data.get("k", 10))
+    output_dir = data.get("output_dir", None)
+    other_table = data.get("other_table", None)
+    exclude_self = data.get("exclude_self", True)
+
+    if output_dir is None:
+        return {"message": "'output_dir' is required"}, 400
+    if server_config.graph_dir is None:
+        return {"message": "kNN graphs are not enabled, set NANOVECTOR_GRAPH_DIR"}, 400
+    # Clients only name a directory under graph_dir, they cannot write anywhere else
+    graph_dir = os.path.realpath(server_config.graph_dir)
+    output_dir = os.path.realpath(os.path.join(graph_dir, output_dir))
+    if os.path.commonpath([graph_dir, output_dir]) != graph_dir:
+        return {"message": "'output_dir' must be a directory under graph_dir"}, 400
+
+    neighbors_path, scores_path = tables.knn_graph(
+        table, k, output_dir, other_table, exclude_self
+    )
+
+    return {
+        "message": f"kNN graph for table '{table}' written successfully",
+        "neighbors_path": neighbors_path,
+        "scores_path": scores_path,
+    }, 201
+
+
+def embed_in_batches(job, table, model_name, texts):
+    """
+    Embed texts batch by batch for a background job, reporting progress up to 90%.
+    """
+    model = get_model(model_name)
+    if isinstance(texts, str) or len(texts) <= EMBED_BATCH:
+        embeddings = model.generate_embeddings(texts, table)
+        job.report(0.9, "embedding")
+        return embeddings
+
+    batches = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        batches.append(
+            model.generate_embeddings(texts[start : start + EMBED_BATCH], table)
+        )
+        done = min(start + EMBED_BATCH, len(texts))
+        job.report(0.9 * done / len(texts), "embedding")
+    return np.concatenate(batches)
+
+
+def create_table_job(job, data):
+    """
+    Background job for a /create request. The table is published only once it is fully built.
+    """
+    embeddings = None
+    request_texts = texts_to_embed(data)
+    if request_texts is not None:
+        embeddings = embed_in_batches(job, data.get("table_name"), *request_texts)
+    job.report(stage="building index")
+    payload, status = handle_create(data, embeddings)
+    if status >= 400:
+        raise ValueError(payload["message"])
+    return payload
+
+
+def add_rows_job(job, table, data):
+    """
+    Background job for an /add request. All the rows become visible at once.
+    """
+    vector = None
+    request_texts = texts_to_embed(data, table)
+    if request_texts is not None:
+        vector = embed_in_batches(job, table, *request_texts)
+    job.report(stage="adding rows")
+    payload, _ = handle_add(table, data, vector)
+    return payload
+
+
+def submit_job(kind, data, table=None):
+    """
+    Queue a /create ("create") or /add ("add") request as a background job.
+
+    Returns:
+        tuple: The response payload, with the job id, and status code.
+    """
+    if (
+        kind == "create"
+        and data.get("table_name", "").replace("/", "_") in tables.tables
+    ):
+        return {"message": f"Table {data['table_name']} already exists"}, 400
+
+    priority = int(data.get("priority", 0))
+    try:
+        if kind == "create":
+            job = jobs.submit("create", create_table_job, data, priority=priority)
+        else:
+            job = jobs.submit("add", add_rows_job, table, data, priority=priority)
+    except RuntimeError as e:
+        return {"message": str(e)}, 503
+
+    return {
+        "message": f"Job {job.job_id} queued",
+        "job_id": job.job_id,
+        "status_url": f"/jobs/{job.job_id}",
+    }, 202
+
+
+def rebuild_table_job(job, table, config):
+    """
+    Background job for a /<table>/rebuild request. Queries use the old index until it is swapped.
+    """
+    tables.rebuild_table(table, config, progress=job.report)
+    return {"message": f"Table '{table}' rebuilt", "config": repr(config)}
+
+
+def submit_rebuild(table, data):
+    """
+    Queue a rebuild of a table with the configuration changes of a /<table>/rebuild request.
+
+    Returns:
+        tuple: The response payload, with the job id, and status code.
+    """
+    current = tables.get_table(table)
+    if not hasattr(current, "rebuild"):
+        return {"message": f"Table {table} does not support rebuilds"}, 400
+
+    changes = {field: data[field] for field in REBUILD_FIELDS if field in data}
+    if changes.get("pca") is False and "dim_final" not in changes:
+        changes["dim_final"] = current.config.dim_input
+    try:
+        config = current.config.replace(**changes)
+    except ValueError as e:
+        return {"message": str(e)}, 400
+
+    try:
+        job = jobs.submit(
+            "rebuild",
+            rebuild_table_job,
+            table,
+            config,
+            priority=int(data.get("priority", 0)),
+        )
+    except RuntimeError as e:
+        return {"message": str(e)}, 503
+
+    return {
+        "message": f"Job {job.job_id} queued",
+        "job_id": job.job_id,
+        "status_url": f"/jobs/{job.job_id}",
+    }, 202
+
+
+def tune_table_job(job, table, options, apply):
+    """
+    Background job for a /<table>/tune request, applying the chosen configuration through a rebuild.
+
+    With apply None, a configuration discarding input dimensions is only evaluated, as the
+    rebuild could not be undone.
+    """
+    result = tuning.tune_table(
+        tables.get_table(table),
+        progress=lambda fraction, stage: job.report(0.9 * fraction, stage),
+        **options,
+    )
+    config = result["config"]
+    current = tables.get_table(table).config
+    drops = tuning.drops_dimensions(current, config)
+    if apply is None:
+        apply = not drops
+    if apply and repr(config) != repr(current):
+        tables.rebuild_table(
+            table,
+            config,
+            progress=lambda fraction, stage: job.report(0.9 + 0.1 * fraction, stage),
+        )
+    message = f"Table '{table}' tuned" if apply else f"Table '{table}' evaluated"
+    if drops and not apply:
+        message += ", the chosen configuration drops dimensions: set 'apply' to true to rebuild"
+    return {
+        "message": message,
+        "config": repr(config),
+        "met": result["met"],
+        "applied": apply,
+        "chosen": result["chosen"],
+        "points": result["points"],
+    }
+
+
+def submit_tune(table, data):
+    """
+    Queue the tuning of the search parameters of a table from a /<table>/tune request.
+
+    Returns:
+        tuple: The response payload, with the job id, and status code.
+    """
+    if not hasattr(tables.get_table(table), "rebuild"):
+        return {"message": f"Table {table} does not support tuning"}, 400
+    if ("target_recall" in data) == ("latency_budget_ms" in data):
+        message = "Expected exactly one of 'target_recall' and 'latency_budget_ms'"
+        return {"message": message}, 400
+    if "vectors" not in data and "vectors_path" not in data:
+        if tables.get_table(table).config.pca:
+            message = "PCA tables are tuned on a sample of their original 'vectors'"
+            return {"message": message}, 400
+
+    options = {
+        field: data[field]
+        for field in (
+            "k",
+            "target_recall",
+            "latency_budget_ms",
+            "num_queries",
+            "nprobes",
+            "dims_final",
+        )
+        if field in data
+    }
+    if "vectors" in data or "vectors_path" in data:
+        options["vectors"] = load_data_from_json(data, "vectors")
+    try:
+        job = jobs.submit(
+            "tune",
+            tune_table_job,
+            table,
+            options,
+            None if data.get("apply") is None else bool(data["apply"]),
+            priority=int(data.get("priority", 0)),
+        )
+    except RuntimeError as e:
+        return {"message": str(e)}, 503
+
+    return {
+        "message": f"Job {job.job_id} queued",
+        "job_id": job.job_id,
+        "status_url": f"/jobs/{job.job_id}",
+    }, 202
+
+
+def handle_job_status(job_id):
+    """
+    Get the status of a background job from a /jobs/<job_id> request.
+
+    Returns:
+        tuple: The response payload and status code.
+    """
+    try:
+        return jobs.get(job_id).to_dict(), 200
+    except ValueError as e:
+        return {"message": str(e)}, 404
+
+
+def handle_pin(table, pinned):
+    """
+    Pin a table in memory, or unpin it, on a server with a memory budget.
+
+    Returns:
+        tuple: The response payload and status code.
+    """
+    if not isinstance(tables, TieredVectorDB):
+        return {"message": "Server has no memory budget"}, 404
+    if pinned:
+        tables.pin(table)
+        return {"message": f"Table {table} pinned in memory"}, 200
+    tables.unpin(table)
+    return {"message": f"Table {table} unpinned"}, 200
+
+
+def replication_authorised(secret) -> bool:
+    """
+    Check the secret a replica sent with a /replication/log request.
+    """
+    expected = server_config.replication_secret
+    return bool(secret and expected) and hmac.compare_digest(
+        secret.encode(), expected.encode()
+    )
+
+
+def replication_status_payload():
+    """
+    Get the replication role and status of this server.
+    """
+    if replica is not None:
+        return replica.status()
+    if isinstance(tables, ReplicatedVectorDB):
+        return {"role": "primary", "head_seq": tables.log.head}
+    return {"role": None}
+
+
+def metrics_text() -> str:
+    """
+    Get the server metrics in the Prometheus text format, refreshing the table gauges first.
+    """
+    update_table_gauges(tables.tables)
+    return REGISTRY.render()
+
+
+# Registered first, so requests rejected by later hooks are still timed
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    if timing_requested(request.headers.get(TIMING_HEADER)):
+        g.timing_token = start_timer()
+    if profiler is not None:
+        g.profile = profiler.start()
+
+
+@app.after_request
+def record_request(response):
+    seconds = time.perf_counter() - g.get("request_start", time.perf_counter())
+    observe_request(request.endpoint, request.method, response.status_code, seconds)
+    if g.get("timing_token") is not None:
+        timer = stop_timer(g.pop("timing_token"))
+        response.headers["Server-Timing"] = timer.server_timing()
+    if profiler is not None:
+        profiler.finish(
+            g.pop("profile", None), seconds, request.endpoint or "unmatched"
+        )
+    if recorder is not None:
+        recorder.record(
+            request.endpoint,
+            request.method,
+            request.path,
+            request.get_data(),
+            response.status_code,
+            seconds,
+        )
+    return response
+
+
+@app.before_request
+def reject_writes_on_replica():
+    if replica is not None and request.endpoint in WRITE_ENDPOINTS:
+        return jsonify(message="Replica is read-only, send writes to the primary"), 403
+
+
+def rejection_response(error: Rejected):
+    response = jsonify(error.payload())
+    response.status_code = error.status
+    response.headers.update(error.headers())
+    return response
+
+
+@app.before_request
+def admit_request():
+    try:
+        deadline = parse_deadline(request.headers)
+    except ValueError:
+        return jsonify(message="Invalid deadline header"), 400
+    g.deadline_token = set_deadline(deadline)
+    tenant = request.headers.get(TENANT_HEADER) or (request.view_args or {}).get(
+        "table"
+    )
+    try:
+        g.ticket = admission.admit(request.endpoint, tenant, deadline)
+    except Rejected as e:
+        return rejection_response(e)
+
+
+@app.teardown_request
+def release_request(error=None):
+    admission.release(g.pop("ticket", None))
+    if g.get("deadline_token") is not None:
+        reset_deadline(g.pop("deadline_token"))
+
+
+@app.errorhandler(Rejected)
+def handle_rejected(error):
+    return rejection_response(error)
+
+
+@app.route("/", methods=["GET"])
+def trying():
+    return "hello"
+
+
+@app.route("/create", methods=["POST"])
+def create_table():
+    data = request.get_json()
+    if data.get("background", False):
+        payload, status = submit_job("create", data)
+    else:
+        payload, status = handle_create(data)
+    return jsonify(payload), status
+
+
+@app.route("/<table>/details", methods=["GET"])
+@check_table_exists
+def table_details(table):
+    table = tables.get_table(table)
+    return jsonify(str(table)), 200
+
+
+@app.route("/<table>/delete", methods=["DELETE"])
+@check_table_exists
+def delete_table(table):
+    tables.delete_table(table)
+    return jsonify(message=f"Table {table} deleted successfully"), 200
+
+
+@app.route("/<table>/add", methods=["POST"])
+@check_table_exists
+def add_to_table(table):
+    data = request.get_json()
+    if data.get("background", False):
+        payload, status = submit_job("add", data, table)
+    else:
+        payload, status = handle_add(table, data)
+    return jsonify(payload), status
+
+
+@app.route("/<table>/query", methods=["POST"])
+@check_table_exists
+def query_table(table):
+    payload, status = handle_query(table, request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/<table>/query_batch", methods=["POST"])
+@check_table_exists
+def query_table_batch(table):
+    payload, status = handle_query_batch(table, request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/query", methods=["POST"])
+def query_tables():
+    payload, status = handle_query_tables(request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/<table>/knn_graph", methods=["POST"])
+@check_table_exists
+def knn_graph(table):
+    payload, status = handle_knn_graph(table, request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/<table>/rebuild", methods=["POST"])
+@check_table_exists
+def rebuild_table(table):
+    payload, status = submit_rebuild(table, request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/<table>/tune", methods=["POST"])
+@check_table_exists
+def tune_table(table):
+    payload, status = submit_tune(table, request.get_json())
+    return jsonify(payload), status
+
+
+@app.route("/<table>/pin", methods=["POST"])
+@check_table_exists
+def pin_table(table):
+    payload, status = handle_pin(table, True)
+    return jsonify(payload), status
+
+
+@app.route("/<table>/unpin", methods=["POST"])
+@check_table_exists
+def unpin_table(table):
+    payload, status = handle_pin(table, False)
+    return jsonify(payload), status
+
+
+@app.route("/memory", methods=["GET"])
+def memory_status():
+    if not isinstance(tables, TieredVectorDB):
+        return jsonify(message="Server has no memory budget"), 404
+    return jsonify(tables.memory_status()), 200
 
 
 @app.route("/list_tables", methods=["GET"])
@@ -202,6 +1080,44 @@ def list_tables():
     return jsonify(tables.list_tables()), 200
 
 
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify(jobs.list_jobs()), 200
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    payload, status = handle_job_status(job_id)
+    return jsonify(payload), status
+
+
+@app.route("/replication/log", methods=["GET"])
+def replication_log():
+    if not isinstance(tables, ReplicatedVectorDB):
+        return jsonify(message="Server is not a replication primary"), 404
+    if not replication_authorised(request.headers.get(SECRET_HEADER)):
+        return jsonify(message="Invalid replication secret"), 403
+
+    since = int(request.args.get("since", 0))
+    limit = int(request.args.get("limit", 0)) or None
+    body = encode_log_batch(tables.log, since, limit)
+    return Response(
+        body,
+        mimetype="application/octet-stream",
+        headers={SIGNATURE_HEADER: sign(server_config.replication_secret, body)},
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metrics_text(), content_type=CONTENT_TYPE)
+
+
+@app.route("/replication/status", methods=["GET"])
+def replication_status():
+    return jsonify(replication_status_payload()), 200
+
+
 @app.errorhandler(400)
 @app.errorhandler(404)
 @app.errorhandler(500)
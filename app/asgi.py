@@ -0,0 +1,524 @@
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import re
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import app.app as core
+from app.admission import (
+    TENANT_HEADER,
+    Rejected,
+    parse_deadline,
+    reset_deadline,
+    set_deadline,
+)
+from tables.replication import (
+    SECRET_HEADER,
+    SIGNATURE_HEADER,
+    ReplicatedVectorDB,
+    encode_log_batch,
+    sign,
+)
+from tables.shared import SharedVectorDB
+from tables.tiered import TieredVectorDB
+from utils.metrics import CONTENT_TYPE, observe_request
+from utils.timing import (
+    TIMING_HEADER,
+    stage,
+    start_timer,
+    stop_timer,
+    timing_requested,
+)
+
+# Request bodies larger than this are parsed on an executor instead of the event loop.
+PARSE_OFFLOAD_BYTES = 1 << 20
+
+
+class BoundedExecutor:
+    """
+    A thread pool that admits at most `max_pending` tasks at once. Further callers wait on the event loop.
+
+    Attributes:
+        max_workers (int): The number of threads.
+        max_pending (int): The number of tasks admitted at once, running or queued.
+
+    Methods:
+        run(fn, *args, **kwargs): Run a function on the pool and await its result.
+        shutdown(): Stop the threads.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, name: str):
+        """
+        Initialize a BoundedExecutor instance.
+
+        Args:
+            max_workers (int): The number of threads.
+            max_pending (int): The number of tasks admitted at once, running or queued.
+            name (str): The thread name prefix.
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(max_pending)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a function on the pool and await its result, in a copy of the caller's context.
+        """
+        context = contextvars.copy_context()
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._pool, functools.partial(context.run, fn, *args, **kwargs)
+            )
+
+    def shutdown(self):
+        """
+        Stop the threads, waiting for running tasks.
+        """
+        self._pool.shutdown(wait=True)
+
+
+def _encode(payload) -> bytes:
+    # Timestamps from list_tables are sent as strings, as Flask does
+    with stage("serialise"):
+        return json.dumps(payload, default=str).encode()
+
+
+def _parse(body: bytes):
+    with stage("parse"):
+        return json.loads(body)
+
+
+class AsyncServer:
+    """
+    An ASGI application serving the same API and tables as the Flask app, without blocking its event loop.
+
+    The event loop only reads requests and writes responses. Embedding, searches and ingest
+    (table creation, adds, kNN graphs) each run on their own bounded thread pool, so a large
+    /create or a slow model cannot hold up queries behind it. Requests waiting for a full
+    pool queue on the event loop, which costs no thread. Run it with any ASGI server; `main`
+    starts uvicorn, which keeps thousands of idle keep-alive connections on one event loop.
+
+    Attributes:
+        search (BoundedExecutor): The pool running searches.
+        embed (BoundedExecutor): The pool running the embedding model.
+        ingest (BoundedExecutor): The pool running table creation and adds.
+
+    Example:
+        uvicorn app.asgi:server --port 5000
+    """
+
+    def __init__(
+        self,
+        search_workers: int = None,
+        embed_workers: int = None,
+        ingest_workers: int = None,
+        max_pending: int = None,
+    ):
+        """
+        Initialize an AsyncServer instance. Unset arguments are read from the server configuration.
+
+        Args:
+            search_workers (int, optional): Threads running searches.
+            embed_workers (int, optional): Threads running the embedding model.
+            ingest_workers (int, optional): Threads running table creation and adds.
+            max_pending (int, optional): Tasks admitted to each pool at once.
+        """
+        config = core.server_config
+        max_pending = max_pending or config.max_pending
+        self.search = BoundedExecutor(
+            search_workers or config.search_workers, max_pending, "search"
+        )
+        self.embed = BoundedExecutor(
+            embed_workers or config.embed_workers, max_pending, "embed"
+        )
+        self.ingest = BoundedExecutor(
+            ingest_workers or config.ingest_workers, max_pending, "ingest"
+        )
+        # (method, path pattern, endpoint name, handler), endpoint names match the Flask app
+        self._routes = [
+            ("GET", r"/", "trying", self._index),
+            ("POST", r"/create", "create_table", self._create),
+            ("POST", r"/query", "query_tables", self._query_tables),
+            ("GET", r"/list_tables", "list_tables", self._list_tables),
+            ("GET", r"/memory", "memory_status", self._memory_status),
+            ("GET", r"/metrics", "metrics", self._metrics),
+            ("GET", r"/jobs", "list_jobs", self._list_jobs),
+            ("GET", r"/jobs/(?P<job_id>[^/]+)", "job_status", self._job_status),
+            ("GET", r"/replication/log", "replication_log", self._replication_log),
+            (
+                "GET",
+                r"/replication/status",
+                "replication_status",
+                self._replication_status,
+            ),
+            ("GET", r"/(?P<table>[^/]+)/details", "table_details", self._details),
+            ("DELETE", r"/(?P<table>[^/]+)/delete", "delete_table", self._delete),
+            ("POST", r"/(?P<table>[^/]+)/add", "add_to_table", self._add),
+            ("POST", r"/(?P<table>[^/]+)/query", "query_table", self._query),
+            (
+                "POST",
+                r"/(?P<table>[^/]+)/query_batch",
+                "query_table_batch",
+                self._query_batch,
+            ),
+            ("POST", r"/(?P<table>[^/]+)/knn_graph", "knn_graph", self._knn_graph),
+            ("POST", r"/(?P<table>[^/]+)/rebuild", "rebuild_table", self._rebuild),
+            ("POST", r"/(?P<table>[^/]+)/tune", "tune_table", self._tune),
+            ("POST", r"/(?P<table>[^/]+)/pin", "pin_table", self._pin),
+            ("POST", r"/(?P<table>[^/]+)/unpin", "unpin_table", self._unpin),
+        ]
+        self._routes = [
+            (method, re.compile(pattern), endpoint, handler)
+            for method, pattern, endpoint, handler in self._routes
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            start = time.perf_counter()
+            request_headers = dict(scope.get("headers", []))
+            timing = request_headers.get(TIMING_HEADER.lower().encode())
+            token = (
+                start_timer() if timing_requested(timing and timing.decode()) else None
+            )
+            try:
+                status, body, content_type, endpoint, extra_headers = (
+                    await self._handle(scope, receive, request_headers)
+                )
+            finally:
+                timer = stop_timer(token) if token is not None else None
+            seconds = time.perf_counter() - start
+            observe_request(endpoint, scope["method"], status, seconds)
+            if core.recorder is not None:
+                core.recorder.record(
+                    endpoint,
+                    scope["method"],
+                    scope["path"],
+                    scope.get("nanovector.body", b""),
+                    status,
+                    seconds,
+                )
+            headers = [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+                (b"access-control-allow-origin", b"*"),
+            ]
+            headers += [
+                (name.lower().encode(), value.encode())
+                for name, value in extra_headers.items()
+            ]
+            if timer is not None:
+                headers.append((b"server-timing", timer.server_timing().encode()))
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": status,
+                    "headers": headers,
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for executor in (self.search, self.embed, self.ingest):
+                    executor.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    async def _handle(self, scope, receive, request_headers: dict):
+        """
+        Route a request, admit it and run its handler.
+
+        Returns:
+            tuple: The status, body, content type, endpoint name and any extra response headers.
+        """
+        json_type = b"application/json"
+        path, method = scope["path"], scope["method"]
+        matches = [
+            (route_method, match, endpoint, handler)
+            for route_method, pattern, endpoint, handler in self._routes
+            if (match := pattern.fullmatch(path))
+        ]
+        if not matches:
+            return 404, _encode({"message": "Invalid request"}), json_type, None, {}
+        route = next((m for m in matches if m[0] == method), None)
+        if route is None:
+            return 405, _encode({"message": "Method not allowed"}), json_type, None, {}
+        _, match, endpoint, handler = route
+
+        if core.replica is not None and endpoint in core.WRITE_ENDPOINTS:
+            message = "Replica is read-only, send writes to the primary"
+            return 403, _encode({"message": message}), json_type, endpoint, {}
+
+        headers = {
+            name.decode(): value.decode() for name, value in request_headers.items()
+        }
+        try:
+            deadline = parse_deadline(headers)
+        except ValueError:
+            payload = {"message": "Invalid deadline header"}
+            return 400, _encode(payload), json_type, endpoint, {}
+        replication_log = endpoint == "replication_log" and isinstance(
+            core.tables, ReplicatedVectorDB
+        )
+        if replication_log and not core.replication_authorised(
+            headers.get(SECRET_HEADER.lower())
+        ):
+            payload = {"message": "Invalid replication secret"}
+            return 403, _encode(payload), json_type, endpoint, {}
+        tenant = headers.get(TENANT_HEADER.lower()) or match.groupdict().get("table")
+        deadline_token = set_deadline(deadline)
+        ticket = None
+        try:
+            # The executors queue admitted requests, so admission does not wait here
+            ticket = core.admission.admit(endpoint, tenant, deadline, block=False)
+            status, body, content_type = await self._dispatch(
+                scope, receive, match, handler
+            )
+        except Rejected as e:
+            return e.status, _encode(e.payload()), json_type, endpoint, e.headers()
+        finally:
+            core.admission.release(ticket)
+            reset_deadline(deadline_token)
+        if replication_log and status == 200:
+            secret = core.server_config.replication_secret
+            signature = await self.search.run(sign, secret, body)
+            return status, body, content_type, endpoint, {SIGNATURE_HEADER: signature}
+        return status, body, content_type, endpoint, {}
+
+    async def _dispatch(self, scope, receive, match, handler):
+        """
+        Parse a request and run its handler, returning the status, body and content type.
+        """
+        json_type = b"application/json"
+        body = await self._read_body(receive)
+        # Kept for the traffic recorder
+        scope["nanovector.body"] = body
+        try:
+            if len(body) > PARSE_OFFLOAD_BYTES:
+                data = await self.ingest.run(_parse, body)
+            else:
+                data = _parse(body) if body else {}
+            query = dict(
+                urllib.parse.parse_qsl(scope.get("query_string", b"").decode())
+            )
+            table = match.groupdict().get("table")
+            if table is not None and not await self._tables_exist([table]):
+                return 404, _encode({"message": "Table not found"}), json_type
+            return await handler(*match.groups(), data=data, query=query)
+        except Rejected:
+            raise
+        except Exception as e:
+            payload = {"message": "Invalid request", "error": str(e)}
+            return 500, _encode(payload), json_type
+
+    async def _read_tables(self, fn, *args):
+        """
+        Run a call reading the tables, on the search pool when they are refreshed from disk under a lock.
+        """
+        if isinstance(core.tables, SharedVectorDB):
+            return await self.search.run(fn, *args)
+        return fn(*args)
+
+    async def _tables_exist(self, table_names: list) -> bool:
+        def exist():
+            tables = core.tables.tables
+            return all(name in tables for name in table_names)
+
+        return await self._read_tables(exist)
+
+    async def _embed(self, data, table_name=None, coalesce=False):
+        """
+        Embed the texts of a request on the embedding pool, None if it carries vectors.
+
+        With coalesce, as for query texts, the embedding is shared with identical texts being
+        embedded at the same time, whose requests wait on the event loop rather than on the pool.
+        """
+        if data.get("texts") is None:
+            return None
+        request_texts = await self._read_tables(core.texts_to_embed, data, table_name)
+        if request_texts is None:
+            return None
+        model_name, texts = request_texts
+
+        def embed():
+            return self.embed.run(
+                lambda: core.get_model(model_name).generate_embeddings(
+                    texts, table_name or data.get("table_name")
+                )
+            )
+
+        if not coalesce:
+            return await embed()
+        key = core.query_embedding_key(model_name, texts)
+        return await core.query_embeddings.do_async(key, embed)
+
+    async def _run(self, executor: BoundedExecutor, handler, *args, **kwargs):
+        """
+        Run a handler returning (payload, status) on a pool, serialising the payload there too.
+        """
+
+        def run():
+            profile = core.profiler.start() if core.profiler is not None else None
+            start = time.perf_counter()
+            payload, status = handler(*args, **kwargs)
+            body = _encode(payload)
+            if profile is not None:
+                seconds = time.perf_counter() - start
+                core.profiler.finish(profile, seconds, handler.__name__)
+            return status, body, b"application/json"
+
+        return await executor.run(run)
+
+    async def _index(self, data, query):
+        return 200, b"hello", b"text/html; charset=utf-8"
+
+    async def _create(self, data, query):
+        if data.get("background", False):
+            payload, status = core.submit_job("create", data)
+            return status, _encode(payload), b"application/json"
+        embeddings = await self._embed(data)
+        return await self._run(self.ingest, core.handle_create, data, embeddings)
+
+    async def _add(self, table, data, query):
+        if data.get("background", False):
+            payload, status = core.submit_job("add", data, table)
+            return status, _encode(payload), b"application/json"
+        vector = await self._embed(data, table)
+        return await self._run(self.ingest, core.handle_add, table, data, vector)
+
+    async def _query(self, table, data, query):
+        query_vector = await self._embed(data, table, coalesce=True)
+        return await self._run(
+            self.search, core.handle_query, table, data, query_vector
+        )
+
+    async def _query_batch(self, table, data, query):
+        query_vectors = await self._embed(data, table, coalesce=True)
+        return await self._run(
+            self.search, core.handle_query_batch, table, data, query_vectors
+        )
+
+    async def _query_tables(self, data, query):
+        table_names = data.get("tables", None)
+        query_vector = None
+        if table_names and await self._tables_exist(table_names):
+            query_vector = await self._embed(data, table_names[0], coalesce=True)
+        return await self._run(
+            self.search, core.handle_query_tables, data, query_vector
+        )
+
+    async def _knn_graph(self, table, data, query):
+        return await self._run(self.ingest, core.handle_knn_graph, table, data)
+
+    async def _rebuild(self, table, data, query):
+        return await self._run(self.ingest, core.submit_rebuild, table, data)
+
+    async def _tune(self, table, data, query):
+        # Reads the table and any vectors_path file
+        return await self._run(self.ingest, core.submit_tune, table, data)
+
+    async def _pin(self, table, data, query):
+        payload, status = await self.ingest.run(core.handle_pin, table, True)
+        return status, _encode(payload), b"application/json"
+
+    async def _unpin(self, table, data, query):
+        payload, status = await self.ingest.run(core.handle_pin, table, False)
+        return status, _encode(payload), b"application/json"
+
+    async def _memory_status(self, data, query):
+        if not isinstance(core.tables, TieredVectorDB):
+            message = "Server has no memory budget"
+            return 404, _encode({"message": message}), b"application/json"
+        return 200, _encode(core.tables.memory_status()), b"application/json"
+
+    async def _metrics(self, data, query):
+        body = await self.search.run(lambda: core.metrics_text().encode())
+        return 200, body, CONTENT_TYPE.encode()
+
+    async def _details(self, table, data, query):
+        body = await self.search.run(lambda: _encode(str(core.tables.get_table(table))))
+        return 200, body, b"application/json"
+
+    async def _delete(self, table, data, query):
+        def delete():
+            core.tables.delete_table(table)
+            return {"message": f"Table {table} deleted successfully"}, 200
+
+        return await self._run(self.ingest, delete)
+
+    async def _list_tables(self, data, query):
+        body = await self.search.run(lambda: _encode(core.tables.list_tables()))
+        return 200, body, b"application/json"
+
+    async def _list_jobs(self, data, query):
+        return 200, _encode(core.jobs.list_jobs()), b"application/json"
+
+    async def _job_status(self, job_id, data, query):
+        payload, status = core.handle_job_status(job_id)
+        return status, _encode(payload), b"application/json"
+
+    async def _replication_log(self, data, query):
+        if not isinstance(core.tables, ReplicatedVectorDB):
+            message = "Server is not a replication primary"
+            return 404, _encode({"message": message}), b"application/json"
+        since = int(query.get("since", 0))
+        limit = int(query.get("limit", 0)) or None
+        body = await self.search.run(encode_log_batch, core.tables.log, since, limit)
+        return 200, body, b"application/octet-stream"
+
+    async def _replication_status(self, data, query):
+        return 200, _encode(core.replication_status_payload()), b"application/json"
+
+
+server = AsyncServer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the nanovector async server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError(
+            "The async server requires uvicorn, install it with `pip install uvicorn`."
+        )
+
+    # A deep accept backlog and long keep-alive suit many bursty, mostly idle clients
+    uvicorn.run(
+        server,
+        host=args.host,
+        port=args.port,
+        backlog=4096,
+        timeout_keep_alive=75,
+        lifespan="on",
+    )
+
+
+if __name__ == "__main__":
+    main()
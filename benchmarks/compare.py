@@ -0,0 +1,97 @@
+import argparse
+import json
+import sys
+
+# Metrics where a lower value is better, the others are throughputs.
+LOWER_IS_BETTER = ("build_seconds", "build_peak_bytes", "query_ms")
+
+KEY_FIELDS = ("index", "kind", "num_vectors", "dimension", "k")
+
+
+def _flatten(result: dict) -> dict:
+    metrics = {}
+    for name, value in result.items():
+        if name in KEY_FIELDS:
+            continue
+        if isinstance(value, dict):
+            for sub_name, sub_value in value.items():
+                metrics[f"{name}.{sub_name}"] = sub_value
+        else:
+            metrics[name] = value
+    return metrics
+
+
+def compare(baseline: dict, candidate: dict, threshold: float = 0.1) -> list:
+    """
+    Compare two benchmark reports, matching results by index, dataset and k.
+
+    Args:
+        baseline (dict): The report of the reference run, as written by benchmarks.run.
+        candidate (dict): The report of the run to check.
+        threshold (float, optional): The relative change beyond which a worse metric is a regression (default is 0.1).
+
+    Returns:
+        list: One dictionary per metric present in both reports, with keys "result", "metric",
+            "baseline", "candidate", "change" (relative) and "regression".
+
+    Example:
+        rows = compare(json.load(open("a.json")), json.load(open("b.json")))
+        regressions = [row for row in rows if row["regression"]]
+    """
+    baseline_results = {
+        tuple(result[field] for field in KEY_FIELDS): _flatten(result)
+        for result in baseline["results"]
+    }
+
+    rows = []
+    for result in candidate["results"]:
+        key = tuple(result[field] for field in KEY_FIELDS)
+        if key not in baseline_results:
+            continue
+        reference = baseline_results[key]
+        for metric, value in _flatten(result).items():
+            if metric not in reference or not reference[metric]:
+                continue
+            change = (value - reference[metric]) / reference[metric]
+            worse = change if metric.startswith(LOWER_IS_BETTER) else -change
+            rows.append(
+                {
+                    "result": "{} {} n={} d={} k={}".format(*key),
+                    "metric": metric,
+                    "baseline": reference[metric],
+                    "candidate": value,
+                    "change": change,
+                    "regression": worse > threshold,
+                }
+            )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare two benchmark result files and report regressions."
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold)
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['result']:<40} {row['metric']:<30} "
+            f"{row['baseline']:>14.4g} {row['candidate']:>14.4g} "
+            f"{100 * row['change']:>+8.1f}% {flag}"
+        )
+    # A non-zero exit status lets CI fail on regressions
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import numpy as np
+
+DATASET_KINDS = ("uniform", "clustered")
+
+
+def make_dataset(
+    num_vectors: int,
+    dimension: int,
+    kind: str = "uniform",
+    num_clusters: int = 64,
+    seed: int = 0,
+) -> np.array:
+    """
+    Generate a synthetic float32 dataset.
+
+    Uniform data has no structure, which is the worst case for approximate indexes and PCA.
+    Clustered data, Gaussian blobs around random centres, is closer to real embeddings.
+
+    Args:
+        num_vectors (int): The number of rows.
+        dimension (int): The dimensionality of the rows.
+        kind (str, optional): "uniform" or "clustered" (default is "uniform").
+        num_clusters (int, optional): The number of blobs of clustered data (default is 64).
+        seed (int, optional): The random seed (default is 0).
+
+    Returns:
+        np.array: The (num_vectors, dimension) dataset.
+
+    Raises:
+        ValueError: If the kind is unknown.
+
+    Example:
+        embeddings = make_dataset(100000, 256, kind="clustered")
+    """
+    if kind not in DATASET_KINDS:
+        raise ValueError(f"Expected kind in {DATASET_KINDS} got {kind}")
+
+    rng = np.random.default_rng(seed)
+    if kind == "uniform":
+        return rng.random((num_vectors, dimension), dtype=np.float32) - 0.5
+
+    centres = rng.standard_normal((num_clusters, dimension), dtype=np.float32)
+    labels = rng.integers(num_clusters, size=num_vectors)
+    noise = rng.standard_normal((num_vectors, dimension), dtype=np.float32)
+    return centres[labels] + 0.3 * noise
+
+
+def make_queries(data: np.array, num_queries: int, seed: int = 1) -> np.array:
+    """
+    Generate queries resembling a dataset: random rows perturbed by noise of a tenth of their spread.
+
+    Args:
+        data (np.array): The dataset.
+        num_queries (int): The number of queries.
+        seed (int, optional): The random seed (default is 1).
+
+    Returns:
+        np.array: The (num_queries, dimension) queries.
+    """
+    rng = np.random.default_rng(seed)
+    rows = data[rng.integers(len(data), size=num_queries)]
+    noise = rng.standard_normal(rows.shape, dtype=np.float32)
+    return rows + 0.1 * data.std() * noise
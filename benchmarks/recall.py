@@ -0,0 +1,55 @@
+import argparse
+import json
+
+import numpy as np
+
+from benchmarks.datasets import DATASET_KINDS, make_dataset, make_queries
+from benchmarks.run import _int_list
+from utils.evaluation import recall_curve, sweep_configs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure recall@k, MRR and QPS of PCA and IVF configurations against exact search."
+    )
+    parser.add_argument("--data", default=None, help="A .npy file of rows to index")
+    parser.add_argument("--queries-file", default=None, help="A .npy file of queries")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--kind", default="clustered", choices=DATASET_KINDS)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims-final", type=_int_list, default=[])
+    parser.add_argument("--nprobes", type=_int_list, default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--output", default=None, help="A JSON file for the curve")
+    args = parser.parse_args(argv)
+
+    if args.data is not None:
+        embeddings = np.load(args.data, mmap_mode="r")
+    else:
+        embeddings = make_dataset(args.size, args.dim, args.kind)
+    if args.queries_file is not None:
+        queries = np.load(args.queries_file)
+    else:
+        queries = make_queries(embeddings, args.queries)
+
+    configs = sweep_configs(
+        embeddings.shape[1], args.dims_final, args.nprobes, args.nlist
+    )
+    points = recall_curve(embeddings, queries, configs, args.k)
+
+    print(f"{'config':<32} {'recall':>7} {'mrr':>6} {'qps':>9} {'p99 ms':>8}")
+    for point in points:
+        print(
+            f"{point['label']:<32} {point['recall']:>7.3f} {point['mrr']:>6.3f} "
+            f"{point['qps']:>9.1f} {point['latency_ms']['p99']:>8.2f}"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"k": args.k, "points": points}, f, indent=2)
+    return points
+
+
+if __name__ == "__main__":
+    main()
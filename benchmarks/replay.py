@@ -0,0 +1,264 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.traffic import read_traffic
+
+
+def schedule(records: list, speed: float = 1.0, rate: float = None) -> list:
+    """
+    Get the second, from the start of a replay, at which each request is sent.
+
+    Args:
+        records (list): The recorded requests, sorted by arrival time.
+        speed (float, optional): How many times faster than recorded the requests are sent (default is 1.0).
+        rate (float, optional): Send requests evenly at this many per second instead of at their recorded times (default is None).
+
+    Returns:
+        list: The send offsets in seconds, one per request.
+    """
+    if rate is not None:
+        return [i / rate for i in range(len(records))]
+    if not records:
+        return []
+    start = records[0]["time"]
+    return [(record["time"] - start) / speed for record in records]
+
+
+class _Connections(threading.local):
+    """
+    Per-thread keep-alive connections to the replayed server.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port
+        self.https = parsed.scheme == "https"
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, record: dict) -> int:
+        """
+        Send a recorded request and return the response status, reconnecting once on a dropped connection.
+        """
+        body = record["body"]
+        if not isinstance(body, str):
+            body = json.dumps(body) if body is not None else ""
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            if self.connection is None:
+                connection_type = (
+                    http.client.HTTPSConnection
+                    if self.https
+                    else http.client.HTTPConnection
+                )
+                self.connection = connection_type(
+                    self.host, self.port, timeout=self.timeout
+                )
+            try:
+                self.connection.request(
+                    record["method"],
+                    self.prefix + record["path"],
+                    body=body.encode(),
+                    headers=headers,
+                )
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt == 1:
+                    raise
+
+
+def replay(
+    records: list,
+    url: str,
+    speed: float = 1.0,
+    rate: float = None,
+    concurrency: int = None,
+    max_workers: int = 64,
+    timeout: float = 30.0,
+) -> dict:
+    """
+    Replay recorded requests against a server and measure how it answers them.
+
+    By default the replay is open-loop: each request is sent at its scheduled time whether or
+    not earlier ones have been answered, as real clients do, and its latency is measured from
+    that scheduled time. A server falling behind then shows up as growing latencies rather than
+    as a slower send rate. With concurrency, the replay is closed-loop instead: that many
+    clients send the requests one after another as fast as they are answered, measuring the
+    maximum throughput.
+
+    Args:
+        records (list): The recorded requests, from `utils.traffic.read_traffic`.
+        url (str): The base URL of the server, such as "http://127.0.0.1:5000".
+        speed (float, optional): How many times faster than recorded the requests are sent (default is 1.0).
+        rate (float, optional): Send requests evenly at this many per second instead (default is None).
+        concurrency (int, optional): Replay closed-loop with this many clients instead (default is None).
+        max_workers (int, optional): Requests in flight at once in an open-loop replay (default is 64).
+        timeout (float, optional): Seconds before a request is abandoned (default is 30.0).
+
+    Returns:
+        dict: The summary of `summarise`, with the "mode" of the replay.
+
+    Example:
+        records = read_traffic("traffic.jsonl")
+        report = replay(records, "http://127.0.0.1:5000", speed=2.0)
+        print(report["throughput"], report["latency_ms"]["p99"])
+    """
+    connections = _Connections(url, timeout)
+    results = [None] * len(records)
+
+    def send(i, scheduled):
+        try:
+            status = connections.send(records[i])
+        except Exception as e:
+            status = type(e).__name__
+        results[i] = (records[i]["endpoint"], status, time.perf_counter() - scheduled)
+
+    start = time.perf_counter()
+    if concurrency is not None:
+        next_request = iter(range(len(records)))
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    i = next(next_request, None)
+                if i is None:
+                    return
+                send(i, time.perf_counter())
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        with ThreadPoolExecutor(max_workers) as executor:
+            for i, offset in enumerate(schedule(records, speed, rate)):
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, i, start + offset)
+    elapsed = time.perf_counter() - start
+
+    report = summarise(results, elapsed)
+    report["mode"] = "closed" if concurrency is not None else "open"
+    return report
+
+
+def _latencies(results: list) -> dict:
+    latencies = 1000 * np.array([seconds for _, _, seconds in results])
+    return {
+        "p50": float(np.percentile(latencies, 50)),
+        "p90": float(np.percentile(latencies, 90)),
+        "p99": float(np.percentile(latencies, 99)),
+        "max": float(latencies.max()),
+    }
+
+
+def summarise(results: list, elapsed: float) -> dict:
+    """
+    Summarise the results of a replay, overall and per endpoint.
+
+    A request is an error when it failed to get a response or got a 5xx or 429 status.
+
+    Args:
+        results (list): The (endpoint, status, seconds) of each request, status being an exception name on failure.
+        elapsed (float): The duration of the replay in seconds.
+
+    Returns:
+        dict: The number of "requests", the "throughput" per second, the "error_rate", the
+            "latency_ms" percentiles and the "statuses" counts, with the same per endpoint in "endpoints".
+    """
+
+    def is_error(status):
+        return not isinstance(status, int) or status >= 500 or status == 429
+
+    def summary(rows):
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            "requests": len(rows),
+            "throughput": len(rows) / elapsed if elapsed > 0 else 0.0,
+            "error_rate": sum(is_error(status) for _, status, _ in rows) / len(rows),
+            "latency_ms": _latencies(rows),
+            "statuses": statuses,
+        }
+
+    results = [result for result in results if result is not None]
+    if not results:
+        return {"requests": 0, "elapsed": elapsed, "endpoints": {}}
+    report = summary(results)
+    report["elapsed"] = elapsed
+    report["endpoints"] = {
+        endpoint: summary([result for result in results if result[0] == endpoint])
+        for endpoint in sorted({result[0] for result in results})
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded JSONL traffic log against a server and report throughput, latency and errors."
+    )
+    parser.add_argument(
+        "traffic", help="A JSONL file recorded with NANOVECTOR_RECORD_PATH"
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--rate", type=float, default=None)
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--max-workers", type=int, default=64)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--endpoints", default=None, help="Comma-separated endpoints to replay"
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", default=None, help="A JSON file for the report")
+    args = parser.parse_args(argv)
+
+    records = read_traffic(args.traffic, args.limit)
+    if args.endpoints is not None:
+        endpoints = args.endpoints.split(",")
+        records = [record for record in records if record["endpoint"] in endpoints]
+    report = replay(
+        records,
+        args.url,
+        args.speed,
+        args.rate,
+        args.concurrency,
+        args.max_workers,
+        args.timeout,
+    )
+
+    print(
+        f"{'endpoint':<16} {'requests':>8} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    rows = list(report["endpoints"].items())
+    rows += [("all", report)] if report["requests"] else []
+    for endpoint, summary in rows:
+        print(
+            f"{endpoint:<16} {summary['requests']:>8} {summary['throughput']:>8.1f} "
+            f"{summary['error_rate']:>7.2%} {summary['latency_ms']['p50']:>8.2f} "
+            f"{summary['latency_ms']['p99']:>8.2f}"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.datasets import DATASET_KINDS, make_dataset, make_queries
+from utils.config import IndexConfig
+from utils.initialise_index import initialise_index
+
+# Index configurations benchmarked, built for a dimension d.
+INDEX_CONFIGS = {
+    "flat": lambda d: IndexConfig(d, d),
+    "pca": lambda d: IndexConfig(d, max(d // 4, 1), pca=True),
+    "ivf": lambda d: IndexConfig(d, d, index_type="ivf"),
+}
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def environment() -> dict:
+    """
+    Describe the code and machine a run was made on, so results can be compared across commits.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def bench_build(config: IndexConfig, data: np.array) -> tuple:
+    """
+    Build an index, returning it with its build seconds and the peak bytes allocated while building.
+
+    The peak is measured on a second build under tracemalloc, which slows allocations down.
+    """
+    start = time.perf_counter()
+    index = initialise_index(config, data)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    initialise_index(config, data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, seconds, peak
+
+
+def bench_query(index, queries: np.array, k: int) -> dict:
+    """
+    Get the latency percentiles of single queries run one after another, in milliseconds.
+    """
+    # Warm up caches and lazily initialised BLAS threads first
+    for query in queries[:10]:
+        index.get_similarity(query, k)
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.get_similarity(query, k)
+        latencies.append(time.perf_counter() - start)
+    latencies = 1000 * np.array(latencies)
+    return {
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "mean": float(latencies.mean()),
+    }
+
+
+def bench_concurrency(index, queries: np.array, k: int, threads: int) -> float:
+    """
+    Get the queries per second reached by several threads querying at once.
+    """
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda query: index.get_similarity(query, k), queries))
+        return len(queries) / (time.perf_counter() - start)
+
+
+def bench_add(index, rows: np.array, batch_size: int) -> float:
+    """
+    Get the rows per second added to an index in batches of batch_size rows.
+    """
+    start = time.perf_counter()
+    for offset in range(0, len(rows), batch_size):
+        index.add_vector(rows[offset : offset + batch_size])
+    return len(rows) / (time.perf_counter() - start)
+
+
+def run(
+    sizes: list,
+    dimensions: list,
+    kinds: list,
+    indexes: list,
+    num_queries: int = 200,
+    k: int = 10,
+    threads: list = (1, 4),
+    num_adds: int = 1000,
+    batch_size: int = 1000,
+) -> dict:
+    """
+    Run the benchmarks for every combination of dataset size, dimension, kind and index.
+
+    Args:
+        sizes (list): The numbers of rows.
+        dimensions (list): The dimensionalities.
+        kinds (list): The dataset kinds, from DATASET_KINDS.
+        indexes (list): The index names, from INDEX_CONFIGS.
+        num_queries (int, optional): The number of queries per measurement (default is 200).
+        k (int, optional): The number of neighbours per query (default is 10).
+        threads (list, optional): The thread counts to measure throughput with (default is (1, 4)).
+        num_adds (int, optional): The number of rows added one at a time and in batches (default is 1000).
+        batch_size (int, optional): The number of rows per batched add (default is 1000).
+
+    Returns:
+        dict: The environment and a list of results, one per combination.
+
+    Raises:
+        ValueError: If an index name or dataset kind is unknown.
+
+    Example:
+        results = run([10000], [128], ["clustered"], ["flat", "ivf"])
+    """
+    for name in indexes:
+        if name not in INDEX_CONFIGS:
+            raise ValueError(f"Expected index in {tuple(INDEX_CONFIGS)} got {name}")
+
+    results = []
+    for kind in kinds:
+        for num_vectors in sizes:
+            for dimension in dimensions:
+                data = make_dataset(num_vectors + 2 * num_adds, dimension, kind)
+                data, new_rows = data[:num_vectors], data[num_vectors:]
+                queries = make_queries(data, num_queries)
+                for name in indexes:
+                    config = INDEX_CONFIGS[name](dimension)
+                    index, build_seconds, peak = bench_build(config, data)
+                    result = {
+                        "index": name,
+                        "kind": kind,
+                        "num_vectors": num_vectors,
+                        "dimension": dimension,
+                        "k": k,
+                        "build_seconds": build_seconds,
+                        "build_peak_bytes": peak,
+                        "query_ms": bench_query(index, queries, k),
+                        "qps": {
+                            str(count): bench_concurrency(index, queries, k, count)
+                            for count in threads
+                        },
+                        "add_single_rows_per_second": bench_add(
+                            index, new_rows[:num_adds], 1
+                        ),
+                        "add_batch_rows_per_second": bench_add(
+                            index, new_rows[num_adds:], batch_size
+                        ),
+                    }
+                    results.append(result)
+                    print(
+                        f"{name:>5} {kind:>9} n={num_vectors} d={dimension}: "
+                        f"build {build_seconds:.2f}s, "
+                        f"p50 {result['query_ms']['p50']:.2f}ms, "
+                        f"p99 {result['query_ms']['p99']:.2f}ms"
+                    )
+    return {"environment": environment(), "results": results}
+
+
+def _int_list(value: str) -> list:
+    return [int(item) for item in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark index build, add and query across index types and scales."
+    )
+    parser.add_argument("--sizes", type=_int_list, default=[10000, 100000])
+    parser.add_argument("--dims", type=_int_list, default=[128, 768])
+    parser.add_argument("--kinds", default=",".join(DATASET_KINDS))
+    parser.add_argument("--indexes", default=",".join(INDEX_CONFIGS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=_int_list, default=[1, 4])
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Results file, by default benchmarks/results/<commit>.json",
+    )
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.sizes,
+        args.dims,
+        args.kinds.split(","),
+        args.indexes.split(","),
+        num_queries=args.queries,
+        k=args.k,
+        threads=args.threads,
+    )
+
+    output = args.output
+    if output is None:
+        name = report["environment"]["commit"] or datetime.utcnow().strftime(
+            "%Y%m%dT%H%M%S"
+        )
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import functools
+
+from client.client import NanovectorClient
+
+
+class AsyncNanovectorClient:
+    """
+    An asyncio client for a nanovector server, running a NanovectorClient on worker threads.
+
+    Every call runs the blocking client on the event loop's default executor, so coroutines
+    never block the loop. Queries and adds awaited concurrently are coalesced into batched
+    requests as they would be from several threads.
+
+    Methods:
+        create_table(table_name, embeddings, texts, **options): Create a table.
+        add(table, vector, texts): Add rows to a table.
+        query(table, query_vector, texts, k, **options): Query a table.
+        query_many(table, query_vectors, texts, k, **options): Query a table with several vectors in one request.
+        details(table): Get the description of a table.
+        list_tables(): List the tables.
+        close(): Flush and close the connections.
+
+    Example:
+        async with AsyncNanovectorClient("http://127.0.0.1:5000") as client:
+            results = await asyncio.gather(
+                *(client.query("docs", vector, k=5) for vector in vectors)
+            )
+    """
+
+    def __init__(self, url: str = "http://127.0.0.1:5000", **options):
+        """
+        Initialize an AsyncNanovectorClient instance.
+
+        Args:
+            url (str, optional): The base URL of the server (default is "http://127.0.0.1:5000").
+            **options: The other options of NanovectorClient, such as pool_size or max_delay.
+        """
+        self.client = NanovectorClient(url, **options)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(method, *args, **kwargs)
+        )
+
+    async def create_table(
+        self, table_name: str, embeddings=None, texts: list = None, **options
+    ) -> dict:
+        """
+        Create a table, see NanovectorClient.create_table.
+        """
+        return await self._call(
+            self.client.create_table, table_name, embeddings, texts, **options
+        )
+
+    async def add(self, table: str, vector=None, texts=None) -> dict:
+        """
+        Add rows to a table, see NanovectorClient.add.
+        """
+        if self.client._batcher is None:
+            return await self._call(self.client.add, table, vector, texts)
+        # Submitting only queues the add, its future is awaited without holding a thread
+        future = self.client.add(table, vector, texts, wait=False)
+        return await asyncio.wrap_future(future)
+
+    async def query(
+        self, table: str, query_vector=None, texts=None, k: int = 1, **options
+    ) -> dict:
+        """
+        Query a table, see NanovectorClient.query.
+        """
+        return await self._call(
+            self.client.query, table, query_vector, texts, k, **options
+        )
+
+    async def query_many(
+        self, table: str, query_vectors=None, texts: list = None, k: int = 1, **options
+    ) -> list:
+        """
+        Query a table with several vectors in one request, see NanovectorClient.query_many.
+        """
+        return await self._call(
+            self.client.query_many, table, query_vectors, texts, k, **options
+        )
+
+    async def details(self, table: str):
+        """
+        Get the description of a table.
+        """
+        return await self._call(self.client.details, table)
+
+    async def list_tables(self):
+        """
+        List the tables of the server.
+        """
+        return await self._call(self.client.list_tables)
+
+    async def close(self):
+        """
+        Flush and close the connections.
+        """
+        await self._call(self.client.close)
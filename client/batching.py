@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+class MicroBatcher:
+    """
+    A class coalescing small calls made close together into batched calls.
+
+    Items are grouped by key, and only items with the same key are batched together, such as
+    queries on the same table with the same k. An item is sent at once when no batch of its key
+    is in flight; items arriving while one is in flight are coalesced, and sent when it completes,
+    when they are max_batch items, or max_delay seconds after the first of them arrived, whichever
+    comes first. Each item gets a future resolved with its own result of the batched call.
+
+    Attributes:
+        run_batch (callable): Called as run_batch(key, items) on a worker thread, returning one result per item.
+            An exception in place of a result fails only the future of that item.
+        max_batch (int): The number of items sent at once.
+        max_delay (float): The seconds an item may wait for others to join its batch.
+
+    Methods:
+        submit(key, item): Add an item to the batch of its key.
+        flush(): Send every pending batch now and wait for the results.
+        close(): Flush and stop the batcher.
+
+    Example:
+        batcher = MicroBatcher(lambda key, items: [x * 2 for x in items], max_delay=0.001)
+        assert batcher.submit("double", 21).result() == 42
+    """
+
+    def __init__(
+        self, run_batch, max_batch: int = 64, max_delay: float = 0.002, workers=4
+    ):
+        """
+        Initialize a MicroBatcher instance.
+
+        Args:
+            run_batch (callable): Called as run_batch(key, items), returning one result, or exception, per item.
+            max_batch (int, optional): The number of items sent at once (default is 64).
+            max_delay (float, optional): The seconds an item may wait for a batch in flight (default is 0.002).
+            workers (int, optional): The batches run at once (default is 4).
+        """
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # Key -> (deadline, [(item, future)]) of the batches being filled
+        self._pending = {}
+        self._in_flight = set()
+        # Key -> the number of its batches being run
+        self._running = Counter()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(workers)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, item) -> Future:
+        """
+        Add an item to the batch of its key.
+
+        Args:
+            key (Hashable): The key of the batch, items with different keys are never batched together.
+            item (object): The item.
+
+        Returns:
+            Future: Resolved with the result for the item, or the exception of its batch.
+
+        Raises:
+            RuntimeError: If the batcher is closed.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The batcher is closed.")
+            deadline = time.monotonic() + self.max_delay
+            _, items = self._pending.setdefault(key, (deadline, []))
+            items.append((item, future))
+            if len(items) >= self.max_batch or not self._running[key]:
+                self._dispatch(key)
+            elif len(items) == 1:
+                self._condition.notify()
+        return future
+
+    def _dispatch(self, key):
+        """
+        Send the batch of a key to a worker. The condition must be held.
+        """
+        _, items = self._pending.pop(key)
+        self._in_flight.update(future for _, future in items)
+        self._running[key] += 1
+        self._executor.submit(self._run, key, items)
+
+    def _run(self, key, items: list):
+        futures = [future for _, future in items]
+        try:
+            results = self.run_batch(key, [item for item, _ in items])
+            for future, result in zip(futures, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except BaseException as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with self._condition:
+                self._in_flight.difference_update(futures)
+                self._running[key] -= 1
+                if not self._running[key]:
+                    del self._running[key]
+                    # The items that waited for this batch go next
+                    if key in self._pending:
+                        self._dispatch(key)
+
+    def _loop(self):
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                for key in [
+                    key
+                    for key, (deadline, _) in self._pending.items()
+                    if deadline <= now
+                ]:
+                    self._dispatch(key)
+                if self._pending:
+                    deadline = min(deadline for deadline, _ in self._pending.values())
+                    self._condition.wait(deadline - now)
+                else:
+                    self._condition.wait()
+
+    def flush(self):
+        """
+        Send every pending batch now and wait for the results of all batches sent so far.
+        """
+        with self._condition:
+            for key in list(self._pending):
+                self._dispatch(key)
+            futures = list(self._in_flight)
+        wait(futures)
+
+    def close(self):
+        """
+        Flush and stop the batcher.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            for key in list(self._pending):
+                self._dispatch(key)
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,498 @@
+import http.client
+import json
+import queue
+import select
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+
+import numpy as np
+
+from client.batching import MicroBatcher
+from utils.encoding import BASE64, decode_array, encode_array
+
+# Statuses of a batch rejected for its content, which is then retried item by item
+VALIDATION_STATUSES = (400, 422)
+# Methods the server applies at most once however often they are sent
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class NanovectorError(Exception):
+    """
+    An error response from a nanovector server.
+
+    Attributes:
+        status (int): The HTTP status code.
+        payload (dict): The decoded response body.
+        retry_after (float): The seconds the server asked to wait before retrying, or None.
+    """
+
+    def __init__(self, status: int, payload, retry_after: float = None):
+        message = (
+            payload.get("message", payload) if isinstance(payload, dict) else payload
+        )
+        if isinstance(payload, dict) and payload.get("error"):
+            message = f"{message}: {payload['error']}"
+        super().__init__(f"{status} {message}")
+        self.status = status
+        self.payload = payload
+        self.retry_after = retry_after
+
+
+class ConnectionPool:
+    """
+    A class keeping keep-alive HTTP connections to a server, reused across requests and threads.
+
+    At most size requests are in flight at once, further ones wait for a connection. A request
+    on a reused connection that the server has since closed is retried once on a new one, if
+    it could not be sent or is idempotent: a request that was sent may have been applied.
+
+    Attributes:
+        host (str): The server host.
+        port (int): The server port.
+        size (int): The number of connections.
+        timeout (float): Seconds before a request is abandoned.
+
+    Methods:
+        request(method, path, body, idempotent): Send a request and get its status, decoded JSON body and headers.
+        close(): Close all idle connections.
+    """
+
+    def __init__(self, url: str, size: int = 8, timeout: float = 30.0):
+        """
+        Initialize a ConnectionPool instance.
+
+        Args:
+            url (str): The base URL of the server, such as "http://127.0.0.1:5000".
+            size (int, optional): The number of connections (default is 8).
+            timeout (float, optional): Seconds before a request is abandoned (default is 30.0).
+        """
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port
+        self.size = size
+        self.timeout = timeout
+        self._prefix = parsed.path.rstrip("/")
+        self._connection_type = (
+            http.client.HTTPSConnection
+            if parsed.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    def _send(self, connection, method: str, path: str, body: bytes, idempotent: bool):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, self._prefix + path, body=body, headers=headers)
+        try:
+            response = connection.getresponse()
+        except (ConnectionResetError, BrokenPipeError) as e:
+            # Sent in full, the request may have been applied before the connection closed
+            if not idempotent:
+                raise http.client.HTTPException(
+                    f"Connection closed before a response to {method} {path}"
+                ) from e
+            raise
+        return response.status, response.read(), response.headers
+
+    @staticmethod
+    def _closed_by_server(connection) -> bool:
+        # An idle connection has nothing to read, unless the server closed it
+        if connection.sock is None:
+            return True
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        return bool(readable)
+
+    def request(self, method: str, path: str, body=None, idempotent: bool = None):
+        """
+        Send a request and get its status, decoded JSON body and headers.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path, such as "/my_table/query".
+            body (dict, optional): The JSON body (default is None).
+            idempotent (bool, optional): Whether the request may be sent again once the server
+                received it, None for the methods of IDEMPOTENT_METHODS (default is None).
+
+        Returns:
+            tuple: The status code, the decoded body and the response headers.
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        body = json.dumps(body).encode() if body is not None else None
+        with self._slots:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+                if not idempotent and self._closed_by_server(connection):
+                    # A request that cannot be resent is not risked on a closed connection
+                    connection.close()
+                    raise queue.Empty
+            except queue.Empty:
+                connection, reused = (
+                    self._connection_type(self.host, self.port, timeout=self.timeout),
+                    False,
+                )
+            try:
+                try:
+                    status, data, headers = self._send(
+                        connection, method, path, body, idempotent
+                    )
+                except (
+                    http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                ):
+                    # The server closed the idle connection before reading the request
+                    if not reused:
+                        raise
+                    connection.close()
+                    status, data, headers = self._send(
+                        connection, method, path, body, idempotent
+                    )
+            except Exception:
+                connection.close()
+                raise
+            self._idle.put(connection)
+        content = data.decode("utf-8")
+        try:
+            return status, json.loads(content) if content else None, headers
+        except ValueError:
+            return status, content, headers
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class NanovectorClient:
+    """
+    A client for a nanovector server, with pooled keep-alive connections, batching and compact vector encoding.
+
+    Vectors are sent base64-encoded (see `utils.encoding`) rather than as JSON lists, which
+    are several times larger and slow to parse, unless binary is False. With batching, a query
+    or add is sent at once when no request of its kind is in flight, and those made by several
+    threads while one is in flight are coalesced into the next request: queries on the same
+    table with the same options are sent to /<table>/query_batch, and adds to the same table
+    are concatenated into one /<table>/add. A batch the server rejects as invalid is retried
+    item by item, so that only the items at fault fail. A request the server turns away with a
+    Retry-After header, such as a 429 over the tenant's quota, is sent again once it has waited.
+
+    Attributes:
+        url (str): The base URL of the server.
+        binary (bool): Whether vectors are base64-encoded in requests and responses.
+        dtype (str): The dtype vectors are encoded in.
+
+    Methods:
+        create_table(table_name, embeddings, texts, **options): Create a table.
+        add(table, vector, texts, wait): Add rows to a table.
+        query(table, query_vector, texts, k, **options): Query a table.
+        query_many(table, query_vectors, texts, k, **options): Query a table with several vectors in one request.
+        details(table): Get the description of a table.
+        list_tables(): List the tables.
+        flush(): Send the pending batched adds and queries.
+        close(): Flush and close the connections.
+
+    Example:
+        with NanovectorClient("http://127.0.0.1:5000") as client:
+            client.create_table("docs", embeddings=np.random.rand(100, 64))
+            result = client.query("docs", np.random.rand(64), k=5)
+            print(result["top_k_indices_sorted"])
+    """
+
+    def __init__(
+        self,
+        url: str = "http://127.0.0.1:5000",
+        pool_size: int = 8,
+        timeout: float = 30.0,
+        binary: bool = True,
+        dtype: str = "float32",
+        batching: bool = True,
+        max_batch: int = 64,
+        max_delay: float = 0.002,
+        max_retries: int = 2,
+    ):
+        """
+        Initialize a NanovectorClient instance.
+
+        Args:
+            url (str, optional): The base URL of the server (default is "http://127.0.0.1:5000").
+            pool_size (int, optional): The number of keep-alive connections (default is 8).
+            timeout (float, optional): Seconds before a request is abandoned (default is 30.0).
+            binary (bool, optional): Whether vectors are base64-encoded rather than sent as JSON lists (default is True).
+            dtype (str, optional): The dtype vectors are encoded in (default is "float32").
+            batching (bool, optional): Whether concurrent queries and adds are coalesced into batched requests (default is True).
+            max_batch (int, optional): The number of queries or adds sent in one request (default is 64).
+            max_delay (float, optional): The seconds a query or add may wait for a request in flight (default is 0.002).
+            max_retries (int, optional): The times a request turned away with Retry-After is sent again (default is 2).
+        """
+        self.url = url
+        self.binary = binary
+        self.dtype = dtype
+        self.max_retries = max_retries
+        self._pool = ConnectionPool(url, pool_size, timeout)
+        self._batcher = (
+            MicroBatcher(self._run_batch, max_batch, max_delay, workers=pool_size)
+            if batching
+            else None
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method: str, path: str, body=None, idempotent: bool = None):
+        for attempt in range(self.max_retries + 1):
+            status, payload, headers = self._pool.request(
+                method, path, body, idempotent
+            )
+            retry_after = headers.get("Retry-After")
+            if status < 400:
+                return payload
+            # Requests turned away with Retry-After were not applied
+            if retry_after is None or attempt == self.max_retries:
+                break
+            time.sleep(float(retry_after))
+        raise NanovectorError(
+            status, payload, None if retry_after is None else float(retry_after)
+        )
+
+    def _encode(self, array) -> dict:
+        array = np.asarray(array)
+        return encode_array(array, self.dtype) if self.binary else array.tolist()
+
+    def _decode_result(self, result: dict) -> dict:
+        result["top_k_indices_sorted"] = np.array(
+            result["top_k_indices_sorted"], dtype=np.int64
+        )
+        result["top_k_embeddings"] = decode_array(result["top_k_embeddings"])
+        if "scores" in result:
+            result["scores"] = decode_array(result["scores"])
+        return result
+
+    @staticmethod
+    def _path(table: str, route: str) -> str:
+        return f"/{urllib.parse.quote(table, safe='')}/{route}"
+
+    def create_table(
+        self, table_name: str, embeddings=None, texts: list = None, **options
+    ) -> dict:
+        """
+        Create a table.
+
+        Args:
+            table_name (str): The name of the table.
+            embeddings (array-like, optional): The (n, d) rows of the table, None to embed texts on the server (default is None).
+            texts (list, optional): The texts of the rows (default is None).
+            **options: The other /create fields, such as index_type, use_embedder or model_name.
+
+        Returns:
+            dict: The response of the server.
+
+        Raises:
+            NanovectorError: If the server rejects the request.
+        """
+        body = dict(options, table_name=table_name)
+        if embeddings is not None:
+            body["embeddings"] = self._encode(embeddings)
+        if texts is not None:
+            body["texts"] = texts
+        return self._request("POST", "/create", body)
+
+    def add(self, table: str, vector=None, texts=None, wait: bool = True):
+        """
+        Add rows to a table.
+
+        With batching, adds to the same table made while an add to it is in flight are sent
+        together as the next request. Pass wait=False to get a future instead of waiting, so that a
+        single thread can queue many small adds to be sent together.
+
+        Args:
+            table (str): The name of the table.
+            vector (array-like, optional): The row or (n, d) rows, None to embed texts on the server (default is None).
+            texts (Union[str, list], optional): The texts of the rows (default is None).
+            wait (bool, optional): Whether to wait for the add to be acknowledged (default is True).
+
+        Returns:
+            dict: The response of the server, or a Future of it if wait is False.
+
+        Raises:
+            NanovectorError: If the server rejects the request.
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if vector is not None:
+            vector = np.asarray(vector)
+            vector = vector.reshape(1, -1) if vector.ndim == 1 else vector
+
+        if self._batcher is None:
+            result = self._send_add(table, [(vector, texts)])
+            if wait:
+                return result
+            future = Future()
+            future.set_result(result)
+            return future
+
+        # Rows with and without texts, or vectors and texts to embed, are sent apart
+        kind = (vector is not None, texts is not None)
+        future = self._batcher.submit(("add", table, kind), (vector, texts))
+        return future.result() if wait else future
+
+    def _send_add(self, table: str, items: list) -> dict:
+        vectors = [vector for vector, _ in items if vector is not None]
+        texts = [text for _, item_texts in items for text in item_texts or []]
+        body = {}
+        if vectors:
+            body["vector"] = self._encode(np.concatenate(vectors))
+        if texts:
+            body["texts"] = texts
+        return self._request("POST", self._path(table, "add"), body)
+
+    def query(
+        self, table: str, query_vector=None, texts=None, k: int = 1, **options
+    ) -> dict:
+        """
+        Query a table.
+
+        With batching, queries on the same table with the same k and options made while one
+        is in flight are sent together as the next /<table>/query_batch request.
+
+        Args:
+            table (str): The name of the table.
+            query_vector (array-like, optional): The query vector, None to embed texts on the server (default is None).
+            texts (Union[str, list], optional): The query text, for tables with an embedder (default is None).
+            k (int, optional): The number of rows to retrieve (default is 1).
+            **options: The other /<table>/query fields, such as min_score, filter_ids, hybrid or explain.
+
+        Returns:
+            dict: The "top_k_indices_sorted" and "top_k_embeddings" as arrays, the "texts" and any other fields of the response.
+
+        Raises:
+            NanovectorError: If the server rejects the request.
+        """
+        if isinstance(texts, list):
+            texts = " ".join(texts)
+        if query_vector is not None:
+            query_vector = np.asarray(query_vector).reshape(-1)
+
+        # Hybrid and explained queries have no batched form
+        batchable = not options.get("hybrid") and not options.get("explain")
+        if self._batcher is None or not batchable:
+            body = dict(options, k=k)
+            if query_vector is not None:
+                body["query_vector"] = self._encode(query_vector)
+            if texts is not None:
+                body["texts"] = texts
+            if self.binary:
+                body["encoding"] = BASE64
+            return self._decode_result(
+                self._request("POST", self._path(table, "query"), body, idempotent=True)
+            )
+
+        key = (
+            "query",
+            table,
+            query_vector is not None,
+            json.dumps(dict(options, k=k), sort_keys=True),
+        )
+        return self._batcher.submit(key, (query_vector, texts)).result()
+
+    def query_many(
+        self, table: str, query_vectors=None, texts: list = None, k: int = 1, **options
+    ) -> list:
+        """
+        Query a table with several vectors, or texts, in one request.
+
+        Args:
+            table (str): The name of the table.
+            query_vectors (array-like, optional): The (n, d) query vectors, None to embed texts on the server (default is None).
+            texts (list, optional): The query texts, for tables with an embedder (default is None).
+            k (int, optional): The number of rows to retrieve per query (default is 1).
+            **options: The other /<table>/query_batch fields, such as min_score or filter_ids.
+
+        Returns:
+            list: One result per query, as returned by `query`.
+
+        Raises:
+            NanovectorError: If the server rejects the request.
+        """
+        body = dict(options, k=k)
+        if query_vectors is not None:
+            body["query_vectors"] = self._encode(np.atleast_2d(query_vectors))
+        if texts is not None:
+            body["texts"] = texts
+        if self.binary:
+            body["encoding"] = BASE64
+        payload = self._request(
+            "POST", self._path(table, "query_batch"), body, idempotent=True
+        )
+        return [self._decode_result(result) for result in payload["results"]]
+
+    def _run_batch(self, key: tuple, items: list) -> list:
+        try:
+            return self._send_batch(key, items)
+        except (NanovectorError, ValueError) as e:
+            # A batch rejected as invalid was not applied: send its items one by one, so that
+            # only the items at fault fail. Quota and server errors fail the whole batch.
+            invalid = (
+                not isinstance(e, NanovectorError) or e.status in VALIDATION_STATUSES
+            )
+            if len(items) == 1 or not invalid:
+                raise
+        results = []
+        for item in items:
+            try:
+                results += self._send_batch(key, [item])
+            except (NanovectorError, ValueError) as e:
+                results.append(e)
+        return results
+
+    def _send_batch(self, key: tuple, items: list) -> list:
+        if key[0] == "add":
+            result = self._send_add(key[1], items)
+            return [result] * len(items)
+
+        _, table, has_vectors, options = key
+        options = json.loads(options)
+        k = options.pop("k")
+        if has_vectors:
+            vectors = np.stack([vector for vector, _ in items])
+            return self.query_many(table, vectors, k=k, **options)
+        return self.query_many(table, texts=[text for _, text in items], k=k, **options)
+
+    def details(self, table: str):
+        """
+        Get the description of a table.
+
+        Raises:
+            NanovectorError: If the table does not exist.
+        """
+        return self._request("GET", self._path(table, "details"))
+
+    def list_tables(self):
+        """
+        List the tables of the server with their creation timestamps.
+        """
+        return self._request("GET", "/list_tables")
+
+    def flush(self):
+        """
+        Send the pending batched adds and queries and wait for them.
+        """
+        if self._batcher is not None:
+            self._batcher.flush()
+
+    def close(self):
+        """
+        Flush and close the connections.
+        """
+        if self._batcher is not None:
+            self._batcher.close()
+        self._pool.close()
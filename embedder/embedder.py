@@ -1,10 +1,18 @@
 from sentence_transformers import SentenceTransformer
 
+from utils.metrics import EMBEDDED_TEXTS, EMBEDDING_SECONDS
+from utils.timing import stage
+
 
 class Embedder:
     def __init__(self, model_name):
         self.model_name = model_name
         self.model = SentenceTransformer(model_name)
 
-    def generate_embeddings(self, sentences):
-        return self.model.encode(sentences)
+    def generate_embeddings(self, sentences, table: str = ""):
+        with EMBEDDING_SECONDS.time(model=self.model_name, table=table), stage("embed"):
+            embeddings = self.model.encode(sentences)
+        EMBEDDED_TEXTS.inc(
+            1 if isinstance(sentences, str) else len(sentences), model=self.model_name
+        )
+        return embeddings
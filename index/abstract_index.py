@@ -15,6 +15,7 @@ class AbstractIndex(ABC):
         __len__(): Get the number of vectors in the index.
         add_vector(id, embedding): Add a vector to the index.
         get_similarity(query, k): Retrieve the top-k similar vectors to a query vector.
+        get_similarity_above(query, min_score, k): Retrieve all vectors scoring at least min_score against a query vector.
 
     Example:
         class MyIndex(AbstractIndex):
@@ -77,16 +78,38 @@ class AbstractIndex(ABC):
         pass
 
     @abstractmethod
-    def get_similarity(self, query, k):
+    def get_similarity(self, query, k, return_scores=False):
         """
         Retrieve the top-k similar vectors to a query vector.
 
         Args:
             query: The query vector for similarity search.
             k (int): The number of similar vectors to retrieve.
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
 
         Returns:
-            tuple: A tuple containing two arrays: top-k indices and top-k embeddings.
+            tuple: A tuple containing two arrays: top-k indices and top-k embeddings,
+                followed by the top-k scores if return_scores is True.
+
+        Raises:
+            NotImplementedError: This method must be implemented by subclasses.
+        """
+        pass
+
+    @abstractmethod
+    def get_similarity_above(self, query, min_score, k=None, return_scores=False):
+        """
+        Retrieve all vectors whose similarity to a query vector is at least min_score.
+
+        Args:
+            query: The query vector for similarity search.
+            min_score (float): The minimum similarity score for a vector to be returned.
+            k (int, optional): The maximum number of vectors to retrieve, None for no cap (default is None).
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+
+        Returns:
+            tuple: A tuple containing two arrays: matching indices and matching embeddings,
+                followed by the matching scores if return_scores is True.
 
         Raises:
             NotImplementedError: This method must be implemented by subclasses.
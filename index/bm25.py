@@ -0,0 +1,174 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenise(text: str) -> list[str]:
+    """
+    Split a text into lower-cased word tokens.
+
+    Args:
+        text (str): The text to tokenise.
+
+    Returns:
+        list[str]: The tokens of the text.
+    """
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class BM25Index:
+    """
+    A class representing a BM25 inverted index over the texts of a table.
+
+    Postings are kept per term as a pair of growable numpy arrays (row ids and term
+    frequencies) rather than Python lists, and new rows are appended in place.
+
+    Attributes:
+        k1 (float): The BM25 term frequency saturation parameter.
+        b (float): The BM25 length normalisation parameter.
+        num_docs (int): The number of texts indexed.
+
+    Methods:
+        add_texts(texts): Index new texts, numbered after the existing ones.
+        get_scores(query): Get the BM25 score of every row for a query.
+        get_top_k(query, k): Retrieve the top-k rows for a query.
+
+    Example:
+        index = BM25Index(["the quick brown fox", "a lazy dog"])
+        indices, scores = index.get_top_k("lazy dog", k=1)
+    """
+
+    def __init__(self, texts: list = None, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize a BM25Index instance.
+
+        Args:
+            texts (list, optional): The texts to index (default is None).
+            k1 (float, optional): The BM25 term frequency saturation parameter (default is 1.5).
+            b (float, optional): The BM25 length normalisation parameter (default is 0.75).
+        """
+        self.k1 = k1
+        self.b = b
+        self.num_docs = 0
+        self._vocabulary = {}
+        self._postings_ids = []
+        self._postings_tfs = []
+        self._postings_sizes = []
+        self._doc_lengths = np.zeros(16, dtype=np.int32)
+        self._total_length = 0
+
+        if texts:
+            self.add_texts(texts)
+
+    def __len__(self):
+        """
+        Get the number of texts in the index.
+
+        Returns:
+            int: The number of texts.
+        """
+        return self.num_docs
+
+    def _append_posting(self, term: str, doc_id: int, tf: int):
+        term_id = self._vocabulary.get(term)
+        if term_id is None:
+            term_id = len(self._vocabulary)
+            self._vocabulary[term] = term_id
+            self._postings_ids.append(np.empty(4, dtype=np.int32))
+            self._postings_tfs.append(np.empty(4, dtype=np.int32))
+            self._postings_sizes.append(0)
+
+        size = self._postings_sizes[term_id]
+        if size == len(self._postings_ids[term_id]):
+            # Double the capacity so appends are amortised O(1)
+            self._postings_ids[term_id] = np.resize(
+                self._postings_ids[term_id], 2 * size
+            )
+            self._postings_tfs[term_id] = np.resize(
+                self._postings_tfs[term_id], 2 * size
+            )
+        self._postings_ids[term_id][size] = doc_id
+        self._postings_tfs[term_id][size] = tf
+        self._postings_sizes[term_id] = size + 1
+
+    def add_texts(self, texts):
+        """
+        Index new texts, numbered after the existing ones.
+
+        Args:
+            texts (Union[str, list]): A text or list of texts to index.
+        """
+        if isinstance(texts, str) or texts is None:
+            texts = [texts]
+
+        needed = self.num_docs + len(texts)
+        if needed > len(self._doc_lengths):
+            self._doc_lengths = np.resize(
+                self._doc_lengths, max(needed, 2 * len(self._doc_lengths))
+            )
+
+        for text in texts:
+            tokens = tokenise(text)
+            for term, tf in Counter(tokens).items():
+                self._append_posting(term, self.num_docs, tf)
+            self._doc_lengths[self.num_docs] = len(tokens)
+            self._total_length += len(tokens)
+            self.num_docs += 1
+
+    def get_scores(self, query: str) -> np.array:
+        """
+        Get the BM25 score of every row for a query.
+
+        Args:
+            query (str): The query text.
+
+        Returns:
+            np.array: An array of shape (num_docs,) with the score of each row.
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        if self.num_docs == 0:
+            return scores
+
+        avg_length = max(self._total_length / self.num_docs, 1e-6)
+        doc_lengths = self._doc_lengths[: self.num_docs]
+        for term in set(tokenise(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            size = self._postings_sizes[term_id]
+            ids = self._postings_ids[term_id][:size]
+            tfs = self._postings_tfs[term_id][:size]
+
+            idf = np.log(1 + (self.num_docs - size + 0.5) / (size + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[ids] / avg_length)
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def get_top_k(self, query: str, k: int):
+        """
+        Retrieve the top-k rows for a query, ignoring rows that share no term with it.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of rows to retrieve.
+
+        Returns:
+            tuple: A tuple containing two arrays: row indices and scores, sorted by descending score.
+
+        Raises:
+            ValueError: If k is less than zero.
+        """
+        if k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+
+        scores = self.get_scores(query)
+        matches = np.flatnonzero(scores > 0)
+        if k == 0:
+            matches = matches[:0]
+        elif len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], kth=k - 1)[:k]]
+        order = np.argsort(-scores[matches], kind="stable")
+        return matches[order], scores[matches[order]]
@@ -1,7 +1,9 @@
 import numpy as np
 
 from index.abstract_index import AbstractIndex
-from utils.utils import normalise_embeddings
+from utils.loading import iter_chunks, normalisation_scale
+from utils.timing import stage
+from utils.utils import append_rows, normalise_embeddings, threshold_search
 
 
 class Index(AbstractIndex):
@@ -14,8 +16,10 @@ class Index(AbstractIndex):
         normalise (bool): Whether the embeddings are to be normalized.
 
     Methods:
+        from_chunks(shards, dimension, normalise): Build an index from several arrays without concatenating them.
         add_vector(vector): Add a vector to the index.
         get_similarity(query_vector, k): Retrieve the top-k similar vectors to a query vector.
+        get_similarity_above(query_vector, min_score, k): Retrieve all vectors scoring at least min_score.
 
     Example:
         embeddings = np.random.rand(100, 256)
@@ -42,12 +46,61 @@ class Index(AbstractIndex):
                 f"Expected embeddings of dimension {dimension} but got {embeddings.shape[1]}"
             )
 
-        self.embeddings = (
+        # Rows past num_vectors are spare capacity for add_vector
+        self._embeddings = (
             embeddings if not normalise else normalise_embeddings(embeddings)
         )
         self.dimension = dimension
         self.normalise = normalise
 
+    @classmethod
+    def from_chunks(cls, shards: list, dimension: int, normalise=False):
+        """
+        Build an Index from several arrays, such as memory-mapped shards, without concatenating them first.
+
+        A single shard that needs no normalisation is used as is, without any copy. Otherwise
+        the shards are copied into one preallocated array in bounded-size chunks, normalising
+        each chunk exactly as `normalise_embeddings` would the concatenated array.
+
+        Args:
+            shards (list): A list of 2D arrays of embeddings.
+            dimension (int): The dimensionality of the embeddings.
+            normalise (bool, optional): Whether the embeddings are to be normalized (default is False).
+
+        Returns:
+            Index: The built index.
+
+        Raises:
+            ValueError: If the shape of a shard is not compatible with the specified dimension.
+
+        Example:
+            index = Index.from_chunks(open_embeddings("/data/embeddings/"), dimension=256)
+        """
+        for shard in shards:
+            if shard.shape[1] != dimension:
+                raise ValueError(
+                    f"Expected embeddings of dimension {dimension} but got {shard.shape[1]}"
+                )
+        if len(shards) == 1 and not normalise:
+            return cls(shards[0], dimension)
+
+        dtype = np.result_type(*[shard.dtype for shard in shards])
+        dtype = dtype if np.issubdtype(dtype, np.floating) else np.float64
+        embeddings = np.empty((sum(len(shard) for shard in shards), dimension), dtype)
+        scale = normalisation_scale(shards) if normalise else 1.0
+        for offset, chunk in iter_chunks(shards):
+            np.multiply(chunk, scale, out=embeddings[offset : offset + len(chunk)])
+
+        # The embeddings are already normalised, only new vectors and queries still need it
+        index = cls(embeddings, dimension)
+        index.normalise = normalise
+        return index
+
+    @property
+    def embeddings(self) -> np.array:
+        """Get the array of embeddings indexed in the table."""
+        return self._embeddings[: self.num_vectors]
+
     def add_vector(self, vector: np.array):
         """
         Add a vector to the index.
@@ -70,26 +123,23 @@ class Index(AbstractIndex):
                 f"Expected vector of dimension {self.dimension} but got {vector.shape[1]}"
             )
         vector = vector if not self.normalise else normalise_embeddings(vector)
-        self.embeddings = np.vstack([self.embeddings, vector])
+        self._embeddings = append_rows(self._embeddings, self.num_vectors, vector)
         self.num_vectors = self.num_vectors + vector.shape[0]
 
-    def get_similarity(self, query_vector: np.array, k: int):
+    def _prepare_query(self, query_vector: np.array) -> np.array:
         """
-        Retrieve the top-k similar vectors to a query vector.
+        Validate a query vector, flatten it to shape (dimension,) and normalise it if required.
 
         Args:
             query_vector (np.array): The query vector for similarity search.
-            k (int): The number of similar vectors to retrieve.
 
         Returns:
-            tuple: A tuple containing two arrays: top-k indices and top-k embeddings.
+            np.array: The prepared query vector.
 
         Raises:
-            ValueError: If k is less than zero or the shape of the query vector is not compatible with the index dimension.
+            ValueError: If the shape of the query vector is not compatible with the index dimension.
             NotImplementedError: If multi-vector queries are not supported.
         """
-        if k < 0:
-            raise ValueError(f"Expected k>0 got k={k}")
         if (
             len(query_vector.shape) == 2
             and query_vector.shape[1] == self.dimension
@@ -105,29 +155,107 @@ class Index(AbstractIndex):
                 f"Expected vector of dimension {self.dimension} but got {query_vector.shape[0]}"
             )
 
+        # Normalize the query vector if required
+        with stage("normalise"):
+            query = (
+                query_vector
+                if not self.normalise
+                else normalise_embeddings(query_vector)
+            )
+        # Score in the stored dtype, rather than upcasting every row to the query's
+        if np.issubdtype(self._embeddings.dtype, np.floating):
+            query = query.astype(self._embeddings.dtype, copy=False)
+        return query
+
+    def get_similarity(
+        self, query_vector: np.array, k: int, return_scores: bool = False
+    ):
+        """
+        Retrieve the top-k similar vectors to a query vector.
+
+        Args:
+            query_vector (np.array): The query vector for similarity search.
+            k (int): The number of similar vectors to retrieve.
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+
+        Returns:
+            tuple: A tuple containing two arrays: top-k indices and top-k embeddings,
+                followed by the top-k scores if return_scores is True.
+
+        Raises:
+            ValueError: If k is less than zero or the shape of the query vector is not compatible with the index dimension.
+            NotImplementedError: If multi-vector queries are not supported.
+        """
+        if k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+
         # Determine the actual number of neighbors based on the available vectors
         num_neighbors = min(k, self.num_vectors)
 
-        # Normalize the query vector if required
-        normalized_query = (
-            query_vector if not self.normalise else normalise_embeddings(query_vector)
-        )
+        normalized_query = self._prepare_query(query_vector)
 
         # Compute the dot product (similarity scores) between the normalized query and all embeddings
-        similarity_scores = np.dot(normalized_query, self.embeddings.T)
+        with stage("score"):
+            similarity_scores = np.dot(normalized_query, self.embeddings.T)
 
-        if num_neighbors != self.num_vectors:
-            # Get the indices of the top k similarity scores using argpartition
-            top_k_indices = np.argpartition(-similarity_scores, kth=num_neighbors)[
-                :num_neighbors
-            ]
-        else:
-            top_k_indices = np.argsort(-similarity_scores)
+        with stage("topk"):
+            if num_neighbors != self.num_vectors:
+                # Get the indices of the top k similarity scores using argpartition
+                top_k_indices = np.argpartition(-similarity_scores, kth=num_neighbors)[
+                    :num_neighbors
+                ]
+            else:
+                top_k_indices = np.argsort(-similarity_scores)
 
-        # Sort the indices in ascending order (to preserve the original order)
-        top_k_indices_sorted = top_k_indices[np.argsort(top_k_indices)]
+            # Sort the indices in ascending order (to preserve the original order)
+            top_k_indices_sorted = top_k_indices[np.argsort(top_k_indices)]
 
         # Get the top k embeddings based on the sorted indices
         top_k_embeddings = self.embeddings[top_k_indices_sorted]
 
+        if return_scores:
+            return (
+                top_k_indices_sorted,
+                top_k_embeddings,
+                similarity_scores[top_k_indices_sorted],
+            )
         return top_k_indices_sorted, top_k_embeddings
+
+    def get_similarity_above(
+        self,
+        query_vector: np.array,
+        min_score: float,
+        k=None,
+        return_scores: bool = False,
+    ):
+        """
+        Retrieve all vectors whose similarity to a query vector is at least min_score.
+
+        The embeddings are scanned blockwise, so the full score array is never materialised,
+        and the scan stops early once k matches are found. When capped, the first k matches
+        in row order are returned rather than the k best ones.
+
+        Args:
+            query_vector (np.array): The query vector for similarity search.
+            min_score (float): The minimum similarity score for a vector to be returned.
+            k (int, optional): The maximum number of vectors to retrieve, None for no cap (default is None).
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+
+        Returns:
+            tuple: A tuple containing two arrays: matching indices (ascending) and matching embeddings,
+                followed by the matching scores if return_scores is True.
+
+        Raises:
+            ValueError: If k is less than zero or the shape of the query vector is not compatible with the index dimension.
+            NotImplementedError: If multi-vector queries are not supported.
+        """
+        normalized_query = self._prepare_query(query_vector)
+
+        with stage("score"):
+            indices, scores = threshold_search(
+                normalized_query, self.embeddings, min_score, k
+            )
+
+        if return_scores:
+            return indices, self.embeddings[indices], scores
+        return indices, self.embeddings[indices]
@@ -0,0 +1,313 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from index.abstract_index import AbstractIndex
+from utils.timing import stage
+from utils.utils import BLOCK_SIZE, append_rows, normalise_embeddings
+
+# Number of rows sampled per cluster to train the centroids.
+TRAIN_ROWS_PER_LIST = 256
+
+
+def default_nlist(num_vectors: int) -> int:
+    """
+    Get the default number of IVF clusters for a number of rows, about its square root.
+    """
+    return max(int(np.sqrt(num_vectors)), 1)
+
+
+class IVFIndex(AbstractIndex):
+    """
+    A class representing an approximate inverted file (IVF) index for vector search.
+
+    Rows are clustered with k-means and each cluster keeps the list of its row ids. A query
+    scores the cluster centroids and then only the rows of the `nprobe` best clusters, so it
+    reads about nprobe / nlist of the table instead of all of it. Results are approximate:
+    a close row whose cluster is not probed is missed. Raising nprobe trades speed for recall.
+
+    Rows are kept in insertion order, as in Index, so row ids and `embeddings` are the same.
+
+    Attributes:
+        embeddings (np.array): The array of embeddings indexed in the table.
+        dimension (int): The dimensionality of the embeddings.
+        normalise (bool): Whether the embeddings are to be normalized.
+        nlist (int): The number of clusters.
+        nprobe (int): The number of clusters searched per query.
+        centroids (np.array): The (nlist, dimension) cluster centroids.
+
+    Methods:
+        add_vector(vector): Add a vector to the index.
+        get_similarity(query_vector, k): Retrieve the approximate top-k similar vectors to a query vector.
+        get_similarity_above(query_vector, min_score, k): Retrieve the vectors scoring at least min_score among the probed clusters.
+
+    Example:
+        embeddings = np.random.rand(100000, 256)
+        index = IVFIndex(embeddings, dimension=256, nlist=316, nprobe=16)
+        indices, top_k_vectors = index.get_similarity(np.random.rand(256), k=10)
+    """
+
+    def __init__(
+        self,
+        embeddings: np.array,
+        dimension: int,
+        nlist: int = None,
+        nprobe: int = 8,
+        normalise=False,
+    ):
+        """
+        Initialize an IVFIndex instance, training its centroids on the embeddings.
+
+        Args:
+            embeddings (np.array): The array of embeddings indexed in the table.
+            dimension (int): The dimensionality of the embeddings.
+            nlist (int, optional): The number of clusters, None for about the square root of the number of rows (default is None).
+            nprobe (int, optional): The number of clusters searched per query (default is 8).
+            normalise (bool, optional): Whether the embeddings are to be normalized (default is False).
+
+        Raises:
+            ValueError: If the shape of embeddings is not compatible with the specified dimension, or there are no embeddings.
+        """
+        super().__init__(len(embeddings), dimension)
+        if embeddings.shape[1] != dimension:
+            raise ValueError(
+                f"Expected embeddings of dimension {dimension} but got {embeddings.shape[1]}"
+            )
+        if len(embeddings) == 0:
+            raise ValueError("An IVF index needs at least one row to train on.")
+
+        # Rows past num_vectors are spare capacity for add_vector
+        self._embeddings = (
+            embeddings if not normalise else normalise_embeddings(embeddings)
+        )
+        self.dimension = dimension
+        self.normalise = normalise
+        self.nlist = min(nlist or default_nlist(len(embeddings)), len(embeddings))
+        self.nprobe = min(nprobe, self.nlist)
+
+        # Train on a sample, at most TRAIN_ROWS_PER_LIST rows per cluster
+        num_train = min(len(embeddings), TRAIN_ROWS_PER_LIST * self.nlist)
+        sample = np.sort(
+            np.random.default_rng(0).choice(len(embeddings), num_train, replace=False)
+        )
+        kmeans = MiniBatchKMeans(
+            n_clusters=self.nlist, n_init=3, random_state=0, batch_size=4096
+        )
+        kmeans.fit(self.embeddings[sample])
+        self.centroids = kmeans.cluster_centers_.astype(self._embeddings.dtype)
+
+        assignments = self._assign(self.embeddings)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        self._lists = [order[bounds[c] : bounds[c + 1]] for c in range(self.nlist)]
+        self._list_sizes = np.diff(bounds)
+
+    @property
+    def embeddings(self) -> np.array:
+        """Get the array of embeddings indexed in the table."""
+        return self._embeddings[: self.num_vectors]
+
+    def _assign(self, rows: np.array) -> np.array:
+        """
+        Get the nearest centroid of each row, blockwise to bound memory.
+        """
+        # argmin ||x - c||^2 = argmax (x.c - ||c||^2 / 2)
+        half_norms = 0.5 * np.einsum("ij,ij->i", self.centroids, self.centroids)
+        assignments = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start : start + BLOCK_SIZE]
+            scores = np.dot(block, self.centroids.T) - half_norms
+            assignments[start : start + len(block)] = np.argmax(scores, axis=1)
+        return assignments
+
+    def add_vector(self, vector: np.array):
+        """
+        Add a vector to the index, appending it to the list of its nearest cluster.
+
+        The centroids are not retrained, so after many adds from a shifted distribution
+        the index should be rebuilt.
+
+        Args:
+            vector (np.array): The vector to be added to the index.
+
+        Raises:
+            ValueError: If the shape of the provided vector is not compatible with the index dimension.
+        """
+        if len(vector.shape) == 1 and len(vector) == self.dimension:
+            vector = vector.reshape(1, self.dimension)
+        elif len(vector.shape) == 1:
+            raise ValueError(
+                f"Expected vector of dimension {self.dimension} but got {len(vector)}"
+            )
+
+        if vector.shape[1] != self.dimension:
+            raise ValueError(
+                f"Expected vector of dimension {self.dimension} but got {vector.shape[1]}"
+            )
+        vector = vector if not self.normalise else normalise_embeddings(vector)
+        self._embeddings = append_rows(self._embeddings, self.num_vectors, vector)
+        self._extend_lists(self.num_vectors, self.num_vectors + len(vector))
+        self.num_vectors = self.num_vectors + vector.shape[0]
+
+    @property
+    def num_listed(self) -> int:
+        """Get the number of rows in the cluster lists."""
+        return int(self._list_sizes.sum())
+
+    def _extend_lists(self, start: int, stop: int):
+        """
+        Append stored rows start to stop to the lists of their nearest clusters.
+
+        Rows are assigned as stored, so every process sharing them assigns them alike.
+        """
+        row_ids = np.arange(start, stop)
+        assignments = self._assign(self._embeddings[start:stop])
+        for cluster in np.unique(assignments):
+            self._lists[cluster] = np.concatenate(
+                [self._lists[cluster], row_ids[assignments == cluster]]
+            )
+        self._list_sizes = self._list_sizes + np.bincount(
+            assignments, minlength=self.nlist
+        )
+
+    def _prepare_query(self, query_vector: np.array) -> np.array:
+        """
+        Validate a query vector, flatten it to shape (dimension,) and normalise it if required.
+        """
+        if (
+            len(query_vector.shape) == 2
+            and query_vector.shape[1] == self.dimension
+            and len(query_vector) == 1
+        ):
+            query_vector = query_vector.reshape(
+                self.dimension,
+            )
+        elif len(query_vector.shape) > 1:
+            raise NotImplementedError("Multi-vector query not supported yet.")
+        elif query_vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Expected vector of dimension {self.dimension} but got {query_vector.shape[0]}"
+            )
+
+        with stage("normalise"):
+            query = (
+                query_vector
+                if not self.normalise
+                else normalise_embeddings(query_vector)
+            )
+        return query.astype(self._embeddings.dtype, copy=False)
+
+    def _candidates(
+        self, query: np.array, min_rows: int = 0, allowed: np.array = None
+    ) -> np.array:
+        """
+        Get the ids of the rows in the probed clusters, ascending, keeping only allowed rows if given.
+
+        At least nprobe clusters are probed, more if needed to reach min_rows rows. With allowed
+        rows, min_rows is scaled up by the fraction of rows allowed, so that about min_rows
+        allowed rows are found.
+        """
+        if allowed is not None:
+            min_rows = int(np.ceil(min_rows * self.num_vectors / max(len(allowed), 1)))
+        order = np.argsort(-np.dot(self.centroids, query))
+        sizes = np.cumsum(self._list_sizes[order])
+        num_probes = max(
+            self.nprobe, int(np.searchsorted(sizes, min(min_rows, sizes[-1]))) + 1
+        )
+        lists = [self._lists[cluster] for cluster in order[:num_probes]]
+        candidates = np.sort(np.concatenate(lists))
+        if allowed is not None:
+            candidates = candidates[np.isin(candidates, allowed, assume_unique=True)]
+        return candidates
+
+    def get_similarity(
+        self,
+        query_vector: np.array,
+        k: int,
+        return_scores: bool = False,
+        allowed: np.array = None,
+    ):
+        """
+        Retrieve the approximate top-k similar vectors to a query vector.
+
+        Args:
+            query_vector (np.array): The query vector for similarity search.
+            k (int): The number of similar vectors to retrieve.
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+            allowed (np.array, optional): The sorted unique row ids that may be returned, None for all rows (default is None).
+
+        Returns:
+            tuple: A tuple containing two arrays: top-k indices (ascending) and top-k embeddings,
+                followed by the top-k scores if return_scores is True.
+
+        Raises:
+            ValueError: If k is less than zero or the shape of the query vector is not compatible with the index dimension.
+            NotImplementedError: If multi-vector queries are not supported.
+        """
+        if k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+
+        query = self._prepare_query(query_vector)
+        with stage("score"):
+            candidates = self._candidates(query, min_rows=k, allowed=allowed)
+            similarity_scores = np.dot(self._embeddings[candidates], query)
+
+        with stage("topk"):
+            num_neighbors = min(k, len(candidates))
+            if num_neighbors != len(candidates):
+                top = np.argpartition(-similarity_scores, kth=num_neighbors)[
+                    :num_neighbors
+                ]
+            else:
+                top = np.arange(len(candidates))
+            # Candidates are ascending, so sorting positions sorts row ids
+            top = np.sort(top)
+
+        top_k_indices_sorted = candidates[top]
+        top_k_embeddings = self._embeddings[top_k_indices_sorted]
+        if return_scores:
+            return top_k_indices_sorted, top_k_embeddings, similarity_scores[top]
+        return top_k_indices_sorted, top_k_embeddings
+
+    def get_similarity_above(
+        self,
+        query_vector: np.array,
+        min_score: float,
+        k=None,
+        return_scores: bool = False,
+        allowed: np.array = None,
+    ):
+        """
+        Retrieve the vectors of the probed clusters whose similarity to a query vector is at least min_score.
+
+        When capped, the first k matches in row order are returned rather than the k best ones.
+
+        Args:
+            query_vector (np.array): The query vector for similarity search.
+            min_score (float): The minimum similarity score for a vector to be returned.
+            k (int, optional): The maximum number of vectors to retrieve, None for no cap (default is None).
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+            allowed (np.array, optional): The sorted unique row ids that may be returned, None for all rows (default is None).
+
+        Returns:
+            tuple: A tuple containing two arrays: matching indices (ascending) and matching embeddings,
+                followed by the matching scores if return_scores is True.
+
+        Raises:
+            ValueError: If k is less than zero or the shape of the query vector is not compatible with the index dimension.
+            NotImplementedError: If multi-vector queries are not supported.
+        """
+        if k is not None and k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+
+        query = self._prepare_query(query_vector)
+        with stage("score"):
+            candidates = self._candidates(query, allowed=allowed)
+            similarity_scores = np.dot(self._embeddings[candidates], query)
+
+        matches = np.flatnonzero(similarity_scores >= min_score)
+        matches = matches if k is None else matches[:k]
+
+        indices = candidates[matches]
+        if return_scores:
+            return indices, self._embeddings[indices], similarity_scores[matches]
+        return indices, self._embeddings[indices]
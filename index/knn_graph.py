@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+
+# Number of query rows and base rows multiplied per step.
+QUERY_BLOCK_SIZE = 1024
+BASE_BLOCK_SIZE = 16384
+
+
+def _merge_top_k(best_scores, best_ids, scores, ids, k):
+    """
+    Merge a block of candidate scores into the running per-row top-k.
+
+    Args:
+        best_scores (np.array): The (b, k) running top-k scores.
+        best_ids (np.array): The (b, k) running top-k indices.
+        scores (np.array): The (b, m) candidate scores.
+        ids (np.array): The (m,) candidate indices.
+        k (int): The number of neighbours to keep per row.
+
+    Returns:
+        tuple: The merged (b, k) scores and indices.
+    """
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_ids = np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1)
+    if all_scores.shape[1] > k:
+        keep = np.argpartition(-all_scores, kth=k - 1, axis=1)[:, :k]
+        all_scores = np.take_along_axis(all_scores, keep, axis=1)
+        all_ids = np.take_along_axis(all_ids, keep, axis=1)
+    return all_scores, all_ids
+
+
+def compute_knn_graph(
+    embeddings: np.array,
+    k: int,
+    output_dir: str,
+    queries: np.array = None,
+    exclude_self: bool = True,
+    query_block_size: int = QUERY_BLOCK_SIZE,
+    base_block_size: int = BASE_BLOCK_SIZE,
+):
+    """
+    Compute the k nearest neighbours of every query row against a set of embeddings.
+
+    Scores are computed with blocked matrix-matrix products, keeping a running top-k per
+    query row, and each finished block of rows is written straight to memory-mapped .npy
+    files, so neither the full (n, n) score matrix nor the full result is held in memory.
+
+    Args:
+        embeddings (np.array): The (n, d) base embeddings to search.
+        k (int): The number of neighbours per row.
+        output_dir (str): The directory to write `neighbors.npy` and `scores.npy` to.
+        queries (np.array, optional): The (q, d) query rows, None for a self-join over embeddings (default is None).
+        exclude_self (bool, optional): Whether a row is excluded from its own neighbours in a self-join (default is True).
+        query_block_size (int, optional): The number of query rows per block (default is QUERY_BLOCK_SIZE).
+        base_block_size (int, optional): The number of base rows per block (default is BASE_BLOCK_SIZE).
+
+    Returns:
+        tuple: The paths to the (q, k) neighbour index array and the (q, k) score array,
+            each row sorted by descending score.
+
+    Raises:
+        ValueError: If k is not positive or the query and base dimensions differ.
+
+    Example:
+        embeddings = np.random.rand(1000, 256)
+        neighbors_path, scores_path = compute_knn_graph(embeddings, 10, "/tmp/graph")
+    """
+    if k <= 0:
+        raise ValueError(f"Expected k>0 got k={k}")
+
+    self_join = queries is None
+    queries = embeddings if self_join else queries
+    exclude_self = exclude_self and self_join
+    if queries.shape[1] != embeddings.shape[1]:
+        raise ValueError(
+            f"Expected queries of dimension {embeddings.shape[1]} but got {queries.shape[1]}"
+        )
+
+    # Determine the actual number of neighbours based on the available vectors
+    num_neighbors = min(k, len(embeddings) - int(exclude_self))
+
+    os.makedirs(output_dir, exist_ok=True)
+    neighbors_path = os.path.join(output_dir, "neighbors.npy")
+    scores_path = os.path.join(output_dir, "scores.npy")
+    score_dtype = np.result_type(embeddings.dtype, queries.dtype, np.float32)
+    neighbors = np.lib.format.open_memmap(
+        neighbors_path, mode="w+", dtype=np.int64, shape=(len(queries), num_neighbors)
+    )
+    scores = np.lib.format.open_memmap(
+        scores_path, mode="w+", dtype=score_dtype, shape=(len(queries), num_neighbors)
+    )
+
+    for q_start in range(0, len(queries) if num_neighbors > 0 else 0, query_block_size):
+        query_block = queries[q_start : q_start + query_block_size]
+        best_scores = np.empty((len(query_block), 0), dtype=score_dtype)
+        best_ids = np.empty((len(query_block), 0), dtype=np.int64)
+
+        for b_start in range(0, len(embeddings), base_block_size):
+            base_block = embeddings[b_start : b_start + base_block_size]
+            base_ids = np.arange(b_start, b_start + len(base_block))
+            block_scores = np.dot(query_block, base_block.T).astype(
+                score_dtype, copy=False
+            )
+            if exclude_self:
+                # Mask the diagonal where the query and base blocks overlap
+                shared = np.arange(
+                    max(q_start, b_start),
+                    min(q_start + len(query_block), b_start + len(base_block)),
+                )
+                block_scores[shared - q_start, shared - b_start] = -np.inf
+            best_scores, best_ids = _merge_top_k(
+                best_scores, best_ids, block_scores, base_ids, num_neighbors
+            )
+
+        # Sort each row by descending score before writing it out
+        order = np.argsort(-best_scores, axis=1)
+        neighbors[q_start : q_start + len(query_block)] = np.take_along_axis(
+            best_ids, order, axis=1
+        )
+        scores[q_start : q_start + len(query_block)] = np.take_along_axis(
+            best_scores, order, axis=1
+        )
+
+    neighbors.flush()
+    scores.flush()
+    del neighbors, scores
+
+    return neighbors_path, scores_path
@@ -0,0 +1,371 @@
+import numpy as np
+
+from index.abstract_index import AbstractIndex
+from utils.timing import stage
+from utils.utils import BLOCK_SIZE, EPS, append_rows
+
+
+def _unit_rows(vectors: np.array) -> np.array:
+    """
+    Scale each vector to unit length.
+    """
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + EPS)
+
+
+def check_offsets(offsets, num_vectors: int) -> np.array:
+    """
+    Validate the offsets of documents in a flat array of vectors.
+
+    Args:
+        offsets (array-like): The start of each document in the flat array, followed by the number of vectors, as in CSR.
+        num_vectors (int): The number of vectors in the flat array.
+
+    Returns:
+        np.array: The offsets as an int64 array.
+
+    Raises:
+        ValueError: If the offsets do not start at 0, end at num_vectors or leave a document without vectors.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if offsets.ndim != 1 or len(offsets) < 1 or offsets[0] != 0:
+        raise ValueError("Expected offsets starting at 0.")
+    if offsets[-1] != num_vectors:
+        raise ValueError(
+            f"Expected offsets ending at the number of vectors {num_vectors} but got {offsets[-1]}"
+        )
+    if np.any(np.diff(offsets) < 1):
+        raise ValueError("Expected every document to have at least one vector.")
+    return offsets
+
+
+def maxsim(
+    vectors: np.array,
+    offsets: np.array,
+    query: np.array,
+    block_size: int = BLOCK_SIZE,
+) -> np.array:
+    """
+    Score documents by late interaction: the sum over query vectors of their best match in the document.
+
+    The vectors of consecutive documents are scored against every query vector at once with
+    one matrix product per block of about block_size vectors, and the best match per document
+    and query vector is taken with a segmented max (np.maximum.reduceat) over the block.
+
+    Args:
+        vectors (np.array): The (v, d) vectors of the documents, one document after the other.
+        offsets (np.array): The (n + 1,) start of each document in vectors, followed by v.
+        query (np.array): The (q, d) query vectors.
+        block_size (int, optional): The number of vectors scored per block (default is BLOCK_SIZE).
+
+    Returns:
+        np.array: The (n,) scores of the documents.
+
+    Example:
+        vectors = np.random.rand(7, 64)
+        scores = maxsim(vectors, np.array([0, 3, 7]), np.random.rand(4, 64))  # two documents
+    """
+    num_documents = len(offsets) - 1
+    scores = np.empty(num_documents, dtype=np.result_type(vectors, query))
+    start = 0
+    while start < num_documents:
+        # Whole documents holding about block_size vectors, at least one document
+        end = np.searchsorted(offsets, offsets[start] + block_size, side="right") - 1
+        end = min(max(end, start + 1), num_documents)
+        block = np.dot(vectors[offsets[start] : offsets[end]], query.T)
+        best = np.maximum.reduceat(block, offsets[start:end] - offsets[start], axis=0)
+        scores[start:end] = best.sum(axis=1)
+        start = end
+    return scores
+
+
+class MultiVectorIndex(AbstractIndex):
+    """
+    A class representing an index whose rows are documents owning a variable number of vectors, such as per-token or per-chunk embeddings.
+
+    The vectors of all documents are stored one after the other in a flat array, with the
+    offset of each document, so documents of any length cost no padding. A query is itself a
+    set of vectors, and scores each document by MaxSim: for each query vector its best match
+    among the document's vectors, summed over the query vectors (late interaction, as in
+    ColBERT). Scoring is a blockwise matrix product over the flat array and a segmented max.
+
+    Each document also keeps the normalised mean of its vectors, its `embeddings` row. A
+    prefilter scores these pooled vectors against the mean query vector, one vector per
+    document, and only rescores the best candidates by MaxSim. This is faster on large tables
+    but approximate: a document ranked low by its mean is missed.
+
+    With normalise, every vector is scaled to unit length on its own, so matches are cosine
+    similarities (scaling all vectors by one factor, as the other indexes do, would not
+    change a MaxSim ranking).
+
+    Attributes:
+        embeddings (np.array): The (num_vectors, dimension) pooled vector of each document.
+        vectors (np.array): The flat array of the vectors of all documents.
+        offsets (np.array): The (num_vectors + 1,) start of each document in vectors, followed by the length of vectors.
+        dimension (int): The dimensionality of the vectors.
+        normalise (bool): Whether the vectors are to be normalized.
+
+    Methods:
+        add_vector(vector): Add a document, or a list of documents.
+        document(row): Get the vectors of a document.
+        get_similarity(query_vector, k, return_scores, allowed, prefilter): Retrieve the top-k documents by MaxSim.
+        get_similarity_above(query_vector, min_score, k, return_scores, allowed, prefilter): Retrieve the documents scoring at least min_score.
+
+    Example:
+        vectors = np.random.rand(1000, 128)  # 100 documents of 10 vectors
+        index = MultiVectorIndex(vectors, np.arange(0, 1001, 10), dimension=128, normalise=True)
+        indices, pooled, scores = index.get_similarity(np.random.rand(4, 128), k=10, return_scores=True)
+    """
+
+    def __init__(
+        self,
+        vectors: np.array,
+        offsets: np.array,
+        dimension: int,
+        normalise=False,
+    ):
+        """
+        Initialize a MultiVectorIndex instance.
+
+        Args:
+            vectors (np.array): The (v, dimension) vectors of all documents, one document after the other.
+            offsets (np.array): The (n + 1,) start of each document in vectors, followed by v. None for one vector per document.
+            dimension (int): The dimensionality of the vectors.
+            normalise (bool, optional): Whether each vector is scaled to unit length (default is False).
+
+        Raises:
+            ValueError: If the dimension does not match or the offsets are invalid.
+        """
+        if offsets is None:
+            offsets = np.arange(len(vectors) + 1)
+        offsets = check_offsets(offsets, len(vectors))
+        super().__init__(len(offsets) - 1, dimension)
+        if vectors.shape[1] != dimension:
+            raise ValueError(
+                f"Expected embeddings of dimension {dimension} but got {vectors.shape[1]}"
+            )
+
+        # Both arrays have spare capacity past the vectors and documents in use
+        self._vectors = _unit_rows(vectors) if normalise else vectors
+        self._offsets = offsets
+        self._embeddings = self._pool(self._vectors, offsets)
+        self.dimension = dimension
+        self.normalise = normalise
+
+    @staticmethod
+    def _pool(vectors: np.array, offsets: np.array) -> np.array:
+        """
+        Get the normalised mean vector of each document.
+        """
+        if len(offsets) < 2:
+            return np.empty((0, vectors.shape[1]), dtype=vectors.dtype)
+        return _unit_rows(np.add.reduceat(vectors[: offsets[-1]], offsets[:-1], axis=0))
+
+    @property
+    def embeddings(self) -> np.array:
+        """Get the pooled vector of each document."""
+        return self._embeddings[: self.num_vectors]
+
+    @property
+    def vectors(self) -> np.array:
+        """Get the flat array of the vectors of all documents."""
+        return self._vectors[: self._offsets[self.num_vectors]]
+
+    @property
+    def offsets(self) -> np.array:
+        """Get the start of each document in vectors, followed by the length of vectors."""
+        return self._offsets[: self.num_vectors + 1]
+
+    def document(self, row: int) -> np.array:
+        """
+        Get the vectors of a document.
+
+        Args:
+            row (int): The row of the document.
+
+        Returns:
+            np.array: The (m, dimension) vectors of the document.
+        """
+        return self._vectors[self._offsets[row] : self._offsets[row + 1]]
+
+    def add_vector(self, vector):
+        """
+        Add a document, or several.
+
+        Args:
+            vector (Union[np.array, list]): The (m, dimension) vectors of one document, or a list of such arrays for several.
+
+        Raises:
+            ValueError: If a document has no vectors or the wrong dimension.
+        """
+        documents = vector if isinstance(vector, list) else [vector]
+        documents = [np.asarray(document) for document in documents]
+        documents = [
+            document.reshape(1, -1) if document.ndim == 1 else document
+            for document in documents
+        ]
+        for document in documents:
+            if document.ndim != 2 or document.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Expected vectors of dimension {self.dimension} but got shape {document.shape}"
+                )
+            if len(document) == 0:
+                raise ValueError("Expected every document to have at least one vector.")
+        if not documents:
+            return
+
+        vectors = np.concatenate(documents)
+        vectors = _unit_rows(vectors) if self.normalise else vectors
+        lengths = np.array([len(document) for document in documents], dtype=np.int64)
+        offsets = self._offsets[self.num_vectors] + np.cumsum(lengths)
+
+        num_flat = self._offsets[self.num_vectors]
+        self._vectors = append_rows(self._vectors, num_flat, vectors)
+        pooled = self._pool(vectors, np.concatenate([[0], np.cumsum(lengths)]))
+        self._embeddings = append_rows(self._embeddings, self.num_vectors, pooled)
+        self._offsets = append_rows(
+            self._offsets[:, None], self.num_vectors + 1, offsets[:, None]
+        )[:, 0]
+        self.num_vectors += len(documents)
+
+    def _prepare_query(self, query_vector: np.array) -> np.array:
+        """
+        Validate query vectors, shape them as (q, dimension) and normalise them if required.
+
+        Raises:
+            ValueError: If the shape of the query vectors is not compatible with the index dimension.
+        """
+        query = np.asarray(query_vector)
+        if query.ndim == 1:
+            query = query.reshape(1, -1)
+        if query.ndim != 2 or query.shape[1] != self.dimension or len(query) == 0:
+            raise ValueError(
+                f"Expected query vectors of dimension {self.dimension} but got shape {query.shape}"
+            )
+        with stage("normalise"):
+            query = _unit_rows(query) if self.normalise else query
+        if np.issubdtype(self._vectors.dtype, np.floating):
+            query = query.astype(self._vectors.dtype, copy=False)
+        return query
+
+    def _score(self, query: np.array, allowed: np.array, prefilter: int):
+        """
+        Score the candidate documents by MaxSim.
+
+        Returns:
+            tuple: The candidate rows (ascending, None for all rows) and their scores.
+        """
+        rows = allowed
+        if prefilter is not None:
+            candidates = self.num_vectors if rows is None else len(rows)
+            if prefilter < candidates:
+                # The best documents by their pooled vector, for the mean query vector
+                with stage("prefilter"):
+                    pooled = self.embeddings if rows is None else self.embeddings[rows]
+                    coarse = np.dot(pooled, query.mean(axis=0))
+                    best = np.sort(np.argpartition(-coarse, kth=prefilter)[:prefilter])
+                    rows = best if rows is None else rows[best]
+
+        offsets = self.offsets
+        with stage("score"):
+            if rows is None or len(rows) > self.num_vectors // 2:
+                scores = maxsim(self._vectors, offsets, query)
+                return rows, scores if rows is None else scores[rows]
+            # Gather the vectors of the candidates, so only they are scored
+            lengths = offsets[rows + 1] - offsets[rows]
+            local = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=local[1:])
+            gather = np.repeat(offsets[rows] - local[:-1], lengths) + np.arange(
+                local[-1]
+            )
+            return rows, maxsim(self._vectors[gather], local, query)
+
+    def get_similarity(
+        self,
+        query_vector: np.array,
+        k: int,
+        return_scores: bool = False,
+        allowed: np.array = None,
+        prefilter: int = None,
+    ):
+        """
+        Retrieve the top-k documents by MaxSim against a set of query vectors.
+
+        Args:
+            query_vector (np.array): The (q, dimension) query vectors, or a single (dimension,) one.
+            k (int): The number of documents to retrieve.
+            return_scores (bool, optional): Whether to also return the MaxSim scores (default is False).
+            allowed (np.array, optional): The sorted unique rows that may be returned, None for all rows (default is None).
+            prefilter (int, optional): The number of documents rescored by MaxSim after a prefilter on their pooled
+                vectors, None to score every document (default is None).
+
+        Returns:
+            tuple: A tuple containing two arrays: top-k rows (ascending) and their pooled vectors,
+                followed by the top-k scores if return_scores is True.
+
+        Raises:
+            ValueError: If k is negative, prefilter is less than k or the query vectors have the wrong dimension.
+        """
+        if k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+        if prefilter is not None and prefilter < k:
+            raise ValueError(f"Expected prefilter>=k got prefilter={prefilter}")
+
+        query = self._prepare_query(query_vector)
+        rows, scores = self._score(query, allowed, prefilter)
+
+        with stage("topk"):
+            if k < len(scores):
+                positions = np.sort(np.argpartition(-scores, kth=k)[:k])
+            else:
+                positions = np.arange(len(scores))
+        ids = positions if rows is None else rows[positions]
+
+        if return_scores:
+            return ids, self.embeddings[ids], scores[positions]
+        return ids, self.embeddings[ids]
+
+    def get_similarity_above(
+        self,
+        query_vector: np.array,
+        min_score: float,
+        k=None,
+        return_scores: bool = False,
+        allowed: np.array = None,
+        prefilter: int = None,
+    ):
+        """
+        Retrieve the documents whose MaxSim score against a set of query vectors is at least min_score.
+
+        When capped, the first k matches in row order are returned rather than the k best ones.
+
+        Args:
+            query_vector (np.array): The (q, dimension) query vectors, or a single (dimension,) one.
+            min_score (float): The minimum MaxSim score for a document to be returned.
+            k (int, optional): The maximum number of documents to retrieve, None for no cap (default is None).
+            return_scores (bool, optional): Whether to also return the MaxSim scores (default is False).
+            allowed (np.array, optional): The sorted unique rows that may be returned, None for all rows (default is None).
+            prefilter (int, optional): The number of documents scored by MaxSim after a prefilter on their pooled
+                vectors, None to score every document (default is None).
+
+        Returns:
+            tuple: A tuple containing two arrays: matching rows (ascending) and their pooled vectors,
+                followed by the matching scores if return_scores is True.
+
+        Raises:
+            ValueError: If k or prefilter is negative or the query vectors have the wrong dimension.
+        """
+        if k is not None and k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+        if prefilter is not None and prefilter < 0:
+            raise ValueError(f"Expected prefilter>=0 got prefilter={prefilter}")
+
+        query = self._prepare_query(query_vector)
+        rows, scores = self._score(query, allowed, prefilter)
+
+        positions = np.flatnonzero(scores >= min_score)
+        positions = positions if k is None else positions[:k]
+        ids = positions if rows is None else rows[positions]
+
+        if return_scores:
+            return ids, self.embeddings[ids], scores[positions]
+        return ids, self.embeddings[ids]
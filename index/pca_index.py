@@ -2,7 +2,12 @@ import numpy as np
 from sklearn.decomposition import PCA
 
 from index.abstract_index import AbstractIndex
-from utils.utils import normalise_embeddings
+from utils.loading import iter_chunks, normalisation_scale
+from utils.timing import stage
+from utils.utils import append_rows, normalise_embeddings, threshold_search
+
+# Maximum number of rows sampled to fit the PCA when building from chunks.
+FIT_ROWS = 100000
 
 
 class PCAIndex(AbstractIndex):
@@ -30,10 +35,66 @@ class PCAIndex(AbstractIndex):
 
         self.PCA = PCA(self.dimension_final)
 
-        self.embeddings = self.PCA.fit_transform(
+        # Rows past num_vectors are spare capacity for add_vector
+        self._embeddings = self.PCA.fit_transform(
             embeddings if not self.normalise else normalise_embeddings(embeddings)
         )
 
+    @classmethod
+    def from_chunks(
+        cls,
+        shards: list,
+        dimension_input: int,
+        dimension_final: int,
+        normalise=False,
+        fit_rows: int = FIT_ROWS,
+    ):
+        """
+        Build a PCAIndex from several arrays, such as memory-mapped shards, without concatenating them first.
+
+        The PCA is fitted on at most fit_rows rows sampled uniformly from the shards, and the
+        shards are then transformed in bounded-size chunks into one preallocated array.
+        """
+        for shard in shards:
+            if shard.shape[1] != dimension_input:
+                raise ValueError(
+                    f"Expected embeddings of dimension {dimension_input} but got {shard.shape[1]}"
+                )
+
+        num_vectors = sum(len(shard) for shard in shards)
+        scale = normalisation_scale(shards) if normalise else 1.0
+
+        # Gather the sampled rows shard by shard, in ascending order
+        sample = np.sort(
+            np.random.default_rng(0).choice(
+                num_vectors, min(fit_rows, num_vectors), replace=False
+            )
+        )
+        starts = np.cumsum([0] + [len(shard) for shard in shards])
+        sample_rows = np.concatenate(
+            [
+                shard[sample[(sample >= start) & (sample < start + len(shard))] - start]
+                for shard, start in zip(shards, starts)
+            ]
+        )
+
+        # Fit on the sample, then replace the fitted rows with the full transformed data
+        index = cls(sample_rows * scale, dimension_input, dimension_final)
+        index.normalise = normalise
+        embeddings = np.empty((num_vectors, dimension_final), index._embeddings.dtype)
+        for offset, chunk in iter_chunks(shards):
+            embeddings[offset : offset + len(chunk)] = index.PCA.transform(
+                chunk * scale
+            )
+        index._embeddings = embeddings
+        index.num_vectors = num_vectors
+        return index
+
+    @property
+    def embeddings(self) -> np.array:
+        """Get the array of embeddings indexed in the table, in the reduced space."""
+        return self._embeddings[: self.num_vectors]
+
     def add_vector(self, vector: np.array):
         if len(vector.shape) == 1 and len(vector) == self.dimension:
             vector = vector.reshape(1, self.dimension)
@@ -48,12 +109,10 @@ class PCAIndex(AbstractIndex):
             )
         vector = vector if not self.normalise else normalise_embeddings(vector)
         vector = self.PCA.transform(vector)
-        self.embeddings = np.vstack([self.embeddings, vector])
-        self.num_vectors = self.num_vectors + 1
+        self._embeddings = append_rows(self._embeddings, self.num_vectors, vector)
+        self.num_vectors = self.num_vectors + vector.shape[0]
 
-    def get_similarity(self, query_vector: np.array, k: int):
-        if k < 0:
-            raise ValueError(f"Expected k>0 got k={k}")
+    def _prepare_query(self, query_vector: np.array) -> np.array:
         if (
             len(query_vector.shape) == 2
             and query_vector.shape[1] == self.dimension
@@ -69,31 +128,69 @@ class PCAIndex(AbstractIndex):
                 f"Expected vector of dimension {self.dimension} but got {query_vector.shape[0]}"
             )
 
+        # Normalize the query vector if required
+        with stage("normalise"):
+            query = (
+                query_vector
+                if not self.normalise
+                else normalise_embeddings(query_vector)
+            )
+
+        with stage("pca"):
+            query = self.PCA.transform(query.reshape(1, -1)).reshape(-1)
+        return query.astype(self._embeddings.dtype, copy=False)
+
+    def get_similarity(
+        self, query_vector: np.array, k: int, return_scores: bool = False
+    ):
+        if k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+
         # Determine the actual number of neighbors based on the available vectors
         num_neighbors = min(k, self.num_vectors)
 
-        # Normalize the query vector if required
-        query = (
-            query_vector if not self.normalise else normalise_embeddings(query_vector)
-        )
-
-        query = self.PCA.transform(query)
+        query = self._prepare_query(query_vector)
 
         # Compute the dot product (similarity scores) between the normalized query and all embeddings
-        similarity_scores = np.dot(query, self.embeddings.T)
+        with stage("score"):
+            similarity_scores = np.dot(query, self.embeddings.T)
 
-        if num_neighbors != self.num_vectors:
-            # Get the indices of the top k similarity scores using argpartition
-            top_k_indices = np.argpartition(-similarity_scores, kth=num_neighbors)[
-                :num_neighbors
-            ]
-        else:
-            top_k_indices = np.argsort(-similarity_scores)
+        with stage("topk"):
+            if num_neighbors != self.num_vectors:
+                # Get the indices of the top k similarity scores using argpartition
+                top_k_indices = np.argpartition(-similarity_scores, kth=num_neighbors)[
+                    :num_neighbors
+                ]
+            else:
+                top_k_indices = np.argsort(-similarity_scores)
 
-        # Sort the indices in ascending order (to preserve the original order)
-        top_k_indices_sorted = top_k_indices[np.argsort(top_k_indices)]
+            # Sort the indices in ascending order (to preserve the original order)
+            top_k_indices_sorted = top_k_indices[np.argsort(top_k_indices)]
 
         # Get the top k embeddings based on the sorted indices
         top_k_embeddings = self.embeddings[top_k_indices_sorted]
 
+        if return_scores:
+            return (
+                top_k_indices_sorted,
+                top_k_embeddings,
+                similarity_scores[top_k_indices_sorted],
+            )
         return top_k_indices_sorted, top_k_embeddings
+
+    def get_similarity_above(
+        self,
+        query_vector: np.array,
+        min_score: float,
+        k=None,
+        return_scores: bool = False,
+    ):
+        query = self._prepare_query(query_vector)
+
+        # Scan blockwise in the reduced space, stopping once k matches are found
+        with stage("score"):
+            indices, scores = threshold_search(query, self.embeddings, min_score, k)
+
+        if return_scores:
+            return indices, self.embeddings[indices], scores
+        return indices, self.embeddings[indices]
@@ -1,9 +1,81 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional, Union
 
 import numpy as np
 
+from index.knn_graph import compute_knn_graph
+from index.multi_vector_index import MultiVectorIndex
 from tables.table import VectorTable
+from utils import compute
+from utils.config import IndexConfig
+from utils.metrics import (
+    SEARCH_SECONDS,
+    TABLE_ADDED_ROWS,
+    TABLE_ADDS,
+    TABLE_QUERIES,
+    forget_table,
+)
+from utils.singleflight import SingleFlight
+from utils.utils import EPS
+
+# Candidates per result taken from each normalised table of a federated query, to be rescored.
+RESCORE_FACTOR = 4
+
+
+def search_work(table, query_vector, num_queries: int = None) -> int:
+    """
+    Estimate the multiply-adds of a search of a table, for the compute scheduler. Sharded tables search in their own processes.
+
+    num_queries is taken from the size of query_vector unless given, as for queries already
+    reduced by PCA, whose rows are not dim_input long.
+    """
+    index = getattr(table, "index", None)
+    if index is None:
+        return 0
+    if num_queries is None:
+        num_queries = np.size(query_vector) // table.config.dim_input
+    num_queries = max(num_queries, 1)
+    # Multi-vector documents are scored vector by vector
+    rows = len(index.vectors) if isinstance(index, MultiVectorIndex) else len(index)
+    return rows * table.config.dim_final * num_queries
+
+
+def added_rows(table, vector) -> int:
+    """
+    Get the number of rows an add creates: one per vector, or one per document of a multi-vector table.
+    """
+    if isinstance(getattr(table, "index", None), MultiVectorIndex):
+        return len(vector) if isinstance(vector, list) else 1
+    return len(vector) if np.ndim(vector) > 1 else 1
+
+
+def query_key(
+    table, query_vector, k, min_score, filter_ids, prefilter=None
+) -> Optional[tuple]:
+    """
+    Get the key identifying the result of a query, None if the table has no version to match results to.
+
+    The key holds everything the result depends on: the table instance, its version and row
+    count (shared tables grow without a new version), the query vector and the options.
+    """
+    version = getattr(table, "version", None)
+    if version is None:
+        return None
+    query_vector = np.ascontiguousarray(query_vector)
+    return (
+        table.uuid,
+        version,
+        len(table.index),
+        query_vector.dtype.str,
+        query_vector.shape,
+        query_vector.tobytes(),
+        k,
+        min_score,
+        None if filter_ids is None else tuple(np.asarray(filter_ids).ravel().tolist()),
+        prefilter,
+    )
 
 
 class VectorDB:
@@ -19,6 +91,9 @@ class VectorDB:
         delete_table(table_name): Delete a vector table from the database.
         __len__(): Get the number of vector tables in the database.
         list_tables(): List all vector tables in the database with their creation timestamps.
+        query_tables(table_names, query_vector, k): Query several tables at once and merge their results.
+        plan(table_name, k, min_score, filter_ids, prefilter): Plan a query on a table without running it.
+        rebuild_table(table_name, config, progress): Rebuild the index of a table with a new configuration.
         __repr__(): Get a string representation of the database.
 
     Example:
@@ -34,6 +109,9 @@ class VectorDB:
         """
         self.created_at = datetime.utcnow()
         self._tables = {}
+        self._executor = None
+        # Identical queries made at once are searched once, e.g. when a query trends
+        self._queries = SingleFlight("query")
 
     def get_table(self, table_name: str):
         """
@@ -103,7 +181,11 @@ class VectorDB:
         """
         self.check_table(table_name)
 
-        del self.tables[table_name]
+        table = self.tables.pop(table_name)
+        forget_table(table_name)
+        # Sharded tables own worker processes that must be stopped
+        if hasattr(table, "close"):
+            table.close()
 
     def add_vector(
         self,
@@ -116,7 +198,7 @@ class VectorDB:
 
         Args:
             table_name (str): The name of the table to which the vector will be added.
-            vector (np.array): The vector to be added to the table.
+            vector (np.array): The vector to be added to the table, or the vectors of a document, or a list of documents, for a multi-vector table.
             texts ( Union[str, list[str], None]): corresponding texts to be added, defaults to None
 
         Raises:
@@ -129,22 +211,42 @@ class VectorDB:
             db.add_vector(table_name, vector)
         """
         self.check_table(table_name)
-        self._tables[table_name].add_vector(vector, texts)
+        table = self._tables[table_name]
+        table.add_vector(vector, texts)
+        TABLE_ADDS.inc(table=table_name)
+        TABLE_ADDED_ROWS.inc(added_rows(table, vector), table=table_name)
 
-    def query(self, table_name: str, query_vector: np.array, k: int = 1):
+    def query(
+        self,
+        table_name: str,
+        query_vector: np.array,
+        k: int = 1,
+        min_score: Optional[float] = None,
+        filter_ids: list = None,
+        plan=None,
+        prefilter: int = None,
+    ):
         """
         Perform a similarity query on a specified table.
 
+        Identical queries on the same version of a table made while one of them is being searched
+        share its search, and its result: callers must not modify the arrays returned.
+
         Args:
             table_name (str): The name of the table to query.
             query_vector (np.array): The query vector for similarity search.
-            k (int, optional): The number of similar vectors to retrieve (default is 1).
+            k (int, optional): The number of similar vectors to retrieve (default is 1), or the cap on matches when min_score is set.
+            min_score (float, optional): If set, return all rows scoring at least min_score (default is None).
+            filter_ids (list, optional): The row ids that may be returned, None for all rows (default is None).
+            plan (QueryPlan, optional): A plan from `plan`, planned by the table if None (default is None).
+            prefilter (int, optional): For a multi-vector table, the number of documents rescored by MaxSim
+                after a prefilter on their pooled vectors, None to score every document (default is None).
 
         Returns:
             tuple: A tuple containing two arrays: top-k indices and top-k embeddings.
 
         Raises:
-            ValueError: If the specified table does not exist in the database.
+            ValueError: If the specified table does not exist in the database, or filters a sharded table.
 
         Example:
             db = VectorDB()
@@ -153,7 +255,252 @@ class VectorDB:
             top_k_indices, top_k_embeddings = db.query(table_name, query_vector, k=10)
         """
         self.check_table(table_name)
-        return self._tables[table_name].query(query_vector, k)
+        table = self._tables[table_name]
+        options = {}
+        if filter_ids is not None or plan is not None or prefilter is not None:
+            if not hasattr(table, "plan"):
+                raise ValueError(f"Table {table_name} does not support query plans.")
+            options = {"filter_ids": filter_ids, "plan": plan, "prefilter": prefilter}
+        TABLE_QUERIES.inc(table=table_name)
+        with SEARCH_SECONDS.time(table=table_name):
+            # A plan is derived from the other options, it does not change the result
+            def search():
+                with compute.section(search_work(table, query_vector)):
+                    return table.query(query_vector, k, min_score, **options)
+
+            key = query_key(table, query_vector, k, min_score, filter_ids, prefilter)
+            return search() if key is None else self._queries.do(key, search)
+
+    def plan(
+        self,
+        table_name: str,
+        k: int = 1,
+        min_score: Optional[float] = None,
+        filter_ids: list = None,
+        prefilter: int = None,
+    ):
+        """
+        Plan a similarity query on a specified table, without running it.
+
+        Args:
+            table_name (str): The name of the table to query.
+            k (int, optional): The number of similar vectors to retrieve (default is 1).
+            min_score (float, optional): The minimum score of a threshold query (default is None).
+            filter_ids (list, optional): The row ids that may be returned, None for all rows (default is None).
+            prefilter (int, optional): For a multi-vector table, the number of documents rescored by MaxSim (default is None).
+
+        Returns:
+            QueryPlan: The chosen strategy and the estimated costs.
+
+        Raises:
+            ValueError: If the table does not exist or does not support query plans.
+        """
+        self.check_table(table_name)
+        table = self._tables[table_name]
+        if not hasattr(table, "plan"):
+            raise ValueError(f"Table {table_name} does not support query plans.")
+        return table.plan(k, min_score, filter_ids, prefilter)
+
+    def hybrid_query(
+        self,
+        table_name: str,
+        query_vector: np.array,
+        query_text: str,
+        k: int = 1,
+    ):
+        """
+        Perform a hybrid lexical and vector query on a specified table.
+
+        Args:
+            table_name (str): The name of the table to query.
+            query_vector (np.array): The query vector for similarity search.
+            query_text (str): The query text for BM25 search.
+            k (int, optional): The number of rows to retrieve (default is 1).
+
+        Returns:
+            tuple: A tuple containing four items: top-k indices, top-k embeddings, texts and fused scores.
+
+        Raises:
+            ValueError: If the specified table does not exist or has no BM25 index.
+        """
+        self.check_table(table_name)
+        table = self._tables[table_name]
+        TABLE_QUERIES.inc(table=table_name)
+        with SEARCH_SECONDS.time(table=table_name):
+            with compute.section(search_work(table, query_vector)):
+                return table.hybrid_query(query_vector, query_text, k)
+
+    def query_tables(
+        self,
+        table_names: list[str],
+        query_vector: np.array,
+        k: int = 1,
+        min_score: Optional[float] = None,
+    ):
+        """
+        Perform one similarity query against several tables concurrently and merge the results.
+
+        Each table is searched on a shared thread pool and the per-table results are merged
+        into a single list ranked by descending score. The tables must share the same
+        configuration. Normalised tables scale their rows by the norm of each added batch, so
+        their scores cannot be compared across tables: each of them contributes its best
+        RESCORE_FACTOR * k candidates by its own score, rescored by cosine similarity.
+
+        Args:
+            table_names (list[str]): The names of the tables to query.
+            query_vector (np.array): The query vector for similarity search.
+            k (int, optional): The number of results to return overall (default is 1), or the cap on matches when min_score is set.
+            min_score (float, optional): If set, return all rows scoring at least min_score in any table (default is None).
+
+        Returns:
+            list: A list of dictionaries with keys "table", "index", "score", "embedding" and "text",
+                sorted by descending score.
+
+        Raises:
+            ValueError: If a table does not exist, or the tables do not share the same input and final dimensions,
+                PCA, normalisation and dtype.
+
+        Example:
+            db = VectorDB()
+            query_vector = np.random.rand(1, config.dim_input)
+            results = db.query_tables(["tenant_a", "tenant_b"], query_vector, k=10)
+        """
+        for table_name in table_names:
+            self.check_table(table_name)
+        fields = ("dim_input", "dim_final", "pca", "normalise", "dtype")
+        for field in fields:
+            values = {getattr(self._tables[name].config, field) for name in table_names}
+            if len(values) > 1:
+                raise ValueError(
+                    f"Tables must share the same {field} to be queried together, got {sorted(map(str, values))}."
+                )
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor()
+        # Each search runs in a copy of the caller's context, so it is timed as part of the request
+        futures = {
+            name: self._executor.submit(
+                contextvars.copy_context().run,
+                self._timed_query,
+                name,
+                query_vector,
+                k,
+                min_score,
+            )
+            for name in dict.fromkeys(table_names)
+        }
+
+        results = []
+        for name, future in futures.items():
+            indices, embeddings, texts, scores = future.result()
+            for i, row in enumerate(indices.tolist()):
+                results.append(
+                    {
+                        "table": name,
+                        "index": row,
+                        "score": float(scores[i]),
+                        "embedding": embeddings[i],
+                        "text": texts[i] if texts is not None else None,
+                    }
+                )
+
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results if k is None else results[:k]
+
+    def _timed_query(self, table_name: str, query_vector: np.array, k, min_score):
+        table = self._tables[table_name]
+        normalise = table.config.normalise
+        if normalise and k is not None:
+            # Sharded tables have no index of their own, but a length
+            k = min(RESCORE_FACTOR * k, len(getattr(table, "index", table)))
+        TABLE_QUERIES.inc(table=table_name)
+        with SEARCH_SECONDS.time(table=table_name):
+            with compute.section(search_work(table, query_vector)):
+                indices, embeddings, texts, scores = table.query(
+                    query_vector, k, min_score, return_scores=True
+                )
+        if normalise and len(indices):
+            # The query is normalised on its own, so dividing by the row norms gives the cosine
+            scores = scores / (
+                np.linalg.norm(embeddings.reshape(len(indices), -1), axis=1) + EPS
+            )
+        return indices, embeddings, texts, scores
+
+    def knn_graph(
+        self,
+        table_name: str,
+        k: int,
+        output_dir: str,
+        other_table_name: Optional[str] = None,
+        exclude_self: bool = True,
+    ):
+        """
+        Compute the k nearest neighbours of every row of a table and write them to disk.
+
+        Without other_table_name this is a self-join over the table. With it, the neighbours of
+        every row of table_name are searched among the rows of other_table_name.
+
+        Args:
+            table_name (str): The name of the table whose rows are the queries.
+            k (int): The number of neighbours per row.
+            output_dir (str): The directory to write `neighbors.npy` and `scores.npy` to.
+            other_table_name (str, optional): The name of the table to search, None for a self-join (default is None).
+            exclude_self (bool, optional): Whether a row is excluded from its own neighbours in a self-join (default is True).
+
+        Returns:
+            tuple: The paths to the (n, k) neighbour index array and the (n, k) score array.
+
+        Raises:
+            ValueError: If a table does not exist, or the two tables do not share an embedding space.
+
+        Example:
+            db = VectorDB()
+            neighbors_path, scores_path = db.knn_graph("my_table", 10, "/tmp/my_table_graph")
+        """
+        self.check_table(table_name)
+        table = self._tables[table_name]
+        if other_table_name is None or other_table_name == table_name:
+            embeddings = table.index.embeddings
+            with compute.section(search_work(table, embeddings, len(embeddings))):
+                return compute_knn_graph(
+                    embeddings, k, output_dir, exclude_self=exclude_self
+                )
+
+        self.check_table(other_table_name)
+        other = self._tables[other_table_name]
+        if table.config.pca or other.config.pca:
+            raise ValueError(
+                "knn_graph between two tables is not supported for PCA tables, their reduced spaces differ."
+            )
+        embeddings = table.index.embeddings
+        with compute.section(search_work(other, embeddings, len(embeddings))):
+            return compute_knn_graph(
+                other.index.embeddings, k, output_dir, queries=embeddings
+            )
+
+    def rebuild_table(self, table_name: str, config: IndexConfig, progress=None):
+        """
+        Rebuild the index of a table with a new configuration, serving queries from the old index meanwhile.
+
+        Args:
+            table_name (str): The name of the table to rebuild.
+            config (IndexConfig): The new configuration, with the same input dimension.
+            progress (callable, optional): Called as progress(fraction, stage) as the rebuild advances (default is None).
+
+        Raises:
+            ValueError: If the table does not exist, does not support rebuilds, or the configuration is invalid.
+
+        Example:
+            db = VectorDB()
+            config = db.get_table("my_table").config.replace(index_type="ivf")
+            db.rebuild_table("my_table", config)
+        """
+        self.check_table(table_name)
+        table = self._tables[table_name]
+        if not hasattr(table, "rebuild"):
+            raise ValueError(f"Table {table_name} does not support rebuilds.")
+        with compute.section(len(table.index) * config.dim_input):
+            table.rebuild(config, progress)
 
     def update_time(self, table_name: str):
         """
@@ -0,0 +1,259 @@
+from typing import Optional
+
+import numpy as np
+
+from index.ivf_index import IVFIndex
+from index.multi_vector_index import MultiVectorIndex
+from utils.timing import stage
+
+# Fixed cost of an IVF search, in multiply-adds: sorting the centroids, concatenating and sorting
+# the probed lists. Measured with benchmarks.run, scans and IVF break even near 3000 rows at d=64.
+IVF_OVERHEAD = 150000
+
+STRATEGIES = ("scan", "filtered_scan", "ivf", "maxsim", "prefiltered_maxsim")
+# Strategies which may miss some of the best rows
+APPROXIMATE = ("ivf", "prefiltered_maxsim")
+
+
+class QueryPlan:
+    """
+    A class describing how a query is executed and what each strategy was estimated to cost.
+
+    Costs are estimated in multiply-adds over vector components. Copying a row out of the
+    table, as a gather over filtered or probed rows does, costs about as much as scoring it.
+
+    Attributes:
+        strategy (str): "scan" to score every row, "filtered_scan" to score only the allowed rows, "ivf" to probe the IVF clusters,
+            "maxsim" to score documents of a multi-vector index by MaxSim, or "prefiltered_maxsim" to rescore only the best
+            documents by their pooled vector.
+        exact (bool): Whether the strategy returns the exact top-k.
+        estimated_cost (float): The estimated cost of the strategy.
+        rows_scored (int): The estimated number of rows scored.
+        selectivity (float): The fraction of rows allowed by the filter, 1 without a filter.
+        costs (dict): The estimated cost of every strategy considered.
+
+    Methods:
+        to_dict(): Get the plan as a dictionary, for debug output.
+    """
+
+    def __init__(
+        self,
+        strategy: str,
+        estimated_cost: float,
+        rows_scored: int,
+        selectivity: float,
+        costs: dict,
+    ):
+        """
+        Initialize a QueryPlan instance.
+
+        Args:
+            strategy (str): The chosen strategy, from STRATEGIES.
+            estimated_cost (float): The estimated cost of the strategy.
+            rows_scored (int): The estimated number of rows scored.
+            selectivity (float): The fraction of rows allowed by the filter.
+            costs (dict): The estimated cost of every strategy considered.
+        """
+        self.strategy = strategy
+        self.exact = strategy not in APPROXIMATE
+        self.estimated_cost = estimated_cost
+        self.rows_scored = rows_scored
+        self.selectivity = selectivity
+        self.costs = costs
+
+    def to_dict(self) -> dict:
+        """
+        Get the plan as a dictionary, for debug output.
+
+        Returns:
+            dict: The attributes of the plan.
+        """
+        return {
+            "strategy": self.strategy,
+            "exact": self.exact,
+            "estimated_cost": self.estimated_cost,
+            "rows_scored": self.rows_scored,
+            "selectivity": self.selectivity,
+            "costs": self.costs,
+        }
+
+    def __repr__(self) -> str:
+        return f"QueryPlan(strategy={self.strategy}, estimated_cost={self.estimated_cost:.0f}, rows_scored={self.rows_scored})"
+
+
+def plan_query(
+    index,
+    k: Optional[int],
+    allowed: np.array = None,
+    min_score: float = None,
+    prefilter: int = None,
+) -> QueryPlan:
+    """
+    Choose the cheapest strategy for a query from the size of the index, k and the filter.
+
+    A full scan scores every row with one BLAS call. A filtered scan gathers and scores the
+    allowed rows only, which wins when the filter is selective. An IVF index scores its
+    centroids and the rows of the probed clusters, probing more clusters when a filter rejects
+    most of their rows, which wins on large tables.
+
+    A multi-vector index scores every vector of the allowed documents per query vector, or
+    with a prefilter one pooled vector per document and the vectors of the prefilter best.
+    The prefilter is approximate, so it is only used when asked for.
+
+    Args:
+        index (AbstractIndex): The index of the table.
+        k (int): The number of rows to retrieve, None for no cap on threshold queries.
+        allowed (np.array, optional): The sorted unique row ids that may be returned, None for all rows (default is None).
+        min_score (float, optional): The minimum score of a threshold query (default is None).
+        prefilter (int, optional): The number of documents of a multi-vector index rescored by MaxSim after
+            a prefilter on their pooled vectors, None to score every document (default is None).
+
+    Returns:
+        QueryPlan: The chosen plan.
+
+    Raises:
+        ValueError: If prefilter is set for an index that is not multi-vector.
+    """
+    if isinstance(index, MultiVectorIndex):
+        return _plan_multi_vector(index, allowed, prefilter)
+    if prefilter is not None:
+        raise ValueError("prefilter is only supported by multi-vector tables.")
+
+    # Rows are scored at their stored width, dim_final for a PCA index
+    n, d = index.num_vectors, index.embeddings.shape[1]
+    selectivity = 1.0 if allowed is None else len(allowed) / max(n, 1)
+
+    costs = {"scan": float(n * d)}
+    rows = {"scan": n}
+    if allowed is not None:
+        costs["filtered_scan"] = float(2 * len(allowed) * d)
+        rows["filtered_scan"] = len(allowed)
+    if isinstance(index, IVFIndex) and n > 0:
+        # Probed rows, nprobe lists' worth and, for top-k queries, enough to hold k allowed rows
+        wanted = 0 if min_score is not None else k / max(selectivity, 1e-9)
+        probed = max(n * index.nprobe / index.nlist, wanted)
+        probed = int(min(probed, n))
+        costs["ivf"] = float(index.nlist * d + 2 * probed * d + IVF_OVERHEAD)
+        rows["ivf"] = probed
+
+    strategy = min(costs, key=costs.get)
+    return QueryPlan(strategy, costs[strategy], rows[strategy], selectivity, costs)
+
+
+def _plan_multi_vector(
+    index: MultiVectorIndex, allowed: Optional[np.array], prefilter: Optional[int]
+) -> QueryPlan:
+    """
+    Plan a MaxSim query on a multi-vector index, costed per query vector.
+    """
+    n, d = index.num_vectors, index.dimension
+    selectivity = 1.0 if allowed is None else len(allowed) / max(n, 1)
+    candidates = n if allowed is None else len(allowed)
+    # Vectors per document, as a gather copies about as many vectors as it scores
+    per_document = len(index.vectors) / max(n, 1)
+
+    costs = {"maxsim": float(candidates * per_document * d)}
+    rows = {"maxsim": candidates}
+    if prefilter is not None:
+        rescored = min(prefilter, candidates)
+        costs["prefiltered_maxsim"] = float(
+            candidates * d + 2 * rescored * per_document * d
+        )
+        rows["prefiltered_maxsim"] = rescored
+        strategy = "prefiltered_maxsim"
+    else:
+        strategy = "maxsim"
+    return QueryPlan(strategy, costs[strategy], rows[strategy], selectivity, costs)
+
+
+def _top_k(scores: np.array, k: Optional[int]) -> np.array:
+    """
+    Get the positions of the k highest scores, ascending.
+    """
+    if k is None or k >= len(scores):
+        return np.arange(len(scores))
+    return np.sort(np.argpartition(-scores, kth=k)[:k])
+
+
+def execute_plan(
+    index,
+    plan: QueryPlan,
+    query_vector: np.array,
+    k: Optional[int],
+    allowed: np.array = None,
+    min_score: float = None,
+    prefilter: int = None,
+):
+    """
+    Run a query on an index following a plan.
+
+    An IVF plan for an index that has since been rebuilt into another type falls back to an
+    exact scan.
+
+    Args:
+        index (AbstractIndex): The index of the table.
+        plan (QueryPlan): The plan, from plan_query.
+        query_vector (np.array): The query vector for similarity search.
+        k (int): The number of rows to retrieve, or the cap on matches when min_score is set.
+        allowed (np.array, optional): The sorted unique row ids that may be returned, None for all rows (default is None).
+        min_score (float, optional): If set, return the rows scoring at least min_score instead of the top-k (default is None).
+        prefilter (int, optional): The prefilter of a multi-vector query, see plan_query (default is None).
+
+    Returns:
+        tuple: The indices (ascending), embeddings and scores of the results.
+    """
+    if isinstance(index, MultiVectorIndex):
+        if plan.strategy != "prefiltered_maxsim":
+            prefilter = None
+        if min_score is not None:
+            return index.get_similarity_above(
+                query_vector,
+                min_score,
+                k,
+                return_scores=True,
+                allowed=allowed,
+                prefilter=prefilter,
+            )
+        return index.get_similarity(
+            query_vector, k, return_scores=True, allowed=allowed, prefilter=prefilter
+        )
+
+    ivf = isinstance(index, IVFIndex)
+    if plan.strategy == "ivf" and ivf:
+        if min_score is not None:
+            return index.get_similarity_above(
+                query_vector, min_score, k, return_scores=True, allowed=allowed
+            )
+        return index.get_similarity(
+            query_vector, k, return_scores=True, allowed=allowed
+        )
+
+    if plan.strategy != "filtered_scan" and allowed is None and not ivf:
+        # The index's own exact search, blockwise for threshold queries
+        if min_score is not None:
+            return index.get_similarity_above(
+                query_vector, min_score, k, return_scores=True
+            )
+        return index.get_similarity(query_vector, k, return_scores=True)
+
+    # Score the allowed rows, or all rows of an IVF index, exactly
+    query = index._prepare_query(query_vector)
+    rows = allowed if plan.strategy == "filtered_scan" else None
+    with stage("score"):
+        embeddings = index.embeddings if rows is None else index.embeddings[rows]
+        scores = np.dot(embeddings, query)
+    with stage("topk"):
+        if rows is None and allowed is not None:
+            # Scored every row, mask out those the filter rejects
+            keep = np.zeros(len(scores), dtype=bool)
+            keep[allowed] = True
+            scores = np.where(keep, scores, -np.inf)
+            if k is not None:
+                k = min(k, len(allowed))
+        if min_score is not None:
+            positions = np.flatnonzero(scores >= min_score)
+            positions = positions if k is None else positions[:k]
+        else:
+            positions = _top_k(scores, k)
+    ids = positions if rows is None else rows[positions]
+    return ids, index.embeddings[ids], scores[positions]
@@ -0,0 +1,454 @@
+import hashlib
+import hmac
+import pickle
+import threading
+import time
+import urllib.request
+from typing import Optional, Union
+
+import numpy as np
+
+from tables.db import VectorDB
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+# Maximum number of log entries shipped per request.
+BATCH_SIZE = 256
+# Header a replica sends the shared secret in, and the primary signs the log batch in.
+SECRET_HEADER = "X-Nanovector-Replication-Secret"
+SIGNATURE_HEADER = "X-Nanovector-Replication-Signature"
+
+
+def sign(secret: str, body: bytes) -> str:
+    """
+    Sign a log batch with the shared replication secret.
+
+    Args:
+        secret (str): The secret shared by the primary and its replicas.
+        body (bytes): The encoded log batch.
+
+    Returns:
+        str: The hex HMAC-SHA256 of the batch.
+    """
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class MutationLog:
+    """
+    A class representing an append-only, in-memory log of the mutations applied to a VectorDB.
+
+    Entries are numbered from 1 in the order they were applied. Each entry is a dictionary with
+    the keys "seq", "op" ("create", "add", "delete" or "snapshot"), "table", "payload" and "time".
+
+    With a snapshot function, the log keeps only its last max_entries entries. A reader behind
+    the oldest entry kept gets a "snapshot" entry instead, holding every table, and continues
+    from there. Each table is taken as of its own sequence number, given in the "seqs" of the
+    entry, and the reader skips the entries of a table up to it.
+
+    Attributes:
+        head (int): The sequence number of the last entry, 0 if the log is empty.
+        max_entries (int): The number of entries kept, None to keep them all.
+
+    Methods:
+        append(op, table_name, payload): Append an entry to the log.
+        since(seq, limit): Get the entries after a sequence number.
+        pending(seq): Get the number and age of the entries after a sequence number, per table.
+    """
+
+    def __init__(self, max_entries: int = None, snapshot=None):
+        """
+        Initialize a MutationLog instance.
+
+        Args:
+            max_entries (int, optional): The number of entries kept, None to keep them all (default is None).
+            snapshot (callable, optional): Returns a "snapshot" entry of the database, required to truncate
+                the log (default is None).
+
+        Raises:
+            ValueError: If max_entries is set without a snapshot function.
+        """
+        if max_entries is not None and snapshot is None:
+            raise ValueError("A bounded mutation log requires a snapshot function.")
+        self.max_entries = max_entries
+        self._snapshot = snapshot
+        self._entries = []
+        # The sequence number of the oldest entry kept
+        self._first = 1
+        self._lock = threading.Lock()
+
+    @property
+    def head(self) -> int:
+        """Get the sequence number of the last entry, 0 if the log is empty."""
+        return self._first + len(self._entries) - 1
+
+    def append(self, op: str, table_name: str, payload=None) -> int:
+        """
+        Append an entry to the log.
+
+        Args:
+            op (str): The mutation, "create", "add" or "delete".
+            table_name (str): The name of the table mutated.
+            payload (optional): The data needed to replay the mutation (default is None).
+
+        Returns:
+            int: The sequence number of the entry.
+        """
+        with self._lock:
+            seq = self._first + len(self._entries)
+            self._entries.append(
+                {
+                    "seq": seq,
+                    "op": op,
+                    "table": table_name,
+                    "payload": payload,
+                    "time": time.time(),
+                }
+            )
+            if self.max_entries is not None and len(self._entries) > self.max_entries:
+                dropped = len(self._entries) - self.max_entries
+                del self._entries[:dropped]
+                self._first += dropped
+            return seq
+
+    def since(self, seq: int, limit: int = BATCH_SIZE) -> list:
+        """
+        Get the entries after a sequence number.
+
+        Args:
+            seq (int): The sequence number of the last entry already seen.
+            limit (int, optional): The maximum number of entries to return (default is BATCH_SIZE).
+
+        Returns:
+            list: The entries, oldest first, or a single "snapshot" entry if entries after seq were truncated.
+        """
+        with self._lock:
+            if seq >= self._first - 1:
+                start = seq - self._first + 1
+                return self._entries[start : start + limit]
+        # Taken outside the lock, the snapshot function appends nothing but reads the head
+        return [self._snapshot()]
+
+    def pending(self, seq: int) -> dict:
+        """
+        Get the number and age of the entries after a sequence number, per table.
+
+        Args:
+            seq (int): The sequence number of the last entry already seen.
+
+        Returns:
+            dict: A dictionary of table names to {"entries": count, "oldest": time of the oldest entry}.
+        """
+        with self._lock:
+            entries = self._entries[max(seq - self._first + 1, 0) :]
+        pending = {}
+        for entry in entries:
+            table = pending.setdefault(
+                entry["table"], {"entries": 0, "oldest": entry["time"]}
+            )
+            table["entries"] += 1
+        return pending
+
+
+class ReplicatedVectorDB(VectorDB):
+    """
+    A VectorDB acting as a replication primary, recording every mutation in a MutationLog.
+
+    Tables are logged as a pickled snapshot when created or rebuilt, and adds as the raw
+    vectors and texts, so replicas that replay the log end up with exactly the same tables.
+    The log keeps its last log_entries entries, and replicas further behind are sent a
+    snapshot of every table instead, so a long-running primary does not grow without bound.
+
+    Mutations of a table are serialised by a lock of its own, so the log order of a table is
+    the order its mutations were applied in. A snapshot holds one table's lock at a time while
+    pickling it, so writes to the other tables go on.
+
+    Attributes:
+        log (MutationLog): The log of mutations applied to the database.
+
+    Example:
+        primary = ReplicatedVectorDB()
+        primary.add_table(table)
+        entries = primary.log.since(0)
+    """
+
+    def __init__(self, log_entries: int = None):
+        """
+        Initialize a ReplicatedVectorDB instance.
+
+        Args:
+            log_entries (int, optional): The number of entries the log keeps, None to keep them all (default is None).
+        """
+        super().__init__()
+        self.log = MutationLog(log_entries, self._snapshot)
+        # Serialise the mutations of each table, so its log order is the order they were applied in
+        self._table_locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _table_lock(self, table_name: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._table_locks.setdefault(table_name, threading.Lock())
+
+    def _snapshot(self) -> dict:
+        """
+        Get a "snapshot" log entry of every table.
+
+        The entry's "seq" is the head of the log when the snapshot starts. Each table is then
+        pickled as of its own "seqs" entry, the head when its lock was taken: its entries up to
+        that number are in the snapshot, and none of its later ones.
+        """
+        seq = self.log.head
+        payload, seqs = {}, {}
+        for table_name in list(self._tables):
+            with self._table_lock(table_name):
+                seqs[table_name] = self.log.head
+                table = self._tables.get(table_name)
+                # A table deleted since is absent as of its seqs entry
+                if table is not None:
+                    payload[table_name] = pickle.dumps(table)
+        return {
+            "seq": seq,
+            "op": "snapshot",
+            "table": None,
+            "payload": payload,
+            "seqs": seqs,
+            "time": time.time(),
+        }
+
+    def add_table(self, table: VectorTable):
+        """
+        Add a table and log it.
+
+        Raises:
+            ValueError: If a table with the same name exists.
+            TypeError: If the table cannot be pickled for the log, such as a sharded table.
+        """
+        # Pickled first, so a table replicas cannot receive is never added
+        payload = pickle.dumps(table)
+        with self._table_lock(table.table_name):
+            super().add_table(table)
+            self.log.append("create", table.table_name, payload)
+
+    def delete_table(self, table_name: str):
+        with self._table_lock(table_name):
+            super().delete_table(table_name)
+            self.log.append("delete", table_name)
+
+    def add_vector(
+        self,
+        table_name: str,
+        vector: np.array,
+        texts: Union[str, list[str], None] = None,
+    ):
+        with self._table_lock(table_name):
+            super().add_vector(table_name, vector, texts)
+            # The documents of a multi-vector add are a list of arrays of different lengths
+            multi_vector = self._tables[table_name].config.index_type == "multi_vector"
+            if multi_vector and isinstance(vector, list):
+                vector = [np.array(document) for document in vector]
+            else:
+                vector = np.array(vector)
+            self.log.append("add", table_name, (vector, texts))
+
+    def rebuild_table(self, table_name: str, config: IndexConfig, progress=None):
+        # Adds keep being logged during the build, the rebuilt table then replaces the
+        # replicas' copy as a snapshot that includes all of them
+        super().rebuild_table(table_name, config, progress)
+        with self._table_lock(table_name):
+            table = self._tables[table_name]
+            self.log.append("create", table_name, pickle.dumps(table))
+
+
+def apply_entry(db: VectorDB, entry: dict):
+    """
+    Replay one mutation log entry on a VectorDB.
+
+    Args:
+        db (VectorDB): The database to apply the entry to.
+        entry (dict): The log entry.
+
+    Raises:
+        ValueError: If the entry has an unknown op.
+    """
+    if entry["op"] == "snapshot":
+        # Replaces every table, the entries after each table's seqs entry are then replayed
+        for table_name in list(db.tables):
+            db.delete_table(table_name)
+        for payload in entry["payload"].values():
+            db.add_table(pickle.loads(payload))
+    elif entry["op"] == "create":
+        table = pickle.loads(entry["payload"])
+        if table.table_name in db.tables:
+            db.delete_table(table.table_name)
+        db.add_table(table)
+    elif entry["op"] == "add":
+        vector, texts = entry["payload"]
+        db.add_vector(entry["table"], vector, texts)
+    elif entry["op"] == "delete":
+        if entry["table"] in db.tables:
+            db.delete_table(entry["table"])
+    else:
+        raise ValueError(f"Unknown mutation log op {entry['op']}")
+
+
+class Replica:
+    """
+    A class that keeps a local VectorDB in sync with a primary server by replaying its mutation log.
+
+    A background thread polls the primary's `/replication/log` route and applies the shipped
+    entries in order. Replication lag is tracked per table, both in log entries and in seconds.
+
+    The log is shipped pickled. The replica authenticates to the primary with a shared secret,
+    and unpickles a batch only if the primary signed it with the same secret.
+
+    Attributes:
+        primary_url (str): The base URL of the primary server.
+        db (VectorDB): The local database kept in sync.
+        applied (int): The sequence number of the last entry applied.
+
+    Methods:
+        start(): Start syncing in a background thread.
+        stop(): Stop the background thread.
+        sync_once(): Fetch and apply one batch of entries.
+        status(): Get the replication status and per-table lag.
+
+    Example:
+        replica = Replica("http://primary:5000", VectorDB())
+        replica.start()
+    """
+
+    def __init__(
+        self, primary_url: str, db: VectorDB, secret: str, poll_interval: float = 0.5
+    ):
+        """
+        Initialize a Replica instance.
+
+        Args:
+            primary_url (str): The base URL of the primary server.
+            db (VectorDB): The local database kept in sync.
+            secret (str): The secret shared with the primary.
+            poll_interval (float, optional): Seconds to wait between polls once caught up (default is 0.5).
+        """
+        self.primary_url = primary_url.rstrip("/")
+        self.db = db
+        self.poll_interval = poll_interval
+        self.applied = 0
+        self._secret = secret
+        # The seqs of the last snapshot, up to which entries of a table are already applied
+        self._snapshot_seqs = {}
+        self._primary_head = 0
+        self._pending = {}
+        self._last_contact = None
+        self._last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch(self) -> dict:
+        url = f"{self.primary_url}/replication/log?since={self.applied}&limit={BATCH_SIZE}"
+        request = urllib.request.Request(url, headers={SECRET_HEADER: self._secret})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = response.read()
+            signature = response.headers.get(SIGNATURE_HEADER, "")
+        if not hmac.compare_digest(signature, sign(self._secret, body)):
+            raise ValueError("The replication log batch is not signed by the primary.")
+        return pickle.loads(body)
+
+    def sync_once(self) -> int:
+        """
+        Fetch and apply one batch of entries from the primary.
+
+        Returns:
+            int: The number of entries applied.
+        """
+        batch = self._fetch()
+        for entry in batch["entries"]:
+            if entry["seq"] > self._snapshot_seqs.get(entry["table"], 0):
+                apply_entry(self.db, entry)
+            if entry["op"] == "snapshot":
+                self._snapshot_seqs = entry["seqs"]
+            self.applied = entry["seq"]
+
+        self._primary_head = batch["head"]
+        self._pending = batch["pending"]
+        self._last_contact = time.time()
+        return len(batch["entries"])
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                caught_up = self.sync_once() < BATCH_SIZE
+                self._last_error = None
+            except Exception as e:
+                self._last_error = repr(e)
+                caught_up = True
+            if caught_up:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """
+        Start syncing in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def status(self) -> dict:
+        """
+        Get the replication status and per-table lag.
+
+        A table's lag is the number of its log entries not yet applied, and the age of the
+        oldest of them, as of the last contact with the primary. Tables not listed are caught up.
+
+        Returns:
+            dict: The replication status.
+        """
+        now = time.time()
+        return {
+            "role": "replica",
+            "primary_url": self.primary_url,
+            "applied_seq": self.applied,
+            "primary_seq": self._primary_head,
+            "seconds_since_contact": (
+                now - self._last_contact if self._last_contact is not None else None
+            ),
+            "last_error": self._last_error,
+            "tables": {
+                table_name: {
+                    "lag_entries": pending["entries"],
+                    "lag_seconds": now - pending["oldest"],
+                }
+                for table_name, pending in self._pending.items()
+            },
+        }
+
+
+def encode_log_batch(
+    log: MutationLog, since: int, limit: Optional[int] = None
+) -> bytes:
+    """
+    Encode a batch of log entries, with the primary's log heads, for shipping to a replica.
+
+    Args:
+        log (MutationLog): The primary's mutation log.
+        since (int): The sequence number of the last entry the replica applied.
+        limit (int, optional): The maximum number of entries (default is BATCH_SIZE).
+
+    Returns:
+        bytes: The pickled batch.
+    """
+    entries = log.since(since, limit or BATCH_SIZE)
+    return pickle.dumps(
+        {
+            "head": log.head,
+            # What will still be pending once the replica has applied this batch
+            "pending": log.pending(entries[-1]["seq"] if entries else since),
+            "entries": entries,
+        }
+    )
@@ -0,0 +1,362 @@
+import multiprocessing
+import threading
+from datetime import datetime
+from typing import Union
+
+import numpy as np
+
+from tables.db import VectorDB, search_work
+from tables.table import VectorTable
+from utils import compute
+from utils.config import IndexConfig
+from utils.utils import normalise_embeddings
+
+PARTITIONS = ("hash", "range")
+
+
+def _shard_worker(connection, policy: str, blas_threads: int, parallel_work: int):
+    """
+    Serve one shard: a VectorDB holding a single table, driven by commands over a pipe.
+
+    Every shard searches at once, so each uses its share of the BLAS threads, under the
+    policy of the process that started it.
+    """
+    compute.configure(policy, blas_threads, parallel_work)
+    db = VectorDB()
+    while True:
+        command, args = connection.recv()
+        if command == "stop":
+            connection.close()
+            return
+        try:
+            if command == "create":
+                db.add_table(VectorTable(*args[0], **args[1]))
+                result = None
+            elif command == "add":
+                result = db.add_vector(*args)
+            elif command == "query":
+                table_name, query_vector, k, min_score = args
+                table = db.get_table(table_name)
+                with compute.section(search_work(table, query_vector)):
+                    result = table.query(query_vector, k, min_score, return_scores=True)
+            else:
+                raise ValueError(f"Unknown shard command {command}")
+            connection.send(("ok", result))
+        except Exception as e:
+            connection.send(("error", e))
+
+
+class ShardedTable:
+    """
+    A class representing one logical vector table partitioned across local worker processes.
+
+    Each shard is a separate process running its own VectorDB. Rows get global ids in
+    insertion order and are assigned to shards by a hash of the id or by id range. Adds are
+    routed to the owning shards, and queries are broadcast to all shards at once and their
+    partial top-k results merged by score.
+
+    To keep scores comparable across shards, normalisation is applied by the coordinator
+    exactly as a single Index would, and PCA is not supported (each shard would fit its own).
+
+    Attributes:
+        table_name (str): The name of the table.
+        config (IndexConfig): The configuration for the table.
+        num_shards (int): The number of shard processes.
+        partition (str): How rows are assigned to shards, "hash" or "range".
+
+    Methods:
+        add_vector(vector, texts): Add vectors to the owning shards.
+        query(query_vector, k, min_score, return_scores): Query all shards and merge the results.
+        close(): Stop the shard processes.
+
+    Example:
+        with ShardedTable("big_table", config, embeddings, num_shards=4) as table:
+            indices, top_k_embeddings, texts = table.query(query_vector, k=10)
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        config: IndexConfig,
+        embeddings: np.array,
+        description: str = None,
+        use_embedder: bool = False,
+        model_name: str = None,
+        texts: list = None,
+        num_shards: int = 2,
+        partition: str = "hash",
+    ):
+        """
+        Initialize a ShardedTable instance and start its shard processes.
+
+        Args:
+            table_name (str): The name of the table.
+            config (IndexConfig): The configuration for the table.
+            embeddings (np.array): The initial embeddings.
+            description (str, optional): A description of the table (default is None).
+            use_embedder (bool, optional): Whether to use an embedder (default is False).
+            model_name (str, optional): Model string of a sentence transformer to use for embedding (default is None).
+            texts (list, optional): A list of associated texts (default is None).
+            num_shards (int, optional): The number of shard processes (default is 2).
+            partition (str, optional): How rows are assigned to shards, "hash" or "range" (default is "hash").
+
+        Raises:
+            ValueError: If the configuration uses PCA or multi-vector documents, or num_shards or partition is invalid.
+        """
+        if config.pca:
+            raise ValueError("Sharded tables do not support PCA.")
+        if config.index_type == "multi_vector":
+            raise ValueError("Sharded tables do not support multi-vector documents.")
+        if num_shards < 1:
+            raise ValueError(f"Expected num_shards>0 got num_shards={num_shards}")
+        if partition not in PARTITIONS:
+            raise ValueError(f"Expected partition in {PARTITIONS} got {partition}")
+
+        self._created_at = datetime.utcnow()
+        self._last_queried_at = None
+        self._table_name = table_name
+        self._config = config
+        self.description = description
+        self._use_embedder = use_embedder
+        self._model_name = model_name
+        self._has_texts = texts is not None
+        self.num_shards = num_shards
+        self.partition = partition
+        # Range partitioning splits the initial rows evenly, later rows go to the last shard
+        self._range_size = max(-(-len(embeddings) // num_shards), 1)
+        self._num_rows = 0
+        self._global_ids = [np.empty(0, dtype=np.int64) for _ in range(num_shards)]
+
+        # Held for every send-then-receive round trip, so concurrent requests never read
+        # each other's replies off the shared pipes
+        self._lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        self._connections, self._processes = [], []
+        scheduler = compute.scheduler
+        blas_threads = max(scheduler.max_threads // num_shards, 1)
+        for _ in range(num_shards):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_shard_worker,
+                args=(child, scheduler.policy, blas_threads, scheduler.parallel_work),
+                daemon=True,
+            )
+            process.start()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        if config.normalise:
+            embeddings = normalise_embeddings(embeddings)
+        shard_config = IndexConfig(config.dim_input, config.dim_final, False, False)
+        self._scatter(
+            embeddings,
+            texts,
+            lambda rows, shard_texts: (
+                "create",
+                (
+                    (table_name, shard_config, rows),
+                    {"texts": shard_texts, "has_texts": self._has_texts},
+                ),
+            ),
+        )
+
+    @property
+    def created_at(self) -> datetime:
+        """Get the creation timestamp of the table."""
+        return self._created_at
+
+    @property
+    def last_queried_at(self) -> datetime:
+        """Get the timestamp of the last query to the table."""
+        return self._last_queried_at
+
+    @last_queried_at.setter
+    def last_queried_at(self, value: datetime):
+        self._last_queried_at = value
+
+    @property
+    def table_name(self) -> str:
+        """Get the name of the table."""
+        return self._table_name
+
+    @property
+    def config(self) -> IndexConfig:
+        """Get the configuration of the table."""
+        return self._config
+
+    @property
+    def model_name(self):
+        return self._model_name
+
+    @property
+    def use_embedder(self):
+        return self._use_embedder
+
+    @property
+    def has_texts(self):
+        return self._has_texts
+
+    def __len__(self):
+        return sum(len(global_ids) for global_ids in self._global_ids)
+
+    def __str__(self) -> str:
+        return f"ShardedTable(created_at={self.created_at}, last_queried_at={self.last_queried_at}, table_name={self.table_name}, table_description={self.description}, config={self.config}, num_rows={len(self)}, num_shards={self.num_shards}, partition={self.partition}, use_embedder={self.use_embedder}, self.has_texts={self.has_texts} )"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _owners(self, global_ids: np.array) -> np.array:
+        """
+        Get the shard owning each of several global row ids.
+        """
+        if self.partition == "range":
+            return np.minimum(global_ids // self._range_size, self.num_shards - 1)
+        # Multiplicative hashing spreads consecutive ids across shards
+        return ((global_ids * 2654435761) % 2**32) % self.num_shards
+
+    def _gather(self, shards: list):
+        """
+        Collect one reply from each of several shards, raising the first error.
+        """
+        replies = [self._connections[shard].recv() for shard in shards]
+        for status, result in replies:
+            if status == "error":
+                raise result
+        return [result for _, result in replies]
+
+    def _scatter(self, rows: np.array, texts, make_command):
+        """
+        Assign new rows global ids and send each shard the rows it owns.
+        """
+        if texts is not None and not isinstance(texts, list):
+            texts = [texts]
+        with self._lock:
+            global_ids = np.arange(self._num_rows, self._num_rows + len(rows))
+            owners = self._owners(global_ids)
+
+            # Built before any is sent, so a failure here leaves no reply unread on a pipe
+            commands = {}
+            for shard in range(self.num_shards):
+                mask = owners == shard
+                if self._num_rows > 0 and not mask.any():
+                    continue
+                shard_texts = (
+                    [texts[i] for i in np.flatnonzero(mask)]
+                    if texts is not None
+                    else None
+                )
+                commands[shard] = make_command(rows[mask], shard_texts)
+            shards = list(commands)
+            for shard in shards:
+                self._connections[shard].send(commands[shard])
+
+            # Ids are recorded only for the shards that stored their rows, so a failed add
+            # leaves no ids behind to be handed out twice
+            replies = [self._connections[shard].recv() for shard in shards]
+            applied = [
+                shard for shard, (status, _) in zip(shards, replies) if status == "ok"
+            ]
+            for shard in applied:
+                self._global_ids[shard] = np.concatenate(
+                    [self._global_ids[shard], global_ids[owners == shard]]
+                )
+            if applied:
+                # Even when other shards failed, as the ids of stored rows must not be reused
+                self._num_rows += len(rows)
+            for status, result in replies:
+                if status == "error":
+                    raise result
+
+    def add_vector(self, vector: np.array, texts: Union[str, list] = None):
+        """
+        Add vectors to the table, routing each row to its owning shard.
+
+        Args:
+            vector (np.array): The vector(s) to be added to the table.
+            texts (Union[str, list], optional): An optional text or list of texts associated with the vectors (default is None).
+
+        Raises:
+            ValueError: If the shape of the provided vector is not compatible with the table dimension.
+        """
+        vector = vector.reshape(1, -1) if len(vector.shape) == 1 else vector
+        if vector.shape[1] != self._config.dim_input:
+            raise ValueError(
+                f"Expected vector of dimension {self._config.dim_input} but got {vector.shape[1]}"
+            )
+        if self._config.normalise:
+            vector = normalise_embeddings(vector)
+        self._scatter(
+            vector,
+            texts,
+            lambda rows, shard_texts: ("add", (self._table_name, rows, shard_texts)),
+        )
+
+    def query(
+        self,
+        query_vector: np.array,
+        k: int = 1,
+        min_score: float = None,
+        return_scores: bool = False,
+    ):
+        """
+        Query all shards concurrently and merge their partial results.
+
+        Args:
+            query_vector (np.array): The query vector for similarity search.
+            k (int, optional): The number of similar vectors to retrieve (default is 1), or the cap on matches when min_score is set.
+            min_score (float, optional): If set, return all rows scoring at least min_score (default is None).
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+
+        Returns:
+            tuple: A tuple containing three items: top-k global indices (ascending), top-k embeddings and
+                the corresponding texts (or None), followed by the top-k scores if return_scores is True.
+        """
+        if self._config.normalise:
+            query_vector = normalise_embeddings(query_vector)
+        with self._lock:
+            for connection in self._connections:
+                connection.send(
+                    ("query", (self._table_name, query_vector, k, min_score))
+                )
+            partials = self._gather(range(self.num_shards))
+            global_ids = np.concatenate(
+                [
+                    self._global_ids[shard][partial[0]]
+                    for shard, partial in enumerate(partials)
+                ]
+            )
+        embeddings = np.concatenate([partial[1] for partial in partials])
+        scores = np.concatenate([partial[3] for partial in partials])
+        texts = (
+            sum((partial[2] for partial in partials), []) if self._has_texts else None
+        )
+
+        top = np.argsort(-scores, kind="stable")
+        top = top if k is None else top[:k]
+        # Sort by global id, as for unsharded tables
+        top = top[np.argsort(global_ids[top])]
+
+        result = (
+            global_ids[top],
+            embeddings[top],
+            [texts[i] for i in top.tolist()] if texts is not None else None,
+        )
+        return result + (scores[top],) if return_scores else result
+
+    def close(self):
+        """
+        Stop the shard processes.
+        """
+        with self._lock:
+            for connection, process in zip(self._connections, self._processes):
+                if process.is_alive():
+                    connection.send(("stop", None))
+                    process.join(timeout=5)
+            self._processes = []
+            self._connections = []
@@ -0,0 +1,420 @@
+import copy
+import fcntl
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from typing import Union
+
+import numpy as np
+
+from index.ivf_index import IVFIndex
+from tables.db import VectorDB
+from tables.storage import (
+    load_table_meta,
+    save_table_meta,
+    write_embeddings,
+    write_json_atomic,
+)
+from tables.table import VectorTable
+from tables.text_store import TextStore
+from utils import compute
+from utils.config import IndexConfig
+from utils.initialise_index import index_vectors
+
+STATE_FILE = "state.json"
+LOCK_FILE = ".lock"
+# Rows an IVF or BM25 table may be added past those its published metadata covers, at the
+# least, before the metadata is published again
+MIN_UNPUBLISHED_ROWS = 1024
+
+
+class SharedVectorDB(VectorDB):
+    """
+    A VectorDB whose tables live in memory-mapped files shared by several processes.
+
+    Each table is a directory under `root` holding its embeddings as a .npy file with spare
+    rows, its texts as a byte buffer and offsets in .npy files with spare room as well, its other
+    state pickled in `meta-<version>.pkl`, and a small `state.json` naming the current files,
+    row and text counts and metadata version. Every process maps the same embeddings
+    file, so N processes serve reads from one physical copy in the page cache. Put `root`
+    on a tmpfs such as /dev/shm to keep that copy in RAM.
+
+    Mutations take an exclusive file lock on `root`, so there is a single writer at a time.
+    The writer appends new rows and texts in place past the published counts, then atomically
+    replaces `state.json`. Readers check `state.json` before every access and pick up new
+    rows, new embeddings files and new metadata as they are published.
+
+    The IVF cluster lists and BM25 postings of a table are in its metadata, but an add does
+    not republish them: every process appends the rows past those its lists and postings cover
+    itself. The metadata is republished once the rows it does not cover outnumber those it
+    does, so adds cost amortised O(1) per row and a process loading a table replays at most
+    as many rows as the metadata holds.
+
+    Attributes:
+        root (str): The directory holding the shared tables.
+
+    Example:
+        # In every worker process
+        db = SharedVectorDB("/dev/shm/nanovector")
+        db.add_table(table)  # visible to all the other workers
+    """
+
+    def __init__(self, root: str):
+        """
+        Initialize a SharedVectorDB instance.
+
+        Args:
+            root (str): The directory holding the shared tables, created if missing.
+        """
+        super().__init__()
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # Per table: (state.json stat signature, published state) last seen by this process
+        self._states = {}
+        # Per table: the shared embeddings file this process has mapped
+        self._mapped = {}
+        # Per table: the shared text buffer and offsets files this process has mapped
+        self._mapped_texts = {}
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _table_dir(self, table_name: str) -> str:
+        return os.path.join(self.root, table_name)
+
+    def _refresh_table(self, table_name: str):
+        """
+        Bring this process's copy of a table up to date with the published state.
+        """
+        # A writer publishing twice after the state was read may have removed the files it
+        # names, the state read again names the current ones
+        for attempt in range(3):
+            try:
+                return self._load_state(table_name)
+            except FileNotFoundError:
+                self._states.pop(table_name, None)
+                if attempt == 2:
+                    raise
+
+    def _load_state(self, table_name: str):
+        """
+        Load what changed in the published state of a table. Raises FileNotFoundError if the files it names were removed meanwhile.
+        """
+        state_path = os.path.join(self._table_dir(table_name), STATE_FILE)
+        try:
+            stat = os.stat(state_path)
+            signature = (stat.st_ino, stat.st_mtime_ns)
+            if table_name in self._states and self._states[table_name][0] == signature:
+                return
+            with open(state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            self._tables.pop(table_name, None)
+            self._states.pop(table_name, None)
+            self._mapped.pop(table_name, None)
+            self._mapped_texts.pop(table_name, None)
+            return
+
+        previous = self._states.get(table_name, (None, {}))[1]
+        table = self._tables.get(table_name)
+        if table is None or previous.get("meta_version") != state["meta_version"]:
+            embeddings = table.index._embeddings if table is not None else None
+            table = load_table_meta(
+                os.path.join(
+                    self._table_dir(table_name), f"meta-{state['meta_version']}.pkl"
+                )
+            )
+            table.index._embeddings = embeddings
+        if previous.get("embeddings") != state["embeddings"] or (
+            table.index._embeddings is None
+        ):
+            self._mapped[table_name] = np.load(
+                os.path.join(self._table_dir(table_name), state["embeddings"]),
+                mmap_mode="r+",
+            )
+        index = table.index
+        index._embeddings = self._mapped[table_name]
+        index.num_vectors = state["num_rows"]
+        if isinstance(index, IVFIndex) and index.num_listed < index.num_vectors:
+            index._extend_lists(index.num_listed, index.num_vectors)
+
+        if "text_buffer" in state:
+            if (
+                previous.get("text_buffer") != state["text_buffer"]
+                or table_name not in self._mapped_texts
+            ):
+                self._mapped_texts[table_name] = tuple(
+                    np.load(
+                        os.path.join(self._table_dir(table_name), state[name]),
+                        mmap_mode="r+",
+                    )
+                    for name in ("text_buffer", "text_offsets")
+                )
+            if table._texts is None:
+                table._texts = TextStore()
+            table._texts._buffer, table._texts._offsets = self._mapped_texts[table_name]
+            table._texts._size = state["num_texts"]
+            bm25 = table.bm25
+            if bm25 is not None and len(bm25) < len(table._texts):
+                bm25.add_texts(
+                    [table._texts[i] for i in range(len(bm25), len(table._texts))]
+                )
+
+        self._tables[table_name] = table
+        self._states[table_name] = (signature, state)
+
+    def _refresh(self):
+        """
+        Bring the set of tables of this process up to date with the published tables.
+        """
+        published = {
+            name
+            for name in os.listdir(self.root)
+            if not name.startswith(".")
+            and os.path.exists(os.path.join(self.root, name, STATE_FILE))
+        }
+        for table_name in list(self._tables.keys() | published):
+            self._refresh_table(table_name)
+
+    def _publish(self, table: VectorTable, meta_changed: bool):
+        """
+        Publish this process's copy of a table. Must be called with the lock held.
+        """
+        table_dir = self._table_dir(table.table_name)
+        state = dict(self._states.get(table.table_name, (None, {}))[1])
+        # Tells a table from another one later created under the same name
+        state.setdefault("id", uuid.uuid4().hex)
+        index = table.index
+
+        if index._embeddings is not self._mapped.get(table.table_name):
+            # The index outgrew the shared file (or is new): move it to a new, larger file
+            generation = state.get("generation", -1) + 1
+            name = f"embeddings-{generation}.npy"
+            index._embeddings = write_embeddings(
+                os.path.join(table_dir, name),
+                index.embeddings,
+                capacity=len(index._embeddings),
+            )
+            self._mapped[table.table_name] = index._embeddings
+            state["generation"], state["embeddings"] = generation, name
+        else:
+            index._embeddings.flush()
+
+        texts = table.texts
+        if texts is not None:
+            mapped = self._mapped_texts.get(table.table_name, (None, None))
+            if texts._buffer is not mapped[0] or texts._offsets is not mapped[1]:
+                # The texts outgrew the shared files (or are new): move them to new, larger files
+                generation = state.get("text_generation", -1) + 1
+                used_bytes = texts._offset(len(texts))
+                texts._buffer = write_embeddings(
+                    os.path.join(table_dir, f"text_buffer-{generation}.npy"),
+                    np.asarray(texts._buffer[:used_bytes]),
+                    capacity=max(len(texts._buffer), 1),
+                )
+                texts._offsets = write_embeddings(
+                    os.path.join(table_dir, f"text_offsets-{generation}.npy"),
+                    np.asarray(texts._offsets[: len(texts) + 1]),
+                    capacity=len(texts._offsets),
+                )
+                self._mapped_texts[table.table_name] = (texts._buffer, texts._offsets)
+                state["text_generation"] = generation
+                state["text_buffer"] = f"text_buffer-{generation}.npy"
+                state["text_offsets"] = f"text_offsets-{generation}.npy"
+            else:
+                texts._buffer.flush()
+                texts._offsets.flush()
+            state["num_texts"] = len(texts)
+
+        if meta_changed:
+            # Versioned, so readers always load the metadata matching the state they read,
+            # without the texts, which are in their own files
+            state["meta_version"] = state.get("meta_version", -1) + 1
+            skeleton = copy.copy(table)
+            skeleton._texts = None
+            save_table_meta(
+                skeleton, os.path.join(table_dir, f"meta-{state['meta_version']}.pkl")
+            )
+            state["meta_rows"] = len(index)
+        state["num_rows"] = len(index)
+
+        write_json_atomic(os.path.join(table_dir, STATE_FILE), state)
+        # Processes that still map an old file keep it alive until they refresh, and the
+        # previous files are kept for readers that have just read the previous state
+        stale = {f"embeddings-{g}.npy" for g in range(state["generation"] - 1)}
+        stale |= {f"meta-{v}.pkl" for v in range(state["meta_version"] - 1)}
+        for g in range(state.get("text_generation", 0) - 1):
+            stale |= {f"text_buffer-{g}.npy", f"text_offsets-{g}.npy"}
+        for name in stale & set(os.listdir(table_dir)):
+            os.remove(os.path.join(table_dir, name))
+
+        stat = os.stat(os.path.join(table_dir, STATE_FILE))
+        self._states[table.table_name] = ((stat.st_ino, stat.st_mtime_ns), state)
+        self._tables[table.table_name] = table
+
+    @property
+    def tables(self):
+        self._refresh()
+        return self._tables
+
+    def get_table(self, table_name: str):
+        self._refresh_table(table_name)
+        return super().get_table(table_name)
+
+    def check_table(self, table_name: str):
+        self._refresh_table(table_name)
+        return super().check_table(table_name)
+
+    def list_tables(self):
+        self._refresh()
+        return super().list_tables()
+
+    def __len__(self):
+        self._refresh()
+        return super().__len__()
+
+    def add_table(self, table: VectorTable):
+        """
+        Add a vector table to the database and publish it to all processes.
+
+        Args:
+            table (VectorTable): The vector table to add to the database.
+
+        Raises:
+            ValueError: If a table with the same name already exists in the database, or is multi-vector.
+        """
+        if table.config.index_type == "multi_vector":
+            # Only the pooled vectors would be shared, every add would republish the document vectors
+            raise ValueError("Multi-vector tables cannot be shared across workers.")
+        with self._lock():
+            self._refresh_table(table.table_name)
+            super().add_table(table)
+            os.makedirs(self._table_dir(table.table_name), exist_ok=True)
+            self._publish(table, meta_changed=True)
+
+    def delete_table(self, table_name: str):
+        """
+        Delete a vector table from the database and from all processes.
+
+        Args:
+            table_name (str): The name of the vector table to delete from the database.
+
+        Raises:
+            ValueError: If the specified table does not exist in the database.
+        """
+        with self._lock():
+            super().delete_table(table_name)
+            # Unpublish atomically first, then remove the files
+            tombstone = os.path.join(self.root, f".deleted-{uuid.uuid4().hex}")
+            os.rename(self._table_dir(table_name), tombstone)
+            shutil.rmtree(tombstone, ignore_errors=True)
+            self._states.pop(table_name, None)
+            self._mapped.pop(table_name, None)
+            self._mapped_texts.pop(table_name, None)
+
+    def add_vector(
+        self,
+        table_name: str,
+        vector: np.array,
+        texts: Union[str, list[str], None] = None,
+    ):
+        """
+        Add a vector to a specified table and publish it to all processes.
+
+        New rows and texts are written in place into the shared files when they have spare
+        capacity. Tables with a BM25 or IVF index republish their metadata only once it covers
+        fewer rows than it leaves out, see the class description.
+
+        Args:
+            table_name (str): The name of the table to which the vector will be added.
+            vector (np.array): The vector to be added to the table.
+            texts (Union[str, list[str], None]): corresponding texts to be added, defaults to None
+
+        Raises:
+            ValueError: If the specified table does not exist.
+        """
+        with self._lock():
+            super().add_vector(table_name, vector, texts)
+            table = self._tables[table_name]
+            # Other processes list the rows the metadata leaves out themselves
+            state = self._states[table_name][1]
+            unpublished = len(table.index) - state.get("meta_rows", 0)
+            listed = table.bm25 is not None or isinstance(table.index, IVFIndex)
+            self._publish(
+                table,
+                meta_changed=listed
+                and unpublished > max(state.get("meta_rows", 0), MIN_UNPUBLISHED_ROWS),
+            )
+
+    def rebuild_table(self, table_name: str, config: IndexConfig, progress=None):
+        """
+        Rebuild the index of a table and publish it to all processes.
+
+        The new index is built without the write lock, so writes from any process go on
+        meanwhile, and every process keeps serving queries from the current files. The lock is
+        then taken to add the rows written during the build to the new index and publish it.
+
+        Args:
+            table_name (str): The name of the table to rebuild.
+            config (IndexConfig): The new configuration, with the same input dimension.
+            progress (callable, optional): Called as progress(fraction, stage) as the rebuild advances (default is None).
+
+        Raises:
+            ValueError: If the table does not exist, the configuration is invalid, or the table
+                was deleted, replaced or rebuilt by another process during the build.
+        """
+        progress = progress or (lambda fraction, stage: None)
+        with self._lock():
+            self._refresh_table(table_name)
+            table = self.get_table(table_name)
+            if table.config.same_index(config):
+                # Search-time changes are applied at once
+                super().rebuild_table(table_name, config, progress)
+                self._publish(table, meta_changed=True)
+                return
+            table_id = self._states[table_name][1]["id"]
+            previous_config = repr(table.config)
+            # Rows below num_rows are never modified, so the copy can read them unlocked
+            building = copy.copy(table)
+            num_rows = len(table.index)
+
+        with compute.section(num_rows * config.dim_input):
+            building.rebuild(
+                config,
+                lambda fraction, stage: progress(
+                    min(fraction, 0.95), "publishing" if stage == "done" else stage
+                ),
+            )
+
+        with self._lock():
+            self._refresh_table(table_name)
+            state = self._states.get(table_name, (None, {}))[1]
+            table = self._tables.get(table_name)
+            if (
+                state.get("id") != table_id
+                or repr(table.config) != previous_config
+                or len(table.index) < num_rows
+            ):
+                raise ValueError(
+                    f"Table {table_name} was changed by another rebuild or deleted during the rebuild."
+                )
+            # Rows written during the build, as stored: already normalised, batch by batch
+            added = index_vectors(table.index)[num_rows:]
+            if len(added):
+                index = building.index
+                normalise, index.normalise = index.normalise, False
+                try:
+                    index.add_vector(added)
+                finally:
+                    index.normalise = normalise
+            table.swap_index(building.index, config)
+            self._publish(table, meta_changed=True)
+        progress(1.0, "done")
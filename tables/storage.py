@@ -0,0 +1,147 @@
+import copy
+import json
+import os
+import pickle
+
+import numpy as np
+
+from index.multi_vector_index import MultiVectorIndex
+from tables.table import VectorTable
+from tables.text_store import TextStore
+
+META_FILE = "meta.pkl"
+EMBEDDINGS_FILE = "embeddings.npy"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+# The vectors of the documents of a multi-vector index, and where each document starts
+VECTORS_FILE = "vectors.npy"
+OFFSETS_FILE = "offsets.npy"
+
+
+def write_embeddings(path: str, embeddings: np.array, capacity: int = None) -> np.array:
+    """
+    Write embeddings to a .npy file with optional spare rows, and memory-map it for reading and writing.
+
+    Args:
+        path (str): The path of the .npy file.
+        embeddings (np.array): The (n, d) embeddings to write, or any (n, ...) array such as a text buffer.
+        capacity (int, optional): The number of rows to allocate, at least n (default is n).
+
+    Returns:
+        np.memmap: The writable memory-mapped (capacity, ...) array.
+    """
+    capacity = max(capacity or 0, len(embeddings))
+    mapped = np.lib.format.open_memmap(
+        path,
+        mode="w+",
+        dtype=embeddings.dtype,
+        shape=(capacity,) + embeddings.shape[1:],
+    )
+    mapped[: len(embeddings)] = embeddings
+    mapped.flush()
+    return mapped
+
+
+def write_json_atomic(path: str, data: dict):
+    """
+    Write a JSON file atomically, so readers see either the old or the new content.
+
+    Args:
+        path (str): The path of the JSON file.
+        data (dict): The data to write.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def save_table_meta(table: VectorTable, path: str):
+    """
+    Pickle a table without its index embeddings, which are stored separately, nor the document vectors of a multi-vector index.
+
+    Args:
+        table (VectorTable): The table to save.
+        path (str): The path of the pickle file.
+    """
+    skeleton = copy.copy(table)
+    if hasattr(table.index, "_embeddings"):
+        skeleton._index = copy.copy(table.index)
+        skeleton._index._embeddings = None
+        if isinstance(table.index, MultiVectorIndex):
+            skeleton._index._vectors = None
+            skeleton._index._offsets = None
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(skeleton, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_table_meta(path: str) -> VectorTable:
+    """
+    Load a table pickled with `save_table_meta`. Its index embeddings must be attached separately.
+
+    Args:
+        path (str): The path of the pickle file.
+
+    Returns:
+        VectorTable: The table without its index embeddings.
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_table(table: VectorTable, path: str):
+    """
+    Save a table to a directory, with its index embeddings and texts as .npy files that can be memory-mapped.
+
+    The document vectors and offsets of a multi-vector index, which hold most of its data, are
+    saved as .npy files as well.
+
+    Args:
+        table (VectorTable): The table to save.
+        path (str): The directory to save to.
+
+    Example:
+        save_table(table, "/var/lib/nanovector/my_table")
+        table = load_table("/var/lib/nanovector/my_table")
+    """
+    os.makedirs(path, exist_ok=True)
+    if hasattr(table.index, "_embeddings"):
+        np.save(os.path.join(path, EMBEDDINGS_FILE), table.index.embeddings)
+    if isinstance(table.index, MultiVectorIndex):
+        np.save(os.path.join(path, VECTORS_FILE), table.index.vectors)
+        np.save(os.path.join(path, OFFSETS_FILE), table.index.offsets)
+    if getattr(table, "texts", None) is not None:
+        table.texts.save(path)
+        table = copy.copy(table)
+        table._texts = None
+    save_table_meta(table, os.path.join(path, META_FILE))
+
+
+def load_table(path: str, mmap_mode: str = "r") -> VectorTable:
+    """
+    Load a table saved with `save_table`.
+
+    Args:
+        path (str): The directory to load from.
+        mmap_mode (str, optional): The mode to memory-map the embeddings and texts with, None to read them (default is "r").
+            Read-only arrays are copied into memory on the first add.
+
+    Returns:
+        VectorTable: The loaded table.
+    """
+    table = load_table_meta(os.path.join(path, META_FILE))
+    embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+    if os.path.exists(embeddings_path):
+        table.index._embeddings = np.load(embeddings_path, mmap_mode=mmap_mode)
+    if os.path.exists(os.path.join(path, VECTORS_FILE)):
+        table.index._vectors = np.load(
+            os.path.join(path, VECTORS_FILE), mmap_mode=mmap_mode
+        )
+        table.index._offsets = np.load(
+            os.path.join(path, OFFSETS_FILE), mmap_mode=mmap_mode
+        )
+    if os.path.exists(os.path.join(path, TEXT_OFFSETS_FILE)):
+        table._texts = TextStore.load(path, mmap=mmap_mode is not None)
+    return table
@@ -1,3 +1,4 @@
+import threading
 import uuid
 from datetime import datetime
 from typing import Union
@@ -5,8 +6,13 @@ from typing import Union
 import numpy as np
 
 from index.abstract_index import AbstractIndex
+from index.bm25 import BM25Index
+from tables.planner import QueryPlan, execute_plan, plan_query
+from tables.text_store import TextStore
 from utils.config import IndexConfig
-from utils.initialise_index import initialise_index
+from utils.initialise_index import index_vectors, initialise_index
+from utils.timing import stage
+from utils.utils import reciprocal_rank_fusion
 
 
 class VectorTable:
@@ -21,19 +27,22 @@ class VectorTable:
         use_embedder (bool, optional): Whether to use an embedder (default is False).
         model_name (str, optional): Model string of a sentence transformer to use for embedding (default is None).
         has_texts (bool, optional): Whether the table has associated texts (default is False).
-        texts (list, optional): A list of associated texts (default is None).
+        texts (TextStore, optional): The associated texts, stored compactly (default is None).
+        bm25 (bool, optional): Whether to keep a BM25 index over the texts for hybrid queries (default is False).
     """
 
     def __init__(
         self,
         table_name: str,
         config: IndexConfig,
-        embeddings: np.array,
+        embeddings: Union[np.array, list],
         description: str = None,
         use_embedder: bool = False,
         model_name: str = None,
         has_texts: bool = False,
         texts: list = None,
+        bm25: bool = False,
+        offsets: np.array = None,
     ):
         """
         Initialize a VectorTable instance.
@@ -41,24 +50,52 @@ class VectorTable:
         Args:
             table_name (str): The name of the table.
             config (IndexConfig): The configuration for the table.
-            embeddings (np.array): The embeddings stored in the table.
+            embeddings (Union[np.array, list]): The embeddings stored in the table, or a list of arrays
+                (such as memory-mapped shards) to build the index from chunk by chunk.
             description (str, optional): A description of the table (default is None).
             use_embedder (bool, optional): Whether to use an embedder (default is False).
             model_name (str, optional): Model string of a sentence transformer to use for embedding (default is None).
             has_texts (bool, optional): Whether the table has associated texts (default is False).
             texts (list, optional): A list of associated texts (default is None).
+            bm25 (bool, optional): Whether to keep a BM25 index over the texts for hybrid queries (default is False).
+            offsets (np.array, optional): For a multi-vector table, the start of each document in embeddings
+                followed by the number of vectors, None for one vector per document (default is None).
+
+        Raises:
+            ValueError: If bm25 is requested for a table without texts, or the offsets are invalid.
         """
         self._uuid = uuid.uuid4()
         self._created_at = datetime.utcnow()
         self._last_queried_at = None
         self._table_name = table_name
-        self._index = initialise_index(config, embeddings)
+        self._index = initialise_index(config, embeddings, offsets)
         self._config = config
         self.description = description
         self._use_embedder = use_embedder
         self._model_name = model_name
         self._has_texts = has_texts or texts != None
-        self._texts = texts
+        self._texts = TextStore(texts) if self._has_texts else None
+        if bm25 and not self._has_texts:
+            raise ValueError("A BM25 index requires the table to have texts.")
+        self._bm25 = BM25Index(texts) if bm25 else None
+        # Serialises adds with the swap at the end of a rebuild
+        self._lock = threading.Lock()
+        # Vectors added while a rebuild is running, None when not rebuilding
+        self._pending_adds = None
+        # Incremented by every change to the rows or index, so results can be matched to it
+        self._version = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_pending_adds"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_version", 0)
+        self._lock = threading.Lock()
+        self._pending_adds = state.get("_pending_adds", None)
 
     @property
     def uuid(self) -> uuid.UUID:
@@ -97,6 +134,11 @@ class VectorTable:
         """Get the name of the table."""
         return self._table_name
 
+    @property
+    def version(self) -> int:
+        """Get the version of the table, incremented by every add and rebuild."""
+        return self._version
+
     @property
     def index(self) -> AbstractIndex:
         """Get the index associated with the table."""
@@ -120,54 +162,309 @@ class VectorTable:
         return self._has_texts
 
     @property
-    def texts(self):
+    def texts(self) -> TextStore:
         return self._texts
 
+    @property
+    def bm25(self) -> BM25Index:
+        """Get the BM25 index over the texts of the table, or None."""
+        return self._bm25
+
     def __repr__(self) -> str:
-        return f"VectorTable(uuid={self.uuid}, created_at={self.created_at}, last_queried_at={self.last_queried_at}, table_name={self.table_name}, table_description={self.description}, config={self.config}, num_rows={len(self.index)}, use_embedder={self.use_embedder}, self.has_texts={self.has_texts} )"
+        return f"VectorTable(uuid={self.uuid}, created_at={self.created_at}, last_queried_at={self.last_queried_at}, table_name={self.table_name}, table_description={self.description}, config={self.config}, num_rows={len(self.index)}, use_embedder={self.use_embedder}, self.has_texts={self.has_texts}, bm25={self.bm25 is not None} )"
 
     def __str__(self) -> str:
-        return f"VectorTable(uuid={self.uuid}, created_at={self.created_at}, last_queried_at={self.last_queried_at}, table_name={self.table_name}, table_description={self.description}, config={self.config}, num_rows={len(self.index)}, use_embedder={self.use_embedder}, self.has_texts={self.has_texts} )"
+        return f"VectorTable(uuid={self.uuid}, created_at={self.created_at}, last_queried_at={self.last_queried_at}, table_name={self.table_name}, table_description={self.description}, config={self.config}, num_rows={len(self.index)}, use_embedder={self.use_embedder}, self.has_texts={self.has_texts}, bm25={self.bm25 is not None} )"
 
     def add_vector(self, vector: np.array, texts: Union[str, list] = None):
         """
         Add a vector to the vector table.
 
         Args:
-            vector (np.array): The vector to be added to the table.
+            vector (np.array): The vector to be added to the table. For a multi-vector table, the
+                (num_vectors, dimension) vectors of a document, or a list of documents.
             texts (Union[str, list], optional): An optional text or list of texts associated with the vector (default is None).
         """
-        if self.has_texts:
-            if isinstance(texts, list):
-                self._texts.extend(texts)
-            else:
-                self._texts.append(texts)
+        with self._lock:
+            if self.has_texts:
+                if isinstance(texts, list):
+                    self._texts.extend(texts)
+                else:
+                    self._texts.append(texts)
+                if self._bm25 is not None:
+                    self._bm25.add_texts(texts)
+
+            self._index.add_vector(vector)
+            if self._pending_adds is not None:
+                self._pending_adds.append(np.array(vector))
+            self._version += 1
+
+    def rebuild(self, config: IndexConfig, progress=None):
+        """
+        Rebuild the index of the table with a new configuration, without downtime.
+
+        The new index is built from the vectors of the current one while queries and adds keep
+        using the current index. Adds made during the build are then replayed on the new index,
+        and the new index is swapped in atomically. Texts and BM25 are kept as they are.
+
+        Vectors are taken from the current index, so text tables are not re-embedded. Leaving PCA
+        reconstructs the vectors from the reduced space, which loses the discarded components.
+        A configuration changing only search-time fields, such as nprobe, is applied at once.
+
+        Multi-vector tables cannot be rebuilt, nor other tables rebuilt into one, as their rows
+        are documents of several vectors that other indexes cannot hold.
+
+        Args:
+            config (IndexConfig): The new configuration, with the same input dimension.
+            progress (callable, optional): Called as progress(fraction, stage) as the rebuild advances (default is None).
+
+        Raises:
+            ValueError: If the input dimension changes, the table is already being rebuilt or either index is multi-vector.
+
+        Example:
+            table.rebuild(table.config.replace(index_type="ivf", nprobe=16))
+        """
+        if config.dim_input != self._config.dim_input:
+            raise ValueError(
+                f"Expected a configuration with dim_input={self._config.dim_input} but got {config.dim_input}"
+            )
+        if "multi_vector" in (config.index_type, self._config.index_type):
+            raise ValueError("Multi-vector tables cannot be rebuilt.")
+        progress = progress or (lambda fraction, stage: None)
+
+        # An identical configuration is still rebuilt, e.g. to retrain IVF centroids after drift
+        if repr(config) != repr(self._config) and self._config.same_index(config):
+            with self._lock:
+                # The build in progress would swap its own configuration in over this one
+                if self._pending_adds is not None:
+                    raise ValueError(
+                        f"Table {self._table_name} is already being rebuilt."
+                    )
+                if hasattr(self._index, "nprobe"):
+                    self._index.nprobe = min(config.nprobe, self._index.nlist)
+                self._config = config
+                self._version += 1
+            progress(1.0, "done")
+            return
 
-        self._index.add_vector(vector)
+        with self._lock:
+            if self._pending_adds is not None:
+                raise ValueError(f"Table {self._table_name} is already being rebuilt.")
+            self._pending_adds = []
+            index = self._index
+            num_rows = len(index)
 
-    def query(self, query_vector: np.array, k: int = 1):
+        try:
+            progress(0.05, "reading vectors")
+            # Rows below num_rows are never modified, later ones are in _pending_adds
+            vectors = index_vectors(index)[:num_rows]
+            progress(0.1, "building index")
+            new_index = initialise_index(config, vectors)
+
+            progress(0.9, "replaying adds")
+            replayed = 0
+            while True:
+                with self._lock:
+                    pending = self._pending_adds[replayed:]
+                    # Replay the last few adds and swap with adds blocked
+                    if len(pending) <= 16:
+                        for vector in pending:
+                            new_index.add_vector(vector)
+                        self._index = new_index
+                        self._config = config
+                        self._version += 1
+                        break
+                for vector in pending:
+                    new_index.add_vector(vector)
+                replayed += len(pending)
+            progress(1.0, "done")
+        finally:
+            with self._lock:
+                self._pending_adds = None
+
+    def swap_index(self, index: AbstractIndex, config: IndexConfig):
+        """
+        Replace the index of the table with one built elsewhere from its rows, such as by a rebuild in another process.
+
+        Args:
+            index (AbstractIndex): The new index, holding every row of the table.
+            config (IndexConfig): The configuration the new index was built with.
+
+        Raises:
+            ValueError: If the new index does not hold every row of the table, or the table is being rebuilt.
+        """
+        with self._lock:
+            if self._pending_adds is not None:
+                raise ValueError(f"Table {self._table_name} is already being rebuilt.")
+            if len(index) != len(self._index):
+                raise ValueError(
+                    f"Expected an index of {len(self._index)} rows but got {len(index)}"
+                )
+            self._index = index
+            self._config = config
+            self._version += 1
+
+    def _filter_rows(self, filter_ids) -> np.array:
+        """
+        Validate a row id filter and get it as a sorted array of unique row ids.
+
+        Raises:
+            ValueError: If a row id is out of range.
+        """
+        if filter_ids is None:
+            return None
+        rows = np.unique(np.asarray(filter_ids, dtype=np.int64))
+        if len(rows) and (rows[0] < 0 or rows[-1] >= len(self._index)):
+            raise ValueError(
+                f"Expected filter_ids between 0 and {len(self._index) - 1} for table {self._table_name}."
+            )
+        return rows
+
+    def plan(
+        self,
+        k: int = 1,
+        min_score: float = None,
+        filter_ids: list = None,
+        prefilter: int = None,
+    ) -> QueryPlan:
+        """
+        Plan a similarity query, choosing between an exact scan and the IVF index by estimated cost.
+
+        Args:
+            k (int, optional): The number of similar vectors to retrieve (default is 1).
+            min_score (float, optional): The minimum score of a threshold query (default is None).
+            filter_ids (list, optional): The row ids that may be returned, None for all rows (default is None).
+            prefilter (int, optional): For a multi-vector table, the number of documents ranked by their pooled
+                vector to rescore by MaxSim, None to score every document (default is None).
+
+        Returns:
+            QueryPlan: The chosen strategy, its estimated cost and the cost of the alternatives.
+
+        Raises:
+            ValueError: If a filtered row id is out of range, or prefilter is set for a table that is not multi-vector.
+
+        Example:
+            plan = table.plan(k=10, filter_ids=[3, 17, 42])
+            print(plan.strategy, plan.costs)
+        """
+        return plan_query(
+            self._index, k, self._filter_rows(filter_ids), min_score, prefilter
+        )
+
+    def query(
+        self,
+        query_vector: np.array,
+        k: int = 1,
+        min_score: float = None,
+        return_scores: bool = False,
+        filter_ids: list = None,
+        plan: QueryPlan = None,
+        prefilter: int = None,
+    ):
         """
         Perform a similarity query on the vector table.
 
+        The query is planned first (see `plan`): selective filters are answered by scoring only
+        the allowed rows, small IVF tables by an exact scan and large ones by probing clusters.
+        Multi-vector tables take a (num_vectors, dimension) query and score documents by MaxSim.
+
         Args:
             query_vector (np.array): The query vector for similarity search.
-            k (int, optional): The number of similar vectors to retrieve (default is 1).
+            k (int, optional): The number of similar vectors to retrieve (default is 1). When min_score is set,
+                this caps the number of matches instead, None meaning no cap.
+            min_score (float, optional): If set, return all rows scoring at least min_score instead of the top-k (default is None).
+            return_scores (bool, optional): Whether to also return the similarity scores (default is False).
+            filter_ids (list, optional): The row ids that may be returned, None for all rows (default is None).
+            plan (QueryPlan, optional): A plan from `plan` for the same k, min_score, filter_ids and prefilter, planned here if None (default is None).
+            prefilter (int, optional): For a multi-vector table, the number of documents ranked by their pooled
+                vector to rescore by MaxSim, None to score every document (default is None).
 
         Returns:
-            tuple: A tuple containing two arrays: top-k indices and top-k embeddings.
+            tuple: A tuple containing three items: top-k indices, top-k embeddings and the corresponding texts (or None),
+                followed by the top-k scores if return_scores is True.
+
+        Raises:
+            ValueError: If k is negative, a filtered row id is out of range or the query vector has the wrong dimension.
 
         Example:
             table = VectorTable(table_name="my_table", config=config, embeddings=embeddings)
             query_vector = np.random.rand(1, config.dim_input)
-            top_k_indices, top_k_embeddings = table.query(query_vector, k=10)
+            top_k_indices, top_k_embeddings, texts = table.query(query_vector, k=10)
         """
-        top_k_indices_sorted, top_k_embeddings = self._index.get_similarity(
-            query_vector, k
+        if min_score is None and k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+        # Plan and search the same index, even if a rebuild swaps it in between
+        index = self._index
+        allowed = self._filter_rows(filter_ids)
+        if plan is None:
+            with stage("plan"):
+                plan = plan_query(index, k, allowed, min_score, prefilter)
+        result = execute_plan(
+            index, plan, query_vector, k, allowed, min_score, prefilter
         )
+        top_k_indices_sorted, top_k_embeddings = result[0], result[1]
 
-        texts = (
-            [self.texts[i] for i in top_k_indices_sorted.tolist()]
-            if self.has_texts
-            else None
-        )
+        with stage("texts"):
+            texts = self.texts.take(top_k_indices_sorted) if self.has_texts else None
+        if return_scores:
+            return top_k_indices_sorted, top_k_embeddings, texts, result[2]
         return top_k_indices_sorted, top_k_embeddings, texts
+
+    def hybrid_query(
+        self,
+        query_vector: np.array,
+        query_text: str,
+        k: int = 1,
+        num_candidates: int = None,
+        rrf_k: int = 60,
+    ):
+        """
+        Perform a hybrid lexical and vector query, fusing both rankings with reciprocal rank fusion.
+
+        The top num_candidates rows are retrieved from the vector index and from the BM25 index,
+        and the k rows with the highest fused score are returned.
+
+        Args:
+            query_vector (np.array): The query vector for similarity search.
+            query_text (str): The query text for BM25 search.
+            k (int, optional): The number of rows to retrieve (default is 1).
+            num_candidates (int, optional): The number of candidates taken from each ranking (default is max(10 * k, 100)).
+            rrf_k (int, optional): The rank offset used by reciprocal rank fusion (default is 60).
+
+        Returns:
+            tuple: A tuple containing four items: top-k indices (ascending), top-k embeddings,
+                the corresponding texts and the fused scores.
+
+        Raises:
+            ValueError: If the table has no BM25 index or k is less than zero.
+
+        Example:
+            table = VectorTable("my_table", config, embeddings, texts=texts, bm25=True)
+            indices, embeddings, texts, scores = table.hybrid_query(query_vector, "red shoes", k=10)
+        """
+        if self._bm25 is None:
+            raise ValueError(
+                "Table has no BM25 index, create it with 'bm25' to use hybrid queries."
+            )
+        if k < 0:
+            raise ValueError(f"Expected k>0 got k={k}")
+        if num_candidates is None:
+            num_candidates = max(10 * k, 100)
+
+        vector_indices, _, vector_scores = self._index.get_similarity(
+            query_vector, num_candidates, return_scores=True
+        )
+        vector_ranking = vector_indices[np.argsort(-vector_scores, kind="stable")]
+        lexical_ranking, _ = self._bm25.get_top_k(query_text, num_candidates)
+
+        fused_indices, fused_scores = reciprocal_rank_fusion(
+            [vector_ranking, lexical_ranking], rrf_k
+        )
+        fused_indices, fused_scores = fused_indices[:k], fused_scores[:k]
+
+        # Sort the indices in ascending order, as for plain queries
+        order = np.argsort(fused_indices)
+        top_k_indices_sorted = fused_indices[order]
+        top_k_embeddings = self._index.embeddings[top_k_indices_sorted]
+        texts = self.texts.take(top_k_indices_sorted)
+        return top_k_indices_sorted, top_k_embeddings, texts, fused_scores[order]
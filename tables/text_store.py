@@ -0,0 +1,215 @@
+import os
+from typing import Optional, Union
+
+import numpy as np
+
+
+class TextStore:
+    """
+    A class representing a compact, append-only store for the texts of a table.
+
+    All texts are kept UTF-8 encoded in a single byte buffer, with an int64 offsets array
+    marking where each one starts and ends, instead of one Python `str` object per row.
+    A None text is marked by storing its end offset e as ~e, which is negative.
+    Both arrays grow by doubling their capacity, and can be saved to and memory-mapped
+    from a directory of .npy files.
+
+    Attributes:
+        nbytes (int): The number of bytes used by the buffer and offsets.
+
+    Methods:
+        append(text): Add one text to the store.
+        extend(texts): Add several texts to the store.
+        take(indices): Get the texts at several row indices.
+        save(path): Save the store to a directory.
+        load(path, mmap): Load a store from a directory.
+
+    Example:
+        store = TextStore(["first text", "second text"])
+        store.append("third text")
+        print(store.take([2, 0]))  # Prints ['third text', 'first text']
+    """
+
+    def __init__(self, texts: list = None):
+        """
+        Initialize a TextStore instance.
+
+        Args:
+            texts (list, optional): The initial texts (default is None). None entries are kept as None.
+        """
+        self._buffer = np.empty(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._size = 0
+
+        if texts:
+            self.extend(texts)
+
+    def __len__(self):
+        """
+        Get the number of texts in the store.
+
+        Returns:
+            int: The number of texts.
+        """
+        return self._size
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        """
+        Get the text at a row index.
+
+        Args:
+            index (int): The row index.
+
+        Returns:
+            str: The text at the row index, None if it was added as None.
+
+        Raises:
+            IndexError: If the index is out of range.
+        """
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(f"Text index {index} out of range for {self._size} rows.")
+        if self._offsets[index + 1] < 0:
+            return None
+        start, end = self._offset(index), self._offset(index + 1)
+        return self._buffer[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self[index]
+
+    @property
+    def nbytes(self) -> int:
+        """Get the number of bytes used by the buffer and offsets."""
+        return self._offset(self._size) + 8 * (self._size + 1)
+
+    def _offset(self, index: int) -> int:
+        """
+        Get the byte offset at which the text at a row index starts, the end of the previous one.
+        """
+        offset = int(self._offsets[index])
+        return offset if offset >= 0 else ~offset
+
+    def _reserve(self, num_texts: int, num_bytes: int):
+        used_bytes = self._offset(self._size)
+        if used_bytes + num_bytes > len(self._buffer):
+            buffer = np.empty(
+                max(used_bytes + num_bytes, 2 * len(self._buffer)), dtype=np.uint8
+            )
+            buffer[:used_bytes] = self._buffer[:used_bytes]
+            self._buffer = buffer
+        if self._size + num_texts + 1 > len(self._offsets):
+            offsets = np.empty(
+                max(self._size + num_texts + 1, 2 * len(self._offsets)),
+                dtype=np.int64,
+            )
+            offsets[: self._size + 1] = self._offsets[: self._size + 1]
+            self._offsets = offsets
+
+    def append(self, text: str):
+        """
+        Add one text to the store.
+
+        Args:
+            text (str): The text to add, or None.
+        """
+        self.extend([text])
+
+    def extend(self, texts: Union[list, "TextStore"]):
+        """
+        Add several texts to the store.
+
+        Args:
+            texts (Union[list, TextStore]): The texts to add, None entries are kept as None.
+        """
+        texts = list(texts)
+        if not texts:
+            return
+        encoded = [text.encode("utf-8") if text else b"" for text in texts]
+        lengths = np.fromiter((len(text) for text in encoded), dtype=np.int64)
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        self._reserve(len(encoded), len(data))
+        used_bytes = self._offset(self._size)
+        if len(data):
+            self._buffer[used_bytes : used_bytes + len(data)] = data
+        ends = used_bytes + np.cumsum(lengths)
+        missing = np.fromiter((text is None for text in texts), dtype=bool)
+        ends[missing] = ~ends[missing]
+        self._offsets[self._size + 1 : self._size + 1 + len(encoded)] = ends
+        self._size += len(encoded)
+
+    def take(self, indices) -> list[str]:
+        """
+        Get the texts at several row indices.
+
+        The bytes of all requested rows are gathered from the buffer in one vectorised
+        step and decoded row by row from the gathered block.
+
+        Args:
+            indices: The row indices, as a list or integer array.
+
+        Returns:
+            list[str]: The texts at the row indices, in the order given, None for texts added as None.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return []
+        if indices.min() < 0 or indices.max() >= self._size:
+            raise IndexError(f"Text indices out of range for {self._size} rows.")
+
+        starts = self._offsets[indices]
+        starts = np.where(starts < 0, ~starts, starts)
+        row_ends = self._offsets[indices + 1]
+        missing = row_ends < 0
+        lengths = np.where(missing, ~row_ends, row_ends) - starts
+        ends = np.cumsum(lengths)
+        # Byte positions of every requested row, laid out back to back
+        positions = np.arange(ends[-1]) - np.repeat(ends - lengths - starts, lengths)
+        data = self._buffer[positions].tobytes()
+
+        return [
+            None if is_missing else data[end - length : end].decode("utf-8")
+            for end, length, is_missing in zip(
+                ends.tolist(), lengths.tolist(), missing.tolist()
+            )
+        ]
+
+    def save(self, path: str):
+        """
+        Save the store to a directory as `text_buffer.npy` and `text_offsets.npy`.
+
+        Args:
+            path (str): The directory to save to.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(
+            os.path.join(path, "text_buffer.npy"),
+            self._buffer[: self._offset(self._size)],
+        )
+        np.save(os.path.join(path, "text_offsets.npy"), self._offsets[: self._size + 1])
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "TextStore":
+        """
+        Load a store saved with `save`.
+
+        Args:
+            path (str): The directory to load from.
+            mmap (bool, optional): Whether to memory-map the arrays instead of reading them (default is True).
+                A memory-mapped store is copied into memory on the first append.
+
+        Returns:
+            TextStore: The loaded store.
+        """
+        mmap_mode = "r" if mmap else None
+        store = cls()
+        store._buffer = np.load(
+            os.path.join(path, "text_buffer.npy"), mmap_mode=mmap_mode
+        )
+        store._offsets = np.load(
+            os.path.join(path, "text_offsets.npy"), mmap_mode=mmap_mode
+        )
+        store._size = len(store._offsets) - 1
+        return store
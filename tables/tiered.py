@@ -0,0 +1,275 @@
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Union
+
+import numpy as np
+
+from tables.db import VectorDB
+from tables.storage import load_table, save_table
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+
+def _resident(array) -> int:
+    """
+    Get the bytes of process memory an array holds, 0 if it is memory-mapped or None.
+    """
+    if array is None or isinstance(array, np.memmap):
+        return 0
+    return array.nbytes
+
+
+def resident_nbytes(table) -> int:
+    """
+    Estimate the process memory held by the parts of a table that spilling releases.
+
+    These are the index embeddings, the document vectors of a multi-vector index and the
+    texts. Memory-mapped arrays live in the page cache, which the kernel reclaims on its own,
+    so they count as 0.
+
+    Args:
+        table: The table.
+
+    Returns:
+        int: The number of bytes.
+    """
+    index = getattr(table, "index", None)
+    nbytes = _resident(getattr(index, "_embeddings", None))
+    nbytes += _resident(getattr(index, "_vectors", None))
+    nbytes += _resident(getattr(index, "_offsets", None))
+    texts = getattr(table, "texts", None)
+    if texts is not None:
+        nbytes += _resident(texts._buffer) + _resident(texts._offsets)
+    return nbytes
+
+
+# Fraction of the budget spilling brings the resident size down to, so that a table growing
+# past the budget does not make every add spill again.
+LOW_WATER = 0.9
+
+
+class TieredVectorDB(VectorDB):
+    """
+    A VectorDB keeping its tables within a memory budget by spilling cold ones to disk.
+
+    When the resident size of the tables exceeds `memory_budget` bytes, the coldest tables are
+    saved under `spill_dir` and replaced by copies whose embeddings and texts are memory-mapped
+    from those files. A spilled table keeps answering queries: its pages are read back from
+    disk on access and the kernel can drop them again under pressure. An add copies the table
+    back into memory, and it is spilled again if it goes cold.
+
+    Tables are ranked by the seconds since their last query or add (or creation) times their
+    resident size, so large idle tables go first. Once over the budget, tables are spilled down
+    to low_water times the budget, leaving room for adds. Pinned tables are kept in memory.
+
+    Attributes:
+        spill_dir (str): The directory cold tables are spilled to.
+        memory_budget (int): The resident bytes allowed for all tables together.
+        low_water (float): The fraction of the budget spilling brings the resident size down to.
+
+    Methods:
+        resident_bytes(): Get the resident size of all tables.
+        spill(table_name): Spill a table to disk.
+        pin(table_name): Keep a table in memory.
+        unpin(table_name): Let a table be spilled again.
+        memory_status(): Get the budget and the memory state of every table.
+
+    Example:
+        db = TieredVectorDB("/var/lib/nanovector/spill", memory_budget=8 * 2**30)
+        db.add_table(table)
+        db.pin(table.table_name)
+    """
+
+    def __init__(
+        self, spill_dir: str, memory_budget: int, low_water: float = LOW_WATER
+    ):
+        """
+        Initialize a TieredVectorDB instance.
+
+        Args:
+            spill_dir (str): The directory cold tables are spilled to, created if missing.
+            memory_budget (int): The resident bytes allowed for all tables together.
+            low_water (float, optional): The fraction of the budget spilling brings the resident size down to (default is LOW_WATER).
+        """
+        super().__init__()
+        self.spill_dir = spill_dir
+        self.memory_budget = memory_budget
+        self.low_water = low_water
+        os.makedirs(spill_dir, exist_ok=True)
+        # Serialises mutations with spills, so an add never lands on a table being replaced
+        self._lock = threading.RLock()
+        self._pinned = set()
+        self._rebuilding = set()
+        self._generations = {}
+        # Time of the last add to each table, an add counts as use like a query
+        self._last_added = {}
+
+    def resident_bytes(self) -> int:
+        """
+        Get the resident size of all tables.
+
+        Returns:
+            int: The number of bytes.
+        """
+        return sum(resident_nbytes(table) for table in list(self._tables.values()))
+
+    def _coldness(self, table, now: datetime) -> float:
+        last_used = max(
+            table.last_queried_at or table.created_at,
+            self._last_added.get(table.table_name, table.created_at),
+        )
+        return (now - last_used).total_seconds() * resident_nbytes(table)
+
+    def _enforce_budget(self, exclude: str = None):
+        """
+        Spill the coldest tables, other than exclude, until the resident size is down to the low-water mark.
+        """
+        with self._lock:
+            resident = self.resident_bytes()
+            if resident <= self.memory_budget:
+                return
+            target = self.low_water * self.memory_budget
+            now = datetime.utcnow()
+            candidates = [
+                table
+                for name, table in self._tables.items()
+                if isinstance(table, VectorTable)
+                and name not in self._pinned
+                and name not in self._rebuilding
+                and name != exclude
+                and resident_nbytes(table) > 0
+            ]
+            candidates.sort(key=lambda table: self._coldness(table, now), reverse=True)
+            for table in candidates:
+                if resident <= target:
+                    break
+                resident -= resident_nbytes(table)
+                self.spill(table.table_name)
+
+    def spill(self, table_name: str):
+        """
+        Spill a table to disk, replacing it with a memory-mapped copy.
+
+        Args:
+            table_name (str): The name of the table.
+
+        Raises:
+            ValueError: If the table does not exist or cannot be spilled.
+        """
+        with self._lock:
+            self.check_table(table_name)
+            table = self._tables[table_name]
+            if not isinstance(table, VectorTable):
+                raise ValueError(f"Table {table_name} cannot be spilled to disk.")
+
+            # A new directory per spill, queries may still read the previous files
+            generation = self._generations.get(table_name, -1) + 1
+            table_dir = os.path.join(self.spill_dir, table_name)
+            path = os.path.join(table_dir, str(generation))
+            save_table(table, path)
+            self._tables[table_name] = load_table(path, mmap_mode="r")
+            self._generations[table_name] = generation
+
+            for name in os.listdir(table_dir):
+                if name != str(generation):
+                    shutil.rmtree(os.path.join(table_dir, name), ignore_errors=True)
+
+    def pin(self, table_name: str):
+        """
+        Keep a table in memory, reading it back from disk if it was spilled.
+
+        Args:
+            table_name (str): The name of the table.
+
+        Raises:
+            ValueError: If the table does not exist.
+        """
+        with self._lock:
+            self.check_table(table_name)
+            self._pinned.add(table_name)
+            table = self._tables[table_name]
+            index = getattr(table, "index", None)
+            for name in ("_embeddings", "_vectors", "_offsets"):
+                if isinstance(getattr(index, name, None), np.memmap):
+                    setattr(index, name, np.array(getattr(index, name)))
+            texts = getattr(table, "texts", None)
+            if texts is not None and isinstance(texts._buffer, np.memmap):
+                texts._buffer = np.array(texts._buffer)
+                texts._offsets = np.array(texts._offsets)
+            self._enforce_budget()
+
+    def unpin(self, table_name: str):
+        """
+        Let a table be spilled again.
+
+        Args:
+            table_name (str): The name of the table.
+
+        Raises:
+            ValueError: If the table does not exist.
+        """
+        with self._lock:
+            self.check_table(table_name)
+            self._pinned.discard(table_name)
+            self._enforce_budget()
+
+    def memory_status(self) -> dict:
+        """
+        Get the budget and the memory state of every table.
+
+        Returns:
+            dict: The budget, the resident bytes and, per table, its resident bytes and whether it is spilled or pinned.
+        """
+        tables = {
+            name: {
+                "resident_bytes": resident_nbytes(table),
+                "spilled": name in self._generations and resident_nbytes(table) == 0,
+                "pinned": name in self._pinned,
+                "last_queried_at": table.last_queried_at,
+            }
+            for name, table in list(self._tables.items())
+        }
+        return {
+            "memory_budget": self.memory_budget,
+            "resident_bytes": sum(table["resident_bytes"] for table in tables.values()),
+            "tables": tables,
+        }
+
+    def add_table(self, table: VectorTable):
+        with self._lock:
+            super().add_table(table)
+            self._enforce_budget()
+
+    def delete_table(self, table_name: str):
+        with self._lock:
+            super().delete_table(table_name)
+            self._pinned.discard(table_name)
+            self._generations.pop(table_name, None)
+            self._last_added.pop(table_name, None)
+            shutil.rmtree(os.path.join(self.spill_dir, table_name), ignore_errors=True)
+
+    def add_vector(
+        self,
+        table_name: str,
+        vector: np.array,
+        texts: Union[str, list[str], None] = None,
+    ):
+        with self._lock:
+            super().add_vector(table_name, vector, texts)
+            self._last_added[table_name] = datetime.utcnow()
+            # The table just written is never the one spilled, it would be read back on the next add
+            self._enforce_budget(exclude=table_name)
+
+    def rebuild_table(self, table_name: str, config: IndexConfig, progress=None):
+        # Not spilled while rebuilding, the rebuild swaps the index of this very table object
+        with self._lock:
+            self.check_table(table_name)
+            self._rebuilding.add(table_name)
+        try:
+            super().rebuild_table(table_name, config, progress)
+        finally:
+            with self._lock:
+                self._rebuilding.discard(table_name)
+                self._enforce_budget()
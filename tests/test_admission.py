@@ -0,0 +1,124 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import app.app as core
+from app.admission import AdmissionController, DeadlineExceeded, Rejected
+from utils.config import AdmissionConfig
+
+
+def test_route_class_queue():
+    controller = AdmissionController(
+        AdmissionConfig(concurrency={"query": 1}, queue={"query": 1}, queue_timeout=5)
+    )
+    first = controller.admit("query_table")
+    # Endpoints outside the route classes are never limited
+    assert controller.admit("metrics") is None
+
+    admitted = []
+    waiter = threading.Thread(
+        target=lambda: admitted.append(controller.admit("query_tables"))
+    )
+    waiter.start()
+    while controller.stats()["queued"]["query"] == 0:
+        time.sleep(0.001)
+
+    # The queue is full, further requests are shed at once
+    with pytest.raises(Rejected) as error:
+        controller.admit("query_table")
+    assert error.value.status == 503 and error.value.headers() == {"Retry-After": "1"}
+    # Other route classes are unaffected
+    controller.release(controller.admit("add_to_table"))
+
+    controller.release(first)
+    waiter.join()
+    assert controller.stats()["running"]["query"] == 1
+    controller.release(admitted[0])
+    assert controller.stats() == {
+        "running": {"query": 0, "ingest": 0, "create": 0},
+        "queued": {"query": 0, "ingest": 0, "create": 0},
+    }
+
+
+def test_timeouts_and_deadlines():
+    controller = AdmissionController(
+        AdmissionConfig(concurrency={"ingest": 1}, queue_timeout=0.02)
+    )
+    ticket = controller.admit("add_to_table")
+    with pytest.raises(Rejected) as error:
+        controller.admit("add_to_table")
+    assert error.value.status == 503
+    with pytest.raises(DeadlineExceeded):
+        controller.admit("add_to_table", deadline=time.time() + 0.01)
+    with pytest.raises(DeadlineExceeded):
+        controller.admit("query_table", deadline=time.time() - 1)
+    controller.release(ticket)
+
+
+def test_tenant_quotas():
+    controller = AdmissionController(
+        AdmissionConfig(tenant_rate=10, tenant_burst=2, tenant_concurrency=3)
+    )
+    tickets = [controller.admit("query_table", "a") for _ in range(2)]
+    with pytest.raises(Rejected) as error:
+        controller.admit("query_table", "a")
+    assert error.value.status == 429 and 0 < error.value.retry_after <= 0.1
+    # Each tenant has its own quota
+    tickets.append(controller.admit("query_table", "b"))
+    for ticket in tickets:
+        controller.release(ticket)
+
+    controller = AdmissionController(AdmissionConfig(tenant_concurrency=1))
+    ticket = controller.admit("query_table", "a")
+    with pytest.raises(Rejected):
+        controller.admit("add_to_table", "a")
+    controller.release(ticket)
+    controller.release(controller.admit("add_to_table", "a"))
+
+    # Requests shed for a full server do not use up the rate quota of their tenant
+    controller = AdmissionController(
+        AdmissionConfig(
+            concurrency={"query": 1},
+            queue={"query": 0},
+            tenant_rate=1e-3,
+            tenant_burst=2,
+        )
+    )
+    ticket = controller.admit("query_table", "a")
+    for _ in range(5):
+        with pytest.raises(Rejected) as error:
+            controller.admit("query_table", "a")
+        assert error.value.status == 503
+    controller.release(ticket)
+    controller.release(controller.admit("query_table", "a"))
+
+    with pytest.raises(ValueError):
+        AdmissionConfig(concurrency={"search": 4})
+
+
+def test_app_sheds_load(monkeypatch):
+    client = core.app.test_client()
+    client.post(
+        "/create",
+        json={"table_name": "admitted", "embeddings": np.random.rand(10, 4).tolist()},
+    )
+    query = {"k": 1, "query_vector": np.random.rand(4).tolist()}
+
+    response = client.post(
+        "/admitted/query", json=query, headers={"X-Nanovector-Deadline": "1"}
+    )
+    assert response.status_code == 504
+
+    controller = AdmissionController(AdmissionConfig(tenant_rate=1, tenant_burst=1))
+    monkeypatch.setattr(core, "admission", controller)
+    assert client.post("/admitted/query", json=query).status_code == 200
+    response = client.post("/admitted/query", json=query)
+    assert response.status_code == 429 and "Retry-After" in response.headers
+    # The tenant header takes precedence over the table
+    response = client.post(
+        "/admitted/query", json=query, headers={"X-Nanovector-Tenant": "other"}
+    )
+    assert response.status_code == 200
+    assert controller.stats()["running"]["query"] == 0
@@ -1,9 +1,15 @@
 import json
+import re
+import time
 
 import numpy as np
 import pytest
 
-from app.app import app
+from app.app import app, handle_query, tables
+from tables.db import VectorDB
+from tables.table import VectorTable
+from utils.config import IndexConfig
+from utils.encoding import decode_array, encode_array
 
 
 @pytest.fixture
@@ -44,6 +50,39 @@ def test_query(client):
     assert response.status_code == 200
 
 
+def test_query_explain(client):
+    """Test filtered queries and query plans on the /query route."""
+    test_data = {
+        "k": 2,
+        "query_vector": np.random.rand(256).tolist(),
+        "filter_ids": [0, 2],
+        "explain": True,
+    }
+
+    response = client.post("/test_table/query", json=test_data)
+
+    assert response.status_code == 200
+    assert sorted(response.json["top_k_indices_sorted"]) == [0, 2]
+    assert response.json["plan"]["strategy"] == "filtered_scan"
+    assert response.json["plan"]["exact"]
+
+
+def test_query_batch(client):
+    """Test the /<table>/query_batch route with base64-encoded vectors."""
+    test_data = {
+        "k": 2,
+        "query_vectors": encode_array(np.random.rand(3, 256), "float32"),
+        "encoding": "base64",
+    }
+
+    response = client.post("/test_table/query_batch", json=test_data)
+
+    assert response.status_code == 200
+    assert len(response.json["results"]) == 3
+    embeddings = decode_array(response.json["results"][0]["top_k_embeddings"])
+    assert embeddings.shape == (2, 256)
+
+
 def test_details(client):
     """Test the /details route."""
     # Define test data
@@ -73,3 +112,270 @@ def test_add(client):
     # print(response)
 
     assert response.status_code == 200
+
+
+def test_query_min_score(client):
+    """Test the /query route in threshold mode."""
+    test_data = {
+        "min_score": 0.0,
+        "k": 5,
+        "query_vector": np.random.rand(256).tolist(),
+    }
+
+    response = client.post("/test_table/query", json=test_data)
+
+    assert response.status_code == 200
+    assert len(response.get_json()["top_k_indices_sorted"]) == 5
+
+
+def test_query_tables(client):
+    """Test the federated /query route."""
+    client.post(
+        "/create",
+        json={
+            "table_name": "test_table_2",
+            "embeddings": np.random.rand(10, 256).tolist(),
+        },
+    )
+    test_data = {
+        "tables": ["test_table", "test_table_2"],
+        "k": 4,
+        "query_vector": np.random.rand(256).tolist(),
+    }
+
+    response = client.post("/query", json=test_data)
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    scores = [result["score"] for result in results]
+    assert len(results) == 4
+    assert scores == sorted(scores, reverse=True)
+    assert {result["table"] for result in results} <= set(test_data["tables"])
+
+
+def test_query_tables_compares_normalised_tables():
+    rng = np.random.default_rng(0)
+    big = rng.random((1000, 16))
+    db = VectorDB()
+    db.add_table(VectorTable("big", IndexConfig(16, 16), big))
+    # Normalised by a smaller norm, its raw scores are larger
+    db.add_table(VectorTable("small", IndexConfig(16, 16), big[:10]))
+
+    results = db.query_tables(["big", "small"], big[500], k=5)
+    assert (results[0]["table"], results[0]["index"]) == ("big", 500)
+    assert results[0]["score"] == pytest.approx(1.0, rel=1e-3)
+    scores = [result["score"] for result in results]
+    assert scores == sorted(scores, reverse=True) and scores[-1] < 1
+
+    db.add_table(VectorTable("raw", IndexConfig(16, 16, normalise=False), big))
+    with pytest.raises(ValueError):
+        db.query_tables(["big", "raw"], big[0], k=1)
+
+
+def test_create_table_from_path(client, tmp_path):
+    """Test the /create route with a memory-mapped .npy file."""
+    np.save(tmp_path / "embeddings.npy", np.random.rand(20, 256).astype(np.float32))
+    test_data = {
+        "table_name": "test_table_path",
+        "embeddings_path": str(tmp_path / "embeddings.npy"),
+    }
+
+    response = client.post("/create", json=test_data)
+
+    assert response.status_code == 201
+
+
+def test_background_create(client):
+    """Test creating a table with a background job."""
+    embeddings = np.eye(16)
+    response = client.post(
+        "/create",
+        json={
+            "table_name": "background_table",
+            "embeddings": embeddings.tolist(),
+            "background": True,
+            "priority": 1,
+        },
+    )
+    assert response.status_code == 202
+    status_url = response.get_json()["status_url"]
+
+    for _ in range(500):
+        status = client.get(status_url).get_json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.01)
+    assert status["status"] == "succeeded"
+
+    response = client.post(
+        "/background_table/query",
+        json={"k": 1, "query_vector": embeddings[3].tolist()},
+    )
+    assert response.status_code == 200
+    assert response.get_json()["top_k_indices_sorted"] == [3]
+
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_rebuild(client):
+    """Test rebuilding a table to an IVF index in the background."""
+    embeddings = np.eye(16)
+    client.post(
+        "/create",
+        json={"table_name": "rebuild_table", "embeddings": embeddings.tolist()},
+    )
+
+    response = client.post(
+        "/rebuild_table/rebuild", json={"index_type": "ivf", "nlist": 4}
+    )
+    assert response.status_code == 202
+    status_url = response.get_json()["status_url"]
+
+    for _ in range(500):
+        status = client.get(status_url).get_json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.01)
+    assert status["status"] == "succeeded"
+    assert "index_type=ivf" in client.get("/rebuild_table/details").get_json()
+
+    response = client.post("/rebuild_table/rebuild", json={"index_type": "hnsw"})
+    assert response.status_code == 400
+
+
+def test_metrics(client):
+    """Test the /metrics route."""
+    client.post("/test_table/query", json={"k": 1, "query_vector": [0.0] * 256})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+
+    text = response.get_data(as_text=True)
+    assert 'nanovector_http_requests_total{route="query_table",method="POST"' in text
+    assert 'nanovector_http_request_seconds_count{route="query_table"}' in text
+    assert 'nanovector_table_rows{table="test_table"}' in text
+
+
+def test_timing_header(client):
+    """Test the stage breakdown of a request."""
+    test_data = {"k": 1, "query_vector": [0.0] * 256}
+    response = client.post("/test_table/query", json=test_data)
+    assert "Server-Timing" not in response.headers
+
+    response = client.post(
+        "/test_table/query", json=test_data, headers={"X-Nanovector-Timing": "1"}
+    )
+    stages = response.headers["Server-Timing"]
+    for name in ("parse", "decode", "score", "topk", "serialise"):
+        assert f"{name};dur=" in stages
+
+
+def test_tune(client):
+    """Test tuning the nprobe of an IVF table in the background."""
+    client.post(
+        "/create",
+        json={
+            "table_name": "tune_table",
+            "embeddings": np.random.rand(400, 8).tolist(),
+            "index_type": "ivf",
+            "nlist": 8,
+            "nprobe": 1,
+        },
+    )
+
+    response = client.post("/tune_table/tune", json={"k": 5})
+    assert response.status_code == 400
+
+    response = client.post(
+        "/tune_table/tune", json={"k": 5, "target_recall": 1.0, "num_queries": 20}
+    )
+    assert response.status_code == 202
+    status_url = response.get_json()["status_url"]
+
+    for _ in range(500):
+        status = client.get(status_url).get_json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.01)
+    assert status["status"] == "succeeded"
+    assert status["result"]["met"]
+    assert status["result"]["chosen"]["recall"] == 1.0
+    nprobe = re.search(r"nprobe=\d+,", status["result"]["config"]).group()
+    assert nprobe in client.get("/tune_table/details").get_json()
+
+
+def test_multi_vector(client):
+    """Test creating, adding to and querying a multi-vector table."""
+    vectors = np.eye(8)
+    response = client.post(
+        "/create",
+        json={
+            "table_name": "multi_vector_table",
+            "embeddings": vectors.tolist(),
+            "offsets": [0, 2, 5, 8],
+            "index_type": "multi_vector",
+        },
+    )
+    assert response.status_code == 201
+
+    response = client.post(
+        "/multi_vector_table/add",
+        json={"vector": np.ones((3, 8)).tolist(), "offsets": [0, 1, 3]},
+    )
+    assert response.status_code == 201
+
+    test_data = {
+        "k": 1,
+        "query_vector": vectors[2:5].tolist(),
+        "prefilter": 3,
+        "explain": True,
+    }
+    response = client.post("/multi_vector_table/query", json=test_data)
+    assert response.status_code == 200
+    assert response.json["top_k_indices_sorted"] == [1]
+    assert response.json["plan"]["strategy"] == "prefiltered_maxsim"
+
+
+def test_hybrid_query_rejects_min_score(client):
+    rng = np.random.default_rng(0)
+    texts = ["numpy arrays", "vector search", "text search"]
+    table = VectorTable(
+        "hybrid_table", IndexConfig(8, 8), rng.random((3, 8)), texts=texts, bm25=True
+    )
+    tables.add_table(table)
+    data = {"query_vector": rng.random(8).tolist(), "query_text": "search"}
+    payload, status = handle_query("hybrid_table", dict(data, hybrid=True, k=2))
+    assert status == 200 and len(payload["top_k_indices_sorted"]) == 2
+
+    # Fused scores cannot be compared with a similarity threshold
+    with pytest.raises(ValueError):
+        handle_query("hybrid_table", dict(data, hybrid=True, min_score=0.5))
+
+
+def test_knn_graph_stays_under_graph_dir(client, monkeypatch, tmp_path):
+    import app.app as core
+
+    rng = np.random.default_rng(0)
+    client.post(
+        "/create",
+        json={"table_name": "graph_table", "embeddings": rng.random((10, 8)).tolist()},
+    )
+    request = {"k": 2, "output_dir": "graphs/graph_table"}
+    monkeypatch.setattr(core.server_config, "graph_dir", None)
+    assert client.post("/graph_table/knn_graph", json=request).status_code == 400
+
+    monkeypatch.setattr(core.server_config, "graph_dir", str(tmp_path / "base"))
+    response = client.post("/graph_table/knn_graph", json=request)
+    assert response.status_code == 201
+    neighbors = np.load(response.get_json()["neighbors_path"])
+    assert neighbors.shape == (10, 2)
+    assert (tmp_path / "base" / "graphs" / "graph_table" / "neighbors.npy").exists()
+
+    for output_dir in ("../escaped", str(tmp_path / "elsewhere")):
+        response = client.post(
+            "/graph_table/knn_graph", json=dict(request, output_dir=output_dir)
+        )
+        assert response.status_code == 400
+    assert not (tmp_path / "escaped").exists()
+    assert not (tmp_path / "elsewhere").exists()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+
+import numpy as np
+import pytest
+
+import app.app as core
+from app.asgi import AsyncServer
+from tables.replication import ReplicatedVectorDB
+from tables.shared import SharedVectorDB
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+
+def request(server, method, path, data=None, query_string=b""):
+    """Send one request to the ASGI app and return the status and decoded body."""
+    return asyncio.run(_request(server, method, path, data, query_string))
+
+
+async def _request(server, method, path, data=None, query_string=b""):
+    body = json.dumps(data).encode() if data is not None else b""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [],
+    }
+    await server(scope, receive, send)
+    status = sent[0]["status"]
+    body = sent[1]["body"]
+    headers = dict(sent[0]["headers"])
+    if headers[b"content-type"] == b"application/json":
+        body = json.loads(body)
+    return status, body
+
+
+@pytest.fixture
+def server():
+    server = AsyncServer(search_workers=2, embed_workers=1, ingest_workers=1)
+    yield server
+    for executor in (server.search, server.embed, server.ingest):
+        executor.shutdown()
+
+
+def test_create_and_query(server):
+    embeddings = np.random.rand(20, 16)
+    status, _ = request(
+        server,
+        "POST",
+        "/create",
+        {"table_name": "asgi_table", "embeddings": embeddings.tolist()},
+    )
+    assert status == 201
+
+    status, body = request(
+        server,
+        "POST",
+        "/asgi_table/query",
+        {"k": 3, "query_vector": embeddings[4].tolist()},
+    )
+    assert status == 200
+    assert 4 in body["top_k_indices_sorted"]
+    assert len(body["top_k_indices_sorted"]) == 3
+
+    status, _ = request(server, "POST", "/asgi_table/add", {"vector": [0.5] * 16})
+    assert status == 201
+
+    status, body = request(server, "GET", "/list_tables")
+    assert status == 200
+    assert "asgi_table" in [name for name, _ in body]
+
+    status, _ = request(server, "DELETE", "/asgi_table/delete")
+    assert status == 200
+
+
+def test_errors(server):
+    status, body = request(server, "POST", "/missing_table/query", {"k": 1})
+    assert status == 404
+    assert body["message"] == "Table not found"
+
+    assert request(server, "GET", "/create")[0] == 405
+    assert request(server, "GET", "/no/such/route")[0] == 404
+
+    status, body = request(server, "POST", "/create", {"table_name": "bad_table"})
+    assert status == 500
+    assert body["message"] == "Invalid request"
+
+    status, body = request(server, "GET", "/metrics")
+    assert status == 200
+    assert b'nanovector_http_errors_total{route="create_table"}' in body
+
+
+def test_queries_not_blocked_by_ingest(server):
+    request(
+        server,
+        "POST",
+        "/create",
+        {"table_name": "asgi_busy", "embeddings": np.random.rand(10, 8).tolist()},
+    )
+
+    async def run():
+        release = threading.Event()
+        # Occupy the only ingest thread, as a large /create would
+        busy = asyncio.ensure_future(server.ingest.run(release.wait, 10))
+        await asyncio.sleep(0)
+        queries = [
+            _request(
+                server,
+                "POST",
+                "/asgi_busy/query",
+                {"k": 2, "query_vector": np.random.rand(8).tolist()},
+            )
+            for _ in range(20)
+        ]
+        results = await asyncio.wait_for(asyncio.gather(*queries), timeout=10)
+        assert not busy.done()
+        release.set()
+        await busy
+        return results
+
+    results = asyncio.run(run())
+    assert all(status == 200 for status, _ in results)
+    request(server, "DELETE", "/asgi_busy/delete")
+
+
+def test_replication_log_requires_secret(server, monkeypatch):
+    monkeypatch.setattr(core, "tables", ReplicatedVectorDB())
+    monkeypatch.setattr(core.server_config, "replication_secret", "s3cret")
+    status, _ = request(server, "GET", "/replication/log")
+    assert status == 403
+
+
+def test_shared_tables_refresh_off_the_event_loop(server, monkeypatch, tmp_path):
+    shared = SharedVectorDB(str(tmp_path))
+    shared.add_table(VectorTable("shared", IndexConfig(4, 4), np.random.rand(10, 4)))
+    monkeypatch.setattr(core, "tables", shared)
+
+    threads = []
+    refresh, refresh_table = shared._refresh, shared._refresh_table
+
+    def record(method):
+        def wrapper(*args):
+            threads.append(threading.current_thread())
+            return method(*args)
+
+        return wrapper
+
+    monkeypatch.setattr(shared, "_refresh", record(refresh))
+    monkeypatch.setattr(shared, "_refresh_table", record(refresh_table))
+    assert request(server, "GET", "/list_tables")[0] == 200
+    assert request(server, "GET", "/shared/details")[0] == 200
+    status, _ = request(
+        server, "POST", "/shared/query", {"k": 1, "query_vector": [1, 0, 0, 0]}
+    )
+    assert status == 200
+    assert request(server, "POST", "/shared/tune", {"k": 1})[0] == 400
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,32 @@
+import json
+
+from benchmarks.compare import compare
+from benchmarks.run import main
+
+
+def test_run_and_compare(tmp_path):
+    output = str(tmp_path / "results.json")
+    main(
+        [
+            "--sizes=300",
+            "--dims=16",
+            "--kinds=clustered",
+            "--indexes=flat,ivf",
+            "--queries=20",
+            "--threads=2",
+            f"--output={output}",
+        ]
+    )
+    with open(output) as f:
+        report = json.load(f)
+
+    assert [result["index"] for result in report["results"]] == ["flat", "ivf"]
+    assert report["results"][0]["query_ms"]["p99"] > 0
+
+    rows = compare(report, report)
+    assert rows and not any(row["regression"] for row in rows)
+
+    slower = json.loads(json.dumps(report))
+    slower["results"][0]["query_ms"]["p50"] *= 2
+    regressions = [row for row in compare(report, slower) if row["regression"]]
+    assert [row["metric"] for row in regressions] == ["query_ms.p50"]
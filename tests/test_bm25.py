@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from index.bm25 import BM25Index
+from tables.table import VectorTable
+from utils.config import IndexConfig
+from utils.utils import reciprocal_rank_fusion
+
+np.random.seed(27)
+
+TEXTS = [
+    "the quick brown fox",
+    "a lazy dog sleeps",
+    "the lazy brown dog",
+    "vectors and numpy",
+]
+
+
+def test_bm25_top_k():
+    index = BM25Index(TEXTS)
+
+    indices, scores = index.get_top_k("lazy dog", k=2)
+
+    assert set(indices.tolist()) == {1, 2}
+    assert scores[0] >= scores[1]
+
+
+def test_bm25_incremental_add_matches_bulk():
+    bulk = BM25Index(TEXTS + ["numpy dog"])
+    incremental = BM25Index(TEXTS)
+    incremental.add_texts("numpy dog")
+
+    assert len(incremental) == len(bulk)
+    assert np.allclose(
+        incremental.get_scores("numpy dog"), bulk.get_scores("numpy dog")
+    )
+
+
+def test_reciprocal_rank_fusion():
+    indices, scores = reciprocal_rank_fusion([np.array([3, 1, 2]), np.array([1, 5])])
+
+    assert indices[0] == 1
+    assert set(indices.tolist()) == {1, 2, 3, 5}
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_table_hybrid_query():
+    embeddings = np.random.rand(len(TEXTS), 8)
+    config = IndexConfig(8, 8)
+    table = VectorTable("hybrid", config, embeddings, texts=list(TEXTS), bm25=True)
+    table.add_vector(np.random.rand(1, 8), ["numpy arrays"])
+
+    indices, top_k_embeddings, texts, scores = table.hybrid_query(
+        embeddings[3], "numpy", k=2
+    )
+
+    assert 3 in indices.tolist()
+    assert len(texts) == 2
+    assert top_k_embeddings.shape == (2, 8)
+
+
+def test_table_hybrid_query_without_bm25():
+    table = VectorTable("plain", IndexConfig(8, 8), np.random.rand(4, 8))
+
+    with pytest.raises(ValueError):
+        table.hybrid_query(np.random.rand(8), "numpy", k=2)
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from werkzeug.serving import make_server
+
+import app.app as core
+from app.admission import AdmissionConfig, AdmissionController
+from client.async_client import AsyncNanovectorClient
+from client.batching import MicroBatcher
+from client.client import NanovectorClient, NanovectorError
+from utils.encoding import decode_array, encode_array
+
+
+@pytest.fixture
+def server():
+    """Serve the Flask app on a free local port."""
+    http_server = make_server("127.0.0.1", 0, core.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http_server.server_port}"
+    http_server.shutdown()
+
+
+def test_encoding():
+    array = np.random.rand(3, 5)
+    encoded = encode_array(array, "float32")
+    assert encoded["dtype"] == "float32" and encoded["shape"] == [3, 5]
+    assert np.array_equal(decode_array(encoded), array.astype(np.float32))
+    assert np.array_equal(decode_array([[1, 2]]), np.array([[1, 2]]))
+
+    with pytest.raises(ValueError):
+        decode_array(dict(encoded, dtype="object"))
+    with pytest.raises(ValueError):
+        decode_array(dict(encoded, shape=[4, 5]))
+
+
+def test_micro_batcher():
+    batches = []
+    release = threading.Event()
+
+    def run_batch(key, items):
+        batches.append((key, items))
+        release.wait()
+        return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch=3, max_delay=10)
+    # Sent at once as nothing of its key is in flight
+    futures = [batcher.submit("a", 0), batcher.submit("b", 10)]
+    # Items arriving while a batch is in flight wait for it, unless they fill a batch
+    futures += [batcher.submit("a", i) for i in (1, 2, 3, 4, -5)]
+    assert not any(future.done() for future in futures)
+    while len(batches) < 3:
+        time.sleep(0.001)
+    assert sorted(batches) == [("a", [0]), ("a", [1, 2, 3]), ("b", [10])]
+
+    release.set()
+    assert [future.result(timeout=1) for future in futures[:-1]] == [
+        0,
+        20,
+        2,
+        4,
+        6,
+        8,
+    ]
+    assert batches[-1] == ("a", [4, -5])
+    # An exception in place of a result fails only its item
+    with pytest.raises(ValueError):
+        futures[-1].result()
+
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit("a", 1)
+
+
+def unit_rows(n, d):
+    """Random rows of unit norm, so that each row is its own nearest neighbour."""
+    rows = np.random.rand(n, d).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_client(server):
+    embeddings = unit_rows(40, 16)
+    with NanovectorClient(server, max_delay=0.05) as client:
+        client.create_table("client_table", embeddings=embeddings)
+        assert "client_table" in str(client.list_tables())
+        assert "client_table" in client.details("client_table")
+
+        result = client.query("client_table", embeddings[3], k=1)
+        assert list(result["top_k_indices_sorted"]) == [3]
+        assert np.allclose(
+            result["top_k_embeddings"][0], embeddings[3] / np.linalg.norm(embeddings)
+        )
+
+        # Concurrent queries are coalesced into batched requests
+        results = [None] * 8
+        threads = [
+            threading.Thread(
+                target=lambda i=i: results.__setitem__(
+                    i, client.query("client_table", embeddings[i], k=1)
+                )
+            )
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [list(result["top_k_indices_sorted"]) for result in results] == [
+            [i] for i in range(8)
+        ]
+
+        futures = [
+            client.add("client_table", np.random.rand(16), wait=False) for _ in range(5)
+        ]
+        client.flush()
+        assert all(future.done() for future in futures)
+        assert len(core.tables.get_table("client_table").index) == 45
+
+        # A rejected add fails alone, the adds batched with it still go through
+        futures = [
+            client.add("client_table", np.random.rand(d), wait=False)
+            for d in (16, 16, 8, 16)
+        ]
+        client.flush()
+        with pytest.raises(NanovectorError):
+            futures[2].result()
+        assert all(futures[i].result() for i in (0, 1, 3))
+        assert len(core.tables.get_table("client_table").index) == 48
+
+        with pytest.raises(NanovectorError) as error:
+            client.details("missing_table")
+        assert error.value.status >= 400
+
+
+def test_client_retries(server, monkeypatch):
+    client = NanovectorClient(server, batching=False)
+    client.create_table("quota_table", embeddings=unit_rows(10, 4))
+
+    # A tenant over its quota waits for Retry-After rather than failing
+    controller = AdmissionController(AdmissionConfig(tenant_rate=20, tenant_burst=1))
+    monkeypatch.setattr(core, "admission", controller)
+    client.query("quota_table", np.ones(4))
+    start = time.monotonic()
+    client.query("quota_table", np.ones(4))
+    assert time.monotonic() - start >= 1
+    client.max_retries = 0
+    with pytest.raises(NanovectorError) as error:
+        client.query("quota_table", np.ones(4))
+    assert error.value.status == 429 and error.value.retry_after == 1
+    client.close()
+
+    # Only a batch rejected as invalid is sent again item by item
+    calls = []
+
+    def send_batch(key, items):
+        calls.append(items)
+        raise NanovectorError(status, {"message": "rejected"})
+
+    monkeypatch.setattr(client, "_send_batch", send_batch)
+    for status, sent in ((429, 1), (503, 1), (400, 4)):
+        calls.clear()
+        try:
+            client._run_batch(("add", "quota_table", (True, False)), [1, 2, 3])
+        except NanovectorError:
+            pass
+        assert len(calls) == sent
+
+
+def test_async_client(server):
+    embeddings = unit_rows(30, 8)
+
+    async def run():
+        async with AsyncNanovectorClient(server, binary=False) as client:
+            await client.create_table("async_table", embeddings=embeddings)
+            results = await asyncio.gather(
+                *(client.query("async_table", embeddings[i], k=1) for i in range(4))
+            )
+            await client.add("async_table", embeddings[:2])
+        async with AsyncNanovectorClient(server, batching=False) as client:
+            await client.add("async_table", embeddings[:1])
+        return results
+
+    results = asyncio.run(run())
+    assert [list(result["top_k_indices_sorted"]) for result in results] == [
+        [0],
+        [1],
+        [2],
+        [3],
+    ]
+    assert len(core.tables.get_table("async_table").index) == 33
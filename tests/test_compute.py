@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from threadpoolctl import threadpool_info, threadpool_limits
+
+from tables.db import VectorDB
+from tables.table import VectorTable
+from utils import compute
+from utils.compute import ComputeScheduler
+from utils.config import IndexConfig, ServerConfig
+
+
+def blas_threads():
+    """Get the threads of the BLAS libraries loaded."""
+    return {
+        info["num_threads"] for info in threadpool_info() if info["user_api"] == "blas"
+    }
+
+
+@pytest.fixture
+def restore_blas():
+    """Restore the BLAS threads and the process scheduler after a test."""
+    scheduler = compute.scheduler
+    with threadpool_limits(limits=None):
+        yield
+    compute.scheduler = scheduler
+
+
+def test_adaptive(restore_blas):
+    scheduler = ComputeScheduler("adaptive", max_threads=4, parallel_work=1000)
+    with scheduler.section(10):
+        assert scheduler.threads() == 1
+        with scheduler.section(1000):
+            assert scheduler.threads() == 2
+            assert blas_threads() == {2}
+            with scheduler.section(5000), scheduler.section(10):
+                assert scheduler.threads() == 1
+        assert scheduler.threads() == 1
+    with scheduler.section(1000):
+        assert scheduler.threads() == 4
+        assert blas_threads() == {4}
+    # Threads set by other code meanwhile are set again
+    threadpool_limits(limits=2, user_api="blas")
+    with scheduler.section(1000):
+        assert blas_threads() == {4}
+
+    ComputeScheduler("single", max_threads=4)
+    assert blas_threads() == {1}
+
+    with pytest.raises(ValueError):
+        ComputeScheduler("dynamic")
+    with pytest.raises(ValueError):
+        ServerConfig(blas_policy="dynamic")
+    config = ServerConfig.from_env(
+        {"NANOVECTOR_BLAS_POLICY": "single", "NANOVECTOR_BLAS_THREADS": "3"}
+    )
+    assert (config.blas_policy, config.blas_threads) == ("single", 3)
+
+
+def test_sections(restore_blas, monkeypatch, tmp_path):
+    scheduler = compute.configure("adaptive", max_threads=4, parallel_work=64 * 8)
+    sections = []
+    section = scheduler.section
+    monkeypatch.setattr(
+        scheduler, "section", lambda work: sections.append(work) or section(work)
+    )
+
+    db = VectorDB()
+    db.add_table(VectorTable("compute", IndexConfig(8, 8), np.random.rand(64, 8)))
+    db.query("compute", np.random.rand(8), 3)
+    db.knn_graph("compute", 3, str(tmp_path))
+    assert sections == [64 * 8, 64 * 64 * 8]
+
+    # PCA tables search with their reduced rows as queries, one per row
+    config = IndexConfig(8, 4, pca=True)
+    db.add_table(VectorTable("reduced", config, np.random.rand(64, 8)))
+    db.knn_graph("reduced", 3, str(tmp_path / "reduced"))
+    assert sections[-1] == 64 * 64 * 4
+    assert scheduler.threads() == 4
@@ -0,0 +1,50 @@
+import numpy as np
+
+from utils.config import IndexConfig
+from utils.evaluation import (
+    exact_neighbours,
+    mean_reciprocal_rank,
+    recall_at_k,
+    recall_curve,
+)
+
+
+def test_metrics():
+    truth = np.array([[1, 2, 3], [4, 5, 6]])
+    retrieved = [np.array([2, 1, 9]), np.array([7, 8, 4])]
+
+    assert recall_at_k(retrieved, truth, 3) == (2 / 3 + 1 / 3) / 2
+    assert mean_reciprocal_rank(retrieved, truth) == (1 / 2 + 1 / 3) / 2
+
+
+def test_exact_neighbours_match_brute_force():
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((500, 16))
+    queries = rng.random((20, 16))
+
+    truth = exact_neighbours(embeddings, queries, 5)
+    expected = np.argsort(-queries @ embeddings.T, axis=1)[:, :5]
+    assert np.array_equal(truth, expected)
+
+
+def test_recall_curve():
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((1000, 16))
+    queries = rng.random((30, 16))
+    configs = [
+        IndexConfig(16, 16),
+        IndexConfig(16, 16, index_type="ivf", nlist=20, nprobe=1),
+        IndexConfig(16, 16, index_type="ivf", nlist=20, nprobe=20),
+    ]
+
+    points = recall_curve(embeddings, queries, configs, k=5)
+    assert [point["label"] for point in points] == [
+        "flat",
+        "ivf nlist=20 nprobe=1",
+        "ivf nlist=20 nprobe=20",
+    ]
+    assert points[0]["recall"] == 1.0 and points[0]["mrr"] == 1.0
+    # Probing every cluster is exact search, and the trained index is shared
+    assert points[2]["recall"] == 1.0
+    assert points[1]["recall"] <= points[2]["recall"]
+    assert points[1]["build_seconds"] == points[2]["build_seconds"]
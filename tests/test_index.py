@@ -451,3 +451,30 @@ def test_query_k_greater_than_index_length():
     assert len(res1.shape) == 1
     assert ans1.shape[0] == len(index)
     assert ans1.shape[1] == dimension
+
+
+def test_query_above_threshold():
+    embeddings = np.random.rand(50, 10)
+    dimension = 10
+
+    query_1 = embeddings[0]
+    index = Index(embeddings, dimension)
+
+    scores = embeddings @ query_1
+    min_score = np.median(scores)
+    res1, ans1 = index.get_similarity_above(query_1, min_score)
+    assert np.array_equal(res1, np.flatnonzero(scores >= min_score))
+    assert np.allclose(ans1, embeddings[res1])
+
+
+def test_query_above_threshold_capped():
+    embeddings = np.random.rand(50, 10)
+    dimension = 10
+
+    query_1 = embeddings[0]
+    index = Index(embeddings, dimension)
+
+    k = 3
+    res1, ans1 = index.get_similarity_above(query_1, -np.inf, k)
+    assert np.array_equal(res1, np.arange(k))
+    assert ans1.shape == (k, dimension)
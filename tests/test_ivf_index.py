@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from index.index import Index
+from index.ivf_index import IVFIndex
+
+
+def clustered(n, d, num_clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, d))
+    return centers[rng.integers(num_clusters, size=n)] + 0.1 * rng.normal(size=(n, d))
+
+
+def test_recall_against_flat():
+    embeddings = clustered(2000, 32)
+    queries = clustered(50, 32, seed=1)
+    flat = Index(embeddings, 32)
+    ivf = IVFIndex(embeddings, 32, nlist=20, nprobe=4)
+
+    hits = 0
+    for query in queries:
+        expected, _ = flat.get_similarity(query, 10)
+        found, _ = ivf.get_similarity(query, 10)
+        hits += len(np.intersect1d(expected, found))
+    assert hits / (10 * len(queries)) > 0.9
+
+
+def test_scores_and_order():
+    embeddings = clustered(500, 16)
+    ivf = IVFIndex(embeddings, 16, nlist=10, nprobe=10)
+    query = embeddings[7]
+
+    indices, top_k, scores = ivf.get_similarity(query, 5, return_scores=True)
+    assert np.all(np.diff(indices) > 0)
+    np.testing.assert_allclose(scores, embeddings[indices] @ query)
+    np.testing.assert_array_equal(top_k, embeddings[indices])
+
+    # Probing every cluster is exact
+    expected, _ = Index(embeddings, 16).get_similarity(query, 5)
+    np.testing.assert_array_equal(indices, expected)
+
+
+def test_add_and_threshold():
+    embeddings = clustered(300, 8)
+    ivf = IVFIndex(embeddings, 8, nlist=5, nprobe=5)
+    new_row = np.full(8, 10.0)
+    ivf.add_vector(new_row)
+
+    assert len(ivf) == 301
+    indices, _ = ivf.get_similarity(new_row, 1)
+    assert indices.tolist() == [300]
+
+    threshold = 0.5 * float(new_row @ new_row)
+    indices, _, scores = ivf.get_similarity_above(
+        new_row, threshold, return_scores=True
+    )
+    assert 300 in indices
+    assert np.all(scores >= threshold)
+
+    with pytest.raises(ValueError):
+        ivf.add_vector(np.ones(9))
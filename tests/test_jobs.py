@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from utils.jobs import JobManager
+
+
+def wait_for(job, timeout=10):
+    deadline = time.time() + timeout
+    while job.status in ("queued", "running"):
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.01)
+
+
+def test_job_result_and_progress():
+    jobs = JobManager(num_workers=1)
+
+    def work(job, n):
+        for i in range(n):
+            job.report((i + 1) / n, "working")
+        return n * 2
+
+    job = jobs.submit("test", work, 4)
+    wait_for(job)
+
+    status = jobs.get(job.job_id).to_dict()
+    assert status["status"] == "succeeded"
+    assert status["result"] == 8
+    assert status["progress"] == 1.0
+    assert status["stage"] == "working"
+    assert status["eta_seconds"] == 0.0
+    jobs.shutdown()
+
+
+def test_job_failure():
+    jobs = JobManager(num_workers=1)
+
+    def fail(job):
+        raise ValueError("bad input")
+
+    job = jobs.submit("test", fail)
+    wait_for(job)
+    assert job.status == "failed"
+    assert job.error == "bad input"
+    jobs.shutdown()
+
+
+def test_priority_order():
+    jobs = JobManager(num_workers=1)
+    release = threading.Event()
+    order = []
+
+    blocker = jobs.submit("test", lambda job: release.wait(10))
+    # Queued while the only worker is busy, so they run by priority
+    submitted = [
+        jobs.submit("test", lambda job, p=p: order.append(p), priority=p)
+        for p in (5, 1, 3)
+    ]
+    release.set()
+    for job in [blocker] + submitted:
+        wait_for(job)
+
+    assert order == [1, 3, 5]
+    jobs.shutdown()
+
+
+def test_queue_limit_and_unknown_job():
+    jobs = JobManager(num_workers=1, max_queued=1)
+    release = threading.Event()
+    jobs.submit("test", lambda job: release.wait(10))
+    time.sleep(0.05)
+    jobs.submit("test", lambda job: None)
+
+    with pytest.raises(RuntimeError):
+        jobs.submit("test", lambda job: None)
+    with pytest.raises(ValueError):
+        jobs.get("missing")
+
+    release.set()
+    jobs.shutdown()
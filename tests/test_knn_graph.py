@@ -0,0 +1,37 @@
+import numpy as np
+
+from index.knn_graph import compute_knn_graph
+
+np.random.seed(27)
+
+
+def test_self_join_matches_brute_force(tmp_path):
+    embeddings = np.random.rand(53, 8)
+    k = 4
+
+    neighbors_path, scores_path = compute_knn_graph(
+        embeddings, k, str(tmp_path), query_block_size=10, base_block_size=7
+    )
+    neighbors = np.load(neighbors_path)
+    scores = np.load(scores_path)
+
+    expected_scores = embeddings @ embeddings.T
+    np.fill_diagonal(expected_scores, -np.inf)
+    expected = np.argsort(-expected_scores, axis=1)[:, :k]
+
+    assert neighbors.shape == (len(embeddings), k)
+    assert np.array_equal(neighbors, expected)
+    assert np.allclose(scores, np.take_along_axis(expected_scores, expected, axis=1))
+
+
+def test_two_table_join(tmp_path):
+    embeddings = np.random.rand(20, 8)
+    queries = np.random.rand(5, 8)
+
+    neighbors_path, _ = compute_knn_graph(
+        embeddings, 30, str(tmp_path), queries=queries, base_block_size=6
+    )
+    neighbors = np.load(neighbors_path)
+
+    assert neighbors.shape == (len(queries), len(embeddings))
+    assert np.array_equal(neighbors[:, 0], np.argmax(queries @ embeddings.T, axis=1))
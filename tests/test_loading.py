@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from index.index import Index
+from index.pca_index import PCAIndex
+from utils.loading import open_embeddings
+
+np.random.seed(27)
+
+
+def test_open_npy_is_memory_mapped(tmp_path):
+    embeddings = np.random.rand(20, 8).astype(np.float32)
+    np.save(tmp_path / "embeddings.npy", embeddings)
+
+    shards = open_embeddings(str(tmp_path / "embeddings.npy"))
+
+    assert len(shards) == 1
+    assert isinstance(shards[0], np.memmap)
+    assert np.array_equal(shards[0], embeddings)
+
+
+def test_open_shard_directory(tmp_path):
+    first = np.random.rand(5, 8).astype(np.float32)
+    second = np.random.rand(7, 8).astype(np.float32)
+    np.save(tmp_path / "00.npy", first)
+    second.tofile(tmp_path / "01.f32")
+
+    shards = open_embeddings(str(tmp_path), dimension=8)
+
+    assert np.array_equal(np.concatenate(shards), np.concatenate([first, second]))
+
+
+def test_open_invalid_files(tmp_path):
+    np.save(tmp_path / "ints.npy", np.arange(10))
+    with pytest.raises(ValueError):
+        open_embeddings(str(tmp_path / "ints.npy"))
+
+    np.random.rand(3, 8).astype(np.float32).tofile(tmp_path / "raw.f32")
+    with pytest.raises(ValueError):
+        open_embeddings(str(tmp_path / "raw.f32"))
+
+
+def test_index_from_chunks_matches_in_memory():
+    embeddings = np.random.rand(30, 8)
+    shards = [embeddings[:10], embeddings[10:25], embeddings[25:]]
+
+    index = Index.from_chunks(shards, 8, normalise=True)
+    expected = Index(embeddings, 8, normalise=True)
+
+    assert len(index) == 30
+    assert np.allclose(index.embeddings, expected.embeddings)
+    index.add_vector(np.random.rand(2, 8))
+    assert len(index.embeddings) == 32
+
+
+def test_pca_index_from_chunks():
+    embeddings = np.random.rand(40, 8)
+
+    index = PCAIndex.from_chunks([embeddings[:15], embeddings[15:]], 8, 4, fit_rows=20)
+
+    assert index.embeddings.shape == (40, 4)
+    indices, _ = index.get_similarity(embeddings[0], 3)
+    assert len(indices) == 3
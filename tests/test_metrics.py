@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import app.app as core
+from embedder.embedder import Embedder
+from tables.db import VectorDB
+from tables.table import VectorTable
+from utils.config import IndexConfig
+from utils.metrics import (
+    EMBEDDING_SECONDS,
+    SEARCH_SECONDS,
+    TABLE_ADDED_ROWS,
+    TABLE_QUERIES,
+    Counter,
+    Histogram,
+)
+
+
+def test_counter_render():
+    counter = Counter("requests_total", "Requests served.", ("route",))
+    counter.inc(route="query")
+    counter.inc(2, route="query")
+    counter.inc(route='a"b')
+
+    text = counter.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="query"} 3' in text
+    assert 'requests_total{route="a\\"b"} 1' in text
+
+    with pytest.raises(ValueError):
+        counter.inc(table="query")
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    lines = histogram.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 6.05" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_db_records_table_metrics():
+    db = VectorDB()
+    config = IndexConfig(dim_input=8, dim_final=8)
+    db.add_table(VectorTable("metrics_table", config, np.random.rand(10, 8)))
+
+    db.add_vector("metrics_table", np.random.rand(3, 8))
+    db.query("metrics_table", np.random.rand(8), k=2)
+    db.query_tables(["metrics_table"], np.random.rand(8), k=2)
+
+    assert 'nanovector_table_queries_total{table="metrics_table"} 2' in (
+        TABLE_QUERIES.render()
+    )
+    assert 'nanovector_table_added_rows_total{table="metrics_table"} 3' in (
+        TABLE_ADDED_ROWS.render()
+    )
+    assert 'nanovector_search_seconds_count{table="metrics_table"} 2' in (
+        SEARCH_SECONDS.render()
+    )
+
+    db.delete_table("metrics_table")
+    assert "metrics_table" not in TABLE_QUERIES.render()
+
+
+def test_embedding_latency_per_table(monkeypatch):
+    class Model:
+        def encode(self, sentences):
+            return np.random.rand(len(sentences), 4)
+
+    model = Embedder.__new__(Embedder)
+    model.model_name, model.model = "fake-model", Model()
+    monkeypatch.setitem(core.models, "fake-model", model)
+
+    client = core.app.test_client()
+    response = client.post(
+        "/create",
+        json={
+            "table_name": "embedded_table",
+            "use_embedder": True,
+            "model_name": "fake-model",
+            "texts": ["a", "b", "c"],
+        },
+    )
+    assert response.status_code == 201
+    client.post("/embedded_table/add", json={"texts": ["d"]})
+    client.post("/embedded_table/query", json={"texts": ["e"], "k": 1})
+
+    text = EMBEDDING_SECONDS.render()
+    series = (
+        'nanovector_embedding_seconds_count{model="fake-model",table="embedded_table"}'
+    )
+    assert f"{series} 3" in text
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from index.multi_vector_index import MultiVectorIndex, maxsim
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+
+def documents(num_documents, d, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 12, size=num_documents)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return rng.normal(size=(offsets[-1], d)), offsets
+
+
+def brute_force(vectors, offsets, query):
+    return np.array(
+        [
+            (vectors[start:end] @ query.T).max(axis=0).sum()
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+    )
+
+
+def test_maxsim_against_brute_force():
+    vectors, offsets = documents(200, 16)
+    query = np.random.default_rng(1).normal(size=(4, 16))
+    expected = brute_force(vectors, offsets, query)
+
+    # Blocks smaller than a document still score whole documents
+    for block_size in (1, 7, 10000):
+        np.testing.assert_allclose(
+            maxsim(vectors, offsets, query, block_size), expected
+        )
+
+    index = MultiVectorIndex(vectors, offsets, 16)
+    indices, pooled, scores = index.get_similarity(query, 10, return_scores=True)
+    np.testing.assert_array_equal(indices, np.sort(np.argsort(-expected)[:10]))
+    np.testing.assert_allclose(scores, expected[indices])
+    assert pooled.shape == (10, 16)
+
+    allowed = np.arange(0, 200, 9)
+    indices, _ = index.get_similarity(query, 3, allowed=allowed)
+    best = allowed[np.argsort(-expected[allowed])[:3]]
+    np.testing.assert_array_equal(indices, np.sort(best))
+
+    indices, _, scores = index.get_similarity_above(query, 5.0, return_scores=True)
+    np.testing.assert_array_equal(indices, np.flatnonzero(expected >= 5.0))
+
+
+def test_prefilter_and_add():
+    vectors, offsets = documents(300, 8)
+    index = MultiVectorIndex(vectors, offsets, 8, normalise=True)
+    document = np.random.default_rng(2).normal(size=(3, 8))
+    index.add_vector([document, document[:1]])
+
+    assert len(index) == 302
+    assert index.offsets[-1] == len(vectors) + 4
+    np.testing.assert_allclose(
+        np.linalg.norm(index.document(300), axis=1), 1.0, rtol=1e-6
+    )
+
+    # The document itself is the best match, and its pooled vector ranks it first
+    indices, _, scores = index.get_similarity(
+        document, 1, return_scores=True, prefilter=5
+    )
+    assert indices.tolist() == [300]
+    assert scores[0] == pytest.approx(3.0, rel=1e-5)
+
+    with pytest.raises(ValueError):
+        index.get_similarity(document, 5, prefilter=2)
+    with pytest.raises(ValueError):
+        index.add_vector(np.empty((0, 8)))
+    with pytest.raises(ValueError):
+        MultiVectorIndex(vectors, [0, 5, 5, len(vectors)], 8)
+
+
+def test_table_plans():
+    vectors, offsets = documents(50, 8)
+    config = IndexConfig(8, 8, index_type="multi_vector")
+    table = VectorTable("documents", config, vectors, offsets=offsets)
+    query = vectors[offsets[7] : offsets[8]]
+
+    plan = table.plan(k=1)
+    assert plan.strategy == "maxsim" and plan.exact
+    plan = table.plan(k=1, prefilter=10)
+    assert plan.strategy == "prefiltered_maxsim" and not plan.exact
+
+    indices, _, _ = table.query(query, 1, filter_ids=[3, 7, 9])
+    assert indices.tolist() == [7]
+
+    with pytest.raises(ValueError):
+        table.rebuild(config.replace(index_type="flat"))
+    with pytest.raises(ValueError):
+        IndexConfig(8, 4, pca=True, index_type="multi_vector")
+    flat = VectorTable("flat", IndexConfig(8, 8), vectors)
+    with pytest.raises(ValueError):
+        flat.plan(k=1, prefilter=10)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from benchmarks.datasets import make_dataset
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+
+def exact_top_k(embeddings, query, k, rows=None):
+    rows = np.arange(len(embeddings)) if rows is None else np.asarray(rows)
+    scores = embeddings[rows] @ query
+    return np.sort(rows[np.argsort(-scores)[:k]])
+
+
+def test_plan_strategies():
+    embeddings = make_dataset(20000, 32, "clustered")
+    flat = VectorTable("flat", IndexConfig(32, 32), embeddings[:1000])
+    ivf = VectorTable("ivf", IndexConfig(32, 32, index_type="ivf"), embeddings)
+    small_ivf = VectorTable(
+        "small_ivf", IndexConfig(32, 32, index_type="ivf"), embeddings[:500]
+    )
+
+    assert flat.plan(k=10).strategy == "scan"
+    assert flat.plan(k=10, filter_ids=range(20)).strategy == "filtered_scan"
+    assert flat.plan(k=10, filter_ids=range(900)).strategy == "scan"
+
+    plan = ivf.plan(k=10)
+    assert plan.strategy == "ivf" and not plan.exact
+    assert set(plan.costs) == {"scan", "ivf"}
+    assert plan.estimated_cost == min(plan.costs.values())
+    # Small tables are scanned exactly, selective filters score only the allowed rows
+    assert small_ivf.plan(k=10).strategy == "scan"
+    assert ivf.plan(k=10, filter_ids=range(0, 20000, 500)).strategy == "filtered_scan"
+
+    with pytest.raises(ValueError):
+        flat.plan(k=10, filter_ids=[1000])
+
+
+def test_filtered_query_is_exact():
+    embeddings = make_dataset(5000, 16, "clustered")
+    query = embeddings[7]
+    allowed = np.random.default_rng(0).choice(5000, 60, replace=False)
+
+    for config in (IndexConfig(16, 16), IndexConfig(16, 16, index_type="ivf")):
+        table = VectorTable("filtered", config, embeddings)
+        indices, _, _, scores = table.query(
+            query, k=5, return_scores=True, filter_ids=allowed
+        )
+        assert np.array_equal(indices, exact_top_k(embeddings, query, 5, allowed))
+        assert len(scores) == 5
+
+        # Threshold queries keep only allowed rows too
+        indices, _, _ = table.query(
+            query, k=None, min_score=-np.inf, filter_ids=allowed[:10]
+        )
+        assert set(indices) <= set(allowed[:10])
+
+
+def test_filtered_ivf_probes_enough_rows():
+    embeddings = make_dataset(20000, 16, "clustered")
+    table = VectorTable(
+        "ivf", IndexConfig(16, 16, index_type="ivf", nprobe=1), embeddings
+    )
+    allowed = np.arange(0, 20000, 4)
+
+    plan = table.plan(k=10, filter_ids=allowed)
+    assert plan.strategy == "ivf"
+    indices, _, _ = table.query(embeddings[3], k=10, filter_ids=allowed, plan=plan)
+    assert len(indices) == 10
+    assert np.all(indices % 4 == 0)
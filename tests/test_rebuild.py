@@ -0,0 +1,102 @@
+import threading
+
+import numpy as np
+import pytest
+
+from index.index import Index
+from index.ivf_index import IVFIndex
+from index.pca_index import PCAIndex
+from tables.db import VectorDB
+from tables.replication import ReplicatedVectorDB, apply_entry
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+
+def make_table(n=200, d=16):
+    embeddings = np.random.default_rng(0).normal(size=(n, d))
+    texts = [f"row {i}" for i in range(n)]
+    config = IndexConfig(d, d, normalise=False)
+    return VectorTable("rebuilt", config, embeddings, texts=texts), embeddings
+
+
+def test_rebuild_to_ivf_and_pca():
+    table, embeddings = make_table()
+    expected, _, expected_texts = table.query(embeddings[3], k=5)
+
+    table.rebuild(table.config.replace(index_type="ivf", nlist=4, nprobe=4))
+    assert isinstance(table.index, IVFIndex)
+    assert table.config.index_type == "ivf"
+    indices, _, texts = table.query(embeddings[3], k=5)
+    np.testing.assert_array_equal(indices, expected)
+    assert texts == expected_texts
+
+    table.rebuild(table.config.replace(index_type="flat", pca=True, dim_final=8))
+    assert isinstance(table.index, PCAIndex)
+    assert table.index.embeddings.shape == (200, 8)
+
+    # Leaving PCA reconstructs the vectors from the reduced space
+    table.rebuild(table.config.replace(pca=False, dim_final=16, dtype="float32"))
+    assert isinstance(table.index, Index)
+    assert table.index.embeddings.dtype == np.float32
+    assert len(table.index) == 200
+
+
+def test_adds_during_rebuild_are_replayed():
+    table, _ = make_table()
+    added = []
+
+    def progress(fraction, stage):
+        # Add rows while the new index is being built, from another thread
+        if stage == "building index":
+            row = np.full(16, 5.0)
+            thread = threading.Thread(target=table.add_vector, args=(row, "late row"))
+            thread.start()
+            thread.join()
+            added.append(row)
+
+    table.rebuild(table.config.replace(index_type="ivf", nlist=4), progress)
+
+    assert isinstance(table.index, IVFIndex)
+    assert len(table.index) == 201
+    indices, _, texts = table.query(added[0], k=1)
+    assert indices.tolist() == [200]
+    assert texts == ["late row"]
+
+
+def test_rebuild_errors():
+    table, _ = make_table()
+    with pytest.raises(ValueError):
+        table.rebuild(IndexConfig(8, 8))
+    with pytest.raises(ValueError):
+        table.config.replace(index_type="hnsw")
+
+    db = VectorDB()
+    with pytest.raises(ValueError):
+        db.rebuild_table("missing", table.config)
+
+    # A search-time change during a build would be overwritten by it
+    table.rebuild(table.config.replace(index_type="ivf", nlist=4))
+
+    def progress(fraction, stage):
+        if stage == "building index":
+            with pytest.raises(ValueError):
+                table.rebuild(table.config.replace(nprobe=2))
+
+    table.rebuild(table.config.replace(nlist=8), progress)
+    assert table.config.nlist == 8
+
+
+def test_rebuild_is_replicated():
+    primary = ReplicatedVectorDB()
+    table, embeddings = make_table()
+    primary.add_table(table)
+    primary.rebuild_table("rebuilt", table.config.replace(index_type="ivf", nlist=4))
+
+    replica = VectorDB()
+    for entry in primary.log.since(0):
+        apply_entry(replica, entry)
+    assert isinstance(replica.get_table("rebuilt").index, IVFIndex)
+    np.testing.assert_array_equal(
+        replica.query("rebuilt", embeddings[5], k=3)[0],
+        primary.query("rebuilt", embeddings[5], k=3)[0],
+    )
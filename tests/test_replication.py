@@ -0,0 +1,168 @@
+import pickle
+import threading
+import urllib.error
+
+import numpy as np
+import pytest
+from werkzeug.serving import make_server
+
+import app.app as core
+import tables.replication
+from tables.db import VectorDB
+from tables.replication import (
+    SECRET_HEADER,
+    SIGNATURE_HEADER,
+    Replica,
+    ReplicatedVectorDB,
+    encode_log_batch,
+    sign,
+)
+from tables.table import VectorTable
+from utils.config import IndexConfig, ServerConfig
+
+np.random.seed(27)
+
+
+def make_replica(primary):
+    replica = Replica("http://primary:5000", VectorDB(), "secret")
+    # Ship the log in-process instead of over HTTP
+    replica._fetch = lambda: pickle.loads(
+        encode_log_batch(primary.log, replica.applied)
+    )
+    return replica
+
+
+def test_replica_replays_mutations():
+    primary = ReplicatedVectorDB()
+    replica = make_replica(primary)
+    primary.add_table(
+        VectorTable("a", IndexConfig(8, 8), np.random.rand(5, 8), texts=list("abcde"))
+    )
+    primary.add_table(VectorTable("b", IndexConfig(8, 8), np.random.rand(5, 8)))
+    primary.add_vector("a", np.random.rand(2, 8), ["f", "g"])
+    primary.delete_table("b")
+
+    assert replica.sync_once() == 4
+
+    assert [name for name, _ in replica.db.list_tables()] == ["a"]
+    query = np.random.rand(8)
+    expected = primary.query("a", query, k=3)
+    actual = replica.db.query("a", query, k=3)
+    assert np.array_equal(actual[0], expected[0])
+    assert actual[2] == expected[2]
+
+
+def test_replica_reports_lag_per_table():
+    primary = ReplicatedVectorDB()
+    replica = make_replica(primary)
+    primary.add_table(VectorTable("a", IndexConfig(8, 8), np.random.rand(5, 8)))
+    replica.sync_once()
+    assert replica.status()["tables"] == {}
+
+    for _ in range(3):
+        primary.add_vector("a", np.random.rand(8))
+    replica._fetch = lambda: pickle.loads(encode_log_batch(primary.log, 1, limit=1))
+    replica.sync_once()
+
+    status = replica.status()
+    assert status["applied_seq"] == 2
+    assert status["tables"]["a"]["lag_entries"] == 2
+    assert status["tables"]["a"]["lag_seconds"] >= 0
+
+
+def test_log_truncates_to_snapshot():
+    primary = ReplicatedVectorDB(log_entries=3)
+    replica = make_replica(primary)
+    primary.add_table(VectorTable("a", IndexConfig(8, 8), np.random.rand(5, 8)))
+    primary.add_table(VectorTable("b", IndexConfig(8, 8), np.random.rand(5, 8)))
+    for _ in range(4):
+        primary.add_vector("a", np.random.rand(8))
+    primary.delete_table("b")
+
+    # Entries 1 to 4 are gone, the replica restarts from a snapshot at the head
+    assert primary.log.head == 7
+    assert len(primary.log.since(4)) == 3
+    assert replica.sync_once() == 1
+    assert replica.applied == 7
+    assert [name for name, _ in replica.db.list_tables()] == ["a"]
+    assert len(replica.db.get_table("a").index) == 9
+
+    primary.add_vector("a", np.random.rand(8))
+    assert replica.sync_once() == 1
+    assert len(replica.db.get_table("a").index) == 10
+
+
+def test_unpicklable_table_is_not_added():
+    class Unpicklable(VectorTable):
+        def __reduce__(self):
+            raise TypeError("cannot pickle")
+
+    primary = ReplicatedVectorDB()
+    with pytest.raises(TypeError):
+        primary.add_table(Unpicklable("a", IndexConfig(8, 8), np.random.rand(5, 8)))
+    assert len(primary) == 0 and primary.log.head == 0
+
+
+def test_snapshot_lets_other_tables_write(monkeypatch):
+    primary = ReplicatedVectorDB(log_entries=2)
+    replica = make_replica(primary)
+    primary.add_table(VectorTable("a", IndexConfig(8, 8), np.random.rand(5, 8)))
+    primary.add_table(VectorTable("b", IndexConfig(8, 8), np.random.rand(5, 8)))
+    primary.add_vector("a", np.random.rand(8))
+
+    # While "a" is pickled, a write to "b" goes through, before "b" is pickled
+    dumps = pickle.dumps
+
+    def slow_dumps(obj, *args, **kwargs):
+        if getattr(obj, "table_name", None) == "a":
+            writer = threading.Thread(
+                target=primary.add_vector, args=("b", np.random.rand(8))
+            )
+            writer.start()
+            writer.join(timeout=5)
+            assert not writer.is_alive()
+        return dumps(obj, *args, **kwargs)
+
+    monkeypatch.setattr(tables.replication.pickle, "dumps", slow_dumps)
+    replica.sync_once()
+    monkeypatch.setattr(tables.replication.pickle, "dumps", dumps)
+
+    # The add to "b" is in its snapshot, and is not replayed on top of it
+    replica.sync_once()
+    assert replica.applied == primary.log.head == 4
+    assert len(replica.db.get_table("a").index) == 6
+    assert len(replica.db.get_table("b").index) == 6
+
+
+def test_replication_log_requires_secret(monkeypatch):
+    primary = ReplicatedVectorDB()
+    primary.add_table(VectorTable("a", IndexConfig(8, 8), np.random.rand(5, 8)))
+    monkeypatch.setattr(core, "tables", primary)
+    monkeypatch.setattr(core.server_config, "replication_secret", "s3cret")
+
+    client = core.app.test_client()
+    assert client.get("/replication/log?since=0").status_code == 403
+    response = client.get("/replication/log?since=0", headers={SECRET_HEADER: "wrong"})
+    assert response.status_code == 403
+    response = client.get("/replication/log?since=0", headers={SECRET_HEADER: "s3cret"})
+    assert response.status_code == 200
+    assert response.headers[SIGNATURE_HEADER] == sign("s3cret", response.data)
+
+    http_server = make_server("127.0.0.1", 0, core.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{http_server.server_port}"
+    try:
+        replica = Replica(url, VectorDB(), "s3cret")
+        assert replica.sync_once() == 1
+        assert len(replica.db.get_table("a").index) == 5
+        with pytest.raises(urllib.error.HTTPError):
+            Replica(url, VectorDB(), "wrong").sync_once()
+    finally:
+        http_server.shutdown()
+
+    with pytest.raises(ValueError):
+        ServerConfig(role="primary")
+    assert "s3cret" not in repr(
+        ServerConfig(role="primary", replication_secret="s3cret")
+    )
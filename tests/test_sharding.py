@@ -0,0 +1,122 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from index.index import Index
+from tables.sharding import ShardedTable
+from utils import compute
+from utils.config import IndexConfig
+
+np.random.seed(27)
+
+
+@pytest.mark.parametrize("partition", ["hash", "range"])
+def test_sharded_query_matches_single_index(partition):
+    embeddings = np.random.rand(40, 8)
+    added = np.random.rand(5, 8)
+    config = IndexConfig(8, 8, normalise=True)
+
+    with ShardedTable(
+        "sharded", config, embeddings, num_shards=3, partition=partition
+    ) as table:
+        table.add_vector(added)
+        index = Index(embeddings, 8, normalise=True)
+        index.add_vector(added)
+
+        query = np.random.rand(8)
+        indices, top_k_embeddings, texts, scores = table.query(
+            query, k=6, return_scores=True
+        )
+        expected_indices, expected_embeddings, expected_scores = index.get_similarity(
+            query, 6, return_scores=True
+        )
+
+        assert len(table) == 45
+        assert texts is None
+        assert np.array_equal(indices, expected_indices)
+        assert np.allclose(top_k_embeddings, expected_embeddings)
+        assert np.allclose(scores, expected_scores)
+
+
+def test_sharded_texts_follow_rows():
+    embeddings = np.eye(6)
+    texts = [f"row {i}" for i in range(6)]
+
+    with ShardedTable(
+        "texts", IndexConfig(6, 6, normalise=False), embeddings, texts=texts
+    ) as table:
+        table.add_vector(np.eye(6)[2] * 2, "added")
+        indices, _, texts = table.query(np.eye(6)[2], k=2)
+
+    assert indices.tolist() == [2, 6]
+    assert texts == ["row 2", "added"]
+
+
+def test_sharded_concurrent_queries():
+    embeddings = np.eye(16)
+
+    with ShardedTable(
+        "concurrent", IndexConfig(16, 16, normalise=False), embeddings, num_shards=2
+    ) as table:
+
+        def query(row):
+            indices, _, _ = table.query(embeddings[row], k=1)
+            return indices.tolist() == [row]
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(query, [i % 16 for i in range(200)]))
+
+    assert all(results)
+
+
+def test_sharded_rejects_pca():
+    with pytest.raises(ValueError):
+        ShardedTable("pca", IndexConfig(8, 4, pca=True), np.random.rand(10, 8))
+
+
+def test_sharded_failed_add_keeps_ids():
+    embeddings = np.eye(6)
+
+    with ShardedTable(
+        "failed", IndexConfig(6, 6, normalise=False), embeddings, num_shards=2
+    ) as table:
+        # Every shard rejects the rows: no ids are taken
+        with pytest.raises(ValueError):
+            table._scatter(np.eye(6)[:2], None, lambda rows, texts: ("unknown", ()))
+        assert len(table) == 6
+
+        # Only the first shard stores its row, the second rejects it
+        commands = iter(["add", "unknown"])
+        with pytest.raises(ValueError):
+            table._scatter(
+                np.eye(6)[:2] * 2,
+                None,
+                lambda rows, texts: (next(commands), ("failed", rows, texts)),
+            )
+        assert len(table) == 7
+
+        # Later rows get new ids, each found under its own
+        table.add_vector(np.eye(6)[3:5] * 3)
+        assert len(table) == 9
+        assert table.query(np.eye(6)[0], k=1)[0].tolist() == [6]
+        assert table.query(np.eye(6)[3], k=1)[0].tolist() == [8]
+        assert table.query(np.eye(6)[4], k=1)[0].tolist() == [9]
+
+
+def test_shards_follow_blas_policy(monkeypatch):
+    context = multiprocessing.get_context("spawn")
+    process, started = context.Process, []
+
+    def record(*args, **kwargs):
+        started.append(kwargs["args"][1:])
+        return process(*args, **kwargs)
+
+    monkeypatch.setattr(context, "Process", record)
+    monkeypatch.setattr(
+        compute, "scheduler", compute.ComputeScheduler("single", 8, 1000)
+    )
+    with ShardedTable("blas", IndexConfig(4, 4), np.random.rand(10, 4), num_shards=2):
+        pass
+    assert started == [("single", 4, 1000)] * 2
@@ -0,0 +1,209 @@
+import json
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import tables.shared
+from tables.shared import SharedVectorDB
+from tables.table import VectorTable
+from utils.config import IndexConfig
+
+np.random.seed(27)
+
+
+def _count_rows(root, table_name, queue):
+    queue.put(len(SharedVectorDB(root).get_table(table_name).index))
+
+
+def test_reader_sees_writes(tmp_path):
+    writer = SharedVectorDB(str(tmp_path))
+    reader = SharedVectorDB(str(tmp_path))
+    embeddings = np.random.rand(10, 8)
+    writer.add_table(VectorTable("shared", IndexConfig(8, 8), embeddings))
+
+    assert reader.check_table("shared")
+    assert np.allclose(
+        reader.get_table("shared").index.embeddings,
+        writer.get_table("shared").index.embeddings,
+    )
+
+    for _ in range(5):
+        writer.add_vector("shared", np.random.rand(3, 8))
+    indices, _ = reader.get_table("shared").index.get_similarity(embeddings[0], 100)
+
+    assert len(reader.get_table("shared").index) == 25
+    assert len(indices) == 25
+    assert np.allclose(
+        reader.get_table("shared").index.embeddings,
+        writer.get_table("shared").index.embeddings,
+    )
+
+
+def test_writes_from_any_process_are_serialised(tmp_path):
+    first = SharedVectorDB(str(tmp_path))
+    second = SharedVectorDB(str(tmp_path))
+    first.add_table(
+        VectorTable("texts", IndexConfig(8, 8), np.random.rand(2, 8), texts=["a", "b"])
+    )
+
+    second.add_vector("texts", np.random.rand(1, 8), ["c"])
+    first.add_vector("texts", np.random.rand(1, 8), ["d"])
+
+    _, _, texts = second.query("texts", np.random.rand(8), k=4)
+    assert sorted(texts) == ["a", "b", "c", "d"]
+
+
+def test_delete_is_seen_by_readers(tmp_path):
+    writer = SharedVectorDB(str(tmp_path))
+    reader = SharedVectorDB(str(tmp_path))
+    writer.add_table(VectorTable("gone", IndexConfig(8, 8), np.random.rand(4, 8)))
+    assert [name for name, _ in reader.list_tables()] == ["gone"]
+
+    writer.delete_table("gone")
+
+    assert len(reader) == 0
+    with pytest.raises(ValueError):
+        reader.get_table("gone")
+
+
+def test_other_process_reads_table(tmp_path):
+    writer = SharedVectorDB(str(tmp_path))
+    writer.add_table(VectorTable("shared", IndexConfig(8, 8), np.random.rand(7, 8)))
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_count_rows, args=(str(tmp_path), "shared", queue)
+    )
+    process.start()
+    process.join(timeout=30)
+
+    assert queue.get(timeout=5) == 7
+
+
+def test_rebuild_is_published(tmp_path):
+    writer = SharedVectorDB(str(tmp_path))
+    reader = SharedVectorDB(str(tmp_path))
+    embeddings = np.random.rand(50, 8)
+    writer.add_table(VectorTable("rebuilt", IndexConfig(8, 8), embeddings))
+    reader.get_table("rebuilt")
+
+    config = writer.get_table("rebuilt").config.replace(index_type="ivf", nlist=4)
+    writer.rebuild_table("rebuilt", config)
+    writer.add_vector("rebuilt", np.random.rand(2, 8))
+
+    table = reader.get_table("rebuilt")
+    assert table.config.index_type == "ivf"
+    assert len(table.index) == 52
+    query = writer.get_table("rebuilt").index.embeddings[51]
+    indices, _ = table.index.get_similarity(query, 1)
+    expected, _ = writer.get_table("rebuilt").index.get_similarity(query, 1)
+    assert indices.tolist() == expected.tolist()
+
+
+def test_writes_go_on_during_rebuild(tmp_path):
+    writer = SharedVectorDB(str(tmp_path))
+    other = SharedVectorDB(str(tmp_path))
+    writer.add_table(VectorTable("rebuilt", IndexConfig(8, 8), np.random.rand(50, 8)))
+    added = np.random.rand(3, 8)
+
+    def progress(fraction, stage):
+        # Takes the write lock, which the build does not hold
+        if stage == "building index":
+            other.add_vector("rebuilt", added)
+
+    config = writer.get_table("rebuilt").config.replace(
+        index_type="ivf", nlist=4, nprobe=4
+    )
+    writer.rebuild_table("rebuilt", config, progress)
+
+    table = other.get_table("rebuilt")
+    assert table.config.index_type == "ivf" and len(table.index) == 53
+    indices, _ = table.index.get_similarity(added[1], 3)
+    expected, _ = writer.get_table("rebuilt").index.get_similarity(added[1], 3)
+    assert indices.tolist() == expected.tolist()
+
+    # Rows added during the build keep the scale of their own add, and rank first for themselves
+    def add_rows(fraction, stage):
+        if stage == "building index":
+            for row in added[:2]:
+                other.add_vector("rebuilt", row.reshape(1, -1))
+
+    writer.rebuild_table("rebuilt", config.replace(nlist=3, nprobe=3), add_rows)
+    table = other.get_table("rebuilt")
+    np.testing.assert_allclose(
+        np.linalg.norm(table.index.embeddings[53:], axis=1), 1.0, rtol=1e-5
+    )
+    for row, expected in zip(added[:2], (53, 54)):
+        indices, _ = table.index.get_similarity(row, 1)
+        assert indices.tolist() == [expected]
+
+    # A table replaced during the build is not overwritten
+    def replace(fraction, stage):
+        if stage == "building index":
+            other.delete_table("rebuilt")
+            other.add_table(VectorTable("rebuilt", IndexConfig(8, 8), added))
+
+    with pytest.raises(ValueError):
+        writer.rebuild_table("rebuilt", config.replace(nlist=2), replace)
+    assert writer.get_table("rebuilt").config.index_type == "flat"
+
+
+def test_rejects_multi_vector(tmp_path):
+    config = IndexConfig(8, 8, index_type="multi_vector")
+    table = VectorTable("documents", config, np.random.rand(6, 8), offsets=[0, 2, 6])
+    with pytest.raises(ValueError):
+        SharedVectorDB(str(tmp_path)).add_table(table)
+
+
+def test_texts_are_appended_in_place(tmp_path):
+    writer = SharedVectorDB(str(tmp_path))
+    reader = SharedVectorDB(str(tmp_path))
+    table = VectorTable(
+        "texts", IndexConfig(8, 8), np.random.rand(2, 8), texts=["a", "b"]
+    )
+    writer.add_table(table)
+    assert reader.get_table("texts").texts.take([0, 1]) == ["a", "b"]
+
+    table_dir = tmp_path / "texts"
+    metadata = sorted(path.name for path in table_dir.glob("meta-*.pkl"))
+    for i in range(20):
+        writer.add_vector("texts", np.random.rand(1, 8), [f"text {i}"])
+
+        texts = reader.get_table("texts").texts
+        assert len(texts) == i + 3
+        assert texts[-1] == f"text {i}"
+    # Text adds write no new metadata, and the previous texts files are kept for readers
+    assert sorted(path.name for path in table_dir.glob("meta-*.pkl")) == metadata
+    assert len(list(table_dir.glob("text_buffer-*.npy"))) == 2
+    assert len(list(table_dir.glob("embeddings-*.npy"))) == 2
+
+
+def test_listed_tables_publish_metadata_rarely(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables.shared, "MIN_UNPUBLISHED_ROWS", 4)
+    rng = np.random.default_rng(0)
+    writer = SharedVectorDB(str(tmp_path))
+    reader = SharedVectorDB(str(tmp_path))
+    config = IndexConfig(8, 8, index_type="ivf", nlist=3, nprobe=3)
+    texts = [f"row {i}" for i in range(4)]
+    writer.add_table(
+        VectorTable("listed", config, rng.random((4, 8)), texts=texts, bm25=True)
+    )
+
+    for i in range(40):
+        writer.add_vector("listed", rng.random((1, 8)), [f"added {i}"])
+        table = reader.get_table("listed")
+        assert table.index.num_listed == len(table.bm25) == i + 5
+    # The metadata is republished as the rows it leaves out double: at 9, 19 and 39 rows
+    state = json.loads((tmp_path / "listed" / "state.json").read_text())
+    assert state["meta_version"] == 3 and state["meta_rows"] == 39
+
+    # A process loading the table lists the rows past the metadata as the writer did
+    for db in (reader, SharedVectorDB(str(tmp_path))):
+        table, expected = db.get_table("listed"), writer.get_table("listed")
+        for listed, rows in zip(table.index._lists, expected.index._lists):
+            assert sorted(listed) == sorted(rows)
+        indices, _ = table.bm25.get_top_k("added 37", 1)
+        assert table.texts[indices[0]] == "added 37"
+        query = rng.random(8)
+        assert np.array_equal(table.query(query, 5)[0], expected.query(query, 5)[0])
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from tables.db import VectorDB
+from tables.table import VectorTable
+from utils.config import IndexConfig
+from utils.singleflight import SingleFlight
+
+
+def run_at_once(fn, n):
+    """Call fn from n threads at once and return the results."""
+    results = [None] * n
+
+    def call(i):
+        results[i] = fn()
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_do():
+    flights = SingleFlight("test")
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        time.sleep(0.2)
+        return [value]
+
+    results = run_at_once(lambda: flights.do("key", compute, 1), 8)
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+    # Finished calls are not cached
+    assert flights.do("key", compute, 2) == [2]
+    assert flights.do("other", compute, 3) == [3]
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("failed")
+
+    errors = run_at_once(lambda: pytest.raises(ValueError, flights.do, "key", fail), 4)
+    assert all(str(error.value) == "failed" for error in errors)
+
+
+def test_do_async():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do_async("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do_async("key", compute))
+        # Cancelling the caller that started the computation leaves it running
+        leader.cancel()
+        return await follower, await flights.do_async("key", compute)
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+def test_coalesced_queries():
+    db = VectorDB()
+    table = VectorTable("coalesced", IndexConfig(8, 8), np.eye(8))
+    db.add_table(table)
+    calls = []
+    query = table.query
+
+    def slow_query(*args, **kwargs):
+        calls.append(1)
+        time.sleep(0.2)
+        return query(*args, **kwargs)
+
+    table.query = slow_query
+    results = run_at_once(lambda: db.query("coalesced", np.eye(8)[3], 1), 6)
+    assert len(calls) == 1
+    assert all(result[0] is results[0][0] for result in results)
+    assert results[0][0].tolist() == [3]
+
+    # Different options and later versions of the table are searched on their own
+    run_at_once(lambda: db.query("coalesced", np.eye(8)[3], 2), 2)
+    assert len(calls) == 2
+    version = table.version
+    db.add_vector("coalesced", np.eye(8)[3] * 2)
+    assert table.version == version + 1
+    assert db.query("coalesced", np.eye(8)[3], 2)[0].tolist() == [3, 8]
@@ -0,0 +1,36 @@
+import numpy as np
+
+from tables.text_store import TextStore
+
+
+def test_append_extend_and_take():
+    store = TextStore(["first", "sëcond"])
+    store.append("third")
+    store.extend(["", None, "sixth"])
+
+    assert len(store) == 6
+    assert store[1] == "sëcond"
+    assert store[-1] == "sixth"
+    assert store.take(np.array([5, 0, 3, 1])) == ["sixth", "first", "", "sëcond"]
+    # None is kept apart from the empty string
+    assert store[4] is None
+    assert store.take([4, 3, 5]) == [None, "", "sixth"]
+    assert list(store) == ["first", "sëcond", "third", "", None, "sixth"]
+
+
+def test_save_and_load_memory_mapped(tmp_path):
+    texts = [f"text number {i}" for i in range(100)]
+    TextStore(texts).save(str(tmp_path))
+
+    store = TextStore.load(str(tmp_path))
+    assert store.take([99, 3]) == [texts[99], texts[3]]
+
+    store.append("appended")
+    assert len(store) == 101
+    assert store[100] == "appended"
+    assert store[0] == texts[0]
+
+    store.extend([None, "last"])
+    store.save(str(tmp_path))
+    store = TextStore.load(str(tmp_path), mmap=False)
+    assert store.take([100, 101, 102]) == ["appended", None, "last"]
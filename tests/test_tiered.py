@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from tables.table import VectorTable
+from tables.tiered import TieredVectorDB, resident_nbytes
+from utils.config import IndexConfig, ServerConfig, parse_size
+
+
+def make_table(name, n=100, d=16, texts=True):
+    embeddings = np.random.default_rng(0).normal(size=(n, d))
+    rows = [f"{name} {i}" for i in range(n)] if texts else None
+    return VectorTable(name, IndexConfig(d, d, normalise=False), embeddings, texts=rows)
+
+
+def test_cold_tables_are_spilled(tmp_path):
+    table_bytes = resident_nbytes(make_table("probe"))
+    db = TieredVectorDB(str(tmp_path), memory_budget=int(2.5 * table_bytes))
+
+    db.add_table(make_table("a"))
+    db.add_table(make_table("b"))
+    db.update_time("b")
+    db.update_time("a")
+    db.add_table(make_table("c"))
+
+    # "b" is the coldest, so it was spilled when "c" went over the budget
+    status = db.memory_status()
+    assert status["resident_bytes"] <= db.memory_budget
+    assert status["tables"]["b"]["spilled"]
+    assert not status["tables"]["a"]["spilled"]
+
+    # A spilled table still answers queries, and comes back into memory on an add
+    embeddings = make_table("b").index.embeddings
+    indices, _, texts = db.query("b", embeddings[4], k=1)
+    assert indices.tolist() == [4]
+    assert texts == ["b 4"]
+
+    db.add_vector("b", np.full(16, 3.0), "b new")
+    assert len(db.get_table("b").index) == 101
+    assert db.get_table("b").texts[100] == "b new"
+    assert db.resident_bytes() <= db.memory_budget
+
+
+def test_pinned_tables_stay_in_memory(tmp_path):
+    table_bytes = resident_nbytes(make_table("probe", texts=False))
+    db = TieredVectorDB(str(tmp_path), memory_budget=int(1.5 * table_bytes))
+
+    db.add_table(make_table("hot", texts=False))
+    db.pin("hot")
+    db.add_table(make_table("cold", texts=False))
+    status = db.memory_status()
+    assert status["tables"]["hot"]["pinned"]
+    assert not status["tables"]["hot"]["spilled"]
+    assert status["tables"]["cold"]["spilled"]
+
+    db.pin("cold")
+    assert not db.memory_status()["tables"]["cold"]["spilled"]
+
+    db.delete_table("cold")
+    assert not (tmp_path / "cold").exists()
+
+
+def test_server_config_budget():
+    assert parse_size("512M") == 512 * 2**20
+    assert parse_size(1024) == 1024
+    config = ServerConfig(memory_budget="1G", spill_dir="/tmp/spill")
+    assert config.memory_budget == 2**30
+    with pytest.raises(ValueError):
+        ServerConfig(memory_budget="1G")
+
+
+def test_adds_do_not_thrash(tmp_path, monkeypatch):
+    import tables.tiered
+
+    saves = []
+    save_table = tables.tiered.save_table
+    monkeypatch.setattr(
+        tables.tiered,
+        "save_table",
+        lambda table, path: saves.append(table.table_name) or save_table(table, path),
+    )
+    table_bytes = resident_nbytes(make_table("probe", texts=False))
+    db = TieredVectorDB(str(tmp_path), memory_budget=int(2.05 * table_bytes))
+    db.add_table(make_table("a", texts=False))
+    db.add_table(make_table("b", texts=False))
+    db.spill("a")
+    saves.clear()
+
+    # Ingesting into the spilled table spills the other one once, not "a" on every add
+    for _ in range(50):
+        db.add_vector("a", np.ones(16))
+    assert saves == ["b"]
+    assert len(db.get_table("a").index) == 150
+
+
+def test_multi_vector_tables_spill(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(1000, 16))
+    config = IndexConfig(16, 16, index_type="multi_vector")
+    table = VectorTable("docs", config, vectors, offsets=np.arange(0, 1001, 10))
+    # The document vectors dominate, the pooled ones are a tenth of them
+    assert resident_nbytes(table) > vectors.nbytes
+
+    db = TieredVectorDB(str(tmp_path), memory_budget=vectors.nbytes)
+    db.add_table(table)
+    assert db.memory_status()["tables"]["docs"]["spilled"]
+    assert db.resident_bytes() == 0
+
+    indices, _, _ = db.query("docs", vectors[30:40], k=1)
+    assert indices.tolist() == [3]
+    db.pin("docs")
+    db.add_vector("docs", vectors[:5])
+    assert len(db.get_table("docs").index) == 101
@@ -0,0 +1,41 @@
+import os
+import time
+
+import numpy as np
+
+from tables.table import VectorTable
+from utils.config import IndexConfig
+from utils.timing import SlowRequestProfiler, stage, start_timer, stop_timer
+
+
+def test_stages_of_a_query():
+    table = VectorTable(
+        "timed",
+        IndexConfig(8, 8),
+        np.random.rand(20, 8),
+        texts=[str(i) for i in range(20)],
+    )
+
+    # Outside a timed request, stages cost nothing and record nothing
+    with stage("score"):
+        pass
+
+    token = start_timer()
+    table.query(np.random.rand(8), k=3)
+    timer = stop_timer(token)
+
+    assert list(timer.stages) == ["plan", "normalise", "score", "topk", "texts"]
+    assert "score;dur=" in timer.server_timing()
+
+
+def test_slow_requests_are_profiled(tmp_path):
+    profiler = SlowRequestProfiler(str(tmp_path), slow_seconds=0.01, sample_rate=1.0)
+
+    profile = profiler.start()
+    assert profiler.finish(profile, 0.0, "fast") is None
+
+    profile = profiler.start()
+    time.sleep(0.02)
+    path = profiler.finish(profile, 0.02, "slow")
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    assert "-slow-" in path
@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+import pytest
+from werkzeug.serving import make_server
+
+import app.app as core
+from benchmarks.replay import replay, schedule
+from utils.traffic import TrafficRecorder, read_traffic
+
+
+@pytest.fixture
+def server():
+    """Serve the Flask app on a free local port."""
+    http_server = make_server("127.0.0.1", 0, core.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http_server.server_port}"
+    http_server.shutdown()
+
+
+def test_record_and_replay(tmp_path, monkeypatch, server):
+    path = str(tmp_path / "traffic.jsonl")
+    monkeypatch.setattr(core, "recorder", TrafficRecorder(path))
+    client = core.app.test_client()
+
+    client.post(
+        "/create",
+        json={"table_name": "replayed", "embeddings": np.random.rand(50, 8).tolist()},
+    )
+    for _ in range(5):
+        client.post(
+            "/replayed/query", json={"k": 3, "query_vector": np.random.rand(8).tolist()}
+        )
+    client.post("/replayed/add", json={"vector": np.random.rand(2, 8).tolist()})
+    client.get("/list_tables")
+    core.recorder.close()
+
+    # Only adds and queries are recorded
+    records = read_traffic(path)
+    assert [record["endpoint"] for record in records] == ["query_table"] * 5 + [
+        "add_to_table"
+    ]
+    assert records[0]["body"]["k"] == 3 and records[0]["status"] == 200
+
+    monkeypatch.setattr(core, "recorder", None)
+    report = replay(records, server, rate=200)
+    assert report["mode"] == "open"
+    assert report["requests"] == 6 and report["error_rate"] == 0
+    assert report["endpoints"]["query_table"]["statuses"] == {"200": 5}
+    assert report["latency_ms"]["p50"] > 0
+
+    report = replay(records, server, concurrency=2)
+    assert report["mode"] == "closed" and report["requests"] == 6
+
+
+def test_schedule():
+    records = [{"time": 100.0}, {"time": 100.5}, {"time": 102.0}]
+    assert schedule(records) == [0.0, 0.5, 2.0]
+    assert schedule(records, speed=2.0) == [0.0, 0.25, 1.0]
+    assert schedule(records, rate=10) == [0.0, 0.1, 0.2]
+
+
+def test_sampling(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl"), sample_rate=0.0)
+    assert not recorder.record("query_table", "POST", "/t/query", b"{}", 200, 0.01)
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl"))
+    assert not recorder.record("create_table", "POST", "/create", b"{}", 201, 0.01)
+    assert recorder.record("query_table", "POST", "/t/query", b"{}", 200, 0.01)
+
+
+def test_records_are_written_in_the_background(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(path)
+    for i in range(100):
+        assert recorder.record(
+            "query_table", "POST", "/t/query", b'{"k": 1}', 200, 0.01, arrived=i
+        )
+    recorder.record(
+        "query_table", "POST", "/t/query", b"not json", 400, 0.01, arrived=100
+    )
+    recorder.close()
+
+    records = read_traffic(path)
+    assert len(records) == 101
+    assert records[0]["body"] == {"k": 1} and records[-1]["body"] == "not json"
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from benchmarks.datasets import make_dataset
+from tables.table import VectorTable
+from utils.config import IndexConfig
+from utils.evaluation import exact_neighbours
+from utils.tuning import candidate_configs, drops_dimensions, tune_table
+
+
+def test_candidate_configs():
+    ivf = IndexConfig(16, 16, index_type="ivf")
+    assert [config.nprobe for config in candidate_configs(ivf, nlist=12)] == [
+        1,
+        2,
+        4,
+        8,
+        12,
+    ]
+
+    flat = IndexConfig(64, 64)
+    configs = candidate_configs(flat)
+    assert [(config.pca, config.dim_final) for config in configs] == [
+        (True, 8),
+        (True, 16),
+        (True, 32),
+        (False, 64),
+    ]
+
+    # A PCA table cannot be tuned above the dimensions it keeps
+    pca = IndexConfig(64, 16, pca=True)
+    assert [config.dim_final for config in candidate_configs(pca)] == [8, 16]
+    assert all(config.pca for config in candidate_configs(pca))
+    assert drops_dimensions(flat, configs[0])
+    assert not drops_dimensions(flat, configs[-1])
+    assert drops_dimensions(pca, configs[0]) and not drops_dimensions(pca, pca)
+
+
+def test_tune_ivf_to_target_recall():
+    embeddings = make_dataset(3000, 16, "clustered")
+    table = VectorTable(
+        "tuned", IndexConfig(16, 16, index_type="ivf", nprobe=1), embeddings
+    )
+
+    result = tune_table(table, k=5, target_recall=0.99, num_queries=50)
+    assert result["met"]
+    assert result["chosen"]["recall"] >= 0.99
+    assert result["config"].nlist is None
+    # The cheapest configuration meeting the target is chosen
+    faster = [
+        p
+        for p in result["points"]
+        if p["latency_ms"]["p50"] < result["chosen"]["latency_ms"]["p50"]
+    ]
+    assert all(point["recall"] < 0.99 for point in faster)
+
+    # Changing only nprobe is applied without retraining the index
+    index = table.index
+    table.rebuild(result["config"])
+    assert table.index is index
+    assert index.nprobe == result["config"].nprobe == table.config.nprobe
+
+
+def test_tune_requires_one_objective():
+    table = VectorTable("tuned", IndexConfig(8, 8), np.random.rand(100, 8))
+    with pytest.raises(ValueError):
+        tune_table(table)
+    with pytest.raises(ValueError):
+        tune_table(table, target_recall=0.9, latency_budget_ms=1.0)
+
+
+def test_tune_pca_on_original_vectors():
+    embeddings = make_dataset(600, 64, "uniform")
+    table = VectorTable("pca", IndexConfig(64, 8, pca=True), embeddings)
+    with pytest.raises(ValueError):
+        tune_table(table, k=5, target_recall=0.9)
+
+    # Against the original vectors, heavy reduction loses recall
+    result = tune_table(
+        table, k=5, target_recall=0.9, num_queries=50, vectors=embeddings
+    )
+    recalls = {point["config"]: point["recall"] for point in result["points"]}
+    assert min(recalls.values()) < 0.9
+    assert result["config"].dim_final == 8
+
+
+def test_tune_pca_recall_holds_after_rebuild():
+    embeddings = make_dataset(600, 64, "uniform")
+    table = VectorTable("pca", IndexConfig(64, 32, pca=True), embeddings)
+    result = tune_table(
+        table,
+        k=5,
+        latency_budget_ms=1e6,
+        num_queries=50,
+        dims_final=[8, 16],
+        vectors=embeddings,
+    )
+    assert all(
+        point["config"] != repr(table.config.replace(pca=False, dim_final=64))
+        for point in result["points"]
+    )
+
+    # Applying a reduction reaches the recall it was measured at
+    config = result["config"].replace(dim_final=8)
+    table.rebuild(config)
+    queries = make_dataset(50, 64, "uniform", seed=1)
+    truth = exact_neighbours(embeddings, queries, 5)
+    found = [table.query(query, 5)[0] for query in queries]
+    recall = np.mean([len(set(f) & set(t)) / 5 for f, t in zip(found, truth)])
+    recalls = {point["config"]: point["recall"] for point in result["points"]}
+    assert recall == pytest.approx(recalls[repr(config)], abs=0.15)
@@ -0,0 +1,171 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from threadpoolctl import ThreadpoolController
+
+from utils.config import BLAS_PARALLEL_WORK, BLAS_POLICIES
+from utils.metrics import BLAS_THREADS
+
+
+class ComputeScheduler:
+    """
+    A class sizing the BLAS thread pool from the compute-heavy calls running, so concurrent requests do not oversubscribe the cores.
+
+    NumPy's BLAS runs each large np.dot on a thread per core. With many request threads each
+    doing so, the cores are shared by many times more threads than they can run, and time goes
+    to context switches. Calls that do BLAS work, such as searches, index builds and kNN
+    graphs, run in a `section` declaring their work in multiply-adds.
+
+    The BLAS thread count is process-wide, so it is set from all the sections running rather
+    than per call. With the "adaptive" policy, a large call (at least parallel_work multiply-adds)
+    running alone uses max_threads, and when others run alongside, the threads are split between
+    them, down to one thread each when there are as many calls as threads. Small calls alone
+    use one thread. With "single", BLAS always uses one thread and the cores are used by
+    serving requests in parallel. With "off", the thread pool is left as the library set it.
+
+    Attributes:
+        policy (str): "adaptive", "single" or "off".
+        max_threads (int): The BLAS threads used by a large call running alone.
+        parallel_work (int): The multiply-adds from which a call uses several threads.
+
+    Methods:
+        section(work): Run a compute-heavy call, sizing the BLAS threads with the others running.
+        threads(): Get the BLAS threads currently set.
+
+    Example:
+        scheduler = ComputeScheduler("adaptive", max_threads=8)
+        with scheduler.section(len(embeddings) * embeddings.shape[1]):
+            scores = np.dot(embeddings, query)
+    """
+
+    def __init__(
+        self,
+        policy: str = "off",
+        max_threads: int = None,
+        parallel_work: int = BLAS_PARALLEL_WORK,
+    ):
+        """
+        Initialize a ComputeScheduler instance.
+
+        Args:
+            policy (str, optional): "adaptive", "single" or "off" (default is "off").
+            max_threads (int, optional): The BLAS threads used by a large call running alone (default is the number of CPUs).
+            parallel_work (int, optional): The multiply-adds from which a call uses several threads (default is BLAS_PARALLEL_WORK).
+
+        Raises:
+            ValueError: If the policy is unknown or max_threads is not positive.
+        """
+        if policy not in BLAS_POLICIES:
+            raise ValueError(f"Expected policy in {BLAS_POLICIES} but got {policy}")
+        self.policy = policy
+        self.parallel_work = parallel_work
+        self._libraries = None
+        self._threads = None
+        self._lock = threading.Lock()
+        # Sections running, and how many of them are large
+        self._running = 0
+        self._large = 0
+
+        if policy != "off":
+            self._libraries = ThreadpoolController().select(user_api="blas")
+        max_threads = max_threads or os.cpu_count() or 1
+        if max_threads < 1:
+            raise ValueError(f"Expected max_threads>0 got max_threads={max_threads}")
+        self.max_threads = max_threads
+
+        if policy == "single":
+            self._set_threads(1)
+
+    def _set_threads(self, threads: int):
+        """
+        Set the BLAS threads if they differ from the libraries' own. The lock must be held, except from __init__.
+        """
+        # Read back from the libraries rather than cached, as code such as scikit-learn's
+        # threadpool_limits may set them meanwhile and restore a count set before
+        for library in self._libraries.lib_controllers:
+            if library.get_num_threads() != threads:
+                library.set_num_threads(threads)
+        if threads != self._threads:
+            self._threads = threads
+            BLAS_THREADS.set(threads)
+
+    @contextmanager
+    def section(self, work: int):
+        """
+        Run a compute-heavy call, sizing the BLAS threads with the other calls running.
+
+        Args:
+            work (int): The multiply-adds of the call, roughly, such as rows times dimensions for a scan.
+        """
+        if self.policy != "adaptive":
+            yield
+            return
+
+        large = work >= self.parallel_work
+        with self._lock:
+            self._running += 1
+            self._large += large
+            self._resize()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._large -= large
+                self._resize()
+
+    def _resize(self):
+        """
+        Split the threads between the sections running. The lock must be held.
+        """
+        if not self._running:
+            # Left as they are until the next section, which sets them again
+            return
+        if not self._large:
+            self._set_threads(1)
+        else:
+            self._set_threads(max(self.max_threads // self._running, 1))
+
+    def threads(self) -> int:
+        """
+        Get the BLAS threads currently set, None if the scheduler has not set them.
+        """
+        return self._threads
+
+
+# The scheduler of this process, replaced by `configure` when a server starts.
+scheduler = ComputeScheduler()
+
+
+def configure(
+    policy: str, max_threads: int = None, parallel_work: int = BLAS_PARALLEL_WORK
+) -> ComputeScheduler:
+    """
+    Set the scheduler of this process, used by `section`.
+
+    Args:
+        policy (str): "adaptive", "single" or "off".
+        max_threads (int, optional): The BLAS threads used by a large call running alone (default is the number of CPUs).
+        parallel_work (int, optional): The multiply-adds from which a call uses several threads (default is BLAS_PARALLEL_WORK).
+
+    Returns:
+        ComputeScheduler: The new scheduler.
+    """
+    global scheduler
+    scheduler = ComputeScheduler(policy, max_threads, parallel_work)
+    return scheduler
+
+
+def section(work: int):
+    """
+    Run a compute-heavy call under the scheduler of this process, see `ComputeScheduler.section`.
+
+    Args:
+        work (int): The multiply-adds of the call, roughly.
+
+    Example:
+        with compute.section(num_rows * dimension):
+            top_k = table.query(query_vector, k)
+    """
+    return scheduler.section(work)
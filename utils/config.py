@@ -1,3 +1,18 @@
+import os
+
+INDEX_TYPES = ("flat", "ivf", "multi_vector")
+SIZE_UNITS = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+DTYPES = (None, "float32", "float64")
+# IndexConfig fields read at query time only, which can change without rebuilding an index.
+SEARCH_FIELDS = ("nprobe",)
+# How the BLAS thread pool is sized: "adaptive" from the calls running, "single" for one thread
+# per call with parallelism across requests, "off" to leave it as the library set it.
+BLAS_POLICIES = ("adaptive", "single", "off")
+# Multiply-adds below which a call gains nothing from more than one BLAS thread, as waking
+# the threads costs more than the arithmetic they share (about 16k rows of 256 dimensions).
+BLAS_PARALLEL_WORK = 1 << 22
+
+
 class IndexConfig:
     """
     A configuration class for indexing vectors.
@@ -7,12 +22,18 @@ class IndexConfig:
         dim_final (int): The desired dimensionality after processing.
         pca (bool): Whether to perform PCA dimension reduction (default is False).
         normalise (bool): Whether to normalize input vectors (default is True).
+        index_type (str): "flat" for exact search, "ivf" for an approximate inverted file index or "multi_vector" for documents of several vectors scored by MaxSim (default is "flat").
+        nlist (int): The number of IVF clusters, None for about the square root of the number of rows (default is None).
+        nprobe (int): The number of IVF clusters searched per query (default is 8).
+        dtype (str): The dtype the index stores its vectors in, "float32", "float64" or None to keep the input dtype (default is None).
 
     Methods:
         dim_input: Get the dimensionality of input vectors.
         dim_final: Get the desired dimensionality after processing.
         pca: Check if PCA dimension reduction is enabled.
         normalise: Check if input vector normalization is enabled.
+        same_index(other): Check whether another configuration builds the same index.
+        replace(**changes): Get a copy of the configuration with some values changed.
         __repr__(): Get a string representation of the configuration.
 
     Example:
@@ -21,7 +42,15 @@ class IndexConfig:
     """
 
     def __init__(
-        self, dim_input: int, dim_final: int, pca: bool = False, normalise: bool = True
+        self,
+        dim_input: int,
+        dim_final: int,
+        pca: bool = False,
+        normalise: bool = True,
+        index_type: str = "flat",
+        nlist: int = None,
+        nprobe: int = 8,
+        dtype: str = None,
     ):
         """
         Initialize an IndexConfig instance.
@@ -31,11 +60,31 @@ class IndexConfig:
             dim_final (int): The desired dimensionality after processing.
             pca (bool, optional): Whether to perform PCA dimension reduction (default is False).
             normalise (bool, optional): Whether to normalize input vectors (default is True).
+            index_type (str, optional): "flat" for exact search, "ivf" for an approximate inverted file index or "multi_vector" for documents of several vectors scored by MaxSim (default is "flat").
+            nlist (int, optional): The number of IVF clusters, None for about the square root of the number of rows (default is None).
+            nprobe (int, optional): The number of IVF clusters searched per query (default is 8).
+            dtype (str, optional): The dtype the index stores its vectors in, "float32", "float64" or None to keep the input dtype (default is None).
+
+        Raises:
+            ValueError: If the index type or dtype is unknown, or an IVF or multi-vector index is combined with PCA.
         """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Expected index_type in {INDEX_TYPES} got {index_type}")
+        if dtype not in DTYPES:
+            raise ValueError(f"Expected dtype in {DTYPES} got {dtype}")
+        if index_type == "ivf" and pca:
+            raise ValueError("The IVF index does not support PCA.")
+        if index_type == "multi_vector" and pca:
+            raise ValueError("The multi-vector index does not support PCA.")
+
         self._dim_input = dim_input
         self._dim_final = dim_final
         self._pca = pca
         self._normalise = normalise
+        self._index_type = index_type
+        self._nlist = nlist
+        self._nprobe = nprobe
+        self._dtype = dtype
 
     @property
     def dim_input(self) -> int:
@@ -57,6 +106,440 @@ class IndexConfig:
         """Check if input vector normalization is enabled."""
         return self._normalise
 
+    @property
+    def index_type(self) -> str:
+        """Get the index type, "flat" or "ivf"."""
+        return getattr(self, "_index_type", "flat")
+
+    @property
+    def nlist(self) -> int:
+        """Get the number of IVF clusters, None for the default."""
+        return getattr(self, "_nlist", None)
+
+    @property
+    def nprobe(self) -> int:
+        """Get the number of IVF clusters searched per query."""
+        return getattr(self, "_nprobe", 8)
+
+    @property
+    def dtype(self) -> str:
+        """Get the dtype the index stores its vectors in, None to keep the input dtype."""
+        return getattr(self, "_dtype", None)
+
+    def same_index(self, other: "IndexConfig") -> bool:
+        """
+        Check whether another configuration builds the same index, differing at most in search-time fields.
+        """
+        unchanged = {field: getattr(self, field) for field in SEARCH_FIELDS}
+        return repr(other.replace(**unchanged)) == repr(self)
+
+    def replace(self, **changes) -> "IndexConfig":
+        """
+        Get a copy of the configuration with some values changed.
+
+        Args:
+            **changes: New values for any of the constructor arguments.
+
+        Returns:
+            IndexConfig: The new configuration.
+
+        Example:
+            config = config.replace(pca=True, dim_final=64)
+        """
+        values = {
+            "dim_input": self.dim_input,
+            "dim_final": self.dim_final,
+            "pca": self.pca,
+            "normalise": self.normalise,
+            "index_type": self.index_type,
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "dtype": self.dtype,
+        }
+        values.update(changes)
+        return IndexConfig(**values)
+
+    def __repr__(self) -> str:
+        """
+        Get a string representation of the configuration.
+
+        Returns:
+            str: A string representation of the configuration.
+        """
+        return f"IndexConfig(dim_input={self._dim_input}, dim_final={self._dim_final}, pca={self._pca}, normalise={self._normalise}, index_type={self.index_type}, nlist={self.nlist}, nprobe={self.nprobe}, dtype={self.dtype})"
+
+
+def parse_size(size) -> int:
+    """
+    Parse a size in bytes, given as a number or a string with an optional K, M, G or T suffix.
+
+    Args:
+        size (Union[int, str]): The size, such as 1048576 or "512M".
+
+    Returns:
+        int: The size in bytes.
+
+    Raises:
+        ValueError: If the size cannot be parsed.
+
+    Example:
+        parse_size("8G")  # 8589934592
+    """
+    if isinstance(size, str):
+        size = size.strip().upper().removesuffix("B")
+        if size and size[-1] in SIZE_UNITS:
+            return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+class ServerConfig:
+    """
+    A configuration class for the server, read from NANOVECTOR_* environment variables.
+
+    Attributes:
+        shared_dir (str): Directory for tables shared by several worker processes, None to keep tables private to each process.
+        role (str): Replication role, "primary", "replica" or None for a standalone server.
+        primary_url (str): Base URL of the primary server, for replicas.
+        replica_poll_interval (float): Seconds between polls of the primary once a replica is caught up.
+        replication_log_entries (int): Entries a primary keeps in its mutation log, replicas further behind restart from a snapshot.
+        replication_secret (str): Secret a primary and its replicas share to authenticate the mutation log.
+        search_workers (int): Threads running searches in the async server.
+        embed_workers (int): Threads running the embedding model in the async server.
+        ingest_workers (int): Threads running table creation and adds in the async server.
+        max_pending (int): Tasks admitted to each async server executor at once, further requests wait.
+        job_workers (int): Background jobs (table creation, bulk adds) running at once.
+        memory_budget (int): Bytes the tables may hold in memory before cold ones are spilled to disk, None for no budget.
+        spill_dir (str): Directory cold tables are spilled to, required with memory_budget.
+        graph_dir (str): Directory /<table>/knn_graph requests write under, None to not serve them.
+        profile_dir (str): Directory profiles of slow requests are written to, None to not profile.
+        profile_slow_seconds (float): Requests slower than this are written out when profiled.
+        profile_sample_rate (float): Fraction of requests profiled, as profiling slows them down.
+        record_path (str): JSONL file add and query requests are recorded to for replay, None to not record.
+        record_sample_rate (float): Fraction of add and query requests recorded.
+        blas_policy (str): How BLAS threads are sized, "adaptive", "single" or "off" (see utils.compute).
+        blas_threads (int): BLAS threads used by a large search running alone.
+        blas_parallel_work (int): Multiply-adds from which a call uses several BLAS threads.
+
+    Methods:
+        from_env(environ): Build a configuration from environment variables.
+        __repr__(): Get a string representation of the configuration.
+
+    Example:
+        config = ServerConfig.from_env()
+        print(config.shared_dir)  # Prints the value of NANOVECTOR_SHARED_DIR
+    """
+
+    def __init__(
+        self,
+        shared_dir: str = None,
+        role: str = None,
+        primary_url: str = None,
+        replica_poll_interval: float = 0.5,
+        replication_log_entries: int = 10000,
+        replication_secret: str = None,
+        search_workers: int = None,
+        embed_workers: int = 1,
+        ingest_workers: int = 1,
+        max_pending: int = 1024,
+        job_workers: int = 1,
+        memory_budget: int = None,
+        spill_dir: str = None,
+        graph_dir: str = None,
+        profile_dir: str = None,
+        profile_slow_seconds: float = 1.0,
+        profile_sample_rate: float = 0.01,
+        record_path: str = None,
+        record_sample_rate: float = 1.0,
+        blas_policy: str = "adaptive",
+        blas_threads: int = None,
+        blas_parallel_work: int = BLAS_PARALLEL_WORK,
+    ):
+        """
+        Initialize a ServerConfig instance.
+
+        Args:
+            shared_dir (str, optional): Directory for tables shared by several worker processes (default is None).
+            role (str, optional): Replication role, "primary", "replica" or None (default is None).
+            primary_url (str, optional): Base URL of the primary server, required for replicas (default is None).
+            replica_poll_interval (float, optional): Seconds between polls of the primary once caught up (default is 0.5).
+            replication_log_entries (int, optional): Entries a primary keeps in its mutation log (default is 10000).
+            replication_secret (str, optional): Secret shared by a primary and its replicas, required for replication (default is None).
+            search_workers (int, optional): Threads running searches in the async server (default is the number of CPUs).
+            embed_workers (int, optional): Threads running the embedding model in the async server (default is 1).
+            ingest_workers (int, optional): Threads running table creation and adds in the async server (default is 1).
+            max_pending (int, optional): Tasks admitted to each async server executor at once (default is 1024).
+            job_workers (int, optional): Background jobs running at once (default is 1).
+            memory_budget (Union[int, str], optional): Bytes the tables may hold in memory, such as "8G" (default is None).
+            spill_dir (str, optional): Directory cold tables are spilled to, required with memory_budget (default is None).
+            graph_dir (str, optional): Directory /<table>/knn_graph requests write under (default is None).
+            profile_dir (str, optional): Directory profiles of slow requests are written to (default is None).
+            profile_slow_seconds (float, optional): Requests slower than this are written out when profiled (default is 1.0).
+            profile_sample_rate (float, optional): Fraction of requests profiled (default is 0.01).
+            record_path (str, optional): JSONL file add and query requests are recorded to (default is None).
+            record_sample_rate (float, optional): Fraction of add and query requests recorded (default is 1.0).
+            blas_policy (str, optional): How BLAS threads are sized, "adaptive", "single" or "off" (default is "adaptive").
+            blas_threads (int, optional): BLAS threads used by a large search running alone (default is the number of CPUs).
+            blas_parallel_work (int, optional): Multiply-adds from which a call uses several BLAS threads (default is BLAS_PARALLEL_WORK).
+
+        Raises:
+            ValueError: If the role or blas_policy is unknown, a replica has no primary_url, replication has no replication_secret
+                or is combined with shared_dir,
+                a worker or thread count is not positive, memory_budget is set without spill_dir or with shared_dir or replication,
+                or profile_sample_rate or record_sample_rate is not within [0, 1].
+        """
+        if role not in (None, "primary", "replica"):
+            raise ValueError(f"Expected role 'primary' or 'replica' but got {role}")
+        if blas_policy not in BLAS_POLICIES:
+            raise ValueError(
+                f"Expected blas_policy in {BLAS_POLICIES} but got {blas_policy}"
+            )
+        if role == "replica" and primary_url is None:
+            raise ValueError("A replica requires primary_url.")
+        if role is not None and not replication_secret:
+            raise ValueError("Replication requires a replication_secret.")
+        if role is not None and shared_dir is not None:
+            raise ValueError("Replication cannot be combined with shared_dir.")
+
+        if memory_budget is not None:
+            memory_budget = parse_size(memory_budget)
+            if spill_dir is None:
+                raise ValueError("A memory_budget requires spill_dir.")
+            if shared_dir is not None or role is not None:
+                raise ValueError(
+                    "A memory_budget cannot be combined with shared_dir or replication."
+                )
+
+        for name, value in (
+            ("profile_sample_rate", profile_sample_rate),
+            ("record_sample_rate", record_sample_rate),
+        ):
+            if not 0 <= value <= 1:
+                raise ValueError(f"Expected 0<={name}<=1 got {name}={value}")
+
+        search_workers = search_workers or os.cpu_count() or 1
+        blas_threads = blas_threads or os.cpu_count() or 1
+        for name, value in (
+            ("search_workers", search_workers),
+            ("embed_workers", embed_workers),
+            ("ingest_workers", ingest_workers),
+            ("max_pending", max_pending),
+            ("job_workers", job_workers),
+            ("blas_threads", blas_threads),
+            ("replication_log_entries", replication_log_entries),
+        ):
+            if value < 1:
+                raise ValueError(f"Expected {name}>0 got {name}={value}")
+
+        self.shared_dir = shared_dir
+        self.role = role
+        self.primary_url = primary_url
+        self.replica_poll_interval = replica_poll_interval
+        self.replication_log_entries = replication_log_entries
+        self.replication_secret = replication_secret
+        self.search_workers = search_workers
+        self.embed_workers = embed_workers
+        self.ingest_workers = ingest_workers
+        self.max_pending = max_pending
+        self.job_workers = job_workers
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.graph_dir = graph_dir
+        self.profile_dir = profile_dir
+        self.profile_slow_seconds = profile_slow_seconds
+        self.profile_sample_rate = profile_sample_rate
+        self.record_path = record_path
+        self.record_sample_rate = record_sample_rate
+        self.blas_policy = blas_policy
+        self.blas_threads = blas_threads
+        self.blas_parallel_work = blas_parallel_work
+
+    @classmethod
+    def from_env(cls, environ=None) -> "ServerConfig":
+        """
+        Build a configuration from environment variables.
+
+        Args:
+            environ (dict, optional): The environment to read from (default is os.environ).
+
+        Returns:
+            ServerConfig: The configuration.
+        """
+        environ = os.environ if environ is None else environ
+        return cls(
+            shared_dir=environ.get("NANOVECTOR_SHARED_DIR", None),
+            role=environ.get("NANOVECTOR_ROLE", None),
+            primary_url=environ.get("NANOVECTOR_PRIMARY_URL", None),
+            replica_poll_interval=float(
+                environ.get("NANOVECTOR_REPLICA_POLL_INTERVAL", 0.5)
+            ),
+            replication_log_entries=int(
+                environ.get("NANOVECTOR_REPLICATION_LOG_ENTRIES", 10000)
+            ),
+            replication_secret=environ.get("NANOVECTOR_REPLICATION_SECRET", None),
+            search_workers=int(environ.get("NANOVECTOR_SEARCH_WORKERS", 0)) or None,
+            embed_workers=int(environ.get("NANOVECTOR_EMBED_WORKERS", 1)),
+            ingest_workers=int(environ.get("NANOVECTOR_INGEST_WORKERS", 1)),
+            max_pending=int(environ.get("NANOVECTOR_MAX_PENDING", 1024)),
+            job_workers=int(environ.get("NANOVECTOR_JOB_WORKERS", 1)),
+            memory_budget=environ.get("NANOVECTOR_MEMORY_BUDGET", None),
+            spill_dir=environ.get("NANOVECTOR_SPILL_DIR", None),
+            graph_dir=environ.get("NANOVECTOR_GRAPH_DIR", None),
+            profile_dir=environ.get("NANOVECTOR_PROFILE_DIR", None),
+            profile_slow_seconds=float(
+                environ.get("NANOVECTOR_PROFILE_SLOW_SECONDS", 1.0)
+            ),
+            profile_sample_rate=float(
+                environ.get("NANOVECTOR_PROFILE_SAMPLE_RATE", 0.01)
+            ),
+            record_path=environ.get("NANOVECTOR_RECORD_PATH", None),
+            record_sample_rate=float(environ.get("NANOVECTOR_RECORD_SAMPLE_RATE", 1.0)),
+            blas_policy=environ.get("NANOVECTOR_BLAS_POLICY", "adaptive"),
+            blas_threads=int(environ.get("NANOVECTOR_BLAS_THREADS", 0)) or None,
+            blas_parallel_work=int(
+                environ.get("NANOVECTOR_BLAS_PARALLEL_WORK", BLAS_PARALLEL_WORK)
+            ),
+        )
+
+    def __repr__(self) -> str:
+        """
+        Get a string representation of the configuration.
+
+        Returns:
+            str: A string representation of the configuration.
+        """
+        return f"ServerConfig(shared_dir={self.shared_dir}, role={self.role}, primary_url={self.primary_url}, replica_poll_interval={self.replica_poll_interval}, replication_log_entries={self.replication_log_entries}, replication_secret={'***' if self.replication_secret else None}, search_workers={self.search_workers}, embed_workers={self.embed_workers}, ingest_workers={self.ingest_workers}, max_pending={self.max_pending}, job_workers={self.job_workers}, memory_budget={self.memory_budget}, spill_dir={self.spill_dir}, graph_dir={self.graph_dir}, profile_dir={self.profile_dir}, profile_slow_seconds={self.profile_slow_seconds}, profile_sample_rate={self.profile_sample_rate}, record_path={self.record_path}, record_sample_rate={self.record_sample_rate}, blas_policy={self.blas_policy}, blas_threads={self.blas_threads}, blas_parallel_work={self.blas_parallel_work})"
+
+
+# Classes of routes admitted separately, so that a flood of one kind cannot starve the others.
+ROUTE_CLASSES = ("query", "ingest", "create")
+
+
+class AdmissionConfig:
+    """
+    A configuration class for admission control, read from NANOVECTOR_* environment variables.
+
+    Every limit is off by default. Limits on a route class bound the requests of that class
+    running at once, and the requests waiting for them. Tenant limits bound the requests of
+    each tenant: the X-Nanovector-Tenant header, or else the table a request is for.
+
+    Attributes:
+        concurrency (dict): Requests of each route class running at once, None for no limit.
+        queue (dict): Requests of each route class waiting to run, beyond which they are rejected.
+        queue_timeout (float): Seconds a request may wait to run before it is rejected.
+        tenant_concurrency (int): Requests of one tenant running at once, None for no limit.
+        tenant_rate (float): Requests per second of one tenant, None for no limit.
+        tenant_burst (int): Requests a tenant may send at once above its rate.
+
+    Methods:
+        from_env(environ): Build a configuration from environment variables.
+        __repr__(): Get a string representation of the configuration.
+
+    Example:
+        config = AdmissionConfig(concurrency={"query": 16}, queue={"query": 64}, tenant_rate=100)
+    """
+
+    def __init__(
+        self,
+        concurrency: dict = None,
+        queue: dict = None,
+        queue_timeout: float = 1.0,
+        tenant_concurrency: int = None,
+        tenant_rate: float = None,
+        tenant_burst: int = None,
+    ):
+        """
+        Initialize an AdmissionConfig instance.
+
+        Args:
+            concurrency (dict, optional): Requests of each route class ("query", "ingest", "create") running at once (default is no limit).
+            queue (dict, optional): Requests of each route class waiting to run (default is 64 per class).
+            queue_timeout (float, optional): Seconds a request may wait to run (default is 1.0).
+            tenant_concurrency (int, optional): Requests of one tenant running at once (default is None).
+            tenant_rate (float, optional): Requests per second of one tenant (default is None).
+            tenant_burst (int, optional): Requests a tenant may send at once above its rate (default is the rate, at least 1).
+
+        Raises:
+            ValueError: If a route class is unknown or a limit is not positive.
+        """
+        concurrency = dict(concurrency or {})
+        queue = dict(queue or {})
+        for name in list(concurrency) + list(queue):
+            if name not in ROUTE_CLASSES:
+                raise ValueError(
+                    f"Expected route class in {ROUTE_CLASSES} but got {name}"
+                )
+        queue = {
+            name: 64 if queue.get(name) is None else queue[name]
+            for name in ROUTE_CLASSES
+        }
+        concurrency = {name: concurrency.get(name) for name in ROUTE_CLASSES}
+        if tenant_rate is not None and tenant_burst is None:
+            tenant_burst = max(int(tenant_rate), 1)
+
+        for name, value in (
+            [(f"{name} concurrency", value) for name, value in concurrency.items()]
+            # A queue of 0 rejects requests as soon as the class is at its concurrency
+            + [(f"{name} queue", value + 1) for name, value in queue.items()]
+            + [
+                ("queue_timeout", queue_timeout),
+                ("tenant_concurrency", tenant_concurrency),
+                ("tenant_rate", tenant_rate),
+                ("tenant_burst", tenant_burst),
+            ]
+        ):
+            if value is not None and value <= 0:
+                raise ValueError(f"Expected a positive {name} but got {value}")
+
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.tenant_concurrency = tenant_concurrency
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+
+    @property
+    def enabled(self) -> bool:
+        """Check whether any limit is set."""
+        return (
+            any(value is not None for value in self.concurrency.values())
+            or self.tenant_concurrency is not None
+            or self.tenant_rate is not None
+        )
+
+    @classmethod
+    def from_env(cls, environ=None) -> "AdmissionConfig":
+        """
+        Build a configuration from environment variables.
+
+        Route class limits are read from NANOVECTOR_<CLASS>_CONCURRENCY and NANOVECTOR_<CLASS>_QUEUE,
+        such as NANOVECTOR_QUERY_CONCURRENCY.
+
+        Args:
+            environ (dict, optional): The environment to read from (default is os.environ).
+
+        Returns:
+            AdmissionConfig: The configuration.
+        """
+        environ = os.environ if environ is None else environ
+
+        def optional(name, parse):
+            value = environ.get(f"NANOVECTOR_{name}", None)
+            return parse(value) if value not in (None, "") else None
+
+        return cls(
+            concurrency={
+                name: optional(f"{name.upper()}_CONCURRENCY", int)
+                for name in ROUTE_CLASSES
+            },
+            queue={
+                name: optional(f"{name.upper()}_QUEUE", int) for name in ROUTE_CLASSES
+            },
+            queue_timeout=float(environ.get("NANOVECTOR_QUEUE_TIMEOUT", 1.0)),
+            tenant_concurrency=optional("TENANT_CONCURRENCY", int),
+            tenant_rate=optional("TENANT_RATE", float),
+            tenant_burst=optional("TENANT_BURST", int),
+        )
+
     def __repr__(self) -> str:
         """
         Get a string representation of the configuration.
@@ -64,4 +547,4 @@ class IndexConfig:
         Returns:
             str: A string representation of the configuration.
         """
-        return f"IndexConfig(dim_input={self._dim_input}, dim_final={self._dim_final}, pca={self._pca}, normalise={self._normalise})"
+        return f"AdmissionConfig(concurrency={self.concurrency}, queue={self.queue}, queue_timeout={self.queue_timeout}, tenant_concurrency={self.tenant_concurrency}, tenant_rate={self.tenant_rate}, tenant_burst={self.tenant_burst})"
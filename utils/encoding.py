@@ -0,0 +1,63 @@
+import base64
+
+import numpy as np
+
+# Value of the 'encoding' request field asking for arrays in responses to be base64-encoded.
+BASE64 = "base64"
+
+# Dtypes arrays may be encoded in, as a sender could otherwise make the server build objects.
+ENCODED_DTYPES = ("float16", "float32", "float64", "int8", "uint8", "int32", "int64")
+
+
+def encode_array(array, dtype: str = None) -> dict:
+    """
+    Encode an array compactly for a JSON body: its raw little-endian bytes in base64, with its dtype and shape.
+
+    A float32 vector takes about 5.3 characters per value this way, against 18 to 20 as a JSON
+    list of floats, and is decoded without parsing every number.
+
+    Args:
+        array (array-like): The array to encode.
+        dtype (str, optional): The dtype to encode in, such as "float32" (default is the array's own).
+
+    Returns:
+        dict: The "dtype", "shape" and base64 "data" of the array.
+
+    Example:
+        data = {"query_vector": encode_array(vector, "float32"), "k": 10}
+    """
+    array = np.asarray(array)
+    array = array.astype(np.dtype(dtype or array.dtype).newbyteorder("<"), copy=False)
+    return {
+        "dtype": array.dtype.name,
+        "shape": list(array.shape),
+        "data": base64.b64encode(np.ascontiguousarray(array).tobytes()).decode("ascii"),
+    }
+
+
+def decode_array(value) -> np.array:
+    """
+    Decode an array from a JSON body, either encoded by encode_array or as nested lists.
+
+    Args:
+        value (Union[dict, list]): The encoded array, or the array as nested lists.
+
+    Returns:
+        np.array: The decoded array.
+
+    Raises:
+        ValueError: If the dtype is not one of ENCODED_DTYPES or the data does not match the shape.
+    """
+    if not isinstance(value, dict):
+        return np.array(value)
+    dtype = value.get("dtype")
+    if dtype not in ENCODED_DTYPES:
+        raise ValueError(f"Expected dtype in {ENCODED_DTYPES} but got {dtype}")
+    shape = tuple(value["shape"])
+    buffer = base64.b64decode(value["data"])
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if len(buffer) != dtype.itemsize * int(np.prod(shape)):
+        raise ValueError(
+            f"Expected {dtype.itemsize * int(np.prod(shape))} bytes for shape {shape} but got {len(buffer)}"
+        )
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
@@ -0,0 +1,205 @@
+import tempfile
+import time
+
+import numpy as np
+
+from index.knn_graph import compute_knn_graph
+from utils.config import IndexConfig
+from utils.initialise_index import initialise_index
+
+
+def exact_neighbours(embeddings: np.array, queries: np.array, k: int) -> np.array:
+    """
+    Compute the exact top-k neighbours of queries by brute force, as the flat Index ranks them.
+
+    Scores are computed with blocked matrix-matrix products, which BLAS spreads over all cores.
+    The normalisation of an Index scales all rows by the same factor, so it does not change
+    the ranking and the raw embeddings are scored directly.
+
+    Args:
+        embeddings (np.array): The (n, d) rows to search.
+        queries (np.array): The (q, d) queries.
+        k (int): The number of neighbours per query.
+
+    Returns:
+        np.array: The (q, k) neighbour row ids, each row sorted by descending score.
+
+    Example:
+        truth = exact_neighbours(embeddings, queries, k=10)
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        neighbours_path, _ = compute_knn_graph(
+            embeddings, k, output_dir, queries=queries
+        )
+        return np.array(np.load(neighbours_path))
+
+
+def _ranked(index, query: np.array, k: int) -> np.array:
+    """
+    Get the top-k row ids of an index for a query, by descending score.
+    """
+    indices, _, scores = index.get_similarity(query, k, return_scores=True)
+    return indices[np.argsort(-scores, kind="stable")]
+
+
+def recall_at_k(retrieved: list, truth: np.array, k: int) -> float:
+    """
+    Get the mean fraction of the true top-k neighbours found among the top-k retrieved rows.
+
+    Args:
+        retrieved (list): The retrieved row ids of each query.
+        truth (np.array): The (q, >=k) true neighbour ids, by descending score.
+        k (int): The cutoff.
+
+    Returns:
+        float: The recall@k, between 0 and 1.
+    """
+    hits = [
+        len(np.intersect1d(rows[:k], true_rows[:k])) / min(k, len(true_rows))
+        for rows, true_rows in zip(retrieved, truth)
+    ]
+    return float(np.mean(hits))
+
+
+def mean_reciprocal_rank(retrieved: list, truth: np.array) -> float:
+    """
+    Get the mean of 1 / rank of the true nearest neighbour among the retrieved rows, 0 when it is missed.
+
+    Args:
+        retrieved (list): The retrieved row ids of each query, by descending score.
+        truth (np.array): The (q, >=1) true neighbour ids, by descending score.
+
+    Returns:
+        float: The MRR, between 0 and 1.
+    """
+    reciprocal_ranks = []
+    for rows, true_rows in zip(retrieved, truth):
+        position = np.flatnonzero(rows == true_rows[0])
+        reciprocal_ranks.append(1 / (position[0] + 1) if len(position) else 0.0)
+    return float(np.mean(reciprocal_ranks))
+
+
+def evaluate(index, queries: np.array, truth: np.array, k: int) -> dict:
+    """
+    Measure the recall@k, MRR and latency of an index against exact ground truth.
+
+    Queries run one after another, so the QPS is that of a single thread.
+
+    Args:
+        index (AbstractIndex): The index to evaluate.
+        queries (np.array): The (q, d) queries.
+        truth (np.array): The (q, k) true neighbour ids, from exact_neighbours.
+        k (int): The number of neighbours per query.
+
+    Returns:
+        dict: The "recall", "mrr", "qps" and "latency_ms" (p50, p95 and p99) of the index.
+    """
+    retrieved, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        retrieved.append(_ranked(index, query, k))
+        latencies.append(time.perf_counter() - start)
+    latencies = 1000 * np.array(latencies)
+    return {
+        "recall": recall_at_k(retrieved, truth, k),
+        "mrr": mean_reciprocal_rank(retrieved, truth),
+        "qps": float(1000 * len(queries) / latencies.sum()),
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+        },
+    }
+
+
+def config_label(config: IndexConfig) -> str:
+    """
+    Get a short label for a configuration, naming only what sets it apart in a sweep.
+    """
+    if config.index_type == "ivf":
+        return f"ivf nlist={config.nlist or 'auto'} nprobe={config.nprobe}"
+    if config.pca:
+        return f"pca dim_final={config.dim_final}"
+    return "flat" if config.dtype is None else f"flat dtype={config.dtype}"
+
+
+def recall_curve(
+    embeddings: np.array,
+    queries: np.array,
+    configs: list,
+    k: int = 10,
+    progress=None,
+) -> list:
+    """
+    Evaluate several index configurations on the same data, for a recall-vs-QPS curve.
+
+    Ground truth is computed once. IVF configurations differing only in nprobe share one
+    trained index, since nprobe only affects queries.
+
+    Args:
+        embeddings (np.array): The (n, d) rows to index.
+        queries (np.array): The (q, d) queries.
+        configs (list): The IndexConfig instances to evaluate.
+        k (int, optional): The number of neighbours per query (default is 10).
+        progress (callable, optional): Called as progress(fraction, stage) after each configuration (default is None).
+
+    Returns:
+        list: One dictionary per configuration with its "label", "config" (as a string),
+            "build_seconds" and the measurements of `evaluate`.
+
+    Example:
+        configs = [IndexConfig(256, 256, index_type="ivf", nprobe=p) for p in (1, 4, 16)]
+        for point in recall_curve(embeddings, queries, configs, k=10):
+            print(point["recall"], point["qps"])
+    """
+    truth = exact_neighbours(embeddings, queries, k)
+
+    built = {}
+    points = []
+    for config in configs:
+        key = repr(config.replace(nprobe=8)) if config.index_type == "ivf" else None
+        if key is not None and key in built:
+            index, build_seconds = built[key]
+        else:
+            start = time.perf_counter()
+            index = initialise_index(config, embeddings)
+            build_seconds = time.perf_counter() - start
+            if key is not None:
+                built[key] = (index, build_seconds)
+        if config.index_type == "ivf":
+            index.nprobe = min(config.nprobe, index.nlist)
+
+        point = {
+            "label": config_label(config),
+            "config": repr(config),
+            "build_seconds": build_seconds,
+        }
+        point.update(evaluate(index, queries, truth, k))
+        points.append(point)
+        if progress is not None:
+            progress(len(points) / len(configs), point["label"])
+    return points
+
+
+def sweep_configs(
+    dimension: int, dims_final: list = (), nprobes: list = (), nlist: int = None
+) -> list:
+    """
+    Get the configurations of a typical sweep: the flat baseline, PCA at several dim_final and IVF at several nprobe.
+
+    Args:
+        dimension (int): The input dimensionality.
+        dims_final (list, optional): The PCA output dimensionalities (default is none).
+        nprobes (list, optional): The IVF nprobe values (default is none).
+        nlist (int, optional): The number of IVF clusters, None for the default (default is None).
+
+    Returns:
+        list: The IndexConfig instances.
+    """
+    configs = [IndexConfig(dimension, dimension)]
+    configs += [IndexConfig(dimension, dim, pca=True) for dim in dims_final]
+    configs += [
+        IndexConfig(dimension, dimension, index_type="ivf", nlist=nlist, nprobe=nprobe)
+        for nprobe in nprobes
+    ]
+    return configs
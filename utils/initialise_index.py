@@ -1,42 +1,128 @@
+from typing import Union
+
 import numpy as np
 
+from index.abstract_index import AbstractIndex
 from index.index import Index
+from index.ivf_index import IVFIndex
+from index.multi_vector_index import MultiVectorIndex
 from index.pca_index import PCAIndex
 from utils.config import IndexConfig
 
 
-def initialise_index(config: IndexConfig, embeddings: np.array):
+def initialise_index(
+    config: IndexConfig, embeddings: Union[np.array, list], offsets: np.array = None
+):
     """
     Initialize an index for vectors based on the provided configuration.
 
     Args:
         config (IndexConfig): The configuration for the index.
-        embeddings (np.array): The input vectors to be indexed.
+        embeddings (Union[np.array, list]): The input vectors to be indexed, or a list of arrays
+            (such as memory-mapped shards) to build the index from chunk by chunk.
+        offsets (np.array, optional): For a multi-vector index, the start of each document in
+            embeddings followed by the number of vectors, None for one vector per document (default is None).
 
     Returns:
-        Index or PCAIndex: An instance of the index based on the configuration.
+        Index, PCAIndex, IVFIndex or MultiVectorIndex: An instance of the index based on the configuration.
 
     Raises:
         AssertionError: If the dimensions specified in the configuration are not compatible.
+        ValueError: If offsets are given for an index other than a multi-vector index.
 
     Example:
         config = IndexConfig(dim_input=256, dim_final=64, pca=True, normalise=False)
         embeddings = np.random.rand(100, 256)
         index = initialise_index(config, embeddings)
     """
+    if not config.pca:
+        assert (
+            config.dim_input == config.dim_final
+        ), "Input and final dimensions must be the same when PCA is not used."
+
+    if config.index_type == "multi_vector":
+        if isinstance(embeddings, list):
+            embeddings = np.concatenate(embeddings)
+        if config.dtype is not None:
+            embeddings = embeddings.astype(config.dtype, copy=False)
+        index = MultiVectorIndex(
+            vectors=embeddings,
+            offsets=offsets,
+            dimension=config.dim_final,
+            normalise=config.normalise,
+        )
+        return _cast(index, config.dtype)
+    if offsets is not None:
+        raise ValueError("Offsets are only supported by the multi-vector index.")
+
+    if isinstance(embeddings, list):
+        if config.pca:
+            index = PCAIndex.from_chunks(
+                embeddings, config.dim_input, config.dim_final, config.normalise
+            )
+        else:
+            index = Index.from_chunks(embeddings, config.dim_final, config.normalise)
+        if config.index_type == "ivf":
+            # The rows are already normalised, only new vectors and queries still need it
+            index = IVFIndex(
+                index.embeddings, config.dim_final, config.nlist, config.nprobe
+            )
+            index.normalise = config.normalise
+        return _cast(index, config.dtype)
+
+    if config.dtype is not None:
+        embeddings = embeddings.astype(config.dtype, copy=False)
+
     if config.pca:
-        return PCAIndex(
+        index = PCAIndex(
             embeddings=embeddings,
             dimension_input=config.dim_input,
             dimension_final=config.dim_final,
             normalise=config.normalise,
         )
+    elif config.index_type == "ivf":
+        index = IVFIndex(
+            embeddings=embeddings,
+            dimension=config.dim_final,
+            nlist=config.nlist,
+            nprobe=config.nprobe,
+            normalise=config.normalise,
+        )
     else:
-        assert (
-            config.dim_input == config.dim_final
-        ), "Input and final dimensions must be the same when PCA is not used."
-        return Index(
+        index = Index(
             embeddings=embeddings,
             dimension=config.dim_final,
             normalise=config.normalise,
         )
+    return _cast(index, config.dtype)
+
+
+def _cast(index: AbstractIndex, dtype: str) -> AbstractIndex:
+    """
+    Store the vectors of an index in a dtype, if given.
+    """
+    if dtype is not None and index._embeddings.dtype != dtype:
+        index._embeddings = index._embeddings.astype(dtype)
+        if isinstance(index, IVFIndex):
+            index.centroids = index.centroids.astype(dtype)
+        if isinstance(index, MultiVectorIndex):
+            index._vectors = index._vectors.astype(dtype)
+    return index
+
+
+def index_vectors(index: AbstractIndex) -> np.array:
+    """
+    Recover the input-space vectors held by an index, to rebuild it with another configuration.
+
+    Vectors are returned as stored, so normalised if the index normalises. For a PCAIndex
+    they are mapped back through the PCA, which loses the discarded components.
+
+    Args:
+        index (AbstractIndex): The index.
+
+    Returns:
+        np.array: The (num_vectors, dim_input) vectors.
+    """
+    if isinstance(index, PCAIndex):
+        return index.PCA.inverse_transform(index.embeddings)
+    return index.embeddings
@@ -0,0 +1,258 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+# Maximum number of jobs waiting to run.
+MAX_QUEUED = 1000
+# Number of finished jobs kept for status lookups.
+MAX_FINISHED = 1000
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+
+class Job:
+    """
+    A class representing one background operation and its progress.
+
+    Attributes:
+        job_id (str): The unique id of the job.
+        kind (str): What the job does, such as "create" or "add".
+        priority (int): Lower values run first.
+        status (str): "queued", "running", "succeeded" or "failed".
+        progress (float): The completed fraction, from 0 to 1.
+        stage (str): A short description of what the job is doing.
+        result: The value returned by the job once it succeeded.
+        error (str): The error message once it failed.
+
+    Methods:
+        report(progress, stage): Update the progress of the job.
+        eta(): Estimate the seconds left until the job finishes.
+        to_dict(): Get the status of the job as a dictionary.
+    """
+
+    def __init__(self, kind: str, priority: int = 0):
+        """
+        Initialize a Job instance.
+
+        Args:
+            kind (str): What the job does, such as "create" or "add".
+            priority (int, optional): Lower values run first (default is 0).
+        """
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.status = "queued"
+        self.progress = 0.0
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def report(self, progress: float = None, stage: str = None):
+        """
+        Update the progress of the job. Called from the job itself.
+
+        Args:
+            progress (float, optional): The completed fraction, from 0 to 1 (default keeps the current one).
+            stage (str, optional): What the job is doing now (default keeps the current one).
+        """
+        if progress is not None:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+        if stage is not None:
+            self.stage = stage
+
+    def eta(self):
+        """
+        Estimate the seconds left until the job finishes, assuming it progresses at a steady rate.
+
+        Returns:
+            float: The estimate, 0 once finished, or None before any progress is reported.
+        """
+        if self.finished_at is not None:
+            return 0.0
+        if self.started_at is None or self.progress <= 0:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed * (1 - self.progress) / self.progress
+
+    def to_dict(self) -> dict:
+        """
+        Get the status of the job as a dictionary.
+
+        Returns:
+            dict: The job id, kind, priority, status, progress, stage, eta, timestamps, result and error.
+        """
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "progress": self.progress,
+            "stage": self.stage,
+            "eta_seconds": self.eta(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    A class running background jobs on a bounded pool of worker threads, by priority.
+
+    Jobs wait in a priority queue (lower priority values first, then oldest first) and at most
+    `num_workers` run at once, so heavy ingest cannot take more than that many cores away from
+    queries. A job is a function called with its Job as first argument, through which it
+    reports progress; its return value becomes the job result.
+
+    Attributes:
+        num_workers (int): The maximum number of jobs running at once.
+        max_queued (int): The maximum number of jobs waiting to run.
+
+    Methods:
+        submit(kind, fn, *args, priority, **kwargs): Queue a job.
+        get(job_id): Get a job by id.
+        list_jobs(): Get the status of all known jobs.
+        shutdown(): Stop the workers once the queue is drained.
+
+    Example:
+        jobs = JobManager(num_workers=1)
+        job = jobs.submit("create", build_table, data, priority=5)
+        print(jobs.get(job.job_id).to_dict())
+    """
+
+    def __init__(self, num_workers: int = 1, max_queued: int = MAX_QUEUED):
+        """
+        Initialize a JobManager instance. Worker threads are started on the first submit.
+
+        Args:
+            num_workers (int, optional): The maximum number of jobs running at once (default is 1).
+            max_queued (int, optional): The maximum number of jobs waiting to run (default is MAX_QUEUED).
+
+        Raises:
+            ValueError: If num_workers is not positive.
+        """
+        if num_workers < 1:
+            raise ValueError(f"Expected num_workers>0 got num_workers={num_workers}")
+        self.num_workers = num_workers
+        self.max_queued = max_queued
+        self._queue = []
+        self._counter = itertools.count()
+        self._jobs = OrderedDict()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._stopping = False
+
+    def submit(self, kind: str, fn, *args, priority: int = 0, **kwargs) -> Job:
+        """
+        Queue a job.
+
+        Args:
+            kind (str): What the job does, such as "create" or "add".
+            fn (callable): The function to run, called as fn(job, *args, **kwargs).
+            priority (int, optional): Lower values run first (default is 0).
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            RuntimeError: If the queue is full or the manager is shut down.
+        """
+        job = Job(kind, priority)
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("Job manager is shut down.")
+            if len(self._queue) >= self.max_queued:
+                raise RuntimeError(
+                    f"Job queue is full ({self.max_queued} jobs waiting), retry later."
+                )
+            heapq.heappush(
+                self._queue, (priority, next(self._counter), job, fn, args, kwargs)
+            )
+            self._jobs[job.job_id] = job
+            self._forget_finished()
+            if len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._run, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._condition.notify()
+        return job
+
+    def _forget_finished(self):
+        """
+        Drop the oldest finished jobs beyond MAX_FINISHED. Must be called with the lock held.
+        """
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in ("succeeded", "failed")
+        ]
+        for job_id in finished[: max(len(finished) - MAX_FINISHED, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                _, _, job, fn, args, kwargs = heapq.heappop(self._queue)
+                job.status = "running"
+                job.started_at = time.time()
+
+            try:
+                job.result = fn(job, *args, **kwargs)
+                job.progress = 1.0
+                job.status = "succeeded"
+            except Exception as e:
+                job.error = str(e) or traceback.format_exc(limit=1)
+                job.status = "failed"
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Job:
+        """
+        Get a job by id.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            Job: The job.
+
+        Raises:
+            ValueError: If no job has this id.
+        """
+        with self._condition:
+            if job_id not in self._jobs:
+                raise ValueError(f"Job {job_id} doesn't exist.")
+            return self._jobs[job_id]
+
+    def list_jobs(self) -> list:
+        """
+        Get the status of all known jobs, oldest first.
+
+        Returns:
+            list: A list of job status dictionaries.
+        """
+        with self._condition:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def shutdown(self):
+        """
+        Stop the workers once the queued jobs have run.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+
+from utils.utils import EPS
+
+# Number of rows copied per step when building an index from memory-mapped files.
+CHUNK_ROWS = 65536
+
+RAW_FLOAT32_EXTENSIONS = (".f32", ".fbin")
+
+
+def open_npy(path: str) -> np.array:
+    """
+    Memory-map a .npy file of embeddings after validating its header.
+
+    Only the header is read eagerly; the data stays on disk and is paged in as it is accessed.
+
+    Args:
+        path (str): The path to the .npy file.
+
+    Returns:
+        np.array: A read-only memory-mapped array.
+
+    Raises:
+        ValueError: If the file is not a 1D or 2D array of floating point numbers.
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        else:
+            header = np.lib.format.read_array_header_2_0(f)
+    shape, fortran_order, dtype = header
+
+    if len(shape) not in (1, 2):
+        raise ValueError(f"Expected a 1D or 2D array in {path} but got shape {shape}")
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError(f"Expected floating point data in {path} but got {dtype}")
+    if fortran_order:
+        raise ValueError(f"Expected C-ordered data in {path} for row-wise loading")
+
+    return np.load(path, mmap_mode="r")
+
+
+def open_raw_float32(path: str, dimension: int) -> np.array:
+    """
+    Memory-map a headerless file of little-endian float32 rows.
+
+    Args:
+        path (str): The path to the raw file.
+        dimension (int): The dimensionality of each row.
+
+    Returns:
+        np.array: A read-only memory-mapped array of shape (n, dimension).
+
+    Raises:
+        ValueError: If dimension is missing or the file size is not a multiple of the row size.
+    """
+    if dimension is None:
+        raise ValueError(
+            f"Raw float32 file {path} requires 'dim_input' to be provided."
+        )
+    row_bytes = 4 * dimension
+    size = os.path.getsize(path)
+    if size % row_bytes != 0:
+        raise ValueError(
+            f"Size of {path} ({size} bytes) is not a multiple of {dimension} float32 values."
+        )
+    return np.memmap(path, dtype="<f4", mode="r", shape=(size // row_bytes, dimension))
+
+
+def open_embeddings(path: str, dimension: int = None) -> list:
+    """
+    Memory-map embeddings from a .npy file, a raw float32 file, or a directory of such shards.
+
+    Shards in a directory are taken in file name order and must share the same dimension.
+
+    Args:
+        path (str): The path to a file or a directory of shards.
+        dimension (int, optional): The dimensionality of raw float32 rows (default is None).
+
+    Returns:
+        list: A list of read-only memory-mapped 2D arrays, one per shard.
+
+    Raises:
+        ValueError: If the path holds no embeddings, or the shards do not share a dimension.
+
+    Example:
+        shards = open_embeddings("/data/embeddings/")
+        num_rows = sum(len(shard) for shard in shards)
+    """
+    if os.path.isdir(path):
+        files = [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.endswith(".npy") or name.endswith(RAW_FLOAT32_EXTENSIONS)
+        ]
+    else:
+        files = [path]
+
+    shards = []
+    for file in files:
+        if file.endswith(RAW_FLOAT32_EXTENSIONS):
+            shard = open_raw_float32(file, dimension)
+        else:
+            shard = open_npy(file)
+        shards.append(shard.reshape(1, -1) if shard.ndim == 1 else shard)
+
+    if not shards:
+        raise ValueError(f"No embeddings found at {path}")
+    dims = {shard.shape[1] for shard in shards}
+    if len(dims) > 1:
+        raise ValueError(f"Shards at {path} have different dimensions {sorted(dims)}")
+    if dimension is not None and dims != {dimension}:
+        raise ValueError(
+            f"Expected embeddings of dimension {dimension} but got {dims.pop()}"
+        )
+    return shards
+
+
+def iter_chunks(shards: list, chunk_rows: int = CHUNK_ROWS):
+    """
+    Iterate over the rows of several shards in chunks of at most chunk_rows rows.
+
+    Args:
+        shards (list): A list of 2D arrays.
+        chunk_rows (int, optional): The maximum number of rows per chunk (default is CHUNK_ROWS).
+
+    Yields:
+        tuple: The global row offset of the chunk and the chunk itself.
+    """
+    offset = 0
+    for shard in shards:
+        for start in range(0, len(shard), chunk_rows):
+            chunk = shard[start : start + chunk_rows]
+            yield offset + start, chunk
+        offset += len(shard)
+
+
+def normalisation_scale(shards: list, chunk_rows: int = CHUNK_ROWS) -> float:
+    """
+    Get the factor `normalise_embeddings` would scale the concatenated shards by, chunk by chunk.
+
+    Args:
+        shards (list): A list of 2D arrays.
+        chunk_rows (int, optional): The maximum number of rows per chunk (default is CHUNK_ROWS).
+
+    Returns:
+        float: The normalisation factor.
+    """
+    squared_norm = 0.0
+    for _, chunk in iter_chunks(shards, chunk_rows):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        squared_norm += float(np.einsum("ij,ij->", chunk, chunk))
+    return 1.0 / (np.sqrt(squared_norm) + EPS)
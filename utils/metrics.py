@@ -0,0 +1,416 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Content type of the Prometheus text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """
+    A base class for a metric with labels, keeping one series per combination of label values.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The description of the metric.
+        labelnames (tuple): The label names.
+
+    Methods:
+        remove(**labels): Drop the series of some label values.
+        clear(): Drop all series.
+        render(): Get the metric in the Prometheus text format.
+    """
+
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        """
+        Initialize a Metric instance.
+
+        Args:
+            name (str): The metric name.
+            help (str): The description of the metric.
+            labelnames (tuple, optional): The label names (default is no labels).
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Expected labels {self.labelnames} for {self.name} but got {tuple(labels)}"
+            )
+        return tuple(labels[name] for name in self.labelnames)
+
+    def remove(self, **labels):
+        """
+        Drop the series of some label values, such as those of a deleted table.
+        """
+        with self._lock:
+            self._series.pop(self._key(labels), None)
+
+    def clear(self):
+        """
+        Drop all series.
+        """
+        with self._lock:
+            self._series = {}
+
+    def _render_series(self, key: tuple, value) -> list:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+        ]
+
+    def render(self) -> str:
+        """
+        Get the metric in the Prometheus text format.
+
+        Returns:
+            str: The HELP and TYPE lines followed by one line per series.
+        """
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: str(item[0]))
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A metric that only goes up, such as a number of requests.
+
+    Example:
+        requests = Counter("requests_total", "Requests served.", ("route",))
+        requests.inc(route="/query")
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increment the series of some label values.
+
+        Args:
+            amount (float, optional): The increment (default is 1).
+            **labels: The label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A metric that can go up and down, such as a number of rows.
+
+    Example:
+        rows = Gauge("table_rows", "Rows per table.", ("table",))
+        rows.set(len(table), table="my_table")
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        """
+        Set the series of some label values.
+
+        Args:
+            value (float): The value.
+            **labels: The label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(Metric):
+    """
+    A metric counting observations, such as latencies, in cumulative buckets.
+
+    Example:
+        latency = Histogram("search_seconds", "Search latency.", ("table",))
+        with latency.time(table="my_table"):
+            table.query(query_vector)
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        """
+        Initialize a Histogram instance.
+
+        Args:
+            name (str): The metric name.
+            help (str): The description of the metric.
+            labelnames (tuple, optional): The label names (default is no labels).
+            buckets (tuple, optional): The ascending bucket upper bounds (default is LATENCY_BUCKETS).
+        """
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        """
+        Record an observation in the series of some label values.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values.
+        """
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds spent in a with block, even if it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_series(self, key: tuple, value) -> list:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+            labels = _format_labels(self.labelnames, key, le)
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A class holding the metrics of a process and rendering them for a Prometheus scrape.
+
+    Methods:
+        counter(name, help, labelnames): Create and register a Counter.
+        gauge(name, help, labelnames): Create and register a Gauge.
+        histogram(name, help, labelnames, buckets): Create and register a Histogram.
+        render(): Get all metrics in the Prometheus text format.
+    """
+
+    def __init__(self):
+        """
+        Initialize a MetricsRegistry instance.
+        """
+        self._metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Get all metrics in the Prometheus text format.
+
+        Returns:
+            str: The exposition text, ending with a newline.
+        """
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# HTTP, recorded by the Flask and async servers per endpoint
+HTTP_REQUESTS = REGISTRY.counter(
+    "nanovector_http_requests_total",
+    "HTTP requests served.",
+    ("route", "method", "status"),
+)
+HTTP_ERRORS = REGISTRY.counter(
+    "nanovector_http_errors_total",
+    "HTTP requests answered with a 5xx status.",
+    ("route",),
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "nanovector_http_request_seconds", "HTTP request latency.", ("route",)
+)
+
+# Tables, recorded by VectorDB
+TABLE_QUERIES = REGISTRY.counter(
+    "nanovector_table_queries_total", "Queries per table.", ("table",)
+)
+TABLE_ADDS = REGISTRY.counter(
+    "nanovector_table_adds_total", "Add calls per table.", ("table",)
+)
+TABLE_ADDED_ROWS = REGISTRY.counter(
+    "nanovector_table_added_rows_total", "Rows added per table.", ("table",)
+)
+SEARCH_SECONDS = REGISTRY.histogram(
+    "nanovector_search_seconds", "Search latency per table.", ("table",)
+)
+TABLE_ROWS = REGISTRY.gauge("nanovector_table_rows", "Rows per table.", ("table",))
+TABLE_BYTES = REGISTRY.gauge(
+    "nanovector_table_bytes",
+    "Bytes of embeddings and texts per table, memory-mapped or not.",
+    ("table",),
+)
+
+# Embedding, recorded by Embedder and the model cache
+EMBEDDING_SECONDS = REGISTRY.histogram(
+    "nanovector_embedding_seconds",
+    "Embedding latency per model and table.",
+    ("model", "table"),
+)
+EMBEDDED_TEXTS = REGISTRY.counter(
+    "nanovector_embedded_texts_total", "Texts embedded per model.", ("model",)
+)
+MODEL_CACHE = REGISTRY.counter(
+    "nanovector_model_cache_total",
+    "Model lookups, by whether the model was already loaded.",
+    ("result",),
+)
+
+# BLAS threads, recorded by utils.compute
+BLAS_THREADS = REGISTRY.gauge(
+    "nanovector_blas_threads", "BLAS threads set by the compute scheduler."
+)
+
+# Identical calls in flight, recorded by utils.singleflight
+COALESCED = REGISTRY.counter(
+    "nanovector_coalesced_total",
+    "Calls answered by an identical call already in flight, by kind.",
+    ("kind",),
+)
+
+# Admission control, recorded by app.admission
+ADMISSION_REJECTED = REGISTRY.counter(
+    "nanovector_admission_rejected_total",
+    "Requests shed by admission control, by route class and reason.",
+    ("route_class", "reason"),
+)
+ADMISSION_QUEUED = REGISTRY.gauge(
+    "nanovector_admission_queued",
+    "Requests waiting to be admitted, by route class.",
+    ("route_class",),
+)
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    """
+    Record one HTTP request, labelled by the name of its endpoint rather than its path.
+
+    Args:
+        route (str): The endpoint name, None if no route matched.
+        method (str): The HTTP method.
+        status (int): The response status code.
+        seconds (float): The time spent serving the request.
+    """
+    route = route or "unmatched"
+    HTTP_REQUESTS.inc(route=route, method=method, status=str(status))
+    HTTP_SECONDS.observe(seconds, route=route)
+    if status >= 500:
+        HTTP_ERRORS.inc(route=route)
+
+
+def forget_table(table_name: str):
+    """
+    Drop the series of a deleted table.
+    """
+    for metric in (
+        TABLE_QUERIES,
+        TABLE_ADDS,
+        TABLE_ADDED_ROWS,
+        SEARCH_SECONDS,
+        TABLE_ROWS,
+        TABLE_BYTES,
+    ):
+        metric.remove(table=table_name)
+
+
+def update_table_gauges(tables: dict):
+    """
+    Set the row and byte gauges from the current tables, just before a scrape.
+
+    Args:
+        tables (dict): The tables of a VectorDB, by name.
+    """
+    TABLE_ROWS.clear()
+    TABLE_BYTES.clear()
+    for table_name, table in list(tables.items()):
+        # Sharded tables hold their rows in worker processes, only their count is known here
+        index = getattr(table, "index", None)
+        TABLE_ROWS.set(
+            len(index) if index is not None else len(table), table=table_name
+        )
+        nbytes = index.embeddings.nbytes if index is not None else 0
+        texts = getattr(table, "texts", None)
+        if texts is not None:
+            nbytes += texts.nbytes
+        TABLE_BYTES.set(nbytes, table=table_name)
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from utils.metrics import COALESCED
+
+
+class SingleFlight:
+    """
+    A class sharing one computation between identical calls made while it is in flight.
+
+    The first call with a key runs the computation, and calls with the same key made before
+    it finishes wait for it and get the same result, or the same exception. Once it has
+    finished, the next call with the key computes again, so results are never cached and
+    never stale: the key must identify everything the result depends on, such as the
+    version of the table searched. Callers share the result object and must not modify it.
+
+    `do` coalesces calls made from threads, `do_async` calls made from coroutines on one event
+    loop, where waiting callers hold no thread.
+
+    Attributes:
+        name (str): The kind of computation, the label of the coalesced calls metric.
+
+    Methods:
+        do(key, fn, *args, **kwargs): Call fn, or wait for the identical call in flight.
+        do_async(key, fn): Await fn(), or the identical call in flight.
+
+    Example:
+        flights = SingleFlight("embedding")
+        vector = flights.do(("model", "query text"), model.generate_embeddings, "query text")
+    """
+
+    def __init__(self, name: str):
+        """
+        Initialize a SingleFlight instance.
+
+        Args:
+            name (str): The kind of computation, the label of the coalesced calls metric.
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs), or wait for the call with the same key already in flight.
+
+        Args:
+            key (Hashable): Identifies the result, calls with equal keys share one computation.
+            fn (callable): The computation.
+
+        Returns:
+            object: The result of the computation.
+
+        Raises:
+            Exception: The exception raised by the computation.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            COALESCED.inc(kind=self.name)
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, fn):
+        """
+        Await fn(), or the call with the same key already in flight on this event loop.
+
+        The computation runs as a task of its own, so it keeps going for the other callers
+        if the caller that started it is cancelled.
+
+        Args:
+            key (Hashable): Identifies the result, calls with equal keys share one computation.
+            fn (callable): Returns the awaitable computing the result.
+
+        Returns:
+            object: The result of the computation.
+
+        Raises:
+            Exception: The exception raised by the computation.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            COALESCED.inc(kind=self.name)
+        return await asyncio.shield(task)
@@ -0,0 +1,203 @@
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+# Request header asking for the stage breakdown of a request.
+TIMING_HEADER = "X-Nanovector-Timing"
+
+_current = contextvars.ContextVar("nanovector_request_timer", default=None)
+
+
+class RequestTimer:
+    """
+    A class accumulating the seconds a request spends in each stage.
+
+    Stages run on worker threads are recorded too, provided the context of the request is
+    copied to them, so the stages of a request queried against several tables in parallel
+    add up to more than its wall time.
+
+    Attributes:
+        stages (dict): The seconds spent per stage, in the order the stages were first entered.
+
+    Methods:
+        add(name, seconds): Add time to a stage.
+        to_dict(): Get the milliseconds spent per stage.
+        server_timing(): Get the breakdown as a Server-Timing header value.
+    """
+
+    def __init__(self):
+        """
+        Initialize a RequestTimer instance.
+        """
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        """
+        Add time to a stage.
+
+        Args:
+            name (str): The stage name.
+            seconds (float): The seconds spent.
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def to_dict(self) -> dict:
+        """
+        Get the milliseconds spent per stage.
+
+        Returns:
+            dict: The milliseconds per stage name.
+        """
+        with self._lock:
+            return {name: seconds * 1000 for name, seconds in self.stages.items()}
+
+    def server_timing(self) -> str:
+        """
+        Get the breakdown as a Server-Timing header value, which browser developer tools display.
+
+        Returns:
+            str: The stages, such as "parse;dur=0.210, embed;dur=12.503".
+        """
+        return ", ".join(f"{name};dur={ms:.3f}" for name, ms in self.to_dict().items())
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a with block as a stage of the current request, doing nothing outside a timed request.
+
+    Example:
+        with stage("score"):
+            scores = np.dot(embeddings, query)
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def start_timer() -> contextvars.Token:
+    """
+    Start timing the stages of the request running in the current context.
+
+    Returns:
+        contextvars.Token: The token to pass to stop_timer.
+    """
+    return _current.set(RequestTimer())
+
+
+def stop_timer(token: contextvars.Token) -> RequestTimer:
+    """
+    Stop timing the current request.
+
+    Args:
+        token (contextvars.Token): The token returned by start_timer.
+
+    Returns:
+        RequestTimer: The timer holding the stages of the request.
+    """
+    timer = _current.get()
+    _current.reset(token)
+    return timer
+
+
+def timing_requested(value: Optional[str]) -> bool:
+    """
+    Check whether the value of the timing header asks for the stage breakdown.
+    """
+    return value is not None and value.strip().lower() in ("1", "true", "yes")
+
+
+class SlowRequestProfiler:
+    """
+    A class profiling a sample of requests and writing out the profiles of the slow ones.
+
+    Profiling uses cProfile, which traces every call and slows the request down, so only a
+    fraction of requests is profiled. Profiles are written as pstats files, to be read with
+    `python -m pstats` or snakeviz.
+
+    Attributes:
+        profile_dir (str): The directory profiles are written to.
+        slow_seconds (float): Profiled requests at least this slow are written out.
+        sample_rate (float): The fraction of requests profiled.
+
+    Methods:
+        start(): Start profiling the current thread if the request is sampled.
+        finish(profile, seconds, name): Stop profiling and write the profile out if the request was slow.
+
+    Example:
+        profiler = SlowRequestProfiler("/tmp/profiles", slow_seconds=0.5, sample_rate=0.1)
+        profile = profiler.start()
+        ...
+        profiler.finish(profile, elapsed, "query_table")
+    """
+
+    def __init__(self, profile_dir: str, slow_seconds: float = 1.0, sample_rate=0.01):
+        """
+        Initialize a SlowRequestProfiler instance.
+
+        Args:
+            profile_dir (str): The directory profiles are written to, created if missing.
+            slow_seconds (float, optional): Profiled requests at least this slow are written out (default is 1.0).
+            sample_rate (float, optional): The fraction of requests profiled (default is 0.01).
+        """
+        self.profile_dir = profile_dir
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """
+        Start profiling the current thread if the request is sampled.
+
+        Returns:
+            cProfile.Profile: The running profile, or None if the request is not sampled.
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            return None
+        return profile
+
+    def finish(
+        self, profile: Optional[cProfile.Profile], seconds: float, name: str
+    ) -> Optional[str]:
+        """
+        Stop profiling and write the profile out if the request was slow.
+
+        Args:
+            profile (cProfile.Profile): The profile returned by start, None does nothing.
+            seconds (float): The duration of the request.
+            name (str): The request name, such as its endpoint, used in the file name.
+
+        Returns:
+            str: The path of the written profile, or None.
+        """
+        if profile is None:
+            return None
+        profile.disable()
+        if seconds < self.slow_seconds:
+            return None
+        file_name = (
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}.prof"
+        )
+        path = os.path.join(self.profile_dir, file_name)
+        profile.dump_stats(path)
+        return path
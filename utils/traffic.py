@@ -0,0 +1,152 @@
+import json
+import queue
+import random
+import threading
+import time
+
+# Endpoints whose requests are recorded: adds and queries, the traffic worth replaying.
+RECORDED_ENDPOINTS = (
+    "add_to_table",
+    "query_table",
+    "query_table_batch",
+    "query_tables",
+)
+
+# Sampled requests waiting for the writer thread; further requests are dropped from the log.
+MAX_PENDING = 10000
+
+
+class TrafficRecorder:
+    """
+    A class recording a sample of live requests to a JSONL traffic log, to be replayed by `benchmarks.replay`.
+
+    Each line holds the wall-clock "time" the request arrived, its "endpoint", "method" and
+    "path", the JSON "body" and the "status" and "seconds" the server answered with, so a
+    replay can be compared with the recorded run. Lines are written as requests finish, so
+    they are close to but not strictly in arrival order; replays sort them by time.
+
+    `record` only samples the request and queues its raw body, so it is cheap enough to call
+    on an event loop; a background thread decodes the bodies and writes the lines.
+
+    Attributes:
+        path (str): The JSONL file requests are appended to.
+        sample_rate (float): The fraction of requests recorded.
+        endpoints (tuple): The endpoint names recorded.
+
+    Methods:
+        record(endpoint, method, path, body, status, seconds, arrived): Queue a request to be logged if it is sampled.
+        close(): Write the queued requests and close the log.
+
+    Example:
+        recorder = TrafficRecorder("/tmp/traffic.jsonl", sample_rate=0.1)
+        recorder.record("query_table", "POST", "/docs/query", body, 200, 0.004)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        endpoints: tuple = RECORDED_ENDPOINTS,
+        max_pending: int = MAX_PENDING,
+    ):
+        """
+        Initialize a TrafficRecorder instance.
+
+        Args:
+            path (str): The JSONL file requests are appended to, created if missing.
+            sample_rate (float, optional): The fraction of requests recorded (default is 1.0).
+            endpoints (tuple, optional): The endpoint names recorded (default is RECORDED_ENDPOINTS).
+            max_pending (int, optional): The number of requests waiting to be written before further ones are dropped (default is MAX_PENDING).
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.endpoints = endpoints
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = queue.Queue(max_pending)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def record(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        body: bytes,
+        status: int,
+        seconds: float,
+        arrived: float = None,
+    ) -> bool:
+        """
+        Queue a request to be appended to the log if its endpoint is recorded and it is sampled.
+
+        Args:
+            endpoint (str): The endpoint name of the request, such as "query_table".
+            method (str): The HTTP method.
+            path (str): The request path.
+            body (bytes): The raw JSON request body.
+            status (int): The response status code.
+            seconds (float): The time taken to answer the request.
+            arrived (float, optional): The wall-clock time the request arrived (default is now minus seconds).
+
+        Returns:
+            bool: Whether the request was queued, False if it was not sampled or too many are waiting.
+        """
+        if endpoint not in self.endpoints or random.random() >= self.sample_rate:
+            return False
+        record = {
+            "time": arrived if arrived is not None else time.time() - seconds,
+            "endpoint": endpoint,
+            "method": method,
+            "path": path,
+            "body": body,
+            "status": status,
+            "seconds": seconds,
+        }
+        try:
+            self._pending.put_nowait(record)
+        except queue.Full:
+            return False
+        return True
+
+    def _write(self):
+        while True:
+            record = self._pending.get()
+            if record is None:
+                return
+            body = record["body"]
+            try:
+                record["body"] = json.loads(body) if body else None
+            except ValueError:
+                # Replays send the recorded bytes as they are
+                record["body"] = body.decode("utf-8", errors="replace")
+            self._file.write(json.dumps(record) + "\n")
+            if self._pending.empty():
+                self._file.flush()
+
+    def close(self):
+        """
+        Write the queued requests and close the log.
+        """
+        self._pending.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+def read_traffic(path: str, limit: int = None) -> list:
+    """
+    Read the requests of a JSONL traffic log, sorted by arrival time.
+
+    Args:
+        path (str): The JSONL file written by a TrafficRecorder.
+        limit (int, optional): The number of requests read, None for all (default is None).
+
+    Returns:
+        list: The recorded requests as dictionaries.
+    """
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["time"])
+    return records if limit is None else records[:limit]
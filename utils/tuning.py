@@ -0,0 +1,183 @@
+import numpy as np
+
+from utils.config import IndexConfig
+from utils.evaluation import recall_curve
+from utils.initialise_index import index_vectors
+
+
+def candidate_configs(
+    config: IndexConfig, nlist: int = None, nprobes: list = None, dims_final=None
+) -> list:
+    """
+    Get the configurations a table can be tuned to.
+
+    IVF tables are tuned over nprobe, keeping their clusters. Other tables are tuned over the
+    PCA dim_final, the flat index being the exact end of the range. PCA tables are only tuned
+    down to dimensions they keep, their current dim_final being the end of the range.
+
+    Args:
+        config (IndexConfig): The current configuration of the table.
+        nlist (int, optional): The number of clusters of the current IVF index (default is None).
+        nprobes (list, optional): The nprobe values, None for powers of two up to nlist (default is None).
+        dims_final (list, optional): The PCA output dimensionalities, None for an eighth, a quarter and half of dim_input (default is None).
+
+    Returns:
+        list: The candidate IndexConfig instances.
+    """
+    if config.index_type == "ivf":
+        nlist = nlist or config.nlist
+        if nprobes is None:
+            nprobes = [2**i for i in range(int(np.log2(nlist)) + 1)]
+            nprobes += [nlist] if nprobes[-1] != nlist else []
+        return [
+            config.replace(nlist=nlist, nprobe=nprobe)
+            for nprobe in sorted(set(nprobes))
+            if nprobe <= nlist
+        ]
+
+    dim = config.dim_input
+    if dims_final is None:
+        dims_final = [max(dim // 8, 1), max(dim // 4, 1), max(dim // 2, 1)]
+    if config.pca:
+        # A rebuild reconstructs the reduced rows, so it cannot recover more dimensions than
+        # the table keeps: the current dim_final is the exact end of the range
+        return [
+            config.replace(dim_final=dim_final)
+            for dim_final in sorted(set(dims_final) | {config.dim_final})
+            if dim_final <= config.dim_final
+        ]
+    configs = [
+        config.replace(pca=True, dim_final=dim_final)
+        for dim_final in sorted(set(dims_final))
+        if dim_final < dim
+    ]
+    return configs + [config.replace(pca=False, dim_final=dim)]
+
+
+def drops_dimensions(current: IndexConfig, config: IndexConfig) -> bool:
+    """
+    Check whether rebuilding a table into a configuration discards input dimensions for good.
+
+    Args:
+        current (IndexConfig): The current configuration of the table.
+        config (IndexConfig): The configuration to rebuild into.
+
+    Returns:
+        bool: True if the configuration keeps fewer dimensions than the table does.
+    """
+    kept = current.dim_final if current.pca else current.dim_input
+    return config.pca and config.dim_final < kept
+
+
+def tune_table(
+    table,
+    k: int = 10,
+    target_recall: float = None,
+    latency_budget_ms: float = None,
+    num_queries: int = 200,
+    nprobes: list = None,
+    dims_final: list = None,
+    seed: int = 0,
+    progress=None,
+    vectors: np.array = None,
+) -> dict:
+    """
+    Find the search parameters of a table meeting a target recall@k at minimum latency, or the best recall within a latency budget.
+
+    Rows of the table are sampled as queries and held out of the data they are searched in,
+    so queries do not trivially find themselves. Each candidate configuration is built on the
+    remaining rows and measured against exact search over them. Latencies are the median of
+    single-threaded queries, as `utils.evaluation.evaluate` measures them.
+
+    The rows of a PCA table are stored reduced, and reconstructing them loses the discarded
+    components, so every candidate would look exact against them. PCA tables are therefore
+    tuned on a sample of their original input vectors, which the caller must give. A rebuild
+    only has the reduced rows, so candidates never keep more dimensions than the table does.
+
+    Args:
+        table (VectorTable): The table to tune.
+        k (int, optional): The number of neighbours the recall is measured at (default is 10).
+        target_recall (float, optional): The recall@k to reach at minimum latency.
+        latency_budget_ms (float, optional): The median latency to stay within at maximum recall.
+        num_queries (int, optional): The number of rows sampled as queries (default is 200).
+        nprobes (list, optional): The nprobe values tried for IVF tables (default is powers of two up to nlist).
+        dims_final (list, optional): The PCA dim_final values tried for other tables (default is d/8, d/4 and d/2).
+        seed (int, optional): The random seed of the query sample (default is 0).
+        progress (callable, optional): Called as progress(fraction, stage) as tuning advances (default is None).
+        vectors (np.array, optional): A sample of the original (n, dim_input) vectors to tune on, required
+            for PCA tables (default is the vectors of the table).
+
+    Returns:
+        dict: The chosen "config" (IndexConfig), whether the objective was "met", the "chosen" measurements
+            and the measurements of every candidate as "points".
+
+    Raises:
+        ValueError: If not exactly one of target_recall and latency_budget_ms is given, the table is too small,
+            or the table uses PCA and no vectors are given.
+
+    Example:
+        result = tune_table(table, k=10, target_recall=0.95)
+        table.rebuild(result["config"])
+    """
+    if (target_recall is None) == (latency_budget_ms is None):
+        raise ValueError("Expected exactly one of target_recall and latency_budget_ms.")
+    progress = progress or (lambda fraction, stage: None)
+
+    if vectors is None:
+        if table.config.pca:
+            raise ValueError(
+                f"Table {table.table_name} uses PCA, tune it on a sample of its original vectors."
+            )
+        vectors = index_vectors(table.index)
+    vectors = np.asarray(vectors)
+    if vectors.ndim != 2 or vectors.shape[1] != table.config.dim_input:
+        raise ValueError(
+            f"Expected vectors of shape (n, {table.config.dim_input}) but got {vectors.shape}"
+        )
+
+    progress(0.0, "sampling queries")
+    num_queries = min(num_queries, len(vectors) // 2)
+    if num_queries < 1 or len(vectors) - num_queries < k:
+        raise ValueError(
+            f"Table {table.table_name} has too few rows to be tuned at k={k}."
+        )
+    held_out = np.random.default_rng(seed).choice(
+        len(vectors), num_queries, replace=False
+    )
+    queries = vectors[held_out]
+    base = np.delete(vectors, held_out, axis=0)
+
+    configs = candidate_configs(
+        table.config, getattr(table.index, "nlist", None), nprobes, dims_final
+    )
+    points = recall_curve(
+        base,
+        queries,
+        configs,
+        k,
+        progress=lambda fraction, stage: progress(0.1 + 0.9 * fraction, stage),
+    )
+
+    def latency(point):
+        return point["latency_ms"]["p50"]
+
+    if target_recall is not None:
+        meeting = [point for point in points if point["recall"] >= target_recall]
+        chosen = (
+            min(meeting, key=latency)
+            if meeting
+            else max(points, key=lambda point: (point["recall"], -latency(point)))
+        )
+    else:
+        meeting = [point for point in points if latency(point) <= latency_budget_ms]
+        chosen = (
+            max(meeting, key=lambda point: (point["recall"], -latency(point)))
+            if meeting
+            else min(points, key=latency)
+        )
+
+    config = configs[points.index(chosen)]
+    if config.index_type == "ivf":
+        # Keep the table's own nlist setting, None staying the size-dependent default
+        config = table.config.replace(nprobe=config.nprobe)
+    return {"config": config, "met": bool(meeting), "chosen": chosen, "points": points}
@@ -1,6 +1,124 @@
 import numpy as np
 
+# Number of rows scored per step by blockwise scans.
+BLOCK_SIZE = 65536
+
+EPS = 1e-6
+
 
 def normalise_embeddings(embeddings: np.array) -> np.array:
-    EPS = 1e-6
     return embeddings / (np.linalg.norm(embeddings, keepdims=True) + EPS)
+
+
+def append_rows(buffer: np.array, num_rows: int, rows: np.array) -> np.array:
+    """
+    Append rows to a 2D buffer that may have spare capacity past its first num_rows rows.
+
+    The buffer is reallocated with doubled capacity only when it is full (or read-only,
+    e.g. memory-mapped), so repeated appends cost amortised O(1) per row instead of
+    copying the whole array every time as np.vstack does.
+
+    Args:
+        buffer (np.array): The (capacity, d) buffer whose first num_rows rows are in use.
+        num_rows (int): The number of rows in use.
+        rows (np.array): The (m, d) rows to append.
+
+    Returns:
+        np.array: The buffer holding the num_rows + m rows, which may be a new array.
+
+    Example:
+        buffer = append_rows(buffer, num_rows, np.random.rand(5, buffer.shape[1]))
+        num_rows += 5
+    """
+    needed = num_rows + len(rows)
+    if needed > len(buffer) or not buffer.flags.writeable:
+        dtype = (
+            buffer.dtype
+            if np.issubdtype(buffer.dtype, np.floating)
+            else np.result_type(buffer.dtype, rows.dtype)
+        )
+        grown = np.empty((max(needed, 2 * len(buffer)), buffer.shape[1]), dtype=dtype)
+        grown[:num_rows] = buffer[:num_rows]
+        buffer = grown
+    buffer[num_rows:needed] = rows
+    return buffer
+
+
+def threshold_search(
+    query: np.array,
+    embeddings: np.array,
+    min_score: float,
+    k: int = None,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Find all rows whose similarity to a query is at least a threshold.
+
+    The embeddings are scored `block_size` rows at a time, so at most one block of
+    scores is held in memory, and the scan stops as soon as `k` matches are found.
+
+    Args:
+        query (np.array): The (prepared) query vector of shape (d,).
+        embeddings (np.array): The (n, d) array of embeddings to scan.
+        min_score (float): The minimum similarity score for a row to match.
+        k (int, optional): The maximum number of matches to return, None for no cap (default is None).
+        block_size (int, optional): The number of rows scored per block (default is BLOCK_SIZE).
+
+    Returns:
+        tuple: A tuple containing two arrays: matching indices (ascending) and their scores.
+
+    Example:
+        embeddings = np.random.rand(100, 256)
+        indices, scores = threshold_search(embeddings[0], embeddings, min_score=60.0, k=10)
+    """
+    if k is not None and k < 0:
+        raise ValueError(f"Expected k>0 got k={k}")
+
+    indices, scores = [], []
+    found = 0
+    for start in range(0, len(embeddings), block_size):
+        if k is not None and found >= k:
+            break
+        block_scores = np.dot(embeddings[start : start + block_size], query)
+        hits = np.flatnonzero(block_scores >= min_score)
+        if k is not None:
+            hits = hits[: k - found]
+        indices.append(hits + start)
+        scores.append(block_scores[hits])
+        found += len(hits)
+
+    if not indices:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=embeddings.dtype)
+    return np.concatenate(indices), np.concatenate(scores)
+
+
+def reciprocal_rank_fusion(rankings: list, rrf_k: int = 60):
+    """
+    Fuse several rankings of row indices with reciprocal rank fusion.
+
+    Each row scores the sum of 1 / (rrf_k + rank) over the rankings it appears in, with
+    ranks starting at 1, so rows ranked highly by several rankings come first.
+
+    Args:
+        rankings (list): A list of arrays of row indices, each sorted best first.
+        rrf_k (int, optional): The rank offset damping the weight of top ranks (default is 60).
+
+    Returns:
+        tuple: A tuple containing two arrays: fused row indices and scores, sorted by descending score.
+
+    Example:
+        indices, scores = reciprocal_rank_fusion([np.array([3, 1, 2]), np.array([1, 5])])
+    """
+    rankings = [np.asarray(ranking, dtype=np.int64) for ranking in rankings]
+    if not any(len(ranking) for ranking in rankings):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    rows = np.concatenate(rankings)
+    weights = np.concatenate(
+        [1.0 / (rrf_k + np.arange(1, len(ranking) + 1)) for ranking in rankings]
+    )
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=weights)
+
+    order = np.argsort(-scores, kind="stable")
+    return unique_rows[order], scores[order]